@@ -0,0 +1,106 @@
+"""Benchmark the direct mass redistribution solver against the iterative solver for retreat-heavy glaciers
+
+Both solvers should give the same geometry, so the differences in volume, area and ice thickness are also printed.
+"""
+
+# Built-in libraries
+import argparse
+import time
+# External libraries
+import numpy as np
+from oggm import cfg
+from oggm.core.flowline import MixedBedFlowline
+# Local libraries
+from pygem.glacierdynamics import MassRedistributionCurveModel
+
+
+def getparser():
+    """
+    Use argparse to add arguments from the command line
+
+    Parameters
+    ----------
+    nbins_list (optional) : list
+        number of elevation bins to benchmark
+    nyears (optional) : int
+        number of years
+    ela_rise (optional) : float
+        rise of the equilibrium line altitude [m yr-1]
+
+    Returns
+    -------
+    Object containing arguments and their respective values.
+    """
+    parser = argparse.ArgumentParser(description="benchmark mass redistribution")
+    parser.add_argument('-nbins_list', action='store', type=int, nargs='+', default=[50, 100, 200, 400],
+                        help='number of elevation bins')
+    parser.add_argument('-nyears', action='store', type=int, default=80,
+                        help='number of years')
+    parser.add_argument('-ela_rise', action='store', type=float, default=40,
+                        help='rise of the equilibrium line altitude [m yr-1]')
+    return parser
+
+
+def flowline(nbins, seed=0):
+    """Flowline with a bumpy bed, trapezoidal and parabolic bins and an irregular ice thickness"""
+    rng = np.random.default_rng(seed)
+    dx = 100
+    bed_h = np.linspace(5000, 5000 - 8 * nbins, nbins) + rng.normal(0, 5, nbins)
+    nglac = int(0.8 * nbins)
+    thick = np.zeros(nbins)
+    thick[:nglac] = (60 + 80 * np.sin(np.pi * np.arange(nglac) / nglac) * rng.uniform(0.6, 1.4, nglac))
+    thick[nglac-5:nglac] = np.linspace(thick[nglac-5], 5, 5)
+    widths_m = rng.uniform(300, 1200, nbins)
+    is_trapezoid = rng.random(nbins) < 0.7
+    bed_shape = 4 * thick / widths_m**2
+    bed_shape[~is_trapezoid & (thick == 0)] = 4 * 50 / 600**2
+    lambdas = np.where(is_trapezoid, 1., 0.)
+    section = np.where(is_trapezoid, thick * (widths_m - lambdas * thick / 2), 2 / 3 * widths_m * thick)
+    return MixedBedFlowline(line=None, dx=1, map_dx=dx, surface_h=bed_h + thick, bed_h=bed_h, section=section,
+                            bed_shape=bed_shape, is_trapezoid=is_trapezoid, lambdas=lambdas, widths_m=widths_m)
+
+
+def run(nbins, nyears, ela_rise, solver, seed=0):
+    """Retreat the glacier with a rising equilibrium line and return volume, area, thickness and solver time"""
+    fl = flowline(nbins, seed=seed)
+    model = MassRedistributionCurveModel([fl], mb_model=None, y0=0)
+    fl = model.fls[0]
+    glac_idx_initial = model.glac_idx_initial[0]
+    sec_in_year = 365 * 24 * 3600
+    rng = np.random.default_rng(seed + 1)
+    ela = np.percentile(fl.surface_h[fl.thick > 0], 40)
+    volume, area = np.zeros(nyears + 1), np.zeros(nyears + 1)
+    volume[0], area[0] = model.volume_m3, model.area_m2
+    time_solver = 0
+    for year in range(nyears):
+        heights = fl.surface_h.copy()
+        # mass balance gradient with a rising equilibrium line
+        ela_year = ela + ela_rise * year + rng.normal(0, 60)
+        massbalclim_annual = np.clip(0.008 * (heights - ela_year), -12, 3) / sec_in_year
+        if fl.thick.sum() > 0:
+            time_start = time.time()
+            args = (fl.section.copy(), fl.thick.copy(), fl.widths_m.copy(), massbalclim_annual, glac_idx_initial,
+                    heights)
+            if solver == 'direct':
+                model._massredistributionHuss_direct(*args, sec_in_year=sec_in_year)
+            else:
+                model._massredistributionHuss(*args, sec_in_year=sec_in_year)
+            time_solver += time.time() - time_start
+        volume[year+1], area[year+1] = model.volume_m3, model.area_m2
+    return volume, area, fl.thick.copy(), time_solver
+
+
+if __name__ == '__main__':
+    parser = getparser()
+    args = parser.parse_args()
+    cfg.initialize_minimal()
+
+    print('nbins  iterative [s]  direct [s]  speedup  max vol dif [%]  max area dif [%]  final thick dif [m]')
+    for nbins in args.nbins_list:
+        volume_it, area_it, thick_it, time_it = run(nbins, args.nyears, args.ela_rise, 'iterative')
+        volume_di, area_di, thick_di, time_di = run(nbins, args.nyears, args.ela_rise, 'direct')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol_dif = np.nanmax(np.abs(volume_di - volume_it) / volume_it * 100)
+            area_dif = np.nanmax(np.abs(area_di - area_it) / area_it * 100)
+        print('{:5d}  {:13.3f}  {:10.3f}  {:7.1f}  {:15.3f}  {:16.3f}  {:19.2f}'.format(
+                nbins, time_it, time_di, time_it / time_di, vol_dif, area_dif, np.abs(thick_di - thick_it).max()))
@@ -0,0 +1,135 @@
+"""Benchmark the batched HH2015 refreezing against the per-bin loop for an increasing number of elevation bins"""
+
+# Built-in libraries
+import argparse
+import time
+# External libraries
+import numpy as np
+# Local libraries
+from pygem.utils._refreeze import refreeze_hh2015
+
+
+# HH2015 refreezing parameters (defaults of pygem_input)
+rf_layers = 5
+rf_dz = 10 / rf_layers
+rf_dsc = 3
+rf_meltcrit = 0.002
+pp = 0.3
+Lh_rf = 333550
+density_water = 1000
+rf_dens_expb = (650 / 300)**(1/(rf_layers-1))
+rf_layers_dens = np.array([300 * rf_dens_expb**x for x in np.arange(0,rf_layers)])
+rf_layers_ch = (1 - rf_layers_dens/1000) * 1297 + rf_layers_dens/1000 * 1890000
+rf_layers_k = (1 - rf_layers_dens/1000) * 0.023 + rf_layers_dens/1000 * 2.33
+
+
+def refreeze_hh2015_loop(te_rf, tl_rf, rf_cold, glac_idx, bin_temp, bin_melt, bin_meltlimit, bin_prec,
+                         bin_snowpack, surfacetype, rf_dt):
+    """Per-bin loop of the HH2015 refreezing of PyGEMMassBalance.get_annual_mb used as reference"""
+    refr = np.zeros(bin_temp.shape)
+    for gidx in glac_idx:
+        if bin_melt[gidx] < rf_meltcrit:
+            for h in np.arange(0, rf_dsc):
+                for j in np.arange(1, rf_layers-1):
+                    tl_rf[0,gidx] = bin_temp[gidx]
+                    te_rf[j,gidx] = (tl_rf[j,gidx] + rf_dt * rf_layers_k[j] / rf_layers_ch[j] / rf_dz**2 * 0.5 *
+                                     ((tl_rf[j-1,gidx] - tl_rf[j,gidx]) - (tl_rf[j,gidx] - tl_rf[j+1,gidx])))
+                    tl_rf[:,gidx] = te_rf[:,gidx]
+        else:
+            if (surfacetype[gidx] == 2) or (surfacetype[gidx] == 3):
+                nlayers = rf_layers-1
+            else:
+                smax = np.round((bin_snowpack[gidx] / (rf_layers_dens[0] / 1000) + pp) / rf_dz, 0)
+                if bin_snowpack[gidx] > 0 and smax == 0:
+                    smax=1
+                if smax == 0:
+                    rf_cold[gidx] = 0
+                if smax > rf_layers - 1:
+                    smax = rf_layers - 1
+                nlayers = int(smax)
+            if rf_cold[gidx] == 0 and tl_rf[:,gidx].min() < 0:
+                for j in np.arange(0,nlayers):
+                    j += 1
+                    rf_cold[gidx] -= tl_rf[j,gidx] * rf_layers_ch[j] * rf_dz / Lh_rf / density_water
+            if (bin_meltlimit[gidx] + bin_prec[gidx]) < rf_cold[gidx]:
+                refr[gidx] = bin_meltlimit[gidx] + bin_prec[gidx]
+            elif rf_cold[gidx] > 0:
+                refr[gidx] = rf_cold[gidx]
+            rf_cold[gidx] -= (bin_meltlimit[gidx] + bin_prec[gidx])
+            if rf_cold[gidx] < 0:
+                rf_cold[gidx] = 0
+                tl_rf[:,gidx] = 0
+    return refr
+
+
+def getparser():
+    """
+    Use argparse to add arguments from the command line
+
+    Parameters
+    ----------
+    nbins_list (optional) : list
+        number of elevation bins to benchmark
+    nyears (optional) : int
+        number of years of monthly time steps
+
+    Returns
+    -------
+    Object containing arguments and their respective values.
+    """
+    parser = argparse.ArgumentParser(description="benchmark refreezing")
+    parser.add_argument('-nbins_list', action='store', type=int, nargs='+', default=[10, 50, 100, 250, 500, 1000],
+                        help='number of elevation bins')
+    parser.add_argument('-nyears', action='store', type=int, default=5,
+                        help='number of years')
+    return parser
+
+
+def forcing(nbins, nmonths, seed=0):
+    """Random monthly forcing with a seasonal cycle of melt and cold months"""
+    rng = np.random.default_rng(seed)
+    season = np.tile(np.cos(2 * np.pi * np.arange(12) / 12), int(np.ceil(nmonths / 12)))[:nmonths]
+    bin_temp = -8 * season[np.newaxis,:] + rng.normal(-2, 3, (nbins, nmonths))
+    bin_melt = np.where(bin_temp > 0, bin_temp * 0.004 * 30, 0)
+    bin_meltsnow = bin_melt * rng.random((nbins, nmonths))
+    bin_prec = np.where(bin_temp > 0, rng.random((nbins, nmonths)) * 0.1, 0)
+    bin_snowpack = rng.random((nbins, nmonths)) * 2
+    surfacetype = rng.integers(1, 5, nbins)
+    return bin_temp, bin_melt, bin_meltsnow, bin_prec, bin_snowpack, surfacetype
+
+
+def run(nbins, nmonths, batched=True):
+    """Run refreezing through all time steps and return the refreeze and run time"""
+    bin_temp, bin_melt, bin_meltsnow, bin_prec, bin_snowpack, surfacetype = forcing(nbins, nmonths)
+    glac_idx = np.arange(nbins)
+    glac_mask = np.ones(nbins, dtype=bool)
+    te_rf = np.zeros((rf_layers, nbins))
+    tl_rf = np.zeros((rf_layers, nbins))
+    rf_cold = np.zeros(nbins)
+    bin_refreeze = np.zeros((nbins, nmonths))
+    rf_dt = 3600 * 24 * 30 / rf_dsc
+    time_start = time.time()
+    for step in range(nmonths):
+        if batched:
+            bin_refreeze[:,step] = refreeze_hh2015(
+                    te_rf, tl_rf, rf_cold, glac_mask, bin_temp[:,step], bin_melt[:,step], bin_meltsnow[:,step],
+                    bin_prec[:,step], bin_snowpack[:,step], surfacetype, rf_dt, rf_layers_dens, rf_layers_ch,
+                    rf_layers_k, rf_dz, rf_dsc, rf_meltcrit, pp, Lh_rf, density_water)
+        else:
+            bin_refreeze[:,step] = refreeze_hh2015_loop(
+                    te_rf, tl_rf, rf_cold, glac_idx, bin_temp[:,step], bin_melt[:,step], bin_meltsnow[:,step],
+                    bin_prec[:,step], bin_snowpack[:,step], surfacetype, rf_dt)
+    return bin_refreeze, time.time() - time_start
+
+
+if __name__ == '__main__':
+    parser = getparser()
+    args = parser.parse_args()
+    nmonths = 12 * args.nyears
+
+    print('nbins  loop [s]  batched [s]  speedup  identical')
+    for nbins in args.nbins_list:
+        refreeze_loop, time_loop = run(nbins, nmonths, batched=False)
+        refreeze_batched, time_batched = run(nbins, nmonths, batched=True)
+        print('{:5d}  {:8.3f}  {:11.4f}  {:7.1f}  {}'.format(nbins, time_loop, time_batched, time_loop / time_batched,
+                                                             np.array_equal(refreeze_loop, refreeze_batched)))
@@ -10,12 +10,12 @@ import multiprocessing
 import os
 import zipfile
 # External libraries
-import numpy as np
-import pandas as pd
-import xarray as xr
+import netCDF4
 # Local libraries
 import pygem.pygem_input as pygem_prms
 import spc_split_glaciers as split_glaciers
+from pygem.utils._merge import merge_files
+from pygem.utils._output_container import container_index, container_rows
 
 
 #%% Functions
@@ -59,10 +59,14 @@ def getparser():
     return parser
 
 
+def rgiid_region(rgiid):
+    """Region of an RGIId as in the filenames of the glaciers (e.g., 'RGI60-01.00570' is region '1')"""
+    return str(int(rgiid.split('-')[1].split('.')[0]))
+
 
 def main(list_packed_vars):
     """
-    Model simulation
+    Merge a chunk of the files of the glaciers of a region and rcp scenario into one internally compressed file
 
     Parameters
     ----------
@@ -71,42 +75,29 @@ def main(list_packed_vars):
 
     Returns
     -------
-    netcdf files of the simulation output (specific output is dependent on the output option)
+    netcdf file of the chunk with the glaciers in the order of the files (see merge_files); only the rows of the
+    glaciers of the region are merged from the output containers (see container_rows)
     """
     # Unpack variables
     count = list_packed_vars[0]
     glac_fullfn_lst = list_packed_vars[1]
+    ds_all_fp = list_packed_vars[2]
+    region = list_packed_vars[3]
+    glac_fullfn_rows = list_packed_vars[4]
     
-    #%%
-    # Merge by chunk
-    for nglac, i in enumerate(glac_fullfn_lst):
-        ds = xr.open_dataset(i)
-        if nglac == 0:
-            ds_all = ds
-        else:
-            ds_all = xr.concat([ds_all, ds], 'glac')
-            
     # Filename
-    region = i.split('/')[-1].split('.')[0]
+    i = glac_fullfn_lst[-1]
     glac_no = i.split('/')[-1].split('_')[0]
     ds_chunk_fn = i.split('/')[-1].replace(glac_no + '_','R' + region + '--chunk' + str(count).zfill(2) + '--')
     
-    # Encoding
-    # Add variables to empty dataset and merge together
-    encoding = {}
-    noencoding_vn = ['stats', 'glac_attrs']
-    for vn in pygem_prms.output_variables_package2:
-        # Encoding (specify _FillValue, offsets, etc.)
-        if vn not in noencoding_vn:
-            encoding[vn] = {'_FillValue': False}
-    # Export to netcdf
-    ds_all.to_netcdf(ds_all_fp + ds_chunk_fn, encoding=encoding)
-    # Close dataset
-    ds.close()
-    ds_all.close()
-    # Remove files in output_list
-    for i in glac_fullfn_lst:
-        os.remove(i)
+    # Merge by chunk
+    merge_files(glac_fullfn_lst, ds_all_fp + ds_chunk_fn, renumber=False, complevel=pygem_prms.output_complevel,
+                chunks=pygem_prms.output_chunks, rows=glac_fullfn_rows)
+    
+    # Remove files in output_list (the containers have other regions and are removed once all regions are merged)
+    for i, rows in zip(glac_fullfn_lst, glac_fullfn_rows):
+        if rows is None:
+            os.remove(i)
     
     
 if __name__ == '__main__':
@@ -150,8 +141,25 @@ if __name__ == '__main__':
                         gcm_files.append(full_fn) 
     gcm_files = sorted(gcm_files)
     
+    # Output containers of the workers (see option_output_container) have the glaciers of several regions; they are
+    #  sorted from the oldest to the newest, so a glacier of a resumed run is taken from its last container
+    container_files = [x for x in gcm_files if x.split('/')[-1].startswith('container-')]
+    container_files = sorted(container_files, key=os.path.getmtime)
+    gcm_files = [x for x in gcm_files if x not in container_files]
+    
     rcps = []
     regions = []
+    for i in container_files:
+        # Regions
+        for rgiid in container_index(i):
+            if rgiid_region(rgiid) not in regions:
+                regions.append(rgiid_region(rgiid))
+        
+        # RCPs
+        i_rcp = i.split('/')[-1].split('_')[2]
+        if i_rcp not in rcps:
+            rcps.append(i_rcp)
+    
     for i in gcm_files:
         # Regions
         i_region = i.split('/')[-1].split('.')[0]
@@ -182,19 +190,30 @@ if __name__ == '__main__':
             glac_fullfn_region = []
             for i in gcm_files:
                 fn = i.split('/')[-1]
-                if fn.startswith(region) and rcp in fn:
+                if fn.split('.')[0] == region and rcp in fn:
                     glac_fullfn_region.append(i)
             glac_fullfn_region = sorted(glac_fullfn_region)
             
-            print(rcp, region, len(glac_fullfn_region), 'glaciers')
+            # Last complete row of the glaciers of the region in the containers
+            container_fns = [x for x in container_files if rcp in x.split('/')[-1]]
+            container_fns_rows = container_rows(container_fns, select=lambda x: rgiid_region(x) == region)
+            container_fns = [x for x, rows in zip(container_fns, container_fns_rows) if len(rows) > 0]
+            container_fns_rows = [x for x in container_fns_rows if len(x) > 0]
+            
+            print(rcp, region, len(glac_fullfn_region) + sum([len(x) for x in container_fns_rows]), 'glaciers')
+            glac_fullfn_rows = [None] * len(glac_fullfn_region) + container_fns_rows
+            glac_fullfn_region = glac_fullfn_region + container_fns
+            if len(glac_fullfn_region) == 0:
+                continue
             
             # Split into lists for parallel processing
-            glac_fullfn_lsts = split_glaciers.split_list(glac_fullfn_region, n=nchunks)
+            glac_idx_lsts = split_glaciers.split_list(list(range(len(glac_fullfn_region))), n=nchunks)
             
             # Pack variables for multiprocessing
             list_packed_vars = []
-            for count, glac_fullfn_lst in enumerate(glac_fullfn_lsts):
-                list_packed_vars.append([count, glac_fullfn_lst])
+            for count, glac_idx_lst in enumerate(glac_idx_lsts):
+                list_packed_vars.append([count, [glac_fullfn_region[x] for x in glac_idx_lst], ds_all_fp, region,
+                                         [glac_fullfn_rows[x] for x in glac_idx_lst]])
 
             # Parallel processing
             # MERGE INDIVIDUAL FILES
@@ -211,35 +230,19 @@ if __name__ == '__main__':
             # MERGE CHUNKS
             chunk_fns = []
             for i in os.listdir(ds_all_fp):
-                if i.startswith('R' + region) and i.endswith('.nc') and rcp in i and gcm_name in i and 'chunk' in i:
+                if (i.split('--')[0] == 'R' + region and i.endswith('.nc') and rcp in i and gcm_name in i and
+                    'chunk' in i):
                     print(i)
                     chunk_fns.append(i)
             chunk_fns = sorted(chunk_fns)
-            for nchunk, chunk_fn in enumerate(chunk_fns):
-                ds = xr.open_dataset(ds_all_fp + chunk_fn)
-                if nchunk == 0:
-                    ds_all = ds
-                else:
-                    ds_all = xr.concat([ds_all, ds], 'glac')
-            # Update glacier values
-            ds_all.glac.values = ds_all.glacier_table.values[:,0].astype(int)
-                    
-            # Encoding
-            # Add variables to empty dataset and merge together
-            encoding = {}
-            noencoding_vn = ['stats', 'glac_attrs']
-            for vn in pygem_prms.output_variables_package2:
-                # Encoding (specify _FillValue, offsets, etc.)
-                if vn not in noencoding_vn:
-                    encoding[vn] = {'_FillValue': False}
             # Export file 
-            chunkno = chunk_fn.split('--')[1]
-            ds_all_fn = chunk_fn.replace(chunkno, 'all')
-            # Export to netcdf
-            ds_all.to_netcdf(ds_all_fp + ds_all_fn, encoding=encoding)
-            # Close dataset
-            ds.close()
-            ds_all.close()
+            chunkno = chunk_fns[-1].split('--')[1]
+            ds_all_fn = chunk_fns[-1].replace(chunkno, 'all')
+            merge_files([ds_all_fp + x for x in chunk_fns], ds_all_fp + ds_all_fn, renumber=False,
+                        complevel=pygem_prms.output_complevel, chunks=pygem_prms.output_chunks)
+            # Update glacier values
+            with netCDF4.Dataset(ds_all_fp + ds_all_fn, 'a') as nc:
+                nc['glac'][:] = nc['glacier_table'][:,0].astype(int)
             
             # Remove files
             for chunk_fn in chunk_fns:
@@ -250,4 +253,8 @@ if __name__ == '__main__':
                 myzip.write(ds_all_fp + ds_all_fn, arcname=ds_all_fn)
             
             # Remove non-zipped file
-            os.remove(ds_all_fp + ds_all_fn)
\ No newline at end of file
+            os.remove(ds_all_fp + ds_all_fn)
+    
+    # Remove the containers
+    for i in container_files:
+        os.remove(i)
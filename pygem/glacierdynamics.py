@@ -14,10 +14,12 @@ import numpy as np
 import xarray as xr
 
 from oggm import cfg, utils
-from oggm.core.flowline import FlowlineModel
+from oggm.core.flowline import FlowlineModel, MixedBedFlowline
 from oggm.exceptions import InvalidParamsError
 from oggm import __version__
 import pygem.pygem_input as pygem_prms
+from pygem.utils._diagnostics_writer import NetCDFDiagnosticsWriter
+from pygem.utils._massredistribution import huss_volumechange_curve
 
 cfg.initialize()
 
@@ -67,7 +69,14 @@ class MassRedistributionCurveModel(FlowlineModel):
         self.spinupyears = spinupyears
         self.glac_idx_initial = [fl.thick.nonzero()[0] for fl in flowlines]
         self.y0 = 0
-        
+        # Years with constant area, whose climate the mass balance model can downscale at once
+        if hasattr(mb_model, 'constantarea_nyears'):
+            if option_areaconstant:
+                mb_model.constantarea_nyears = mb_model.nyears
+            else:
+                mb_model.constantarea_nyears = max(mb_model.constantarea_nyears,
+                                                   min(max(spinupyears, constantarea_years), mb_model.nyears))
+
 #        widths_t0 = flowlines[0].widths_m
 #        area_v1 = widths_t0 * flowlines[0].dx_meter
 #        print('area v1:', area_v1.sum())
@@ -115,7 +124,8 @@ class MassRedistributionCurveModel(FlowlineModel):
                     
 
     def run_until_and_store(self, y1, run_path=None, diag_path=None,
-                            store_monthly_step=None):
+                            store_monthly_step=None, store_geometry=True,
+                            stream_path=None, stream_geometry=True, sink=None):
         """Runs the model and returns intermediate steps in xarray datasets.
 
         This function repeatedly calls FlowlineModel.run_until for either
@@ -134,6 +144,22 @@ class MassRedistributionCurveModel(FlowlineModel):
             If True (False)  model diagnostics will be stored monthly (yearly).
             If unspecified, we follow the update of the MB model, which
             defaults to yearly (see __init__).
+        store_geometry : Bool
+            If False, the section and width of each year are not kept in
+            memory (run_ds is empty and run_path only gets the diagnostics).
+        stream_path : str
+            Path and filename of a netCDF file to which the diagnostics (and
+            the geometry if stream_geometry) are written year by year while the
+            model runs (see NetCDFDiagnosticsWriter); the file is closed also
+            if the run fails
+        stream_geometry : Bool
+            If True, the section and width of each year are written to
+            stream_path (independent of store_geometry, so the geometry can be
+            streamed without keeping it in memory)
+        sink : object
+            Caller-supplied sink that receives the diagnostics and geometry of
+            each year while the model runs (same methods as
+            NetCDFDiagnosticsWriter; not closed by the model)
 
         Returns
         -------
@@ -141,7 +167,8 @@ class MassRedistributionCurveModel(FlowlineModel):
             stores the entire glacier geometry. It is useful to visualize the
             glacier geometry or to restart a new run from a modelled geometry.
             The glacier state is stored at the begining of each hydrological
-            year (not in between in order to spare disk space).
+            year (not in between in order to spare disk space). Empty list if
+            store_geometry is False.
         diag_ds : xarray.Dataset
             stores a few diagnostic variables such as the volume, area, length
             and ELA of the glacier.
@@ -182,8 +209,9 @@ class MassRedistributionCurveModel(FlowlineModel):
             months = [months]
             cmonths = [cmonths]
         nm = len(monthly_time)
-        sects = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
-        widths = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
+        if store_geometry:
+            sects = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
+            widths = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
         bucket = [(np.zeros(ny) * np.NaN) for _ in self.fls]
         diag_ds = xr.Dataset()
 
@@ -244,43 +272,87 @@ class MassRedistributionCurveModel(FlowlineModel):
             diag_ds['calving_rate_myr'].attrs['description'] = 'Calving rate'
             diag_ds['calving_rate_myr'].attrs['unit'] = 'm yr-1'
 
+        # Streaming output
+        sinks = [] if sink is None else [sink]
+        writer = None
+        if stream_path is not None:
+            writer = NetCDFDiagnosticsWriter(stream_path, store_geometry=stream_geometry)
+            sinks.append(writer)
+
+        def record_diag(idx, vns=('volume_m3', 'area_m2', 'length_m')):
+            """Record the diagnostics (same values for all time indices idx)"""
+            values = {'volume_m3': self.volume_m3, 'area_m2': self.area_m2, 'length_m': self.length_m}
+            if self.is_tidewater:
+                values.update({'calving_m3': self.calving_m3_since_y0, 'calving_rate_myr': self.calving_rate_myr})
+                if self.is_marine_terminating:
+                    values.update({'volume_bsl_m3': self.volume_bsl_m3, 'volume_bwl_m3': self.volume_bwl_m3})
+            values = {vn: values[vn] for vn in vns}
+            for vn in vns:
+                diag_ds[vn].data[idx] = values[vn]
+            for sk in sinks:
+                sk.write_diag(idx, values)
+
+        def record_geometry(idx):
+            """Record the section and width of each flowline (same values for all time indices idx)"""
+            if store_geometry:
+                for s, w, fl in zip(sects, widths, self.fls):
+                    s[idx, :] = fl.section
+                    w[idx, :] = fl.widths_m
+            for sk in sinks:
+                sk.write_geometry(idx, [fl.section for fl in self.fls], [fl.widths_m for fl in self.fls])
+
         # Run
-        j = 0
-        for i, (yr, mo) in enumerate(zip(yearly_time[:-1], months[:-1])):
-
-            # Record initial parameters
-            if i == 0:
-                diag_ds['volume_m3'].data[i] = self.volume_m3
-                diag_ds['area_m2'].data[i] = self.area_m2
-                diag_ds['length_m'].data[i] = self.length_m
+        try:
+            for sk in sinks:
+                sk.start(diag_ds, yearly_time, [fl.nx for fl in self.fls])
+            j = 0
+            for i, (yr, mo) in enumerate(zip(yearly_time[:-1], months[:-1])):
+
+                # Record initial parameters
+                if i == 0:
+                    record_diag(i)
             
-            self.run_until(yr, run_single_year=True)
-            # Model run
-            if mo == 1:
-                for s, w, b, fl in zip(sects, widths, bucket, self.fls):
-                    s[j, :] = fl.section
-                    w[j, :] = fl.widths_m
+                self.run_until(yr, run_single_year=True)
+                # Model run
+                if mo == 1:
+                    record_geometry(j)
                     if self.is_tidewater:
-                        try:
-                            b[j] = fl.calving_bucket_m3
-                        except AttributeError:
-                            pass
-                j += 1
-            # Diagnostics
-            diag_ds['volume_m3'].data[i+1] = self.volume_m3
-            diag_ds['area_m2'].data[i+1] = self.area_m2
-            diag_ds['length_m'].data[i+1] = self.length_m
+                        for b, fl in zip(bucket, self.fls):
+                            try:
+                                b[j] = fl.calving_bucket_m3
+                            except AttributeError:
+                                pass
+                    j += 1
+                # Diagnostics
+                record_diag(i+1)
 
-            if self.is_tidewater:
-                diag_ds['calving_m3'].data[i] = self.calving_m3_since_y0
-                diag_ds['calving_rate_myr'].data[i] = self.calving_rate_myr
-                if self.is_marine_terminating:
-                    diag_ds['volume_bsl_m3'].data[i] = self.volume_bsl_m3
-                    diag_ds['volume_bwl_m3'].data[i] = self.volume_bwl_m3
+                if self.is_tidewater:
+                    vns = ['calving_m3', 'calving_rate_myr']
+                    if self.is_marine_terminating:
+                        vns += ['volume_bsl_m3', 'volume_bwl_m3']
+                    record_diag(i, vns=vns)
+
+                # Glacier disappeared: nothing changes anymore, so the remaining years are recorded at once
+                if i + 2 < ny and not np.any([fl.thick.any() for fl in self.fls]):
+                    self._record_disappeared(int(yr) + 1, int(yearly_time[-1]))
+                    record_geometry(slice(j, ny-1))
+                    record_diag(slice(i+2, None))
+                    if self.is_tidewater:
+                        for b, fl in zip(bucket, self.fls):
+                            try:
+                                b[j:ny-1] = fl.calving_bucket_m3
+                            except AttributeError:
+                                pass
+                        record_diag(slice(i+1, ny-1), vns=vns)
+                    break
+        finally:
+            # the file is also closed if the run fails
+            if writer is not None:
+                writer.close()
 
         # to datasets
         run_ds = []
-        for (s, w, b) in zip(sects, widths, bucket):
+        for (s, w, b) in (zip(sects, widths, bucket) if store_geometry else []):
             ds = xr.Dataset()
             ds.attrs['description'] = 'OGGM model output'
             ds.attrs['oggm_version'] = __version__
@@ -317,6 +389,62 @@ class MassRedistributionCurveModel(FlowlineModel):
         return run_ds, diag_ds
     
     
+    def _record_disappeared(self, year_start, year_end):
+        """Record the glacier properties of the years after the glacier disappeared at once
+
+        Once all ice is gone, the mass redistribution is skipped and the mass balance model does not compute anything,
+        so updategeometry would only record the same empty glacier every year.
+
+        Parameters
+        ----------
+        year_start, year_end : int
+            first and last (excluded) year that would be computed by updategeometry
+        """
+        rec = slice(year_start+1, year_end+1)
+        for fl in self.fls:
+            self.mb_model.glac_bin_area_annual[:,rec] = 0
+            self.mb_model.glac_bin_icethickness_annual[:,rec] = 0
+            self.mb_model.glac_bin_width_annual[:,rec] = fl.widths_m[:,np.newaxis]
+            self.mb_model.glac_wide_area_annual[rec] = 0
+            self.mb_model.glac_wide_volume_annual[rec] = 0
+
+
+    def get_state(self, year):
+        """Snapshot of the flowlines and the mass balance model after the first years have been computed
+
+        Parameters
+        ----------
+        year : int
+            number of years that have been computed (the next year to compute)
+
+        Returns
+        -------
+        state : dict
+            ice thickness of each flowline (section and width follow from the bed shape), calving and the mass 
+            balance model state (see PyGEMMassBalance.get_state)
+        """
+        year = int(year)
+        return {'year': year,
+                'thick': [fl.thick.copy() for fl in self.fls],
+                'calving_m3_since_y0': self.calving_m3_since_y0,
+                'mb_model': self.mb_model.get_state(year)}
+
+
+    def set_state(self, state):
+        """Restore a state from get_state, so run_until and run_until_and_store continue after the snapshot year
+
+        Parameters
+        ----------
+        state : dict
+            model state from get_state
+        """
+        for fl, thick in zip(self.fls, state['thick']):
+            fl.thick = thick.copy()
+        self.calving_m3_since_y0 = state['calving_m3_since_y0']
+        self.mb_model.set_state(state['mb_model'])
+        self.t = (state['year'] - self.y0) * cfg.SEC_IN_YEAR
+
+
     def updategeometry(self, year):
         """Update geometry for a given year"""
         
@@ -403,8 +531,13 @@ class MassRedistributionCurveModel(FlowlineModel):
 #                        print(self.glac_idx_initial[fl_id])
 #                        print('heights:', heights)
                     
-                    self._massredistributionHuss(section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, 
-                                                 self.glac_idx_initial[fl_id], heights, sec_in_year=sec_in_year)     
+                    if pygem_prms.option_massredistribution_solver == 'direct':
+                        self._massredistributionHuss_direct(section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual,
+                                                            self.glac_idx_initial[fl_id], heights, 
+                                                            sec_in_year=sec_in_year)
+                    else:
+                        self._massredistributionHuss(section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, 
+                                                     self.glac_idx_initial[fl_id], heights, sec_in_year=sec_in_year)
                     
             # Record glacier properties (volume [m3], area [m2], thickness [m], width [km])
             #  record the next year's properties as well
@@ -432,6 +565,10 @@ class MassRedistributionCurveModel(FlowlineModel):
         downstream in cases of glacier advance because you'd be moving new ice to a higher elevation. To avoid this 
         unrealistic case, in the event that this would occur, the overdeepening will simply fill up with ice first until
         it reaches an elevation where it would put new ice into a downstream bin.
+        
+        Note: if the annual volume loss is at least the glacier volume, all ice is removed, consistent with the mass 
+        balance model, which caps the melt at the glacier volume (the ice used to be left unchanged in this case). The
+        direct solver and the ensemble model do the same.
 
         Parameters
         ----------
@@ -469,7 +606,7 @@ class MassRedistributionCurveModel(FlowlineModel):
             print('glacier volume change:', glacier_volumechange)
               
         # If volume loss is less than the glacier volume, then redistribute mass loss/gains across the glacier;
-        #  otherwise, the glacier disappears (area and thickness were already set to zero above)
+        #  otherwise, the glacier disappears (all ice is removed below)
         glacier_volume_total = (self.fls[0].section * self.fls[0].dx_meter).sum()
         if -1 * glacier_volumechange < glacier_volume_total:
              # Determine where glacier exists            
@@ -525,123 +662,238 @@ class MassRedistributionCurveModel(FlowlineModel):
                               '\nvolume remaining:', glacier_volumechange_remaining)
                         nloop += 1
 
-            # Glacier advances 
-            #  based on ice thickness change exceeding threshold
-            #  Overview:
-            #    1. Add new bin and fill it up to a maximum of terminus average ice thickness
-            #    2. If additional volume after adding new bin, then redistribute mass gain across all bins again,
-            #       i.e., increase the ice thickness and width
-            #    3. Repeat adding a new bin and redistributing the mass until no addiitonal volume is left
-            while (icethickness_change > pygem_prms.icethickness_advancethreshold).any() == True: 
-                if debug:
-                    print('advancing glacier')
-                    
-                # Record glacier area and ice thickness before advance corrections applied
-                section_t0_raw = self.fls[0].section.copy()
-                thick_t0_raw = self.fls[0].thick.copy()
-                width_t0_raw = self.fls[0].widths_m.copy()
-                glacier_area_t0_raw = width_t0_raw * self.fls[0].dx_meter
-                
-                if debug:
-                    print('\n\nthickness t0:', thick_t0_raw)
-                    print('glacier area t0:', glacier_area_t0_raw)
-                    print('width_t0_raw:', width_t0_raw,'\n\n')
-                
-                # Index bins that are advancing
-                icethickness_change[icethickness_change <= pygem_prms.icethickness_advancethreshold] = 0
-                glac_idx_advance = icethickness_change.nonzero()[0]
-                
-                # Update ice thickness based on maximum advance threshold [m ice]
-                self.fls[0].thick[glac_idx_advance] = (self.fls[0].thick[glac_idx_advance] - 
-                               (icethickness_change[glac_idx_advance] - pygem_prms.icethickness_advancethreshold))
-                glacier_area_t1 = self.fls[0].widths_m.copy() * self.fls[0].dx_meter
-                
-                # Advance volume [m3]
-                advance_volume = ((glacier_area_t0_raw[glac_idx_advance] * thick_t0_raw[glac_idx_advance]).sum() 
-                                  - (glacier_area_t1[glac_idx_advance] * self.fls[0].thick[glac_idx_advance]).sum())
-                
-                # Set the cross sectional area of the next bin
-                advance_section = advance_volume / self.fls[0].dx_meter
-                
-                # Index of bin to add
-                glac_idx_t0 = self.fls[0].thick.nonzero()[0]
-                min_elev = self.fls[0].surface_h[glac_idx_t0].min()
-                glac_idx_bin2add = (
-                        np.where(self.fls[0].surface_h == 
-                                 self.fls[0].surface_h[np.where(self.fls[0].surface_h < min_elev)[0]].max())[0][0])
-                section_2add = self.fls[0].section.copy()
-                section_2add[glac_idx_bin2add] = advance_section
-                self.fls[0].section = section_2add              
-
-                # Advance characteristics
-                # Indices that define the glacier terminus
-                glac_idx_terminus = (
-                        glac_idx_t0[(heights[glac_idx_t0] - heights[glac_idx_t0].min()) / 
-                                    (heights[glac_idx_t0].max() - heights[glac_idx_t0].min()) * 100 
-                                    < pygem_prms.terminus_percentage])
-                # For glaciers with so few bands that the terminus is not identified (ex. <= 4 bands for 20% threshold),
-                #  then use the information from all the bands
-                if glac_idx_terminus.shape[0] <= 1:
-                    glac_idx_terminus = glac_idx_t0.copy()
-                
-                if debug:
-                    print('glacier index terminus:',glac_idx_terminus)
-
-                # Average area of glacier terminus [m2]
-                #  exclude the bin at the terminus, since this bin may need to be filled first
-                try:
-                    minelev_idx = np.where(heights == heights[glac_idx_terminus].min())[0][0]
-                    glac_idx_terminus_removemin = list(glac_idx_terminus)
-                    glac_idx_terminus_removemin.remove(minelev_idx)
-                    terminus_thickness_avg = np.mean(self.fls[0].thick[glac_idx_terminus_removemin])
-                except:  
-                    glac_idx_terminus_initial = (
-                        glac_idx_initial[(heights[glac_idx_initial] - heights[glac_idx_initial].min()) / 
-                                    (heights[glac_idx_initial].max() - heights[glac_idx_initial].min()) * 100 
-                                    < pygem_prms.terminus_percentage])
-                    if glac_idx_terminus_initial.shape[0] <= 1:
-                        glac_idx_terminus_initial = glac_idx_initial.copy()
-                        
-                    minelev_idx = np.where(heights == heights[glac_idx_terminus_initial].min())[0][0]
-                    glac_idx_terminus_removemin = list(glac_idx_terminus_initial)
-                    glac_idx_terminus_removemin.remove(minelev_idx)
-                    terminus_thickness_avg = np.mean(self.fls[0].thick[glac_idx_terminus_removemin])
+            # Glacier advances
+            self._massredistributionHuss_advance(icethickness_change, glacier_volumechange_remaining, 
+                                                 glac_idx_initial, heights, debug=debug, sec_in_year=sec_in_year)
+        else:
+            # Glacier disappears
+            self.fls[0].thick = np.zeros(self.fls[0].nx)
+    
+    
+    def _massredistributionHuss_advance(self, icethickness_change, glacier_volumechange_remaining, glac_idx_initial,
+                                        heights, debug=False, sec_in_year=365*24*3600):
+        """
+        Glacier advance of the mass redistribution according to Huss and Hock (2015).
+        
+        Bins with an ice thickness change above icethickness_advancethreshold are limited to the threshold and the 
+        excess volume is used to add bins below the terminus.
+
+        Parameters
+        ----------
+        icethickness_change : np.ndarray
+            Ice thickness change [m] of the last redistribution for each elevation bin
+        glacier_volumechange_remaining : float
+            Glacier volume change remaining [m3 ice] of the last redistribution
+        glac_idx_initial : np.ndarray
+            Initial glacier indices
+        heights : np.ndarray
+            Surface elevation [m] from previous year for each elevation bin
+        debug : Boolean
+            option to turn on print statements for development or debugging of code (default False)
+            
+        Returns
+        -------
+        Updates the flowlines automatically, so does not return anything
+        """
+        # Glacier advances 
+        #  based on ice thickness change exceeding threshold
+        #  Overview:
+        #    1. Add new bin and fill it up to a maximum of terminus average ice thickness
+        #    2. If additional volume after adding new bin, then redistribute mass gain across all bins again,
+        #       i.e., increase the ice thickness and width
+        #    3. Repeat adding a new bin and redistributing the mass until no addiitonal volume is left
+        while (icethickness_change > pygem_prms.icethickness_advancethreshold).any() == True: 
+            if debug:
+                print('advancing glacier')
                 
-                # If last bin exceeds terminus thickness average then fill up the bin to average and redistribute mass
-                if self.fls[0].thick[glac_idx_bin2add] > terminus_thickness_avg:
-                    self.fls[0].thick[glac_idx_bin2add] = terminus_thickness_avg
-                    # Redistribute remaining mass
-                    volume_added2bin = self.fls[0].section[glac_idx_bin2add] * self.fls[0].dx_meter
-                    advance_volume -= volume_added2bin
+            # Record glacier area and ice thickness before advance corrections applied
+            section_t0_raw = self.fls[0].section.copy()
+            thick_t0_raw = self.fls[0].thick.copy()
+            width_t0_raw = self.fls[0].widths_m.copy()
+            glacier_area_t0_raw = width_t0_raw * self.fls[0].dx_meter
+            
+            if debug:
+                print('\n\nthickness t0:', thick_t0_raw)
+                print('glacier area t0:', glacier_area_t0_raw)
+                print('width_t0_raw:', width_t0_raw,'\n\n')
+            
+            # Index bins that are advancing
+            icethickness_change[icethickness_change <= pygem_prms.icethickness_advancethreshold] = 0
+            glac_idx_advance = icethickness_change.nonzero()[0]
+            
+            # Update ice thickness based on maximum advance threshold [m ice]
+            self.fls[0].thick[glac_idx_advance] = (self.fls[0].thick[glac_idx_advance] - 
+                           (icethickness_change[glac_idx_advance] - pygem_prms.icethickness_advancethreshold))
+            glacier_area_t1 = self.fls[0].widths_m.copy() * self.fls[0].dx_meter
+            
+            # Advance volume [m3]
+            advance_volume = ((glacier_area_t0_raw[glac_idx_advance] * thick_t0_raw[glac_idx_advance]).sum() 
+                              - (glacier_area_t1[glac_idx_advance] * self.fls[0].thick[glac_idx_advance]).sum())
+            
+            # Set the cross sectional area of the next bin
+            advance_section = advance_volume / self.fls[0].dx_meter
+            
+            # Index of bin to add
+            glac_idx_t0 = self.fls[0].thick.nonzero()[0]
+            min_elev = self.fls[0].surface_h[glac_idx_t0].min()
+            glac_idx_bin2add = (
+                    np.where(self.fls[0].surface_h == 
+                             self.fls[0].surface_h[np.where(self.fls[0].surface_h < min_elev)[0]].max())[0][0])
+            section_2add = self.fls[0].section.copy()
+            section_2add[glac_idx_bin2add] = advance_section
+            self.fls[0].section = section_2add              
+
+            # Advance characteristics
+            # Indices that define the glacier terminus
+            glac_idx_terminus = (
+                    glac_idx_t0[(heights[glac_idx_t0] - heights[glac_idx_t0].min()) / 
+                                (heights[glac_idx_t0].max() - heights[glac_idx_t0].min()) * 100 
+                                < pygem_prms.terminus_percentage])
+            # For glaciers with so few bands that the terminus is not identified (ex. <= 4 bands for 20% threshold),
+            #  then use the information from all the bands
+            if glac_idx_terminus.shape[0] <= 1:
+                glac_idx_terminus = glac_idx_t0.copy()
+            
+            if debug:
+                print('glacier index terminus:',glac_idx_terminus)
+
+            # Average area of glacier terminus [m2]
+            #  exclude the bin at the terminus, since this bin may need to be filled first
+            try:
+                minelev_idx = np.where(heights == heights[glac_idx_terminus].min())[0][0]
+                glac_idx_terminus_removemin = list(glac_idx_terminus)
+                glac_idx_terminus_removemin.remove(minelev_idx)
+                terminus_thickness_avg = np.mean(self.fls[0].thick[glac_idx_terminus_removemin])
+            except:  
+                glac_idx_terminus_initial = (
+                    glac_idx_initial[(heights[glac_idx_initial] - heights[glac_idx_initial].min()) / 
+                                (heights[glac_idx_initial].max() - heights[glac_idx_initial].min()) * 100 
+                                < pygem_prms.terminus_percentage])
+                if glac_idx_terminus_initial.shape[0] <= 1:
+                    glac_idx_terminus_initial = glac_idx_initial.copy()
+                    
+                minelev_idx = np.where(heights == heights[glac_idx_terminus_initial].min())[0][0]
+                glac_idx_terminus_removemin = list(glac_idx_terminus_initial)
+                glac_idx_terminus_removemin.remove(minelev_idx)
+                terminus_thickness_avg = np.mean(self.fls[0].thick[glac_idx_terminus_removemin])
+            
+            # If last bin exceeds terminus thickness average then fill up the bin to average and redistribute mass
+            if self.fls[0].thick[glac_idx_bin2add] > terminus_thickness_avg:
+                self.fls[0].thick[glac_idx_bin2add] = terminus_thickness_avg
+                # Redistribute remaining mass
+                volume_added2bin = self.fls[0].section[glac_idx_bin2add] * self.fls[0].dx_meter
+                advance_volume -= volume_added2bin
+
+            # With remaining advance volume, add a bin or redistribute over existing bins if no bins left
+            if advance_volume > 0:
+                # Indices for additional bins below the terminus
+                glac_idx_t1 = np.where(glacier_area_t1 > 0)[0]
+                below_glac_idx = np.where(heights < heights[glac_idx_t1].min())[0]
+
+                # if no more bins below, then distribute volume over the glacier without further adjustments
+                #  this occurs with OGGM flowlines when the terminus is in an overdeepening, so we just fill up 
+                #  the overdeepening
+                if len(below_glac_idx) == 0:
+                    # Revert to the initial section, which also updates the thickness and width automatically
+                    self.fls[0].section = section_t0_raw
+                    
+                    # set icethickness change and advance_volume to 0 to break the loop
+                    icethickness_change[icethickness_change > 0] = 0
+                    advance_volume = 0
+                    
+                # otherwise, redistribute mass
+                else:
+                    glac_idx_t0 = self.fls[0].thick.nonzero()[0]
+                    glacier_area_t0 = self.fls[0].widths_m.copy() * self.fls[0].dx_meter
+                    glac_bin_massbalclim_annual = np.zeros(self.fls[0].thick.shape)
+                    glac_bin_massbalclim_annual[glac_idx_t0] = (glacier_volumechange_remaining / 
+                                                                glacier_area_t0.sum() / sec_in_year)
+                    icethickness_change, glacier_volumechange_remaining = (
+                        self._massredistributioncurveHuss(
+                                self.fls[0].section.copy(), self.fls[0].thick.copy(), self.fls[0].widths_m.copy(), 
+                                glac_idx_t0, advance_volume, glac_bin_massbalclim_annual, heights, debug=False))
     
-                # With remaining advance volume, add a bin or redistribute over existing bins if no bins left
-                if advance_volume > 0:
-                    # Indices for additional bins below the terminus
-                    glac_idx_t1 = np.where(glacier_area_t1 > 0)[0]
-                    below_glac_idx = np.where(heights < heights[glac_idx_t1].min())[0]
-
-                    # if no more bins below, then distribute volume over the glacier without further adjustments
-                    #  this occurs with OGGM flowlines when the terminus is in an overdeepening, so we just fill up 
-                    #  the overdeepening
-                    if len(below_glac_idx) == 0:
-                        # Revert to the initial section, which also updates the thickness and width automatically
-                        self.fls[0].section = section_t0_raw
-                        
-                        # set icethickness change and advance_volume to 0 to break the loop
-                        icethickness_change[icethickness_change > 0] = 0
-                        advance_volume = 0
-                        
-                    # otherwise, redistribute mass
-                    else:
-                        glac_idx_t0 = self.fls[0].thick.nonzero()[0]
-                        glacier_area_t0 = self.fls[0].widths_m.copy() * self.fls[0].dx_meter
-                        glac_bin_massbalclim_annual = np.zeros(self.fls[0].thick.shape)
-                        glac_bin_massbalclim_annual[glac_idx_t0] = (glacier_volumechange_remaining / 
-                                                                    glacier_area_t0.sum() / sec_in_year)
-                        icethickness_change, glacier_volumechange_remaining = (
-                            self._massredistributioncurveHuss(
-                                    self.fls[0].section.copy(), self.fls[0].thick.copy(), self.fls[0].widths_m.copy(), 
-                                    glac_idx_t0, advance_volume, glac_bin_massbalclim_annual, heights, debug=False))
+    
+    def _massredistributionHuss_direct(self, section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, 
+                                       glac_idx_initial, heights, hindcast=0, sec_in_year=365*24*3600):
+        """
+        Mass redistribution according to Huss and Hock (2015) with a bounded number of retreat passes.
+        
+        Same geometry evolution as _massredistributionHuss, but the retreat passes work on the cross-sectional area 
+        directly: each pass distributes the volume change that the bins of the previous pass could not lose over the 
+        remaining bins with their curve (huss_volumechange_curve), without copying the flowline. Every pass removes at 
+        least one bin, so the number of passes is limited to the number of glacier bins. The advance uses 
+        _massredistributionHuss_advance and glaciers with 3 bins or less use _massredistributionHuss.
+
+        Parameters
+        ----------
+        section_t0 : np.ndarray
+            Glacier cross-sectional area (m2) from previous year for each elevation bin
+        thick_t0 : np.ndarray
+            Glacier ice thickness [m] from previous year for each elevation bin
+        width_t0 : np.ndarray
+            Glacier width [m] from previous year for each elevation bin
+        glac_bin_massbalclim_annual : np.ndarray
+            Climatic mass balance [m ice s-1] for each elevation bin and year
+        glac_idx_initial : np.ndarray
+            Initial glacier indices
+        heights : np.ndarray
+            Surface elevation [m] from previous year for each elevation bin
+            
+        Returns
+        -------
+        Updates the flowlines automatically, so does not return anything
+        """
+        fl = self.fls[0]
+        glacier_area_t0 = width_t0 * fl.dx_meter
+        glacier_area_t0[thick_t0 == 0] = 0
+        glac_idx_t0 = fl.thick.nonzero()[0]
+        
+        # Annual glacier-wide volume change [m3]
+        glacier_volumechange = (glac_bin_massbalclim_annual * sec_in_year * glacier_area_t0).sum()
+        if hindcast == 1:
+            glacier_volumechange = -1 * glacier_volumechange
+        # Glacier disappears
+        if -1 * glacier_volumechange >= (fl.section * fl.dx_meter).sum():
+            fl.thick = np.zeros(fl.nx)
+            return
+        # Too few bins for the curve
+        if glac_idx_t0.shape[0] <= 3:
+            self._massredistributionHuss(section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, 
+                                         glac_idx_initial, heights, hindcast=hindcast, sec_in_year=sec_in_year)
+            return
+        
+        # Retreat: bins that lose all their ice are removed and the volume change they could not lose is distributed 
+        #  over the remaining bins in the next pass
+        section = section_t0
+        glacier_area = glacier_area_t0
+        glacier_volumechange_remaining = glacier_volumechange
+        retreat = False
+        for npass in range(glac_idx_t0.shape[0]):
+            bin_volumechange = huss_volumechange_curve(glacier_area, heights, glacier_volumechange_remaining)
+            fl.section = utils.clip_min(section + bin_volumechange / fl.dx_meter, 0)
+            if npass == 0:
+                icethickness_change = fl.thick - thick_t0
+            bin_volumechange_remaining = bin_volumechange - (fl.section - section) * fl.dx_meter
+            # remove values below tolerance to avoid rounding errors
+            bin_volumechange_remaining[abs(bin_volumechange_remaining) < pygem_prms.tolerance] = 0
+            glacier_volumechange_remaining = bin_volumechange_remaining.sum()
+            if npass > 0 and abs(glacier_volumechange_remaining) < 1:
+                glacier_volumechange_remaining = 0
+            if glacier_volumechange_remaining >= 0:
+                break
+            retreat = True
+            section = fl.section
+            glacier_area = fl.widths_m * fl.dx_meter
+            glacier_area[fl.thick == 0] = 0
+            # remaining volume change is not redistributed over 3 bins or less (same as _massredistributionHuss)
+            if np.count_nonzero(glacier_area) <= 3:
+                break
+        
+        # Advance (the ice thickness only decreases in the passes of the retreat)
+        if not retreat:
+            self._massredistributionHuss_advance(icethickness_change, glacier_volumechange_remaining, 
+                                                 glac_idx_initial, heights, sec_in_year=sec_in_year)
     
     
     def _massredistributioncurveHuss(self, section_t0, thick_t0, width_t0, glac_idx_t0, glacier_volumechange, 
@@ -751,6 +1003,344 @@ class MassRedistributionCurveModel(FlowlineModel):
         return icethickness_change, glacier_volumechange_remaining
     
     
+#%%
+class MassRedistributionCurveModelEnsemble():
+    """Glacier geometry of an ensemble of glaciers updated together using mass redistribution curves
+
+    Same geometry evolution as MassRedistributionCurveModel with the 'direct' solver, but the ice thickness of all
+    members (e.g., the parameter sets of a simulation, each with its own ice thickness inversion) is held as
+    (nmembers, nbins) arrays. Each year, the mass balance of all members comes from one call of the ensemble mass
+    balance model (PyGEMMassBalanceBatch) and the retreat passes of the Huss curves are applied to all members in the
+    same array operations. Members that advance or have 3 bins or less are updated on their own with
+    MassRedistributionCurveModel.
+    """
+
+    def __init__(self, flowlines, mb_model=None, y0=0.,
+                 option_areaconstant=False, spinupyears=pygem_prms.ref_spinupyears,
+                 constantarea_years=pygem_prms.constantarea_years):
+        """ Instanciate the model.
+
+        Parameters
+        ----------
+        flowlines : list
+            the glacier flowlines of each member, i.e., one list with a MixedBedFlowline per member; all members 
+            need the same grid
+        mb_model : PyGEMMassBalanceBatch
+            the mass-balance model with one parameter set per member
+        y0 : int
+            initial year of the simulation
+        """
+        self.mb_model = mb_model
+        self.yr = y0
+        self.option_areaconstant = option_areaconstant
+        self.constantarea_years = constantarea_years
+        self.spinupyears = spinupyears
+        self.check_for_boundaries = cfg.PARAMS['error_when_glacier_reaches_boundaries']
+
+        # Model of each member for the advance and glaciers with few bins (copies of the flowlines)
+        self.members = [MassRedistributionCurveModel(fls, mb_model=None, y0=y0, option_areaconstant=option_areaconstant,
+                                                     spinupyears=spinupyears, constantarea_years=constantarea_years)
+                        for fls in flowlines]
+        fls = [member.fls[0] for member in self.members]
+        for fl in fls:
+            if not isinstance(fl, MixedBedFlowline):
+                raise InvalidParamsError('MassRedistributionCurveModelEnsemble needs MixedBedFlowlines')
+            if fl.nx != fls[0].nx or fl.dx_meter != fls[0].dx_meter:
+                raise InvalidParamsError('MassRedistributionCurveModelEnsemble needs the same grid for all members')
+        self.nmembers = len(fls)
+        self.nx = fls[0].nx
+        self.dx_meter = fls[0].dx_meter
+        self.glac_idx_initial = [member.glac_idx_initial[0] for member in self.members]
+
+        # Bed of each member (nmembers, nbins)
+        self.bed_h = np.array([fl.bed_h for fl in fls])
+        self.bed_shape = np.array([fl.bed_shape for fl in fls])
+        self._sqrt_bed = np.sqrt(self.bed_shape)
+        self.is_trapezoid = np.array([fl.is_trapezoid for fl in fls])
+        self._w0_m = np.array([fl._w0_m for fl in fls])
+        self._lambdas = np.array([fl._lambdas for fl in fls])
+        self._prec = self.is_trapezoid & (self._lambdas == 0)
+        self.thick = np.array([fl.thick for fl in fls])
+
+
+    @property
+    def surface_h(self):
+        return self.thick + self.bed_h
+
+    @property
+    def widths_m(self):
+        return self._widths_m(slice(None))
+
+    @property
+    def section(self):
+        return self._section(slice(None))
+
+    @property
+    def volume_m3(self):
+        return (self.section * self.dx_meter).sum(1)
+
+    @property
+    def area_m2(self):
+        return (np.where(self.thick > 0, self.widths_m, 0) * self.dx_meter).sum(1)
+
+    @property
+    def length_m(self):
+        lt = cfg.PARAMS.get('min_ice_thick_for_length', 0)
+        if cfg.PARAMS.get('glacier_length_method') == 'consecutive':
+            nx = np.where((self.thick > lt).all(1), self.nx, np.argmin(self.thick > lt, axis=1))
+        else:
+            nx = (self.thick > lt).sum(1)
+        return nx * self.dx_meter
+
+
+    def _widths_m(self, members):
+        """Widths [m] of some members from their ice thickness (same as MixedBedFlowline.widths_m)"""
+        thick = self.thick[members]
+        trap = self.is_trapezoid[members]
+        out = np.sqrt(4*thick/self.bed_shape[members])
+        out[trap] = self._w0_m[members][trap] + self._lambdas[members][trap] * thick[trap]
+        return out
+
+
+    def _section(self, members):
+        """Cross-sectional area [m2] of some members from their ice thickness (same as MixedBedFlowline.section)"""
+        thick = self.thick[members]
+        trap = self.is_trapezoid[members]
+        widths_m = self._widths_m(members)
+        out = 2./3. * widths_m * thick
+        out[trap] = (widths_m[trap] + self._w0_m[members][trap]) / 2 * thick[trap]
+        return out
+
+
+    def _set_section(self, members, section):
+        """Set the ice thickness of some members from their section (same as the MixedBedFlowline.section setter)"""
+        out = (0.75 * section * self._sqrt_bed[members])**(2./3.)
+        trap = self.is_trapezoid[members]
+        prec = self._prec[members]
+        b = 2 * self._w0_m[members][trap]
+        a = 2 * self._lambdas[members][trap]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[trap] = (np.sqrt(b ** 2 + 4 * a * section[trap]) - b) / a
+        out[prec] = section[prec] / self._w0_m[members][prec]
+        self.thick[members] = utils.clip_min(out, 0)
+
+
+    def _member_model(self, member):
+        """Model of a single member with the present ice thickness"""
+        member_model = self.members[member]
+        member_model.fls[0].thick = self.thick[member].copy()
+        return member_model
+
+
+    def run_until(self, y1):
+        """Runs the model from the current year up to a given year y1
+
+        Parameters
+        ----------
+        y1 : int
+            Upper time span for how long the model should run
+        """
+        for year in np.arange(self.yr, y1):
+            self.updategeometry(year)
+        self.yr = y1
+
+        # Check for domain bounds
+        if self.check_for_boundaries:
+            if (self.thick[:,-1] > 10).any():
+                raise RuntimeError('Glacier exceeds domain boundaries, at year: {}'.format(self.yr))
+        # Check for NaNs
+        if np.any(~np.isfinite(self.thick)):
+            raise FloatingPointError('NaN in numerical solution.')
+
+
+    def run_until_and_store(self, y1, store_geometry=True):
+        """Runs the model and returns the yearly glacier geometry and diagnostics of each member
+
+        Parameters
+        ----------
+        y1 : int
+            Upper time span for how long the model should run (needs to be a full year)
+        store_geometry : bool
+            If False, the section and width of each year are not kept in memory (run_ds has no variables)
+
+        Returns
+        -------
+        run_ds : xarray.Dataset
+            section and width of each member at the beginning of each year (member, time, x)
+        diag_ds : xarray.Dataset
+            volume, area and length of each member (member, time)
+        """
+        if int(y1) != y1:
+            raise InvalidParamsError('run_until_and_store only accepts integer year dates.')
+        yearly_time = np.arange(np.floor(self.yr), np.floor(y1)+1)
+        ny = len(yearly_time)
+        if store_geometry:
+            sects = np.zeros((self.nmembers, ny, self.nx)) * np.nan
+            widths = np.zeros((self.nmembers, ny, self.nx)) * np.nan
+        volume = np.zeros((self.nmembers, ny)) * np.nan
+        area = np.zeros((self.nmembers, ny)) * np.nan
+        length = np.zeros((self.nmembers, ny)) * np.nan
+
+        # Run
+        for i, yr in enumerate(yearly_time):
+            if i > 0:
+                self.run_until(yr)
+            if store_geometry:
+                sects[:,i,:] = self.section
+                widths[:,i,:] = self.widths_m
+            volume[:,i] = self.volume_m3
+            area[:,i] = self.area_m2
+            length[:,i] = self.length_m
+            # All glaciers disappeared: nothing changes anymore, so the remaining years are recorded at once
+            if i + 1 < ny and not self.thick.any():
+                rec = slice(int(yr)+1, int(yearly_time[-1])+1)
+                self.mb_model.glac_wide_area_annual[:,rec] = 0
+                self.mb_model.glac_wide_volume_annual[:,rec] = 0
+                if store_geometry:
+                    sects[:,i+1:,:] = sects[:,i:i+1,:]
+                    widths[:,i+1:,:] = widths[:,i:i+1,:]
+                volume[:,i+1:] = volume[:,i:i+1]
+                area[:,i+1:] = area[:,i:i+1]
+                length[:,i+1:] = length[:,i:i+1]
+                self.yr = yearly_time[-1]
+                break
+
+        # to datasets
+        coords = OrderedDict(member=('member', np.arange(self.nmembers)), time=('time', yearly_time))
+        run_ds = xr.Dataset(coords=coords)
+        run_ds.attrs['description'] = 'PyGEM ensemble model output'
+        if store_geometry:
+            run_ds['ts_section'] = (('member', 'time', 'x'), sects)
+            run_ds['ts_width_m'] = (('member', 'time', 'x'), widths)
+        diag_ds = xr.Dataset(coords=coords)
+        diag_ds.attrs['description'] = 'PyGEM ensemble model output'
+        diag_ds['volume_m3'] = (('member', 'time'), volume)
+        diag_ds['volume_m3'].attrs['description'] = 'Total glacier volume'
+        diag_ds['volume_m3'].attrs['unit'] = 'm 3'
+        diag_ds['area_m2'] = (('member', 'time'), area)
+        diag_ds['area_m2'].attrs['description'] = 'Total glacier area'
+        diag_ds['area_m2'].attrs['unit'] = 'm 2'
+        diag_ds['length_m'] = (('member', 'time'), length)
+        diag_ds['length_m'].attrs['description'] = 'Glacier length'
+        diag_ds['length_m'].attrs['unit'] = 'm 3'
+        return run_ds, diag_ds
+
+
+    def updategeometry(self, year):
+        """Update geometry of all members for a given year"""
+        year = int(year)
+        heights = self.surface_h
+        section_t0 = self.section
+        thick_t0 = self.thick.copy()
+        width_t0 = self.widths_m
+
+        # Annual climatic mass balance of all members [m ice s-1]
+        glac_bin_massbalclim_annual = self.mb_model.get_annual_mb(heights, year=year, 
+                                                                  glacier_area=width_t0 * self.dx_meter,
+                                                                  icethickness=thick_t0, section=section_t0)
+
+        # MASS REDISTRIBUTION (constant area for calibration and spinup years)
+        if not ((self.option_areaconstant) or (year < self.spinupyears) or (year < self.constantarea_years)):
+            sec_in_year = (self.mb_model.dates_table.loc[12*year:12*(year+1)-1,'daysinmonth'].values.sum() 
+                           * 24 * 3600)
+            self._massredistributionHuss(section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, heights,
+                                         sec_in_year=sec_in_year)
+
+        # Record glacier area and volume of the next year
+        glacier_area = self.widths_m * self.dx_meter
+        glacier_area[self.thick == 0] = 0
+        self.mb_model.glac_wide_area_annual[:,year+1] = glacier_area.sum(1)
+        self.mb_model.glac_wide_volume_annual[:,year+1] = self.volume_m3
+
+
+    def _massredistributionHuss(self, section_t0, thick_t0, width_t0, glac_bin_massbalclim_annual, heights,
+                                sec_in_year=365*24*3600):
+        """
+        Mass redistribution according to Huss and Hock (2015) of all members (see 
+        MassRedistributionCurveModel._massredistributionHuss_direct)
+
+        Parameters
+        ----------
+        section_t0 : np.ndarray
+            Glacier cross-sectional area (m2) from previous year for each member and elevation bin
+        thick_t0 : np.ndarray
+            Glacier ice thickness [m] from previous year for each member and elevation bin
+        width_t0 : np.ndarray
+            Glacier width [m] from previous year for each member and elevation bin
+        glac_bin_massbalclim_annual : np.ndarray
+            Climatic mass balance [m ice s-1] for each member and elevation bin
+        heights : np.ndarray
+            Surface elevation [m] from previous year for each member and elevation bin
+
+        Returns
+        -------
+        Updates the ice thickness automatically, so does not return anything
+        """
+        glacier_area_t0 = width_t0 * self.dx_meter
+        glacier_area_t0[thick_t0 == 0] = 0
+        nglac = np.count_nonzero(thick_t0, axis=1)
+
+        # Annual glacier-wide volume change [m3]
+        glacier_volumechange = (glac_bin_massbalclim_annual * sec_in_year * glacier_area_t0).sum(1)
+        # Glaciers that disappear
+        redistribute = (nglac > 0) & (-1 * glacier_volumechange < (section_t0 * self.dx_meter).sum(1))
+        self.thick[(nglac > 0) & ~redistribute] = 0
+
+        # Too few bins for the curve
+        for member in np.where(redistribute & (nglac <= 3))[0]:
+            member_model = self._member_model(member)
+            member_model._massredistributionHuss(
+                    section_t0[member].copy(), thick_t0[member].copy(), width_t0[member].copy(),
+                    glac_bin_massbalclim_annual[member], self.glac_idx_initial[member], heights[member].copy(),
+                    sec_in_year=sec_in_year)
+            self.thick[member] = member_model.fls[0].thick
+
+        # Retreat: bins that lose all their ice are removed and the volume change they could not lose is distributed 
+        #  over the remaining bins in the next pass, for all members at once
+        members = np.where(redistribute & (nglac > 3))[0]
+        section = section_t0[members]
+        glacier_area = glacier_area_t0[members]
+        glacier_volumechange_remaining = glacier_volumechange[members]
+        retreat = np.zeros(members.shape, dtype=bool)
+        icethickness_change = np.zeros(section.shape)
+        active = np.arange(members.shape[0])
+        for npass in range(self.nx):
+            if active.shape[0] == 0:
+                break
+            rows = members[active]
+            bin_volumechange = huss_volumechange_curve(glacier_area[active], heights[rows], 
+                                                       glacier_volumechange_remaining[active])
+            self._set_section(rows, utils.clip_min(section[active] + bin_volumechange / self.dx_meter, 0))
+            section_t1 = self._section(rows)
+            if npass == 0:
+                icethickness_change = self.thick[rows] - thick_t0[rows]
+            bin_volumechange_remaining = bin_volumechange - (section_t1 - section[active]) * self.dx_meter
+            # remove values below tolerance to avoid rounding errors
+            bin_volumechange_remaining[abs(bin_volumechange_remaining) < pygem_prms.tolerance] = 0
+            volumechange_remaining = bin_volumechange_remaining.sum(1)
+            if npass > 0:
+                volumechange_remaining[abs(volumechange_remaining) < 1] = 0
+            glacier_volumechange_remaining[active] = volumechange_remaining
+            retreating = volumechange_remaining < 0
+            retreat[active[retreating]] = True
+            section[active] = section_t1
+            glacier_area_t1 = self._widths_m(rows) * self.dx_meter
+            glacier_area_t1[self.thick[rows] == 0] = 0
+            glacier_area[active] = glacier_area_t1
+            # remaining volume change is not redistributed over 3 bins or less (same as _massredistributionHuss)
+            active = active[retreating & (np.count_nonzero(glacier_area_t1, axis=1) > 3)]
+
+        # Advance (the ice thickness only decreases in the passes of the retreat)
+        advance = ~retreat & (icethickness_change > pygem_prms.icethickness_advancethreshold).any(1)
+        for n in np.where(advance)[0]:
+            member = members[n]
+            member_model = self._member_model(member)
+            member_model._massredistributionHuss_advance(
+                    icethickness_change[n], glacier_volumechange_remaining[n], self.glac_idx_initial[member], 
+                    heights[member].copy(), sec_in_year=sec_in_year)
+            self.thick[member] = member_model.fls[0].thick
+    
+    
 #%%
 ## ------ FLOWLINEMODEL FOR MODEL DIAGNOSTICS WITH OGGM (10/30/2020) -----
 #import copy
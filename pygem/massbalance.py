@@ -12,7 +12,9 @@ import pandas as pd
 from oggm import cfg, utils
 from oggm.core.massbalance import MassBalanceModel
 import pygem.pygem_input as pygem_prms
-from pygem.utils._funcs import annualweightedmean_array
+from pygem.utils._funcs import annualweightedmean_array, downscale_climate, partition_precsnow
+from pygem.utils._melt import melt_energy_daily, melt_energy_expected, tempstd_noise_table
+from pygem.utils._refreeze import refreeze_hh2015
 
 cfg.initialize()
 
@@ -42,7 +44,8 @@ class PyGEMMassBalance(MassBalanceModel):
         glacier_rgi_table : pd.Series
             Table of glacier's RGI information
         option_areaconstant : Boolean
-            option to keep glacier area constant (default False allows glacier area to change annually)
+            option to keep glacier area constant (default False allows glacier area to change annually); the climate
+            is then downscaled for the whole period at once
         frontalablation_k : float
             frontal ablation parameter
         debug : Boolean
@@ -107,6 +110,14 @@ class PyGEMMassBalance(MassBalanceModel):
         self.nmonths = self.glacier_gcm_temp.shape[0]
         self.nyears = int(self.dates_table.shape[0] / 12)
 
+        # Constant area: number of first years with the initial glacier (e.g., spin-up years of the dynamical model,
+        #  see MassRedistributionCurveModel), whose climate is downscaled at once
+        self.option_areaconstant = option_areaconstant
+        if option_areaconstant:
+            self.constantarea_nyears = self.nyears
+        else:
+            self.constantarea_nyears = 0
+
         self.bin_temp = np.zeros((nbins,self.nmonths))
         self.bin_prec = np.zeros((nbins,self.nmonths))
         self.bin_acc = np.zeros((nbins,self.nmonths))
@@ -154,6 +165,10 @@ class PyGEMMassBalance(MassBalanceModel):
         self.dayspermonth = self.dates_table['daysinmonth'].values
         self.surfacetype_ddf = np.zeros((nbins))
 
+        # Daily temperature anomalies drawn once per model with its own random number generator
+        if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'random':
+            self.tempstd_noise = tempstd_noise_table(self.nmonths, seed=pygem_prms.tempstd_seed)
+
         # Surface type DDF dictionary (manipulate this function for calibration or for each glacier)
         self.surfacetype_ddf_dict = self._surfacetypeDDFdict(self.modelprms)
 
@@ -171,10 +186,35 @@ class PyGEMMassBalance(MassBalanceModel):
             self.refr = np.zeros(nbins)
             # refrezee cold content or "potential" refreeze
             self.rf_cold = np.zeros(nbins)
-            # layer temp of each elev bin for present time step
-            self.te_rf = np.zeros((pygem_prms.rf_layers,nbins,self.nmonths)) 
-            # layer temp of each elev bin for previous time step
-            self.tl_rf = np.zeros((pygem_prms.rf_layers,nbins,self.nmonths)) 
+            if pygem_prms.option_rf_state == 'full':
+                # layer temp of each elev bin for present time step
+                self.te_rf = np.zeros((pygem_prms.rf_layers,nbins,self.nmonths))
+                # layer temp of each elev bin for previous time step
+                self.tl_rf = np.zeros((pygem_prms.rf_layers,nbins,self.nmonths))
+            elif pygem_prms.option_rf_state == 'rolling':
+                # layer temps of each elev bin only for the present time step (updated in place every month)
+                self.te_rf = np.zeros((pygem_prms.rf_layers,nbins))
+                self.tl_rf = np.zeros((pygem_prms.rf_layers,nbins))
+                # last year computed and layer temps at the start of each year {year: (te_rf, tl_rf)}, so any year
+                #  can be computed again (e.g., dynamical model sub-steps) from the same layer temps as 'full'
+                self.rf_year = -1
+                self.rf_yearstart = {}
+                # sampled history of layer temps for debugging {step: tl_rf}
+                self.tl_rf_history = {}
+
+        # Climate downscaled for all years (constant area runs): key of the model parameters, first time step and
+        #  heights used
+        self.climate_key = None
+        self.climate_t_start = 0
+        self.climate_heights = None
+        self.climate_glac_idx = None
+        # Mass balance of the last year computed for each flowline {fl_id: (key, mb)}, so repeated calls for a year
+        #  (e.g., sub-steps of the dynamical model) do not run the year again; hits and misses for profiling
+        self.mb_cache = {}
+        # Mass balance of the years taken from another model {(year, fl_id): (key, mb)}, see reuse_years
+        self.mb_reused = {}
+        self.mb_cache_hits = 0
+        self.mb_cache_misses = 0
 
         # Sea level for marine-terminating glaciers
         self.sea_level = 0
@@ -207,6 +247,14 @@ class PyGEMMassBalance(MassBalanceModel):
             year = year % (pygem_prms.gcm_endyear - pygem_prms.gcm_startyear)
 
         fl = fls[fl_id]
+        # Year already computed for the same surface and ice thickness (or taken from another model, see reuse_years)
+        if pygem_prms.option_mb_cache or self.mb_reused:
+            mb_cache_key = self._mb_cache_key(heights, year, fl, option_areaconstant)
+            for mb_cached in [self.mb_cache.get(fl_id), self.mb_reused.get((year, fl_id))]:
+                if mb_cached is not None and self._mb_cache_match(mb_cache_key, mb_cached[0]):
+                    self.mb_cache_hits += 1
+                    return mb_cached[1].copy()
+            self.mb_cache_misses += 1
         np.testing.assert_allclose(heights, fl.surface_h)
         glacier_area_t0 = fl.widths_m * fl.dx_meter
         glacier_area_initial = self.glacier_area_initial
@@ -222,13 +270,19 @@ class PyGEMMassBalance(MassBalanceModel):
         nbins = heights.shape[0]
         nmonths = self.glacier_gcm_temp.shape[0]
 
-        # Local variables
-        bin_precsnow = np.zeros((nbins,nmonths))
-
         # Refreezing specific layers
-        if pygem_prms.option_refreezing == 'HH2015' and year == 0:
+        if pygem_prms.option_refreezing == 'HH2015' and pygem_prms.option_rf_state == 'full' and year == 0:
             self.te_rf[:,:,0] = 0     # layer temp of each elev bin for present time step
             self.tl_rf[:,:,0] = 0     # layer temp of each elev bin for previous time step
+        elif pygem_prms.option_refreezing == 'HH2015' and pygem_prms.option_rf_state == 'rolling':
+            # layer temps at the end of the last year computed are the start of the following year
+            self.rf_yearstart[self.rf_year+1] = (self.te_rf.copy(), self.tl_rf.copy())
+            if year > 0 and year in self.rf_yearstart:
+                self.te_rf[:,:], self.tl_rf[:,:] = self.rf_yearstart[year]
+            else:
+                self.te_rf[:,:] = 0
+                self.tl_rf[:,:] = 0
+            self.rf_year = year
         elif pygem_prms.option_refreezing == 'Woodward':
             refreeze_potential = np.zeros(nbins)
 
@@ -248,90 +302,19 @@ class PyGEMMassBalance(MassBalanceModel):
             #  only compute mass balance while glacier exists
             if (pygem_prms.timestep == 'monthly') and (glac_idx_t0.shape[0] != 0):
 
-                # AIR TEMPERATURE: Downscale the gcm temperature [deg C] to each bin
-                if pygem_prms.option_temp2bins == 1:
-                    # Downscale using gcm and glacier lapse rates
-                    #  T_bin = T_gcm + lr_gcm * (z_ref - z_gcm) + lr_glac * (z_bin - z_ref) + tempchange
-                    self.bin_temp[:,12*year:12*(year+1)] = (self.glacier_gcm_temp[12*year:12*(year+1)] +
-                         self.glacier_gcm_lrgcm[12*year:12*(year+1)] *
-                         (self.glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale] - self.glacier_gcm_elev) +
-                         self.glacier_gcm_lrglac[12*year:12*(year+1)] * (heights -
-                         self.glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale])[:, np.newaxis] +
-                                                self.modelprms['tbias'])
-
-                # PRECIPITATION/ACCUMULATION: Downscale the precipitation (liquid and solid) to each bin
-                if pygem_prms.option_prec2bins == 1:
-                    # Precipitation using precipitation factor and precipitation gradient
-                    #  P_bin = P_gcm * prec_factor * (1 + prec_grad * (z_bin - z_ref))
-                    bin_precsnow[:,12*year:12*(year+1)] = (self.glacier_gcm_prec[12*year:12*(year+1)] *
-                            self.modelprms['kp'] * (1 + self.modelprms['precgrad'] * (heights -
-                            self.glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale]))[:,np.newaxis])
-                # Option to adjust prec of uppermost 25% of glacier for wind erosion and reduced moisture content
-                if pygem_prms.option_preclimit == 1:
-                    # Elevation range based on all flowlines
-                    raw_min_elev = []
-                    raw_max_elev = []
-                    if len(fl.surface_h[fl.widths_m > 0]):
-                        raw_min_elev.append(fl.surface_h[fl.widths_m > 0].min())
-                        raw_max_elev.append(fl.surface_h[fl.widths_m > 0].max())
-                    elev_range = np.max(raw_max_elev) - np.min(raw_min_elev)
-                    elev_75 = np.min(raw_min_elev) + 0.75 * (elev_range)
-
-                    # If elevation range > 1000 m, apply corrections to uppermost 25% of glacier (Huss and Hock, 2015)
-                    if elev_range > 1000:
-                        # Indices of upper 25%
-                        glac_idx_upper25 = glac_idx_t0[heights[glac_idx_t0] >= elev_75]
-                        # Exponential decay according to elevation difference from the 75% elevation
-                        #  prec_upper25 = prec * exp(-(elev_i - elev_75%)/(elev_max- - elev_75%))
-                        # height at 75% of the elevation
-                        height_75 = heights[glac_idx_upper25].min()
-                        glac_idx_75 = np.where(heights == height_75)[0][0]
-                        # exponential decay
-                        bin_precsnow[glac_idx_upper25,12*year:12*(year+1)] = (
-                                bin_precsnow[glac_idx_75,12*year:12*(year+1)] *
-                                np.exp(-1*(heights[glac_idx_upper25] - height_75) /
-                                       (heights[glac_idx_upper25].max() - heights[glac_idx_upper25].min()))
-                                [:,np.newaxis])
-                        # Precipitation cannot be less than 87.5% of the maximum accumulation elsewhere on the glacier
-                        for month in range(0,12):
-                            bin_precsnow[glac_idx_upper25[(bin_precsnow[glac_idx_upper25,month] < 0.875 *
-                                                           bin_precsnow[glac_idx_t0,month].max()) &
-                                                          (bin_precsnow[glac_idx_upper25,month] != 0)], month] = (
-                                    0.875 * bin_precsnow[glac_idx_t0,month].max())
-
-                # Separate total precipitation into liquid (bin_prec) and solid (bin_acc)
-                if pygem_prms.option_accumulation == 1:
-                    # if temperature above threshold, then rain
-                    (self.bin_prec[:,12*year:12*(year+1)]
-                                  [self.bin_temp[:,12*year:12*(year+1)] > self.modelprms['tsnow_threshold']]) = (
-                        bin_precsnow[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] > self.modelprms['tsnow_threshold']])
-                    # if temperature below threshold, then snow
-                    (self.bin_acc[:,12*year:12*(year+1)]
-                                 [self.bin_temp[:,12*year:12*(year+1)] <= self.modelprms['tsnow_threshold']]) = (
-                        bin_precsnow[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] <= self.modelprms['tsnow_threshold']])
-                elif pygem_prms.option_accumulation == 2:
-                    # if temperature between min/max, then mix of snow/rain using linear relationship between min/max
-                    self.bin_prec[:,12*year:12*(year+1)] = (
-                            (0.5 + (self.bin_temp[:,12*year:12*(year+1)] -
-                             self.modelprms['tsnow_threshold']) / 2) * bin_precsnow[:,12*year:12*(year+1)])
-                    self.bin_acc[:,12*year:12*(year+1)] = (
-                            bin_precsnow[:,12*year:12*(year+1)] - self.bin_prec[:,12*year:12*(year+1)])
-                    # if temperature above maximum threshold, then all rain
-                    (self.bin_prec[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] > self.modelprms['tsnow_threshold'] + 1]) = (
-                        bin_precsnow[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] > self.modelprms['tsnow_threshold'] + 1])
-                    (self.bin_acc[:,12*year:12*(year+1)]
-                        [self.bin_temp[:,12*year:12*(year+1)] > self.modelprms['tsnow_threshold'] + 1]) = 0
-                    # if temperature below minimum threshold, then all snow
-                    (self.bin_acc[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] <= self.modelprms['tsnow_threshold'] - 1]) = (
-                        bin_precsnow[:,12*year:12*(year+1)]
-                            [self.bin_temp[:,12*year:12*(year+1)] <= self.modelprms['tsnow_threshold'] - 1])
-                    (self.bin_prec[:,12*year:12*(year+1)]
-                        [self.bin_temp[:,12*year:12*(year+1)] <= self.modelprms['tsnow_threshold'] - 1]) = 0
+                # Downscale climate to each bin: all constant-area years at once, else this year
+                if option_areaconstant:
+                    self._downscale_climate_allyears(heights, fl, glac_idx_t0, year, self.nmonths)
+                elif year < self.constantarea_nyears:
+                    self._downscale_climate_allyears(heights, fl, glac_idx_t0, year, 12*self.constantarea_nyears)
+                else:
+                    self.climate_key = None
+                    self._downscale_climate(heights, fl, glac_idx_t0, 12*year, 12*(year+1))
+                # Expected energy available for melt of normally distributed daily temperatures [degC day] of the year
+                if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+                    melt_energy_year = melt_energy_expected(self.bin_temp[:,12*year:12*(year+1)],
+                                                            self.glacier_gcm_tempstd[12*year:12*(year+1)],
+                                                            self.dayspermonth[12*year:12*(year+1)])
 
                 # ENTER MONTHLY LOOP (monthly loop required since surface type changes)
                 for month in range(0,12):
@@ -351,22 +334,15 @@ class PyGEMMassBalance(MassBalanceModel):
                         # option 1: energy based on monthly temperature
                         melt_energy_available = self.bin_temp[:,step]*self.dayspermonth[step]
                         melt_energy_available[melt_energy_available < 0] = 0
+                    elif pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+                        # option 2: expected energy of normally distributed daily temperatures
+                        melt_energy_available = melt_energy_year[:,month]
                     elif pygem_prms.option_ablation == 2:
-                        # Seed randomness for repeatability, but base it on step to ensure the daily variability is not
-                        #  the same for every single time step
-                        np.random.seed(step)
                         # option 2: monthly temperature superimposed with daily temperature variability
-                        # daily temperature variation in each bin for the monthly timestep
-                        bin_tempstd_daily = np.repeat(
-                                np.random.normal(loc=0, scale=self.glacier_gcm_tempstd[step],
-                                                 size=self.dayspermonth[step])
-                                .reshape(1,self.dayspermonth[step]), heights.shape[0], axis=0)
-                        # daily temperature in each bin for the monthly timestep
-                        bin_temp_daily = self.bin_temp[:,step][:,np.newaxis] + bin_tempstd_daily
-                        # remove negative values
-                        bin_temp_daily[bin_temp_daily < 0] = 0
-                        # Energy available for melt [degC day] = sum of daily energy available
-                        melt_energy_available = bin_temp_daily.sum(axis=1)
+                        #  daily temperatures are the same in each bin and drawn once per model (see __init__)
+                        melt_energy_available = melt_energy_daily(self.bin_temp[:,step],
+                                                                  self.glacier_gcm_tempstd[step],
+                                                                  self.dayspermonth[step], self.tempstd_noise[step])
                     # SNOW MELT [m w.e.]
                     self.bin_meltsnow[:,step] = self.surfacetype_ddf_dict[2] * melt_energy_available
                     # snow melt cannot exceed the snow depth
@@ -395,135 +371,63 @@ class PyGEMMassBalance(MassBalanceModel):
 
                     # REFREEZING
                     if pygem_prms.option_refreezing == 'HH2015':
-                        if step > 0:
-                            self.tl_rf[:,:,step] = self.tl_rf[:,:,step-1]
-                            self.te_rf[:,:,step] = self.te_rf[:,:,step-1]
+                        if pygem_prms.option_rf_state == 'full':
+                            if step > 0:
+                                self.tl_rf[:,:,step] = self.tl_rf[:,:,step-1]
+                                self.te_rf[:,:,step] = self.te_rf[:,:,step-1]
+                            te_rf = self.te_rf[:,:,step]
+                            tl_rf = self.tl_rf[:,:,step]
+                        else:
+                            # rolling state: layer temps of previous step are updated in place
+                            te_rf = self.te_rf
+                            tl_rf = self.tl_rf
 
                         # Refreeze based on heat conduction approach (Huss and Hock 2015)
                         # refreeze time step (s)
                         rf_dt = 3600 * 24 * self.dayspermonth[step] / pygem_prms.rf_dsc
 
                         if pygem_prms.option_rf_limit_meltsnow == 1:
-                            bin_meltlimit = self.bin_meltsnow.copy()
+                            bin_meltlimit = self.bin_meltsnow[:,step]
                         else:
-                            bin_meltlimit = self.bin_melt.copy()
+                            bin_meltlimit = self.bin_melt[:,step]
 
                         # Debug lowest bin
                         if self.debug_refreeze:
                             gidx_debug = np.where(heights == heights[glac_idx_t0].min())[0]
-
-                        # Loop through each elevation bin of glacier
-                        for nbin, gidx in enumerate(glac_idx_t0):
-                            # COMPUTE HEAT CONDUCTION - BUILD COLD RESERVOIR
-                            # If no melt, then build up cold reservoir (compute heat conduction)
-                            if self.bin_melt[gidx,step] < pygem_prms.rf_meltcrit:
-
-                                if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                    print('\nMonth ' + str(self.dates_table.loc[step,'month']),
-                                          'Computing heat conduction')
-
-                                # Set refreeze equal to 0
-                                self.refr[gidx] = 0
-                                # Loop through multiple iterations to converge on a solution
-                                #  -> this will loop through 0, 1, 2
-                                for h in np.arange(0, pygem_prms.rf_dsc):
-                                    # Compute heat conduction in layers (loop through rows)
-                                    #  go from 1 to rf_layers-1 to avoid indexing errors with "j-1" and "j+1"
-                                    #  "j+1" is set to zero, which is fine for temperate glaciers but inaccurate for
-                                    #  cold/polythermal glaciers
-                                    for j in np.arange(1, pygem_prms.rf_layers-1):
-                                        # Assume temperature of first layer equals air temperature
-                                        #  assumption probably wrong, but might still work at annual average
-                                        # Since next line uses tl_rf for all calculations, set tl_rf[0] to present mean
-                                        #  monthly air temperature to ensure the present calculations are done with the
-                                        #  present time step's air temperature
-                                        self.tl_rf[0, gidx,step] = self.bin_temp[gidx,step]
-                                        # Temperature for each layer
-                                        self.te_rf[j,gidx,step] = (self.tl_rf[j,gidx,step] +
-                                             rf_dt * self.rf_layers_k[j] / self.rf_layers_ch[j] / pygem_prms.rf_dz**2 *
-                                             0.5 * ((self.tl_rf[j-1,gidx,step] - self.tl_rf[j,gidx,step]) -
-                                                     (self.tl_rf[j,gidx,step] - self.tl_rf[j+1,gidx,step])))
-                                        # Update previous time step
-                                        self.tl_rf[:,gidx,step] = self.te_rf[:,gidx,step]
-
-                                if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                    print('tl_rf:', ["{:.2f}".format(x) for x in self.tl_rf[:,gidx,step]])
-
-                            # COMPUTE REFREEZING - TAP INTO "COLD RESERVOIR" or potential refreezing
+                            rf_cold_debug = self.rf_cold[gidx_debug].copy()
+
+                        # Heat conduction and refreezing for all elevation bins of the glacier at once
+                        glac_mask = np.zeros(nbins, dtype=bool)
+                        glac_mask[glac_idx_t0] = True
+                        self.refr[glac_idx_t0] = refreeze_hh2015(
+                                te_rf, tl_rf, self.rf_cold, glac_mask,
+                                self.bin_temp[:,step], self.bin_melt[:,step], bin_meltlimit, self.bin_prec[:,step],
+                                self.bin_snowpack[:,step], self.surfacetype, rf_dt, self.rf_layers_dens,
+                                self.rf_layers_ch, self.rf_layers_k, pygem_prms.rf_dz, pygem_prms.rf_dsc,
+                                pygem_prms.rf_meltcrit, pygem_prms.pp, pygem_prms.Lh_rf, pygem_prms.density_water
+                                )[glac_idx_t0]
+
+                        # Record refreeze
+                        self.bin_refreeze[glac_idx_t0,step] = self.refr[glac_idx_t0]
+
+                        if (self.debug_refreeze and pygem_prms.option_rf_state == 'rolling' and
+                            step % pygem_prms.rf_history_step == 0):
+                            self.tl_rf_history[step] = self.tl_rf.copy()
+
+                        if self.debug_refreeze and step < 12:
+                            if self.bin_melt[gidx_debug[0],step] < pygem_prms.rf_meltcrit:
+                                print('\nMonth ' + str(self.dates_table.loc[step,'month']),
+                                      'Computing heat conduction')
+                                print('tl_rf:', ["{:.2f}".format(x) for x in tl_rf[:,gidx_debug[0]]])
                             else:
-
-                                if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                    print('\nMonth ' + str(self.dates_table.loc[step,'month']), 'Computing refreeze')
-
-                                # Refreezing over firn surface
-                                if (self.surfacetype[gidx] == 2) or (self.surfacetype[gidx] == 3):
-                                    nlayers = pygem_prms.rf_layers-1
-                                # Refreezing over ice surface
-                                else:
-                                    # Approximate number of layers of snow on top of ice
-                                    smax = np.round((self.bin_snowpack[gidx,step] / (self.rf_layers_dens[0] / 1000) +
-                                                     pygem_prms.pp) / pygem_prms.rf_dz, 0)
-                                    # if there is very little snow on the ground (SWE > 0.06 m for pp=0.3),
-                                    #  then still set smax (layers) to 1
-                                    if self.bin_snowpack[gidx,step] > 0 and smax == 0:
-                                        smax=1
-                                    # if no snow on the ground, then set to rf_cold to NoData value
-                                    if smax == 0:
-                                        self.rf_cold[gidx] = 0
-                                    # if smax greater than the number of layers, set to max number of layers minus 1
-                                    if smax > pygem_prms.rf_layers - 1:
-                                        smax = pygem_prms.rf_layers - 1
-                                    nlayers = int(smax)
-                                # Compute potential refreeze, "cold reservoir", from temperature in each layer
-                                # only calculate potential refreezing first time it starts melting each year
-                                if self.rf_cold[gidx] == 0 and self.tl_rf[:,gidx,step].min() < 0:
-
-                                    if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                        print('calculating potential refreeze from ' + str(nlayers) + ' layers')
-
-                                    for j in np.arange(0,nlayers):
-                                        j += 1
-                                        # units: (degC) * (J K-1 m-3) * (m) * (kg J-1) * (m3 kg-1)
-                                        rf_cold_layer = (self.tl_rf[j,gidx,step] * self.rf_layers_ch[j] *
-                                                         pygem_prms.rf_dz / pygem_prms.Lh_rf / pygem_prms.density_water)
-                                        self.rf_cold[gidx] -= rf_cold_layer
-
-                                        if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                            print('j:', j, 'tl_rf @ j:', np.round(self.tl_rf[j,gidx,step],2),
-                                                           'ch @ j:', np.round(self.rf_layers_ch[j],2),
-                                                           'rf_cold_layer @ j:', np.round(rf_cold_layer,2),
-                                                           'rf_cold @ j:', np.round(self.rf_cold[gidx],2))
-
-                                    if self.debug_refreeze and gidx == gidx_debug and step < 12:
-                                        print('rf_cold:', np.round(self.rf_cold[gidx],2))
-
-                                # Compute refreezing
-                                # If melt and liquid prec < potential refreeze, then refreeze all melt and liquid prec
-                                if (bin_meltlimit[gidx,step] + self.bin_prec[gidx,step]) < self.rf_cold[gidx]:
-                                    self.refr[gidx] = bin_meltlimit[gidx,step] + self.bin_prec[gidx,step]
-                                # otherwise, refreeze equals the potential refreeze
-                                elif self.rf_cold[gidx] > 0:
-                                    self.refr[gidx] = self.rf_cold[gidx]
-                                else:
-                                    self.refr[gidx] = 0
-
-                                # Track the remaining potential refreeze
-                                self.rf_cold[gidx] -= (bin_meltlimit[gidx,step] + self.bin_prec[gidx,step])
-                                # if potential refreeze consumed, set to 0 and set temperature to 0 (temperate firn)
-                                if self.rf_cold[gidx] < 0:
-                                    self.rf_cold[gidx] = 0
-                                    self.tl_rf[:,gidx,step] = 0
-
-                            # Record refreeze
-                            self.bin_refreeze[gidx,step] = self.refr[gidx]
-
-                            if self.debug_refreeze and step < 12 and gidx == gidx_debug:
-                                print('Month ' + str(self.dates_table.loc[step,'month']),
-                                      'Rf_cold remaining:', np.round(self.rf_cold[gidx],2),
-                                      'Snow depth:', np.round(self.bin_snowpack[glac_idx_t0[nbin],step],2),
-                                      'Snow melt:', np.round(self.bin_meltsnow[glac_idx_t0[nbin],step],2),
-                                      'Rain:', np.round(self.bin_prec[glac_idx_t0[nbin],step],2),
-                                      'Rfrz:', np.round(self.bin_refreeze[gidx,step],2))
+                                print('\nMonth ' + str(self.dates_table.loc[step,'month']), 'Computing refreeze')
+                                print('rf_cold:', np.round(rf_cold_debug,2))
+                            print('Month ' + str(self.dates_table.loc[step,'month']),
+                                  'Rf_cold remaining:', np.round(self.rf_cold[gidx_debug],2),
+                                  'Snow depth:', np.round(self.bin_snowpack[gidx_debug,step],2),
+                                  'Snow melt:', np.round(self.bin_meltsnow[gidx_debug,step],2),
+                                  'Rain:', np.round(self.bin_prec[gidx_debug,step],2),
+                                  'Rfrz:', np.round(self.bin_refreeze[gidx_debug,step],2))
 
                     elif pygem_prms.option_refreezing == 'Woodward':
                         # Refreeze based on annual air temperature (Woodward etal. 1997)
@@ -625,9 +529,340 @@ class PyGEMMassBalance(MassBalanceModel):
         if self.inversion_filter:
             mb = np.minimum.accumulate(mb)
 
+        if pygem_prms.option_mb_cache:
+            self.mb_cache[fl_id] = (self._mb_cache_key(heights.copy(), year, fl, option_areaconstant, copy=True),
+                                    mb.copy())
+
         return mb
 
 
+    # Model variables that make up the state after a number of years, grouped by their time dimension
+    state_vns_monthly = ['bin_temp', 'bin_prec', 'bin_acc', 'bin_refreezepotential', 'bin_refreeze', 'bin_meltglac',
+                         'bin_meltsnow', 'bin_melt', 'bin_snowpack', 'snowpack_remaining', 'glac_bin_refreeze',
+                         'glac_bin_melt', 'glac_bin_frontalablation', 'glac_bin_snowpack', 'glac_bin_massbalclim',
+                         'offglac_bin_prec', 'offglac_bin_melt', 'offglac_bin_refreeze', 'offglac_bin_snowpack',
+                         'glac_wide_temp', 'glac_wide_prec', 'glac_wide_acc', 'glac_wide_refreeze', 'glac_wide_melt',
+                         'glac_wide_frontalablation', 'glac_wide_massbaltotal', 'glac_wide_runoff',
+                         'glac_wide_snowline', 'offglac_wide_prec', 'offglac_wide_refreeze', 'offglac_wide_melt',
+                         'offglac_wide_snowpack', 'offglac_wide_runoff']
+    state_vns_annual = ['glac_bin_massbalclim_annual', 'glac_wide_volume_change_ignored_annual']
+    # annual variables with an extra year, which the dynamical model records at the end of each year
+    state_vns_annual_plus1 = ['glac_bin_surfacetype_annual', 'glac_bin_area_annual', 'glac_bin_icethickness_annual',
+                              'glac_bin_width_annual', 'offglac_bin_area_annual', 'glac_wide_area_annual',
+                              'glac_wide_volume_annual', 'glac_wide_ELA_annual']
+
+
+    def get_state(self, year):
+        """Snapshot of the model state after the first years have been computed
+
+        The state holds copies of everything needed to continue the run in a new model (snowpack, surface type,
+        refreezing layers) and the results of the years computed so far, so the snapshot can be restored into any 
+        number of models (e.g., after a spin-up shared by all GCMs) using set_state.
+
+        Parameters
+        ----------
+        year : int
+            number of years that have been computed (the next year to compute)
+
+        Returns
+        -------
+        state : dict
+            model state (numpy arrays and scalars only, so it can be pickled)
+        """
+        year = int(year)
+        state = {'year': year}
+        for vn in self.state_vns_monthly:
+            state[vn] = getattr(self, vn)[...,:12*year].copy()
+        for vn in self.state_vns_annual:
+            state[vn] = getattr(self, vn)[...,:year].copy()
+        for vn in self.state_vns_annual_plus1:
+            state[vn] = getattr(self, vn)[...,:year+1].copy()
+        state['surfacetype_ddf'] = self.surfacetype_ddf.copy()
+        if hasattr(self, 'surfacetype'):
+            state['surfacetype'] = self.surfacetype.copy()
+            state['firnline_idx'] = self.firnline_idx
+        if pygem_prms.option_refreezing == 'HH2015':
+            state['refr'] = self.refr.copy()
+            state['rf_cold'] = self.rf_cold.copy()
+            if pygem_prms.option_rf_state == 'full':
+                state['te_rf'] = self.te_rf[:,:,:12*year].copy()
+                state['tl_rf'] = self.tl_rf[:,:,:12*year].copy()
+            elif pygem_prms.option_rf_state == 'rolling':
+                state['te_rf'] = self.te_rf.copy()
+                state['tl_rf'] = self.tl_rf.copy()
+                state['rf_year'] = self.rf_year
+                state['rf_yearstart'] = {x: (self.rf_yearstart[x][0].copy(), self.rf_yearstart[x][1].copy())
+                                         for x in self.rf_yearstart if x <= year}
+                state['tl_rf_history'] = {step: self.tl_rf_history[step].copy() for step in self.tl_rf_history
+                                          if step < 12*year}
+        return state
+
+
+    def set_state(self, state):
+        """Restore a model state from get_state, so the run continues with the year after the snapshot
+
+        The model must have the same elevation bins and refreezing options as the model the state was taken from.
+        Climate data of the following years is taken from this model.
+
+        Parameters
+        ----------
+        state : dict
+            model state from get_state
+        """
+        year = state['year']
+        self.mb_cache = {}
+        self.mb_reused = {}
+        self.climate_key = None
+        for vn in self.state_vns_monthly:
+            getattr(self, vn)[...,:12*year] = state[vn]
+        for vn in self.state_vns_annual:
+            getattr(self, vn)[...,:year] = state[vn]
+        for vn in self.state_vns_annual_plus1:
+            getattr(self, vn)[...,:year+1] = state[vn]
+        self.surfacetype_ddf = state['surfacetype_ddf'].copy()
+        if 'surfacetype' in state:
+            self.surfacetype = state['surfacetype'].copy()
+            self.firnline_idx = state['firnline_idx']
+        if pygem_prms.option_refreezing == 'HH2015':
+            self.refr = state['refr'].copy()
+            self.rf_cold = state['rf_cold'].copy()
+            if pygem_prms.option_rf_state == 'full':
+                self.te_rf[:,:,:12*year] = state['te_rf']
+                self.tl_rf[:,:,:12*year] = state['tl_rf']
+            elif pygem_prms.option_rf_state == 'rolling':
+                self.te_rf[:,:] = state['te_rf']
+                self.tl_rf[:,:] = state['tl_rf']
+                self.rf_year = state['rf_year']
+                self.rf_yearstart = {x: (te_rf.copy(), tl_rf.copy()) for x, (te_rf, tl_rf) in
+                                     state['rf_yearstart'].items()}
+                self.tl_rf_history = {step: tl_rf.copy() for step, tl_rf in state['tl_rf_history'].items()}
+
+
+    def reuse_years(self, mbmod, nyears, fls, fl_id=0, tolerance=1e-6):
+        """Take the first constant-area years from another model of the glacier instead of computing them again
+
+        The model used for the ice thickness inversion already computed every year on the initial glacier with the
+        same model parameters. While the dynamical model keeps the area constant (spin-up and constant-area years),
+        the climatic mass balance of each bin is the same, so the binned results of these years (downscaled climate,
+        snowpack, melt, refreezing, surface type) are copied for the bins found in both models. Glacier-wide results
+        are computed from the glacier area of this model and the mass balance of the copied years is returned from the
+        cache by get_annual_mb.
+
+        Bins are matched by surface elevation. Bins of this model without a counterpart (e.g., the bins below the
+        terminus added by init_present_time_glacier) have no snowpack at the end of the copied years, which only
+        affects the glacier if it advances into them. The refreezing layers of HH2015 are not stored for each year,
+        so the years are only copied with the Woodward refreezing.
+
+        Parameters
+        ----------
+        mbmod : PyGEMMassBalance
+            model that computed at least the first nyears with constant area
+        nyears : int
+            number of constant-area years to copy
+        fls : list
+            flowlines of this model (initial glacier)
+        fl_id : int
+            flowline id
+        tolerance : float
+            maximum elevation difference of matching bins [m]
+
+        Returns
+        -------
+        nyears_reused : int
+            number of years copied (0 if the models do not match)
+        """
+        nyears = int(nyears)
+        fl = fls[fl_id]
+        if (nyears < 1 or nyears > min(self.nyears, mbmod.nyears) or self.repeat_period or mbmod.repeat_period or
+            pygem_prms.option_refreezing != 'Woodward'):
+            return 0
+        # same parameters and climate
+        if (sorted(self.modelprms) != sorted(mbmod.modelprms) or
+            any(float(self.modelprms[x]) != float(mbmod.modelprms[x]) for x in self.modelprms)):
+            return 0
+        for vn in ['glacier_gcm_temp', 'glacier_gcm_tempstd', 'glacier_gcm_prec', 'glacier_gcm_lrgcm',
+                   'glacier_gcm_lrglac']:
+            if not np.array_equal(getattr(self, vn)[:12*nyears], getattr(mbmod, vn)[:12*nyears]):
+                return 0
+        if not np.array_equal(self.glacier_gcm_elev, mbmod.glacier_gcm_elev):
+            return 0
+        # years computed by mbmod with its initial glacier area (only bins with ice, as in get_annual_mb)
+        glacier_area_initial_mbmod = mbmod.glacier_area_initial.copy()
+        if mbmod.icethickness_initial is not None:
+            glacier_area_initial_mbmod[mbmod.icethickness_initial == 0] = 0
+        if not np.allclose(mbmod.glac_bin_area_annual[:,:nyears], glacier_area_initial_mbmod[:,np.newaxis]):
+            return 0
+
+        # Glacier of this model, as in get_annual_mb
+        heights = fl.surface_h.copy()
+        glacier_area_t0 = fl.widths_m * fl.dx_meter
+        icethickness_t0 = getattr(fl, 'thick', None)
+        if icethickness_t0 is not None:
+            glacier_area_t0[icethickness_t0 == 0] = 0
+        glac_mask = glacier_area_t0 > 0
+        glac_mask_mbmod = mbmod.glac_bin_area_annual[:,0] > 0
+
+        # Bins with the same elevation, which must include all bins with glacier in both models
+        match = np.abs(heights[:,np.newaxis] - mbmod.heights[np.newaxis,:]) < tolerance
+        if match.sum(0).max() > 1 or match.sum(1).max() > 1:
+            return 0
+        idx, idx_mbmod = match.nonzero()
+        if (glac_mask[idx].sum() != glac_mask.sum() or glac_mask_mbmod[idx_mbmod].sum() != glac_mask_mbmod.sum() or
+            not np.array_equal(glac_mask[idx], glac_mask_mbmod[idx_mbmod]) or
+            not np.array_equal(self.debris_ed[idx], mbmod.debris_ed[idx_mbmod])):
+            return 0
+
+        # Binned results
+        for vn in self.state_vns_monthly:
+            if getattr(self, vn).ndim == 2:
+                getattr(self, vn)[:,:12*nyears] = 0
+                getattr(self, vn)[idx,:12*nyears] = getattr(mbmod, vn)[idx_mbmod,:12*nyears]
+        self.glac_bin_massbalclim_annual[:,:nyears] = 0
+        self.glac_bin_massbalclim_annual[idx,:nyears] = mbmod.glac_bin_massbalclim_annual[idx_mbmod,:nyears]
+        self.glac_bin_surfacetype_annual[:,:nyears] = 0
+        self.glac_bin_surfacetype_annual[idx,:nyears] = mbmod.glac_bin_surfacetype_annual[idx_mbmod,:nyears]
+        # Surface type at the start of the first year that is not copied
+        self.firnline_idx = idx[idx_mbmod == mbmod.firnline_idx][0]
+        self.surfacetype, _ = self._surfacetypebinsannual(self.glac_bin_surfacetype_annual[:,nyears-1].copy(),
+                                                          self.glac_bin_massbalclim_annual, nyears-1)
+
+        # Glacier-wide results and mass balance of each year
+        self.mb_cache = {}
+        self.mb_reused = {}
+        for year in range(nyears):
+            self.offglac_bin_area_annual[:,year] = self.glacier_area_initial - glacier_area_t0
+            self.glac_bin_area_annual[:,year] = glacier_area_t0
+            self._convert_glacwide_results(year, glacier_area_t0.copy(), heights, fls=fls, fl_id=fl_id)
+            seconds_in_year = self.dayspermonth[12*year:12*(year+1)].sum() * 24 * 3600
+            mb = (self.glac_bin_massbalclim[:,12*year:12*(year+1)].sum(1)
+                  * pygem_prms.density_water / pygem_prms.density_ice / seconds_in_year)
+            if self.inversion_filter:
+                mb = np.minimum.accumulate(mb)
+            self.mb_reused[(year, fl_id)] = (self._mb_cache_key(heights.copy(), year, fl, False, copy=True), mb)
+        return nyears
+
+
+    def _mb_cache_key(self, heights, year, fl, option_areaconstant, copy=False):
+        """Key of the mass balance cache: year, model parameters, and surface and ice thickness of the flowline"""
+        thick = getattr(fl, 'thick', fl.widths_m)
+        return (year, option_areaconstant, tuple(float(self.modelprms[x]) for x in sorted(self.modelprms)),
+                heights, thick.copy() if copy else thick)
+
+
+    @staticmethod
+    def _mb_cache_match(key, key_cached):
+        """Check if a key of the mass balance cache matches a stored key (the arrays are only compared if needed)"""
+        return (key[:3] == key_cached[:3] and np.array_equal(key[3], key_cached[3]) and
+                np.array_equal(key[4], key_cached[4]))
+
+
+    def _downscale_climate(self, heights, fl, glac_idx_t0, t_start, t_end):
+        """
+        Downscale the temperature and precipitation to each elevation bin and separate liquid and solid precipitation
+
+        Parameters
+        ----------
+        heights : np.array
+            elevation bins
+        fl : object
+            flowline object
+        glac_idx_t0 : np.array
+            indices of the elevation bins with glacier
+        t_start, t_end : int
+            first and last (excluded) time step to downscale
+        """
+        # Local variables
+        bin_precsnow = np.zeros((heights.shape[0],self.nmonths))
+
+        # AIR TEMPERATURE AND PRECIPITATION: Downscale the gcm temperature [deg C] and precipitation (liquid and solid)
+        #  to each bin
+        bin_temp, bin_precsnow_t = downscale_climate(
+                self.glacier_gcm_temp[t_start:t_end], self.glacier_gcm_prec[t_start:t_end], self.glacier_gcm_elev,
+                self.glacier_gcm_lrgcm[t_start:t_end], self.glacier_gcm_lrglac[t_start:t_end],
+                self.glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale], heights[:,np.newaxis],
+                self.modelprms['tbias'], self.modelprms['kp'], self.modelprms['precgrad'])
+        if pygem_prms.option_temp2bins == 1:
+            self.bin_temp[:,t_start:t_end] = bin_temp
+        if pygem_prms.option_prec2bins == 1:
+            bin_precsnow[:,t_start:t_end] = bin_precsnow_t
+        # Option to adjust prec of uppermost 25% of glacier for wind erosion and reduced moisture content
+        if pygem_prms.option_preclimit == 1:
+            # Elevation range based on all flowlines
+            raw_min_elev = []
+            raw_max_elev = []
+            if len(fl.surface_h[fl.widths_m > 0]):
+                raw_min_elev.append(fl.surface_h[fl.widths_m > 0].min())
+                raw_max_elev.append(fl.surface_h[fl.widths_m > 0].max())
+            elev_range = np.max(raw_max_elev) - np.min(raw_min_elev)
+            elev_75 = np.min(raw_min_elev) + 0.75 * (elev_range)
+
+            # If elevation range > 1000 m, apply corrections to uppermost 25% of glacier (Huss and Hock, 2015)
+            if elev_range > 1000:
+                # Indices of upper 25%
+                glac_idx_upper25 = glac_idx_t0[heights[glac_idx_t0] >= elev_75]
+                # Exponential decay according to elevation difference from the 75% elevation
+                #  prec_upper25 = prec * exp(-(elev_i - elev_75%)/(elev_max- - elev_75%))
+                # height at 75% of the elevation
+                height_75 = heights[glac_idx_upper25].min()
+                glac_idx_75 = np.where(heights == height_75)[0][0]
+                # exponential decay
+                bin_precsnow[glac_idx_upper25,t_start:t_end] = (
+                        bin_precsnow[glac_idx_75,t_start:t_end] *
+                        np.exp(-1*(heights[glac_idx_upper25] - height_75) /
+                               (heights[glac_idx_upper25].max() - heights[glac_idx_upper25].min()))
+                        [:,np.newaxis])
+                # Precipitation cannot be less than 87.5% of the maximum accumulation elsewhere on the glacier
+                for month in range(0,12):
+                    bin_precsnow[glac_idx_upper25[(bin_precsnow[glac_idx_upper25,month] < 0.875 *
+                                                   bin_precsnow[glac_idx_t0,month].max()) &
+                                                  (bin_precsnow[glac_idx_upper25,month] != 0)], month] = (
+                            0.875 * bin_precsnow[glac_idx_t0,month].max())
+
+        # Separate total precipitation into liquid (bin_prec) and solid (bin_acc)
+        self.bin_prec[:,t_start:t_end], self.bin_acc[:,t_start:t_end] = partition_precsnow(
+                self.bin_temp[:,t_start:t_end], bin_precsnow[:,t_start:t_end], self.modelprms['tsnow_threshold'])
+
+
+    def _downscale_climate_allyears(self, heights, fl, glac_idx_t0, year, t_end):
+        """
+        Downscale the climate of the year and the following constant-area years at once (the heights do not change).
+
+        The downscaled temperature, liquid precipitation and accumulation are cached on the model, so further calls
+        with the same heights and model parameters (tbias, kp, precgrad, tsnow_threshold) do not compute them again.
+        If the heights differ from the last call, only the year is downscaled (so changing heights cost one year per
+        call), and the following years are downscaled at once when the heights stay the same. Downscaling a single
+        year (see get_annual_mb) invalidates the cache.
+
+        Parameters
+        ----------
+        heights : np.array
+            elevation bins
+        fl : object
+            flowline object
+        glac_idx_t0 : np.array
+            indices of the elevation bins with glacier
+        year : int
+            year of the mass balance
+        t_end : int
+            last (excluded) time step to downscale, i.e. 12 times the number of constant-area years
+        """
+        climate_key = (tuple(float(self.modelprms[x]) for x in ['tbias', 'kp', 'precgrad', 'tsnow_threshold']) +
+                       (t_end,))
+        same_heights = (self.climate_heights is not None and np.array_equal(self.climate_heights, heights) and
+                        np.array_equal(self.climate_glac_idx, glac_idx_t0))
+        if same_heights and self.climate_key == climate_key and 12*year >= self.climate_t_start:
+            return
+        if same_heights or self.climate_heights is None:
+            self._downscale_climate(heights, fl, glac_idx_t0, 12*year, t_end)
+            self.climate_key = climate_key
+            self.climate_t_start = 12*year
+        else:
+            self._downscale_climate(heights, fl, glac_idx_t0, 12*year, 12*(year+1))
+            self.climate_key = None
+        self.climate_heights = heights.copy()
+        self.climate_glac_idx = glac_idx_t0.copy()
+
+
     #%%
     def _convert_glacwide_results(self, year, glacier_area, heights, 
                                   fls=None, fl_id=None, option_areaconstant=False, debug=False):
@@ -1135,3 +1370,479 @@ class PyGEMMassBalance(MassBalanceModel):
             elif option_ddf_firn == 1:
                 surfacetype_ddf_dict[3] = np.mean([modelprms['ddfsnow'],modelprms['ddfice']])
         return surfacetype_ddf_dict
+
+
+#%%
+class PyGEMMassBalanceBatch():
+    """Mass balance for many parameter sets evaluated together.
+
+    Same accumulation, melt and refreezing as PyGEMMassBalance, but the model parameters (kp, tbias, ddfsnow, ddfice,
+    precgrad, tsnow_threshold) may be arrays and all states have a leading parameter set axis (nsets, nbins), so N
+    parameter sets are run through the climate in a single pass. Only glacier-wide results are stored (on-glacier,
+    snow line, ELA and off-glacier of the area the glacier lost).
+    """
+    def __init__(self, gdir, modelprms, glacier_rgi_table, fls=None, fl_id=0, repeat_period=False,
+                 inversion_filter=False):
+        """ Initialize.
+
+        Parameters
+        ----------
+        modelprms : dict
+            Model parameters dictionary (kp, tbias, ddfsnow, ddfice, precgrad, tsnow_threshold), where each value is
+            a float or an array with one value per parameter set
+        glacier_rgi_table : pd.Series
+            Table of glacier's RGI information
+        fls : list
+            flowlines; initial area, thickness and section are taken from fls[fl_id]. If each parameter set has its own
+            glacier geometry (e.g., from an ice thickness inversion with its parameters), a list with the flowlines of 
+            each parameter set; the glacier data then has a parameter set axis (nsets, nbins)
+        """
+        self.glacier_rgi_table = glacier_rgi_table
+        self.repeat_period = repeat_period
+        self.inversion_filter = inversion_filter
+
+        # Model parameters as arrays (nsets, 1) to broadcast over the elevation bins
+        prm_names = ['kp', 'tbias', 'ddfsnow', 'ddfice', 'precgrad', 'tsnow_threshold']
+        self.nsets = max([np.size(modelprms[x]) for x in prm_names])
+        self.modelprms = {x: np.broadcast_to(np.asarray(modelprms[x], dtype=float).reshape(-1),
+                                             (self.nsets,)).copy()[:,np.newaxis] for x in prm_names}
+        # Surface type DDF
+        self.ddfsnow = self.modelprms['ddfsnow']
+        self.ddfice = self.modelprms['ddfice']
+        if pygem_prms.option_ddf_firn == 0:
+            self.ddffirn = self.ddfsnow
+        elif pygem_prms.option_ddf_firn == 1:
+            self.ddffirn = (self.ddfsnow + self.ddfice) / 2
+
+        # Glacier data (nbins) or, with flowlines for each parameter set, (nsets, nbins)
+        if isinstance(fls[0], list):
+            fl_sets = [fls_set[fl_id] for fls_set in fls]
+            assert len(fl_sets) == self.nsets, 'Error: need the flowlines of each parameter set'
+            glacier_data = lambda x: None if x[0] is None else np.array(x)
+        else:
+            fl_sets = [fls[fl_id]]
+            glacier_data = lambda x: x[0]
+        self.heights = glacier_data([fl.surface_h for fl in fl_sets])
+        self.dx_meter = fl_sets[0].dx_meter
+        self.glacier_area_initial = glacier_data([fl.widths_m * fl.dx_meter for fl in fl_sets])
+        self.icethickness_initial = glacier_data([getattr(fl, 'thick', None) for fl in fl_sets])
+        self.section_initial = glacier_data([getattr(fl, 'section', None) for fl in fl_sets])
+        if pygem_prms.include_debris:
+            self.debris_ed = glacier_data([fl.debris_ed for fl in fl_sets])
+        else:
+            self.debris_ed = np.ones(self.glacier_area_initial.shape)
+
+        # Climate data
+        self.dates_table = gdir.dates_table
+        self.glacier_gcm_temp = gdir.historical_climate['temp']
+        self.glacier_gcm_tempstd = gdir.historical_climate['tempstd']
+        self.glacier_gcm_prec = gdir.historical_climate['prec']
+        self.glacier_gcm_elev = gdir.historical_climate['elev']
+        self.glacier_gcm_lrgcm = gdir.historical_climate['lr']
+        self.glacier_gcm_lrglac = gdir.historical_climate['lr']
+        if pygem_prms.hindcast == 1:
+            self.glacier_gcm_prec = self.glacier_gcm_prec[::-1]
+            self.glacier_gcm_temp = self.glacier_gcm_temp[::-1]
+            self.glacier_gcm_lrgcm = self.glacier_gcm_lrgcm[::-1]
+            self.glacier_gcm_lrglac = self.glacier_gcm_lrglac[::-1]
+        self.dayspermonth = self.dates_table['daysinmonth'].values
+
+        nbins = self.glacier_area_initial.shape[-1]
+        self.nmonths = self.glacier_gcm_temp.shape[0]
+        self.nyears = int(self.dates_table.shape[0] / 12)
+        if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'random':
+            self.tempstd_noise = tempstd_noise_table(self.nmonths, seed=pygem_prms.tempstd_seed)
+
+        # States carried from one month to the next
+        self.snowpack_remaining = np.zeros((self.nsets,nbins))
+        self.surfacetype = None
+        if pygem_prms.option_refreezing == 'HH2015':
+            self.rf_dens_expb = (pygem_prms.rf_dens_bot / pygem_prms.rf_dens_top)**(1/(pygem_prms.rf_layers-1))
+            self.rf_layers_dens = np.array([pygem_prms.rf_dens_top * self.rf_dens_expb**x
+                                            for x in np.arange(0,pygem_prms.rf_layers)])
+            self.rf_layers_ch = ((1 - self.rf_layers_dens/1000) * pygem_prms.ch_air + self.rf_layers_dens/1000 *
+                                 pygem_prms.ch_ice)
+            self.rf_layers_k = ((1 - self.rf_layers_dens/1000) * pygem_prms.k_air + self.rf_layers_dens/1000 *
+                                pygem_prms.k_ice)
+            self.rf_cold = np.zeros((self.nsets,nbins))
+            self.te_rf = np.zeros((pygem_prms.rf_layers,self.nsets,nbins))
+            self.tl_rf = np.zeros((pygem_prms.rf_layers,self.nsets,nbins))
+
+        # Results for each parameter set
+        self.glac_bin_massbalclim_annual = np.zeros((self.nsets,nbins,self.nyears))
+        self.glac_wide_temp = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_prec = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_acc = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_refreeze = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_melt = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_massbaltotal = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_runoff = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_frontalablation = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_snowline = np.zeros((self.nsets,self.nmonths))
+        self.glac_wide_area_annual = np.zeros((self.nsets,self.nyears+1))
+        self.glac_wide_volume_annual = np.zeros((self.nsets,self.nyears+1))
+        self.glac_wide_ELA_annual = np.zeros((self.nsets,self.nyears+1))
+        self.glac_wide_volume_change_ignored_annual = np.zeros((self.nsets,self.nyears))
+        self.offglac_wide_prec = np.zeros((self.nsets,self.nmonths))
+        self.offglac_wide_refreeze = np.zeros((self.nsets,self.nmonths))
+        self.offglac_wide_melt = np.zeros((self.nsets,self.nmonths))
+        self.offglac_wide_snowpack = np.zeros((self.nsets,self.nmonths))
+        self.offglac_wide_runoff = np.zeros((self.nsets,self.nmonths))
+
+
+    def get_annual_mb(self, heights=None, year=None, glacier_area=None, icethickness=None, section=None):
+        """
+        Returns annual climatic mass balance [m ice per second] of each parameter set
+
+        Parameters
+        ----------
+        heights : np.array
+            elevation bins (nbins) or (nsets, nbins); default is the initial surface
+        year : int
+            year starting with 0 to the number of years in the study
+        glacier_area : np.array
+            glacier area of each elevation bin [m2] (nbins) or (nsets, nbins); default is the initial area
+        icethickness : np.array
+            ice thickness of each elevation bin [m] (nbins) or (nsets, nbins); default is the initial thickness
+        section : np.array
+            section of each elevation bin [m2] (nbins) or (nsets, nbins); default is the initial section
+
+        Returns
+        -------
+        mb : np.array
+            mass balance for each parameter set and bin (nsets, nbins) [m ice per second]
+        """
+        year = int(year)
+        if self.repeat_period:
+            year = year % (pygem_prms.gcm_endyear - pygem_prms.gcm_startyear)
+        if heights is None:
+            heights = self.heights
+        if glacier_area is None:
+            glacier_area = self.glacier_area_initial
+        if icethickness is None:
+            icethickness = self.icethickness_initial
+        if section is None:
+            section = self.section_initial
+        nbins = self.glacier_area_initial.shape[-1]
+        heights = np.broadcast_to(heights, (self.nsets,nbins))
+        glacier_area = np.broadcast_to(glacier_area, (self.nsets,nbins)).copy()
+        width_mask = glacier_area > 0
+        # Quality control: ensure you only have glacier area where there is ice
+        if icethickness is not None:
+            icethickness = np.broadcast_to(icethickness, (self.nsets,nbins))
+            glacier_area[icethickness == 0] = 0
+        glac_mask = glacier_area > 0
+        yr = slice(12*year, 12*(year+1))
+
+        # Surface type [0=off-glacier, 1=ice, 2=snow, 3=firn, 4=debris]
+        if year == 0 or self.surfacetype is None:
+            self.surfacetype = np.zeros((self.nsets,nbins))
+            zref_st = self.glacier_rgi_table.loc['Zmed' if pygem_prms.option_surfacetype_initial == 1 else 'Zmean']
+            self.surfacetype[np.broadcast_to((self.heights < zref_st) & (self.glacier_area_initial > 0),
+                                             (self.nsets,nbins))] = 1
+            self.surfacetype[np.broadcast_to((self.heights >= zref_st) & (self.glacier_area_initial > 0),
+                                             (self.nsets,nbins))] = 2
+            if pygem_prms.include_firn == 1:
+                self.surfacetype[self.surfacetype == 2] = 3
+            self.snowpack_remaining[:,:] = 0
+            if pygem_prms.option_refreezing == 'HH2015':
+                self.rf_cold[:,:] = 0
+                self.te_rf[:,:,:] = 0
+                self.tl_rf[:,:,:] = 0
+
+        # AIR TEMPERATURE AND PRECIPITATION: Downscale the gcm temperature [deg C] and precipitation (liquid and solid)
+        #  to each bin (nsets, nbins, 12)
+        bin_temp, bin_precsnow = downscale_climate(
+                self.glacier_gcm_temp[yr], self.glacier_gcm_prec[yr], self.glacier_gcm_elev,
+                self.glacier_gcm_lrgcm[yr], self.glacier_gcm_lrglac[yr],
+                self.glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale], heights[:,:,np.newaxis],
+                self.modelprms['tbias'][:,:,np.newaxis], self.modelprms['kp'][:,:,np.newaxis],
+                self.modelprms['precgrad'][:,:,np.newaxis])
+        # Option to adjust prec of uppermost 25% of glacier for wind erosion and reduced moisture content
+        if pygem_prms.option_preclimit == 1:
+            for nset in range(self.nsets):
+                glac_idx_t0 = glac_mask[nset].nonzero()[0]
+                if len(glac_idx_t0) == 0:
+                    continue
+                # Elevation range based on the flowline
+                elev_range = heights[nset,width_mask[nset]].max() - heights[nset,width_mask[nset]].min()
+                elev_75 = heights[nset,width_mask[nset]].min() + 0.75 * (elev_range)
+                if elev_range > 1000:
+                    glac_idx_upper25 = glac_idx_t0[heights[nset,glac_idx_t0] >= elev_75]
+                    height_75 = heights[nset,glac_idx_upper25].min()
+                    glac_idx_75 = np.where(heights[nset] == height_75)[0][0]
+                    bin_precsnow[nset,glac_idx_upper25,:] = (
+                            bin_precsnow[nset,glac_idx_75,:] *
+                            np.exp(-1*(heights[nset,glac_idx_upper25] - height_75) /
+                                   (heights[nset,glac_idx_upper25].max() - heights[nset,glac_idx_upper25].min()))
+                            [:,np.newaxis])
+                    # Precipitation cannot be less than 87.5% of the maximum accumulation elsewhere on the glacier
+                    #  (as in PyGEMMassBalance, only applied to the first year)
+                    if year == 0:
+                        for month in range(0,12):
+                            prec_min = 0.875 * bin_precsnow[nset,glac_idx_t0,month].max()
+                            prec_upper25 = bin_precsnow[nset,glac_idx_upper25,month]
+                            bin_precsnow[nset,glac_idx_upper25[(prec_upper25 < prec_min) & (prec_upper25 != 0)],
+                                         month] = prec_min
+
+        # Separate total precipitation into liquid (bin_prec) and solid (bin_acc)
+        bin_prec, bin_acc = partition_precsnow(bin_temp, bin_precsnow,
+                                               self.modelprms['tsnow_threshold'][:,:,np.newaxis])
+
+        # DDF based on surface type [m w.e. degC-1 day-1]
+        surfacetype_ddf = np.broadcast_to(self.ddfsnow, (self.nsets,nbins)).copy()
+        surfacetype_ddf[self.surfacetype == 1] = np.broadcast_to(self.ddfice, (self.nsets,nbins))[self.surfacetype == 1]
+        if pygem_prms.include_debris:
+            surfacetype_ddf[self.surfacetype == 1] = (surfacetype_ddf[self.surfacetype == 1] *
+                                                      np.broadcast_to(self.debris_ed, (self.nsets,nbins))
+                                                      [self.surfacetype == 1])
+        surfacetype_ddf[self.surfacetype == 3] = np.broadcast_to(self.ddffirn,(self.nsets,nbins))[self.surfacetype == 3]
+
+        if pygem_prms.option_refreezing == 'Woodward':
+            # Refreeze based on annual air temperature (Woodward etal. 1997)
+            bin_temp_annual = annualweightedmean_array(bin_temp.reshape(-1,12),
+                                                       self.dates_table.iloc[yr,:]).reshape(self.nsets,nbins)
+            refreeze_potential = (-0.69 * bin_temp_annual + 0.0096) / 100
+            refreeze_potential[refreeze_potential < 0] = 0
+
+        bin_snowpack = np.zeros(bin_temp.shape)
+        bin_melt = np.zeros(bin_temp.shape)
+        bin_refreeze = np.zeros(bin_temp.shape)
+        offglac_bin_melt = np.zeros(bin_temp.shape)
+        # Expected energy available for melt of normally distributed daily temperatures [degC day] of the year
+        if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+            melt_energy_year = melt_energy_expected(bin_temp, self.glacier_gcm_tempstd[yr], self.dayspermonth[yr])
+        for month in range(0,12):
+            step = 12*year + month
+
+            # Snowpack [m w.e.] = snow remaining + new snow
+            if step == 0:
+                bin_snowpack[:,:,month] = bin_acc[:,:,month]
+            else:
+                bin_snowpack[:,:,month] = self.snowpack_remaining + bin_acc[:,:,month]
+
+            # MELT [m w.e.]
+            # energy available for melt [degC day]
+            if pygem_prms.option_ablation == 1:
+                melt_energy_available = bin_temp[:,:,month]*self.dayspermonth[step]
+                melt_energy_available[melt_energy_available < 0] = 0
+            elif pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+                melt_energy_available = melt_energy_year[:,:,month]
+            elif pygem_prms.option_ablation == 2:
+                # same daily temperatures as PyGEMMassBalance for every parameter set
+                melt_energy_available = melt_energy_daily(bin_temp[:,:,month], self.glacier_gcm_tempstd[step],
+                                                          self.dayspermonth[step], self.tempstd_noise[step])
+            # SNOW MELT [m w.e.]
+            bin_meltsnow = self.ddfsnow * melt_energy_available
+            # snow melt cannot exceed the snow depth
+            bin_meltsnow[bin_meltsnow > bin_snowpack[:,:,month]] = (
+                    bin_snowpack[:,:,month][bin_meltsnow > bin_snowpack[:,:,month]])
+            # GLACIER MELT (ice and firn) [m w.e.]
+            melt_energy_available = melt_energy_available - bin_meltsnow / self.ddfsnow
+            melt_energy_available[abs(melt_energy_available) < pygem_prms.tolerance] = 0
+            bin_meltglac = np.zeros((self.nsets,nbins))
+            bin_meltglac[glac_mask] = surfacetype_ddf[glac_mask] * melt_energy_available[glac_mask]
+            # TOTAL MELT (snow + glacier)
+            bin_melt[:,:,month] = bin_meltglac + bin_meltsnow
+
+            # REFREEZING
+            if pygem_prms.option_refreezing == 'HH2015':
+                rf_dt = 3600 * 24 * self.dayspermonth[step] / pygem_prms.rf_dsc
+                if pygem_prms.option_rf_limit_meltsnow == 1:
+                    bin_meltlimit = bin_meltsnow
+                else:
+                    bin_meltlimit = bin_melt[:,:,month]
+                bin_refreeze[:,:,month] = refreeze_hh2015(
+                        self.te_rf, self.tl_rf, self.rf_cold, glac_mask, bin_temp[:,:,month], bin_melt[:,:,month],
+                        bin_meltlimit, bin_prec[:,:,month], bin_snowpack[:,:,month], self.surfacetype, rf_dt,
+                        self.rf_layers_dens, self.rf_layers_ch, self.rf_layers_k, pygem_prms.rf_dz,
+                        pygem_prms.rf_dsc, pygem_prms.rf_meltcrit, pygem_prms.pp, pygem_prms.Lh_rf,
+                        pygem_prms.density_water)
+            elif pygem_prms.option_refreezing == 'Woodward':
+                # refreeze cannot exceed rain and melt, snow depth or refreeze potential
+                refreeze = bin_meltsnow + bin_prec[:,:,month]
+                refreeze[refreeze > bin_snowpack[:,:,month]] = (
+                        bin_snowpack[:,:,month][refreeze > bin_snowpack[:,:,month]])
+                refreeze[refreeze > refreeze_potential] = refreeze_potential[refreeze > refreeze_potential]
+                refreeze[abs(refreeze) < pygem_prms.tolerance] = 0
+                refreeze_potential -= refreeze
+                refreeze_potential[abs(refreeze_potential) < pygem_prms.tolerance] = 0
+                bin_refreeze[:,:,month] = refreeze
+
+            # OFF-GLACIER MELT = snow melt + melt of refreezing (assumed to be snow, cannot exceed refreezing)
+            offglac_bin_melt[:,:,month] = bin_meltsnow + np.minimum(self.ddfsnow * melt_energy_available,
+                                                                    bin_refreeze[:,:,month])
+
+            # SNOWPACK REMAINING [m w.e.]
+            self.snowpack_remaining = bin_snowpack[:,:,month] - bin_meltsnow
+            self.snowpack_remaining[abs(self.snowpack_remaining) < pygem_prms.tolerance] = 0
+
+        # Record values on the glacier only
+        bin_melt[~glac_mask] = 0
+        bin_refreeze[~glac_mask] = 0
+        # CLIMATIC MASS BALANCE [m w.e.]
+        bin_massbalclim = np.where(glac_mask[:,:,np.newaxis], bin_acc + bin_refreeze - bin_melt, 0)
+
+        # SURFACE TYPE (-): average annual climatic mass balance over the last 5 years
+        self.glac_bin_massbalclim_annual[:,:,year] = bin_massbalclim.sum(2)
+        massbal_clim_mwe_runningavg = self.glac_bin_massbalclim_annual[:,:,max(0,year-4):year+1].mean(2)
+        self.surfacetype[(self.surfacetype != 0) & (massbal_clim_mwe_runningavg <= 0)] = 1
+        self.surfacetype[(self.surfacetype != 0) & (massbal_clim_mwe_runningavg > 0)] = 2
+        if pygem_prms.include_firn == 1:
+            self.surfacetype[self.surfacetype == 2] = 3
+
+        # GLACIER-WIDE RESULTS
+        self._convert_glacwide_results(year, glacier_area, icethickness, section, bin_temp, bin_prec, bin_acc,
+                                       bin_refreeze, bin_melt, bin_massbalclim)
+        self._convert_snowline_offglac_results(year, glacier_area, heights, bin_prec, bin_snowpack, bin_refreeze,
+                                               offglac_bin_melt)
+
+        # Mass balance for each bin [m ice per second]
+        seconds_in_year = self.dayspermonth[yr].sum() * 24 * 3600
+        mb = bin_massbalclim.sum(2) * pygem_prms.density_water / pygem_prms.density_ice / seconds_in_year
+        if self.inversion_filter:
+            mb = np.minimum.accumulate(mb, axis=1)
+        return mb
+
+
+    def _convert_glacwide_results(self, year, glacier_area, icethickness, section, bin_temp, bin_prec, bin_acc,
+                                  bin_refreeze, bin_melt, bin_massbalclim):
+        """
+        Convert binned results of one year to glacier-wide results for each parameter set
+
+        Parameters
+        ----------
+        year : int
+            the year of the model run starting from zero
+        glacier_area : np.array
+            glacier area for each parameter set and elevation bin (m2)
+        """
+        yr = slice(12*year, 12*(year+1))
+        glacier_area_wide = glacier_area.sum(1)
+        glacier_area_monthly = glacier_area[:,:,np.newaxis]
+        self.glac_wide_area_annual[:,year] = glacier_area_wide
+        has_glacier = glacier_area_wide > 0
+        if not has_glacier.any():
+            return
+        area_wide = np.where(has_glacier, glacier_area_wide, 1)[:,np.newaxis]
+        if section is not None:
+            section = np.broadcast_to(section, glacier_area.shape).copy()
+            section[glacier_area == 0] = 0
+            self.glac_wide_volume_annual[:,year] = (section * self.dx_meter).sum(1)
+
+        self.glac_wide_temp[:,yr] = np.where(has_glacier[:,np.newaxis],
+                                             (bin_temp * glacier_area_monthly).sum(1) / area_wide, 0)
+        self.glac_wide_prec[:,yr] = (bin_prec * glacier_area_monthly).sum(1)
+        self.glac_wide_acc[:,yr] = (bin_acc * glacier_area_monthly).sum(1)
+        self.glac_wide_refreeze[:,yr] = (bin_refreeze * glacier_area_monthly).sum(1)
+        self.glac_wide_melt[:,yr] = (bin_melt * glacier_area_monthly).sum(1)
+        # If mass loss more negative than glacier mass, reduce melt so glacier completely melts (no excess)
+        if icethickness is not None:
+            mb_max_loss = (-1 * (glacier_area * icethickness).sum(1) / area_wide[:,0] *
+                           pygem_prms.density_ice / pygem_prms.density_water)
+            mb_mwea = (glacier_area * bin_massbalclim.sum(2)).sum(1) / area_wide[:,0]
+            melt_cap = has_glacier & (mb_mwea < mb_max_loss)
+            if melt_cap.any():
+                melt_yr_raw = self.glac_wide_melt[melt_cap,yr].sum(1)
+                melt_yr_max = (self.glac_wide_volume_annual[melt_cap,year]
+                               * pygem_prms.density_ice / pygem_prms.density_water +
+                               self.glac_wide_acc[melt_cap,yr].sum(1) +
+                               self.glac_wide_refreeze[melt_cap,yr].sum(1))
+                melt_frac = melt_yr_max / melt_yr_raw
+                self.glac_wide_melt[melt_cap,yr] = self.glac_wide_melt[melt_cap,yr] * melt_frac[:,np.newaxis]
+        # Glacier-wide total mass balance (m3 w.e.)
+        self.glac_wide_massbaltotal[:,yr] = (self.glac_wide_acc[:,yr] + self.glac_wide_refreeze[:,yr] -
+                                             self.glac_wide_melt[:,yr])
+        # Glacier-wide runoff (m3)
+        self.glac_wide_runoff[:,yr] = (self.glac_wide_prec[:,yr] + self.glac_wide_melt[:,yr] -
+                                       self.glac_wide_refreeze[:,yr])
+
+
+    def _convert_snowline_offglac_results(self, year, glacier_area, heights, bin_prec, bin_snowpack, bin_refreeze,
+                                          offglac_bin_melt):
+        """
+        Snow line, equilibrium line altitude and off-glacier results of one year for each parameter set (same as
+        PyGEMMassBalance._convert_glacwide_results)
+
+        Parameters
+        ----------
+        year : int
+            the year of the model run starting from zero
+        glacier_area : np.array
+            glacier area for each parameter set and elevation bin (m2)
+        heights : np.array
+            surface elevation for each parameter set and elevation bin (m)
+        """
+        yr = slice(12*year, 12*(year+1))
+        glac_mask = glacier_area > 0
+        has_glacier = glac_mask.any(1)
+        if not has_glacier.any():
+            return
+        heights_change = np.zeros(heights.shape)
+        heights_change[:,0:-1] = heights[:,0:-1] - heights[:,1:]
+        heights_mid = heights - heights_change / 2
+        sets = np.arange(self.nsets)[:,np.newaxis]
+
+        # Snow line altitude (m a.s.l.): lowest bin of the glacier with snow
+        snow_mask = glac_mask[:,:,np.newaxis] & (bin_snowpack > 0)
+        snowline_idx = np.where(snow_mask, heights[:,:,np.newaxis], np.inf).argmin(1)
+        snowline = np.where(snow_mask.any(1), heights_mid[sets,snowline_idx], np.nan)
+        self.glac_wide_snowline[has_glacier,yr] = snowline[has_glacier]
+
+        # Equilibrium line altitude (m a.s.l.): lowest bin with a positive annual climatic mass balance
+        ela_mask = self.glac_bin_massbalclim_annual[:,:,year] > 0
+        ela_idx = np.where(ela_mask, heights, np.inf).argmin(1)
+        ela = np.where(ela_mask.any(1), heights_mid[np.arange(self.nsets),ela_idx], np.nan)
+        self.glac_wide_ELA_annual[has_glacier,year] = ela[has_glacier]
+
+        # Off-glacier: area the glacier lost in the bins it still covers
+        offglacier_area = np.broadcast_to(self.glacier_area_initial, glacier_area.shape) - glacier_area
+        has_offglac = (offglacier_area > 0).any(1)
+        # precipitation uses the area change of all glacier bins (negative where the glacier advanced), the other
+        #  results only the bins with off-glacier area (same as PyGEMMassBalance)
+        offglacier_area_prec = np.where(glac_mask & has_offglac[:,np.newaxis], offglacier_area, 0)[:,:,np.newaxis]
+        offglacier_area = np.where(offglacier_area_prec > 0, offglacier_area_prec, 0)
+        # precipitation, refreeze and snowpack are the same both on- and off-glacier
+        self.offglac_wide_prec[:,yr] = (bin_prec * offglacier_area_prec).sum(1)
+        self.offglac_wide_melt[:,yr] = (offglac_bin_melt * offglacier_area).sum(1)
+        self.offglac_wide_refreeze[:,yr] = (bin_refreeze * offglacier_area).sum(1)
+        self.offglac_wide_runoff[:,yr] = (self.offglac_wide_prec[:,yr] + self.offglac_wide_melt[:,yr] -
+                                          self.offglac_wide_refreeze[:,yr])
+        self.offglac_wide_snowpack[:,yr] = (bin_snowpack * offglacier_area).sum(1)
+
+
+    def ensure_mass_conservation(self, diag, set_idx=None):
+        """
+        Ensure mass conservation of each parameter set with the volume change of the glacier dynamics (see 
+        PyGEMMassBalance.ensure_mass_conservation)
+
+        Parameters
+        ----------
+        diag : xarray.Dataset
+            model diagnostics with the volume [m3] of each parameter set (member, time)
+        set_idx : np.array
+            indices of the parameter sets to correct (default all)
+        """
+        if set_idx is None:
+            set_idx = np.arange(self.nsets)
+        # Compute difference between volume change
+        vol_change_annual_mbmod = (self.glac_wide_massbaltotal[set_idx].reshape(len(set_idx),-1,12).sum(2) *
+                                   pygem_prms.density_water / pygem_prms.density_ice)
+        volume = diag.volume_m3.values[set_idx]
+        vol_change_annual_dif = volume[:,1:] - volume[:,:-1] - vol_change_annual_mbmod
+
+        # Reduce glacier melt by the difference
+        vol_change_annual_mbmod_melt = (self.glac_wide_melt[set_idx].reshape(len(set_idx),-1,12).sum(2) *
+                                        pygem_prms.density_water / pygem_prms.density_ice)
+        vol_change_annual_melt_reduction = np.zeros(vol_change_annual_mbmod.shape)
+        chg = vol_change_annual_mbmod != 0
+        vol_change_annual_melt_reduction[chg] = 1 - vol_change_annual_dif[chg] / vol_change_annual_mbmod_melt[chg]
+        self.glac_wide_melt[set_idx] = (self.glac_wide_melt[set_idx] *
+                                        np.repeat(vol_change_annual_melt_reduction, 12, axis=1))
+
+        # Glacier-wide total mass balance (m3 w.e.) and runoff (m3)
+        self.glac_wide_massbaltotal[set_idx] = (self.glac_wide_acc[set_idx] + self.glac_wide_refreeze[set_idx] -
+                                                self.glac_wide_melt[set_idx])
+        self.glac_wide_runoff[set_idx] = (self.glac_wide_prec[set_idx] + self.glac_wide_melt[set_idx] -
+                                          self.glac_wide_refreeze[set_idx])
+        self.glac_wide_volume_change_ignored_annual[set_idx] = vol_change_annual_dif
@@ -190,8 +190,31 @@ sim_burn = 200      # number of burn-in (needed for cal_opt 2)
 
 # Simulation output filepath
 output_sim_fp = output_filepath + 'simulations/'
+# Spin-up state cache (MassRedistributionCurves): start reruns from the state after the spin-up years
+option_spinup_cache = False         # True: cache the state after max(gcm_spinupyears, constantarea_years)
+spinup_cache_fp = output_filepath + 'spinup_cache/'
+spinup_cache_maxsize = 5e9          # maximum size of the cache [bytes], least recently used states removed first
+spinup_cache_settings = ['option_refreezing', 'rf_layers', 'rf_dz', 'rf_dsc', 'rf_meltcrit', 'pp', 'rf_dens_top',
+                         'rf_dens_bot', 'option_rf_limit_meltsnow', 'rf_month', 'option_ablation',
+                         'option_ablation_dailytemp', 'tempstd_seed', 'option_accumulation', 'option_preclimit',
+                         'option_ddf_firn', 'include_firn', 'include_debris', 'option_surfacetype_initial',
+                         'option_elev_ref_downscale', 'option_temp2bins', 'option_prec2bins',
+                         'option_adjusttemp_surfelev', 'option_massredistribution',
+                         'option_massredistribution_solver', 'option_glaciershape',
+                         'icethickness_advancethreshold', 'terminus_percentage', 'hindcast', 'gcm_startyear',
+                         'gcm_spinupyears', 'constantarea_years', 'ref_spinupyears', 'density_ice', 'density_water']
+                                    # settings that change the spin-up, their values are part of the cache key
+# Simulation states (MassRedistributionCurves): continue finished simulations, e.g., when the climate data is extended
+option_sim_savestate = False        # True: save the final state of each simulation so it can be continued later
+option_sim_extend = False           # True: continue the saved simulations that end in sim_extend_endyear to gcm_endyear
+sim_extend_endyear = 2019           # last year of the saved simulations that are continued
+sim_state_fp = output_filepath + 'sim_states/'
+# Ensemble (MassRedistributionCurves): advance the glaciers of all parameter sets together in one model
+option_dynamics_ensemble = False    # True: one ensemble model (marine-terminating glaciers run each simulation)
 # Simulation output statistics (can include 'mean', 'std', '2.5%', '25%', 'median', '75%', '97.5%')
 sim_stat_cns = ['mean', 'std']
+option_exact_stats = False          # True: keep the output of all simulations and compute exact percentiles
+sim_stat_sketch_size = 64           # values per level of the percentile sketch (exact below 2x this many simulations)
 # Bias adjustment options (0: no adjustment, 1: new prec scheme and temp from HH2015, 2: HH2015 methods)
 option_bias_adjustment = 1
 
@@ -216,6 +239,10 @@ if option_calibration == 'HH2015':
     ddfsnow_init = 0.003
     ddfsnow_bndlow = 0.00175
     ddfsnow_bndhigh = 0.0045
+    # Region-wide calibration of land-terminating glaciers (bisection of each round for all glaciers at once)
+    option_calibration_region = False
+    bisect_steps_region = 20        # maximum number of bisection steps of each round
+    bisect_tol_region = 0.01        # mass balance difference [mwea] at which a glacier's bisection stops
     
 elif option_calibration == 'HH2015mod':
     # Initial parameters
@@ -233,6 +260,7 @@ elif option_calibration == 'HH2015mod':
     
 elif option_calibration == 'emulator':
     emulator_sims = 10000            # Number of simulations to develop the emulator
+    emulator_batchsize = 1000        # Number of simulations evaluated together as one batch of parameter sets
     tbias_step = 1                   # tbias step size
     tbias_init = 0                   # tbias initial value
     kp_init = 1                      # kp initial value
@@ -380,9 +408,15 @@ option_accumulation = 2             # 1: single threshold, 2: threshold +/- 1 de
 
 # Ablation model options
 option_ablation = 1                 # 1: monthly temp, 2: superimposed daily temps enabling melt near 0 (HH2015)
+option_ablation_dailytemp = 'random'  # option 2: 'random' draws daily temps, 'expected' uses their expected melt
+tempstd_seed = 0                    # seed of the random daily temps (option_ablation 2, 'random')
 option_ddf_firn = 1                 # 0: ddf_firn = ddf_snow; 1: ddf_firn = mean of ddf_snow and ddf_ice
 ddfdebris = ddfice                  # add options for handling debris-covered glaciers
 
+# Mass balance cache
+option_mb_cache = False             # True: repeated calls for a year with the same surface return the stored result
+option_reuse_inversion_mb = False   # True: constant-area years of simulations are copied from the inversion model
+
 # Refreezing model options
 #option_refreezing = 'HH2015'        # HH2015: heat conduction (Huss and Hock, 2015)
 option_refreezing = 'Woodward'      # Woodward: annual air temp (Woodward etal 1997)
@@ -396,16 +430,22 @@ if option_refreezing == 'HH2015':
     rf_dens_top = 300               # snow density at surface (kg m-3)
     rf_dens_bot = 650               # snow density at bottom refreezing layer (kg m-3)
     option_rf_limit_meltsnow = 1
+    option_rf_state = 'rolling'     # 'rolling': layer temps of the present step and the start of each year, 'full': every month
+    rf_history_step = 12            # months between stored layer temperatures if debug_refreeze (rolling state only)
     
 elif option_refreezing == 'Woodward':
     rf_month = 10                   # refreeze month
 
 # Mass redistribution / Glacier geometry change options
 option_massredistribution = 1       # 1: mass redistribution (Huss and Hock, 2015)
+option_massredistribution_solver = 'iterative'  # 'iterative': original, 'direct': bounded retreat passes on the section
 option_glaciershape = 1             # 1: parabolic (Huss and Hock, 2015), 2: rectangular, 3: triangular
 option_glaciershape_width = 1       # 1: include width, 0: do not include
 icethickness_advancethreshold = 5   # advancing glacier ice thickness change threshold (5 m in Huss and Hock, 2015)
 terminus_percentage = 20            # glacier (%) considered terminus (20% in HH2015), used to size advancing new bins
+option_compactbins = False         # True: runmassbalance only models the bins of the glacier plus a margin
+compactbins_margin = 20            # number of bins below and above the glacier kept for advance
+region_chunk_cells = 2e7           # glaciers x bins x months modeled at once by the region-wide mass balance
     
 #%% CLIMATE DATA
 # ERA-INTERIM (Reference data)
@@ -814,6 +854,21 @@ output_variables_package2 = ['temp_glac_monthly', 'prec_glac_monthly', 'acc_glac
                             'area_glac_annual', 'volume_glac_annual', 'ELA_glac_annual',
                             'offglac_prec_monthly', 'offglac_refreeze_monthly', 'offglac_melt_monthly',
                             'offglac_snowpack_monthly', 'offglac_runoff_monthly']
+# Output containers (output package 2): append the glaciers of each worker to one netcdf file instead of one per glacier
+option_output_container = False     # True: one file per worker, gcm and rcp; rows are indexed by the RGIId variable
+output_container_flush = 50         # number of glaciers after which a container is synced to disk
+# Output encoding (see pygem/utils/_encoding.py): 'lossless' (float64), 'float32' (7 significant digits) or 'int16'
+#  (variables of output_pack_ranges packed in int16 with a precision of (max - min) / 131068, others float32; values
+#  outside their range raise a ValueError)
+output_encoding_profile = 'lossless'
+output_complevel = 9                # zlib compression level (1-9)
+output_chunks = {'glac': 50, 'time': 120, 'year': 10, 'year_plus1': 10}    # chunks of 50 glaciers and 10 years
+output_pack_ranges = {'glac_temp_monthly': (180, 340),          # [K] precision 0.0012 K
+                      'glac_temp_monthly_std': (0, 50),         # [K] precision 0.0004 K
+                      'glac_snowline_monthly': (-1000, 10000),  # [m] precision 0.08 m
+                      'glac_snowline_monthly_std': (0, 5000),   # [m] precision 0.04 m
+                      'glac_ELA_annual': (-1000, 10000),        # [m] precision 0.08 m
+                      'glac_ELA_annual_std': (0, 5000)}         # [m] precision 0.04 m
 
 #%% MODEL PROPERTIES
 density_ice = 900           # Density of ice [kg m-3] (or Gt / 1000 km3)
@@ -0,0 +1,59 @@
+from pygem.tests.test_massbalance_region import synthetic_region
+import pygem.pygem_input as pygem_prms
+import numpy as np
+import pytest
+pytest.importorskip('pymc')
+import run_calibration
+
+
+def observation_periods(nglac):
+    """Dates and indices of mass balance observations of different periods"""
+    t1 = 2000. + np.array([0, 1, 0, 2])[:nglac]
+    t2 = t1 + np.array([6, 4, 3, 4])[:nglac]
+    return (t1 - 2000).astype(int) * 12, (t2 - 2000).astype(int) * 12 - 1, t1, t2
+
+
+def mb_mwea_single(modelparameters, main_glac_rgi, area, icethickness, heights, climate, dates_table, t1_idx, t2_idx,
+                   t1, t2, glac):
+    return run_calibration.mb_mwea_calc(
+            modelparameters, main_glac_rgi.loc[glac], area[glac], icethickness[glac], area[glac] / 0.1, heights,
+            climate['temp'][glac], climate['tempstd'][glac], climate['prec'][glac], climate['elev'][glac],
+            climate['lr'][glac], climate['lr'][glac], dates_table, t1_idx[glac], t2_idx[glac], t1[glac], t2[glac])
+
+
+def test_region_matches_single_calibration(monkeypatch):
+    # the region-wide calibration uses the observation period of each glacier, so its mass balance is that of the
+    #  calibration of each glacier on its own and the calibrated parameters match the observations within tolerance
+    #  (bisection parameters of pygem_input, which only sets them with option_calibration = 'HH2015')
+    monkeypatch.setattr(pygem_prms, 'bisect_steps_region', 20, raising=False)
+    monkeypatch.setattr(pygem_prms, 'bisect_tol_region', 0.01, raising=False)
+    main_glac_rgi, area, icethickness, heights, climate, dates_table, modelparameters = synthetic_region()
+    nglac = area.shape[0]
+    t1_idx, t2_idx, t1, t2 = observation_periods(nglac)
+    glac_idx = np.arange(nglac)
+
+    def mb_mwea_calc_glac(modelparameters, glac_idx):
+        return run_calibration.mb_mwea_calc_region(
+                modelparameters, main_glac_rgi.iloc[glac_idx], area[glac_idx], icethickness[glac_idx], heights,
+                climate['temp'][glac_idx], climate['tempstd'][glac_idx], climate['prec'][glac_idx],
+                climate['elev'][glac_idx], climate['lr'][glac_idx], climate['lr'][glac_idx], dates_table,
+                t1_idx[glac_idx], t2_idx[glac_idx], t1[glac_idx], t2[glac_idx])
+
+    mb_mwea_region = mb_mwea_calc_glac(modelparameters, glac_idx)
+    for glac in glac_idx:
+        np.testing.assert_allclose(mb_mwea_region[glac],
+                                   mb_mwea_single(modelparameters[glac], main_glac_rgi, area, icethickness, heights,
+                                                  climate, dates_table, t1_idx, t2_idx, t1, t2, glac), rtol=1e-10)
+
+    # observations of the mass balance with other precipitation factors
+    observed_massbal = mb_mwea_calc_glac(np.column_stack([modelparameters[:,:2], modelparameters[:,2] * 1.3,
+                                                          modelparameters[:,3:]]), glac_idx)
+    modelparameters_cal = modelparameters.copy()
+    mb_mwea_cal = np.zeros(nglac)
+    run_calibration.bisect_region(mb_mwea_calc_glac, modelparameters_cal, 2, modelparameters[:,2] / 2,
+                                  modelparameters[:,2] * 2, glac_idx, mb_mwea_cal, observed_massbal,
+                                  modelparameters[0,4] / modelparameters[0,5])
+    for glac in glac_idx:
+        mb_mwea = mb_mwea_single(modelparameters_cal[glac], main_glac_rgi, area, icethickness, heights, climate,
+                                 dates_table, t1_idx, t2_idx, t1, t2, glac)
+        assert abs(mb_mwea - observed_massbal[glac]) <= pygem_prms.bisect_tol_region
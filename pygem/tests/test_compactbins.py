@@ -0,0 +1,65 @@
+from pygem.tests.test_massbalance import SyntheticGlacierDirectory
+import pygem.pygem_input as pygem_prms
+import pygemfxns_massbalance as massbalance
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def synthetic_hypsometry(nyears=10, nbins=150, seed=2):
+    """Glacier in the middle of many elevation bins with its climate"""
+    gdir = SyntheticGlacierDirectory(nyears, seed=seed, elev=4000.)
+    heights = np.arange(nbins) * 10 + 3005.
+    area = np.zeros(nbins)
+    icethickness = np.zeros(nbins)
+    area[60:100] = np.linspace(0.05, 0.2, 40)
+    icethickness[60:100] = 120 * np.sin(np.linspace(0.2, np.pi - 0.2, 40))
+    glacier_rgi_table = pd.Series({'RGIId': 'RGI60-15.00001', 'Zmed': heights[80], 'Zmean': heights[80],
+                                   'TermType': 0})
+    return glacier_rgi_table, area, icethickness, area / 0.1, heights, gdir.historical_climate, gdir.dates_table
+
+
+@pytest.mark.parametrize('hyps_data', ['OGGM', 'Huss'])
+@pytest.mark.parametrize('option_accumulation', [1, 2])
+@pytest.mark.parametrize('option_areaconstant', [0, 1])
+@pytest.mark.parametrize('tbias', [0, 8])
+def test_compactbins_matches_allbins(hyps_data, option_accumulation, option_areaconstant, tbias, monkeypatch):
+    # the glacier retreats (tbias 0) or disappears (tbias 8) and all output is the same as modeling all bins
+    monkeypatch.setattr(pygem_prms, 'hyps_data', hyps_data)
+    monkeypatch.setattr(pygem_prms, 'option_accumulation', option_accumulation)
+    glacier_rgi_table, area, icethickness, width, heights, climate, dates_table = synthetic_hypsometry()
+    modelparameters = [-0.0065, -0.0065, 1.5, 0.0001, 0.0041, 0.0041 / 0.7, 1., tbias]
+    output = {}
+    for option_compactbins in [False, True]:
+        output[option_compactbins] = massbalance.runmassbalance(
+                modelparameters, glacier_rgi_table, area, icethickness, width, heights, climate['temp'],
+                climate['tempstd'], climate['prec'], climate['elev'], climate['lr'], climate['lr'], dates_table,
+                option_areaconstant=option_areaconstant, option_compactbins=option_compactbins)
+    assert len(output[True]) == len(output[False])
+    for x_compact, x in zip(output[True], output[False]):
+        np.testing.assert_allclose(x_compact, x, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('option_compactbins', [False, True])
+def test_max_loss_offglacier_bins(option_compactbins):
+    # the year in which the glacier disappears has its melt reduced to the glacier mass, which leaves the climatic mass 
+    #  balance of the off-glacier bins at zero as in the other years
+    glacier_rgi_table, area, icethickness, width, heights, climate, dates_table = synthetic_hypsometry()
+    modelparameters = [-0.0065, -0.0065, 1.5, 0.0001, 0.0041, 0.0041 / 0.7, 1., 8]
+    output = massbalance.runmassbalance(
+            modelparameters, glacier_rgi_table, area, icethickness, width, heights, climate['temp'], 
+            climate['tempstd'], climate['prec'], climate['elev'], climate['lr'], climate['lr'], dates_table, 
+            option_compactbins=option_compactbins)
+    glac_bin_massbalclim, glac_bin_area_annual, glac_bin_icethickness_annual = output[7], output[9], output[10]
+    year_loss = np.where((glac_bin_area_annual[:,:-1].sum(0) > 0) & (glac_bin_area_annual[:,1:].sum(0) == 0))[0]
+    assert len(year_loss) == 1
+    for year in range(glac_bin_area_annual.shape[1] - 1):
+        offglac = glac_bin_area_annual[:,year] == 0
+        assert (glac_bin_massbalclim[offglac,12*year:12*(year+1)] == 0).all()
+    # the climatic mass balance of that year is the glacier mass
+    year = year_loss[0]
+    mb_mwea = ((glac_bin_area_annual[:,year] * glac_bin_massbalclim[:,12*year:12*(year+1)].sum(1)).sum() / 
+               glac_bin_area_annual[:,year].sum())
+    mb_max_loss = (-1 * (glac_bin_area_annual[:,year] * glac_bin_icethickness_annual[:,year]).sum() * 
+                   pygem_prms.density_ice / pygem_prms.density_water / glac_bin_area_annual[:,year].sum())
+    np.testing.assert_allclose(mb_mwea, mb_max_loss * (1 + pygem_prms.tolerance), rtol=1e-3)
@@ -0,0 +1,27 @@
+from pygem.utils._diagnostics_writer import NetCDFDiagnosticsWriter
+import numpy as np
+import xarray as xr
+
+
+def test_netcdf_diagnostics_writer(tmp_path):
+    path = str(tmp_path / 'diag.nc')
+    yearly_time = np.arange(5.)
+    diag_ds = xr.Dataset(coords={'time': ('time', yearly_time), 'calendar_year': ('time', np.arange(2000, 2005))})
+    diag_ds['volume_m3'] = ('time', np.zeros(5) * np.nan)
+    diag_ds['volume_m3'].attrs['unit'] = 'm 3'
+    with NetCDFDiagnosticsWriter(path) as writer:
+        writer.start(diag_ds, yearly_time, [3])
+        writer.write_diag(0, {'volume_m3': 10.})
+        writer.write_geometry(0, [np.arange(3.)], [np.ones(3)])
+        # same values for the remaining years
+        writer.write_diag(slice(1, None), {'volume_m3': 0.})
+        writer.write_geometry(slice(1, 4), [np.zeros(3)], [np.ones(3)])
+    with xr.open_dataset(path) as ds:
+        np.testing.assert_array_equal(ds.volume_m3.values, [10, 0, 0, 0, 0])
+        np.testing.assert_array_equal(ds.calendar_year.values, np.arange(2000, 2005))
+        assert ds.volume_m3.attrs['unit'] == 'm 3'
+    with xr.open_dataset(path, group='fl_0') as ds:
+        np.testing.assert_array_equal(ds.ts_section.values[0], np.arange(3.))
+        np.testing.assert_array_equal(ds.ts_section.values[1:4], 0)
+        # years that are not written are missing
+        assert np.isnan(ds.ts_width_m.values[4]).all()
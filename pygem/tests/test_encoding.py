@@ -0,0 +1,55 @@
+from pygem.utils._encoding import output_encoding, packing
+from pygem.utils._merge import merge_files
+from pygem.tests.test_merge import output_ds
+import numpy as np
+import pytest
+import xarray as xr
+
+
+@pytest.mark.parametrize('profile', ['lossless', 'float32', 'int16'])
+def test_output_encoding(tmp_path, profile):
+    ds = output_ds(np.arange(3))
+    ds['glac_temp_monthly'][0, 3] = np.nan
+    pack_ranges = {'glac_temp_monthly': (180, 340)}
+    encoding = output_encoding(ds, profile=profile, chunks={'glac': 2, 'time': 12}, pack_ranges=pack_ranges)
+    assert 'RGIId' not in encoding
+    fn = str(tmp_path / 'R15.nc')
+    ds.to_netcdf(fn, encoding=encoding)
+    with xr.open_dataset(fn) as ds_file:
+        assert ds_file['glac_runoff_monthly'].encoding['chunksizes'] == (2, 12)
+        # glacier attributes are not lossy
+        np.testing.assert_array_equal(ds_file['Area'].values, ds['Area'].values)
+        if profile == 'lossless':
+            xr.testing.assert_identical(ds_file, ds)
+        elif profile == 'float32':
+            xr.testing.assert_allclose(ds_file, ds, rtol=1e-7)
+        else:
+            assert ds_file['glac_temp_monthly'].encoding['dtype'] == 'int16'
+            assert ds_file['glac_runoff_monthly'].encoding['dtype'] == 'float32'
+            np.testing.assert_allclose(ds_file['glac_temp_monthly'].values, ds['glac_temp_monthly'].values,
+                                       atol=packing(*pack_ranges['glac_temp_monthly'])[2] * 1.0001)
+    # values outside the pack range cannot be packed
+    if profile == 'int16':
+        with pytest.raises(ValueError):
+            output_encoding(ds, profile=profile, pack_ranges={'glac_temp_monthly': (180, 300)})
+
+
+def test_merge_packed(tmp_path):
+    fns = []
+    for nbatch, glac in enumerate([np.arange(2), np.arange(2, 5)]):
+        ds = output_ds(glac)
+        fns.append(str(tmp_path / 'R15_batch{}.nc'.format(nbatch)))
+        ds.to_netcdf(fns[-1], encoding=output_encoding(ds, profile='int16',
+                                                       pack_ranges={'glac_temp_monthly': (180, 340)}))
+    merge_files(fns, str(tmp_path / 'R15.nc'), chunks={'glac': 50, 'time': 12})
+    with xr.open_dataset(str(tmp_path / 'R15.nc')) as ds:
+        ds_concat = xr.concat([xr.open_dataset(x) for x in fns], dim='glac')
+        xr.testing.assert_identical(ds.drop_vars('glac'), ds_concat.drop_vars('glac'))
+        assert ds['glac_temp_monthly'].encoding['chunksizes'] == (5, 12)
+
+    # packing of the files must match
+    ds = output_ds(np.arange(5, 6))
+    fns.append(str(tmp_path / 'R15_batch2.nc'))
+    ds.to_netcdf(fns[-1], encoding=output_encoding(ds, profile='int16', pack_ranges={'glac_temp_monthly': (0, 340)}))
+    with pytest.raises(ValueError):
+        merge_files(fns, str(tmp_path / 'R15.nc'))
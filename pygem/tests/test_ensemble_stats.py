@@ -0,0 +1,36 @@
+from pygem.utils._ensemble_stats import EnsembleStats
+import numpy as np
+
+
+def test_ensemble_stats():
+    stats_cns = ['mean', 'std', '2.5%', '25%', 'median', '75%', '97.5%']
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(24, 100)) * np.linspace(1, 3, 24)[:, np.newaxis]
+    data_exact = np.column_stack([data.mean(axis=1), data.std(axis=1)] +
+                                 [np.percentile(data, q, axis=1) for q in [2.5, 25, 50, 75, 97.5]])
+    # exact below twice the sketch size, one simulation at a time or all at once
+    stats = EnsembleStats(24, stats_cns, sketch_size=64)
+    for n_iter in range(data.shape[1]):
+        stats.update(data[:, n_iter])
+    np.testing.assert_allclose(stats.stats(), data_exact)
+    stats = EnsembleStats(24, stats_cns, exact=True, nsims=100)
+    stats.update(data)
+    np.testing.assert_allclose(stats.stats(), data_exact)
+
+    # merged sketches: exact moments, percentiles close in rank
+    data = rng.uniform(size=(24, 2000))
+    stats = [EnsembleStats(24, stats_cns, sketch_size=32, seed=x) for x in range(2)]
+    for n_iter in range(data.shape[1]):
+        stats[n_iter % 2].update(data[:, n_iter])
+    stats[0].merge(stats[1])
+    data_stats = stats[0].stats()
+    np.testing.assert_allclose(data_stats[:, 0], data.mean(axis=1))
+    np.testing.assert_allclose(data_stats[:, 1], data.std(axis=1))
+    for ncol, q in enumerate([2.5, 25, 50, 75, 97.5]):
+        rank = (data <= data_stats[:, ncol + 2][:, np.newaxis]).mean(axis=1) * 100
+        assert np.abs(rank - q).max() < 3
+
+    # only the requested statistics, nan if a simulation is nan
+    stats = EnsembleStats(2, ['median', 'mean'])
+    stats.update(np.array([[1, 2, 3], [np.nan, 1, 2]]))
+    np.testing.assert_array_equal(stats.stats(), [[2, 2], [np.nan, np.nan]])
@@ -0,0 +1,257 @@
+from oggm.core.flowline import MixedBedFlowline
+from pygem.glacierdynamics import MassRedistributionCurveModel, MassRedistributionCurveModelEnsemble
+import pygem.pygem_input as pygem_prms
+from pygem.massbalance import PyGEMMassBalance, PyGEMMassBalanceBatch
+from pygem.tests.test_massbalance import synthetic_glacier, option_refreezing
+from pygem.utils._diagnostics_writer import NetCDFDiagnosticsWriter
+import copy
+import numpy as np
+import pickle
+import pytest
+import xarray as xr
+
+
+def test_spinup_downscale_climate_allyears(option_refreezing):
+    # spin-up years of the dynamical model are downscaled at once, with the same result as year by year
+    results = []
+    for constantarea_nyears in [None, 0]:
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        ev_model = MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=3)
+        if constantarea_nyears is None:
+            assert mbmod.constantarea_nyears == 3
+        else:
+            mbmod.constantarea_nyears = constantarea_nyears
+        ev_model.run_until(8)
+        results.append((ev_model.fls[0].thick.copy(), mbmod.glac_wide_massbaltotal, mbmod.bin_temp))
+    for x, x_annual in zip(*results):
+        np.testing.assert_array_equal(x, x_annual)
+
+
+@pytest.mark.parametrize('option_rf_state', ['full', 'rolling'])
+def test_state_roundtrip(option_refreezing, option_rf_state, monkeypatch):
+    # a run restored from the state after 4 years is the same as the uninterrupted run
+    monkeypatch.setattr(pygem_prms, 'option_rf_state', option_rf_state, raising=False)
+    models = []
+    for nmodel in range(3):
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        models.append(MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=2))
+    ev_model_state, ev_model, ev_model_restored = models
+    ev_model_state.run_until(4)
+    state = pickle.loads(pickle.dumps(ev_model_state.get_state(4)))
+    ev_model.run_until(8)
+    ev_model_restored.set_state(state)
+    assert ev_model_restored.yr == 4
+    ev_model_restored.run_until(8)
+    np.testing.assert_array_equal(ev_model_restored.fls[0].thick, ev_model.fls[0].thick)
+    for vn in ['bin_temp', 'glac_bin_massbalclim', 'glac_bin_refreeze', 'glac_bin_snowpack', 'glac_wide_massbaltotal',
+               'glac_wide_runoff', 'glac_bin_area_annual', 'glac_bin_icethickness_annual']:
+        np.testing.assert_array_equal(getattr(ev_model_restored.mb_model, vn), getattr(ev_model.mb_model, vn))
+
+
+def test_extend_run(option_refreezing):
+    # a 7-year run continued from its final state to 12 years is the same as a 12-year run
+    models = []
+    for nyears in [7, 12, 12]:
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier(nyears=12)
+        # climate data of the shorter run ends after nyears
+        gdir.dates_table = gdir.dates_table.iloc[:12*nyears]
+        gdir.historical_climate = {vn: x if np.ndim(x) == 0 else x[:12*nyears] 
+                                   for vn, x in gdir.historical_climate.items()}
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        models.append(MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=2))
+    ev_model_prev, ev_model, ev_model_extended = models
+    _, diag_prev = ev_model_prev.run_until_and_store(7)
+    _, diag = ev_model.run_until_and_store(12)
+    ev_model_extended.set_state(pickle.loads(pickle.dumps(ev_model_prev.get_state(7))))
+    _, diag_extended = ev_model_extended.run_until_and_store(12)
+    np.testing.assert_array_equal(ev_model_extended.fls[0].thick, ev_model.fls[0].thick)
+    for vn in ['volume_m3', 'area_m2']:
+        np.testing.assert_array_equal(diag_prev[vn].values, diag[vn].values[:8])
+        np.testing.assert_array_equal(diag_extended[vn].values, diag[vn].values[7:])
+    for vn in ['bin_temp', 'glac_bin_massbalclim', 'glac_bin_refreeze', 'glac_wide_massbaltotal', 'glac_wide_runoff',
+               'glac_bin_area_annual', 'glac_bin_icethickness_annual']:
+        np.testing.assert_array_equal(getattr(ev_model_extended.mb_model, vn), getattr(ev_model.mb_model, vn))
+
+
+def trapezoid_fls(fls, thick_scale):
+    """Trapezoid flowlines (as from the ice thickness inversion) of the synthetic glacier with scaled ice thickness"""
+    fl = fls[0]
+    thick = fl.thick * thick_scale
+    lambdas = np.ones(fl.nx)
+    w0 = fl.widths_m - lambdas * fl.thick
+    widths = w0 + lambdas * thick
+    nfl = MixedBedFlowline(dx=fl.dx, map_dx=fl.map_dx, surface_h=fl.bed_h + thick, bed_h=fl.bed_h,
+                           section=(widths + w0) / 2 * thick, bed_shape=np.zeros(fl.nx),
+                           is_trapezoid=np.ones(fl.nx, dtype=bool), lambdas=lambdas, widths_m=widths)
+    nfl.debris_ed = fl.debris_ed
+    return [nfl]
+
+
+def test_ensemble_matches_single(option_refreezing, monkeypatch):
+    # every member of the ensemble (retreat, advance, disappearance) has the same output as its own simulation with
+    #  the direct solver
+    monkeypatch.setattr(pygem_prms, 'option_massredistribution_solver', 'direct')
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    members = [(1.5, 3., 1.), (1., 1., 0.8), (2.5, 2., 1.2), (1., 9., 0.3)]
+    nfls_ens = [trapezoid_fls(fls, thick_scale) for _, _, thick_scale in members]
+    modelprms_ens = dict(modelprms, kp=np.array([x[0] for x in members]), tbias=np.array([x[1] for x in members]))
+    mbmod_ens = PyGEMMassBalanceBatch(gdir, modelprms_ens, glacier_rgi_table, fls=copy.deepcopy(nfls_ens))
+    ev_model_ens = MassRedistributionCurveModelEnsemble(copy.deepcopy(nfls_ens), mb_model=mbmod_ens, y0=0,
+                                                        spinupyears=2)
+    _, diag_ens = ev_model_ens.run_until_and_store(8, store_geometry=False)
+    assert diag_ens.volume_m3.values[-1,-1] == 0
+    for member, (kp, tbias, _) in enumerate(members):
+        mbmod = PyGEMMassBalance(gdir, dict(modelprms, kp=kp, tbias=tbias), glacier_rgi_table,
+                                 fls=copy.deepcopy(nfls_ens[member]))
+        ev_model = MassRedistributionCurveModel(copy.deepcopy(nfls_ens[member]), mb_model=mbmod, y0=0, spinupyears=2)
+        _, diag = ev_model.run_until_and_store(8)
+        np.testing.assert_allclose(diag_ens.volume_m3.values[member], diag.volume_m3.values, rtol=1e-12)
+        for vn in ['glac_wide_massbaltotal', 'glac_wide_runoff', 'glac_wide_frontalablation', 'glac_wide_snowline',
+                   'glac_wide_ELA_annual', 'offglac_wide_prec', 'offglac_wide_refreeze', 'offglac_wide_melt',
+                   'offglac_wide_snowpack', 'offglac_wide_runoff']:
+            np.testing.assert_allclose(getattr(mbmod_ens, vn)[member], getattr(mbmod, vn), rtol=1e-10, atol=1e-6)
+
+
+@pytest.mark.parametrize('kp, tbias, thick_scale', [(1., 3., 1.), (3., -4., 0.8)], ids=['retreat', 'advance'])
+def test_direct_matches_iterative(kp, tbias, thick_scale, monkeypatch):
+    # the direct solver of the mass redistribution has the same geometry evolution as the iterative solver
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    nfls = trapezoid_fls(fls, thick_scale)
+    runs = {}
+    for solver in ['iterative', 'direct']:
+        monkeypatch.setattr(pygem_prms, 'option_massredistribution_solver', solver)
+        mbmod = PyGEMMassBalance(gdir, dict(modelprms, kp=kp, tbias=tbias), glacier_rgi_table,
+                                 fls=copy.deepcopy(nfls))
+        ev_model = MassRedistributionCurveModel(copy.deepcopy(nfls), mb_model=mbmod, y0=0, spinupyears=0)
+        _, diag = ev_model.run_until_and_store(8)
+        runs[solver] = (diag, ev_model.fls[0].thick, mbmod)
+    (diag, thick, mbmod), (diag_direct, thick_direct, mbmod_direct) = runs['iterative'], runs['direct']
+    volume_change = diag.volume_m3.values[-1] - diag.volume_m3.values[0]
+    assert volume_change < 0 if tbias > 0 else volume_change > 0
+    np.testing.assert_allclose(diag_direct.volume_m3.values, diag.volume_m3.values, rtol=1e-12)
+    np.testing.assert_allclose(diag_direct.area_m2.values, diag.area_m2.values, rtol=1e-12)
+    np.testing.assert_allclose(thick_direct, thick, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(mbmod_direct.glac_wide_massbaltotal, mbmod.glac_wide_massbaltotal, rtol=1e-12)
+
+
+@pytest.mark.parametrize('is_tidewater', [False, True])
+def test_disappeared_stops_early(is_tidewater, monkeypatch):
+    # once the glacier disappeared, the remaining years are recorded without stepping the model
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    fls[0].thick = fls[0].thick * 0.1
+    mbmod = PyGEMMassBalance(gdir, dict(modelprms, tbias=9.), glacier_rgi_table, fls=fls)
+    ev_model = MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=0, is_tidewater=is_tidewater)
+    years = []
+    updategeometry = ev_model.updategeometry
+    monkeypatch.setattr(ev_model, 'updategeometry', lambda year, **kwargs: years.append(year) or
+                                                                           updategeometry(year, **kwargs))
+    run_ds, diag = ev_model.run_until_and_store(8)
+    assert years == [0]
+    np.testing.assert_array_equal(diag.volume_m3.values[1:], 0)
+    np.testing.assert_array_equal(run_ds[0].ts_section.values[:-1], 0)
+    np.testing.assert_array_equal(mbmod.glac_wide_area_annual[1:], 0)
+    if is_tidewater:
+        np.testing.assert_array_equal(diag.calving_m3.values[:-1], 0)
+
+
+@pytest.mark.parametrize('solver', ['iterative', 'direct', 'ensemble'])
+def test_annual_loss_exceeds_volume(solver, monkeypatch):
+    # a glacier whose annual mass loss exceeds its volume loses all of its ice, as the mass balance model caps the
+    #  melt at the glacier volume (the ice was left unchanged before)
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    nfls = trapezoid_fls(fls, 0.1)
+    modelprms['tbias'] = 9.
+    if solver == 'ensemble':
+        mbmod = PyGEMMassBalanceBatch(gdir, modelprms, glacier_rgi_table, fls=[nfls])
+        ev_model = MassRedistributionCurveModelEnsemble([nfls], mb_model=mbmod, y0=0, spinupyears=0)
+    else:
+        monkeypatch.setattr(pygem_prms, 'option_massredistribution_solver', solver)
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=nfls)
+        ev_model = MassRedistributionCurveModel(nfls, mb_model=mbmod, y0=0, spinupyears=0)
+    volume_initial = np.sum(ev_model.volume_m3)
+    ev_model.run_until(1)
+    assert np.sum(ev_model.volume_m3) == 0
+    # volume change of the dynamics is the mass balance
+    massbaltotal = np.sum(mbmod.glac_wide_massbaltotal, axis=-1)
+    np.testing.assert_allclose(-volume_initial, massbaltotal * pygem_prms.density_water / pygem_prms.density_ice,
+                               rtol=1e-10)
+
+
+@pytest.mark.parametrize('is_tidewater', [False, True])
+def test_disappeared_matches_every_year(is_tidewater):
+    # the years recorded at once after the glacier disappeared are the same as stepping through every year
+    models = []
+    for nmodel in range(2):
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        fls[0].thick = fls[0].thick * 0.1
+        mbmod = PyGEMMassBalance(gdir, dict(modelprms, tbias=9.), glacier_rgi_table, fls=fls)
+        models.append(MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=0,
+                                                   is_tidewater=is_tidewater))
+    ev_model_store, ev_model_steps = models
+    ev_model_store.run_until_and_store(8)
+    ev_model_steps.run_until(8)
+    np.testing.assert_array_equal(ev_model_store.fls[0].thick, ev_model_steps.fls[0].thick)
+    for vn in ['glac_bin_area_annual', 'glac_bin_icethickness_annual', 'glac_bin_width_annual', 'glac_wide_area_annual',
+               'glac_wide_volume_annual', 'glac_wide_massbaltotal', 'glac_wide_runoff', 'offglac_wide_runoff']:
+        np.testing.assert_array_equal(getattr(ev_model_store.mb_model, vn), getattr(ev_model_steps.mb_model, vn))
+
+
+def test_stream_geometry(tmp_path):
+    # the geometry is streamed to the file without keeping it in memory, with the same values as the stored geometry
+    runs = []
+    for store_geometry in [True, False]:
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        ev_model = MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=2)
+        stream_path = str(tmp_path / 'stream_{}.nc'.format(store_geometry))
+        run_ds, diag = ev_model.run_until_and_store(8, store_geometry=store_geometry, stream_path=stream_path)
+        runs.append((run_ds, stream_path))
+    (run_ds, _), (run_ds_stream, stream_path) = runs
+    assert run_ds_stream == []
+    with xr.open_dataset(stream_path, group='fl_0') as ds:
+        np.testing.assert_array_equal(ds.ts_section.values, run_ds[0].ts_section.values)
+
+
+def test_stream_closed_on_error(tmp_path, monkeypatch):
+    # the streamed file is closed if the run fails
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+    ev_model = MassRedistributionCurveModel(fls, mb_model=mbmod, y0=0, spinupyears=2)
+    def updategeometry(year, **kwargs):
+        raise FloatingPointError('NaN in numerical solution.')
+    monkeypatch.setattr(ev_model, 'updategeometry', updategeometry)
+    closed = []
+    close = NetCDFDiagnosticsWriter.close
+    monkeypatch.setattr(NetCDFDiagnosticsWriter, 'close', lambda self: closed.append(self.nc) or close(self))
+    with pytest.raises(FloatingPointError):
+        ev_model.run_until_and_store(8, stream_path=str(tmp_path / 'stream.nc'), stream_geometry=False)
+    assert len(closed) == 1 and closed[0] is not None
+
+
+def test_reuse_inversion_years(option_refreezing):
+    # a run that copies the constant-area years of the inversion model is the same as the run computing them
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    mbmod_inv = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls, option_areaconstant=True)
+    for year in range(8):
+        mbmod_inv.get_annual_mb(fls[0].surface_h, year=year, fls=fls, fl_id=0)
+    models = []
+    for reuse in [False, True]:
+        nfls = trapezoid_fls(fls, 1.)
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=nfls)
+        ev_model = MassRedistributionCurveModel(nfls, mb_model=mbmod, y0=0, spinupyears=3)
+        if reuse:
+            nyears_reused = mbmod.reuse_years(mbmod_inv, 3, fls=ev_model.fls)
+            # the refreezing layers of HH2015 are not stored for each year, so nothing is copied
+            assert nyears_reused == (3 if option_refreezing == 'Woodward' else 0)
+        _, diag = ev_model.run_until_and_store(8)
+        models.append((ev_model, diag))
+    (ev_model, diag), (ev_model_reuse, diag_reuse) = models
+    np.testing.assert_allclose(diag_reuse.volume_m3.values, diag.volume_m3.values, rtol=1e-12)
+    np.testing.assert_allclose(ev_model_reuse.fls[0].thick, ev_model.fls[0].thick, rtol=1e-12)
+    for vn in ['glac_bin_massbalclim', 'glac_bin_snowpack', 'glac_wide_acc', 'glac_wide_melt', 'glac_wide_refreeze',
+               'glac_wide_massbaltotal', 'glac_wide_runoff', 'glac_wide_area_annual', 'glac_wide_ELA_annual',
+               'offglac_wide_runoff']:
+        np.testing.assert_allclose(getattr(ev_model_reuse.mb_model, vn), getattr(ev_model.mb_model, vn), rtol=1e-12,
+                                   atol=1e-12)
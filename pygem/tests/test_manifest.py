@@ -0,0 +1,75 @@
+from pygem.tests.test_merge import output_ds
+from pygem.utils._manifest import RunManifest, batch_name, run_pending
+from pygem.utils._output_container import GlacierContainer
+import functools
+import netCDF4
+import os
+
+
+def test_run_pending(tmp_path):
+    manifest = RunManifest(str(tmp_path / 'manifest.sqlite'))
+    glac_no = ['15.00001', '15.00002', '15.00003', '15.00004']
+    runs = []
+
+    def run(glac_no_run, fail='15.00002'):
+        runs.append(list(glac_no_run))
+        for glacier in glac_no_run:
+            manifest.record_start(glacier, 'gcm_rcp')
+            if glacier == fail:
+                raise ValueError('glacier failed')
+            output_fn = str(tmp_path / (glacier + '.nc'))
+            with open(output_fn, 'w') as f:
+                f.write(glacier)
+            manifest.record_success(glacier, 'gcm_rcp', [output_fn])
+
+    # failed glacier is retried up to max_attempts, the others continue
+    assert run_pending(run, glac_no, manifest, 'gcm_rcp', max_attempts=2) == ['15.00002', '15.00002']
+    assert runs == [glac_no, glac_no[1:], glac_no[2:]]
+    records = manifest.status(glac_no, 'gcm_rcp')
+    assert records['15.00002'][:2] == ('failed', 2) and 'glacier failed' in records['15.00002'][4]
+    assert [records[x][0] for x in glac_no] == ['done', 'failed', 'done', 'done']
+
+    # resume: completed glaciers are skipped unless their output changed
+    assert manifest.pending(glac_no, 'gcm_rcp', max_attempts=2) == []
+    with open(str(tmp_path / '15.00003.nc'), 'w') as f:
+        f.write('changed')
+    assert manifest.pending(glac_no, 'gcm_rcp', max_attempts=3) == ['15.00002', '15.00003']
+    assert manifest.pending(glac_no, 'other_task') == glac_no
+    assert manifest.failed(glac_no, 'gcm_rcp') == ['15.00002']
+
+    # not resumed: the glaciers are run again and the records of the other glaciers are kept
+    runs.clear()
+    assert run_pending(functools.partial(run, fail=None), glac_no[1:3], manifest, 'gcm_rcp', resume=False) == []
+    assert runs == [glac_no[1:3]]
+    records = manifest.status(glac_no, 'gcm_rcp')
+    assert [records[x][:2] for x in glac_no] == [('done', 1), ('done', 1), ('done', 1), ('done', 1)]
+    assert manifest.failed(glac_no, 'gcm_rcp') == []
+
+
+def test_batch_name():
+    # batches of a run configuration (e.g., one per node) have their own manifest
+    assert batch_name() is None
+    assert batch_name(3, 'R15_rgi_glac_number_batch_3.pkl') == 'batch3'
+    assert batch_name(glac_number_fn='../R15_rgi_glac_number_batch_3.pkl') == 'R15_rgi_glac_number_batch_3'
+
+
+def test_container_rows(tmp_path):
+    # glaciers written to a container are verified with the checksum of their row when the run is resumed
+    manifest = RunManifest(str(tmp_path / 'manifest.sqlite'))
+    fn = str(tmp_path / 'container.nc')
+    glac_no = ['15.00001', '15.00002']
+    with GlacierContainer(fn) as container:
+        for glac, glacier in enumerate(glac_no):
+            manifest.record_start(glacier, 'gcm_rcp')
+            container.append(output_ds(glac + 1),
+                             callback=functools.partial(manifest.record_success_row, glacier, 'gcm_rcp', fn))
+    records = manifest.status(glac_no, 'gcm_rcp')
+    assert [records[x][0] for x in glac_no] == ['done', 'done']
+    assert records['15.00002'][2] == fn and records['15.00002'][3].startswith('row 1 ')
+    assert manifest.pending(glac_no, 'gcm_rcp') == []
+    # values of a glacier changed (e.g., the row was not completely written)
+    with netCDF4.Dataset(fn, 'a') as nc:
+        nc['Area'][1] = -1
+    assert manifest.pending(glac_no, 'gcm_rcp') == ['15.00002']
+    os.remove(fn)
+    assert manifest.pending(glac_no, 'gcm_rcp') == glac_no
@@ -0,0 +1,148 @@
+from oggm.core.flowline import RectangularBedFlowline
+import pygem.pygem_input as pygem_prms
+from pygem.massbalance import PyGEMMassBalance, PyGEMMassBalanceBatch
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class SyntheticGlacierDirectory(object):
+    """Climate of a glacier directory as used by PyGEMMassBalance"""
+    def __init__(self, nyears, seed=0, elev=3500.):
+        rng = np.random.default_rng(seed)
+        dates = pd.date_range('2000-01-01', periods=12*nyears, freq='MS')
+        self.dates_table = pd.DataFrame({'date': dates, 'year': dates.year, 'month': dates.month,
+                                         'daysinmonth': dates.days_in_month})
+        month = np.arange(12*nyears) % 12
+        self.historical_climate = {'temp': 2 + 8 * np.sin((month - 3) / 12 * 2 * np.pi) +
+                                           rng.normal(0, 1, 12*nyears),
+                                   'tempstd': np.full(12*nyears, 2.),
+                                   'prec': rng.uniform(0.02, 0.15, 12*nyears),
+                                   'elev': elev,
+                                   'lr': np.full(12*nyears, -0.0065)}
+
+
+def synthetic_glacier(nyears=8, nbins=40, nbins_glac=30, seed=0):
+    """Climate, flowlines, RGI information and model parameters of a synthetic valley glacier"""
+    gdir = SyntheticGlacierDirectory(nyears, seed=seed)
+    bed_h = np.linspace(5000, 3800, nbins)
+    thick = np.zeros(nbins)
+    thick[:nbins_glac] = 120 * np.sin(np.linspace(0.2, np.pi - 0.2, nbins_glac))
+    widths = np.zeros(nbins) + 5.
+    widths[:nbins_glac] = np.linspace(6, 3, nbins_glac)
+    fl = RectangularBedFlowline(dx=1, map_dx=100, surface_h=bed_h + thick, bed_h=bed_h, widths=widths)
+    fl.debris_ed = np.ones(nbins)
+    glacier_rgi_table = pd.Series({'RGIId': 'RGI60-15.03473', 'Zmed': 4500., 'Zmean': 4500., 'TermType': 0})
+    modelprms = {'kp': 1.5, 'tbias': 3., 'ddfsnow': 0.0041, 'ddfice': 0.0041 / 0.7, 'tsnow_threshold': 1.,
+                 'precgrad': 0.0001}
+    return gdir, [fl], glacier_rgi_table, modelprms
+
+
+# HH2015 refreezing parameters (defaults of pygem_input, which only sets them with option_refreezing = 'HH2015')
+hh2015_prms = {'rf_layers': 5, 'rf_dz': 2, 'rf_dsc': 3, 'rf_meltcrit': 0.002, 'pp': 0.3, 'rf_dens_top': 300,
+               'rf_dens_bot': 650, 'option_rf_limit_meltsnow': 1, 'option_rf_state': 'rolling', 'rf_history_step': 12}
+
+
+@pytest.fixture(params=['Woodward', 'HH2015'])
+def option_refreezing(request, monkeypatch):
+    monkeypatch.setattr(pygem_prms, 'option_refreezing', request.param)
+    if request.param == 'HH2015':
+        for vn, value in hh2015_prms.items():
+            monkeypatch.setattr(pygem_prms, vn, value, raising=False)
+    return request.param
+
+
+def test_batch_matches_single(option_refreezing):
+    # every parameter set of the batch is the same as a constant-area PyGEMMassBalance with its parameters
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    prms_batch = dict(modelprms, kp=np.array([1, 1.5, 2.5]), tbias=np.array([-1, 1.5, 3]))
+    mbmod_batch = PyGEMMassBalanceBatch(gdir, prms_batch, glacier_rgi_table, fls=fls)
+    mb_batch = np.array([mbmod_batch.get_annual_mb(year=year) for year in range(8)])
+    for nset in range(3):
+        prms = dict(modelprms, kp=prms_batch['kp'][nset], tbias=prms_batch['tbias'][nset])
+        mbmod = PyGEMMassBalance(gdir, prms, glacier_rgi_table, fls=fls, option_areaconstant=True)
+        mb = np.array([mbmod.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year) for year in range(8)])
+        np.testing.assert_allclose(mb_batch[:,nset], mb, rtol=1e-12, atol=1e-20)
+        for vn in ['glac_wide_acc', 'glac_wide_refreeze', 'glac_wide_melt', 'glac_wide_massbaltotal',
+                   'glac_wide_runoff']:
+            np.testing.assert_allclose(getattr(mbmod_batch, vn)[nset], getattr(mbmod, vn), rtol=1e-12)
+
+
+def test_downscale_climate_allyears(option_refreezing):
+    # constant-area model downscales the whole period at once, with the same mass balance as year by year
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    mbmod_allyears = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls, option_areaconstant=True)
+    mbmod_annual = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+    for year in range(8):
+        mb_allyears = mbmod_allyears.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year)
+        assert mbmod_allyears.climate_key is not None
+        mb_annual = mbmod_annual.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year)
+        assert mbmod_annual.climate_key is None
+        np.testing.assert_array_equal(mb_allyears, mb_annual)
+    for vn in ['bin_temp', 'bin_prec', 'bin_acc', 'glac_bin_massbalclim', 'glac_wide_massbaltotal']:
+        np.testing.assert_array_equal(getattr(mbmod_allyears, vn), getattr(mbmod_annual, vn))
+
+
+def test_downscale_climate_allyears_heights_change(monkeypatch):
+    # with heights that change every year, constant-area years are downscaled one at a time (not the whole remaining
+    #  period each year), with the same mass balance as year by year
+    gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+    mbmod_allyears = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls, option_areaconstant=True)
+    mbmod_annual = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+    nmonths_downscaled = []
+    downscale_climate = mbmod_allyears._downscale_climate
+    monkeypatch.setattr(mbmod_allyears, '_downscale_climate', lambda heights, fl, glac_idx_t0, t_start, t_end:
+                        nmonths_downscaled.append(t_end - t_start) or
+                        downscale_climate(heights, fl, glac_idx_t0, t_start, t_end))
+    for year in range(8):
+        fls[0].thick = fls[0].thick * 0.98
+        for mbmod in [mbmod_allyears, mbmod_annual]:
+            mbmod.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year)
+    # the following years are downscaled at once if the heights stay the same
+    mbmod_allyears.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=7)
+    mbmod_annual.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=7)
+    assert nmonths_downscaled == [96] + [12] * 8
+    for vn in ['bin_temp', 'bin_prec', 'bin_acc', 'glac_bin_massbalclim', 'glac_wide_massbaltotal']:
+        np.testing.assert_array_equal(getattr(mbmod_allyears, vn), getattr(mbmod_annual, vn))
+
+
+def test_rf_state_rolling_matches_full(monkeypatch):
+    # the rolling refreezing state starts every year from the same layer temps as the full state, also for years that
+    #  are computed again after later years
+    monkeypatch.setattr(pygem_prms, 'option_refreezing', 'HH2015')
+    for vn, value in hh2015_prms.items():
+        monkeypatch.setattr(pygem_prms, vn, value, raising=False)
+    years = [0, 1, 2, 3, 1, 2, 5, 4, 2, 3]
+    results = []
+    for option_rf_state in ['full', 'rolling']:
+        monkeypatch.setattr(pygem_prms, 'option_rf_state', option_rf_state)
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        mb = np.array([mbmod.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year) for year in years])
+        results.append((mb, mbmod.glac_bin_refreeze))
+    (mb_full, refreeze_full), (mb_rolling, refreeze_rolling) = results
+    assert refreeze_full.max() > 0
+    np.testing.assert_array_equal(mb_rolling, mb_full)
+    np.testing.assert_array_equal(refreeze_rolling, refreeze_full)
+
+
+def test_mb_cache_matches_no_cache(option_refreezing, monkeypatch):
+    # repeated calls for a year (e.g., sub-steps of the dynamical model) return the result of the first call, so the
+    #  run is the same as computing each year once without cache
+    results = []
+    for option_mb_cache, ncalls in [(False, 1), (True, 3)]:
+        monkeypatch.setattr(pygem_prms, 'option_mb_cache', option_mb_cache)
+        gdir, fls, glacier_rgi_table, modelprms = synthetic_glacier()
+        mbmod = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table, fls=fls)
+        mb = np.array([[mbmod.get_annual_mb(fls[0].surface_h, fls=fls, fl_id=0, year=year) for _ in range(ncalls)]
+                       for year in range(8)])
+        results.append((mb, mbmod))
+    (mb, mbmod), (mb_cache, mbmod_cache) = results
+    assert (mbmod.mb_cache_hits, mbmod.mb_cache_misses) == (0, 0)
+    assert (mbmod_cache.mb_cache_hits, mbmod_cache.mb_cache_misses) == (16, 8)
+    # only the last year of each flowline is kept
+    assert list(mbmod_cache.mb_cache) == [0] and mbmod_cache.mb_cache[0][0][0] == 7
+    np.testing.assert_array_equal(mb_cache, mb.repeat(3, axis=1))
+    for vn in ['bin_temp', 'glac_bin_massbalclim', 'glac_bin_refreeze', 'glac_bin_snowpack', 'glac_wide_massbaltotal',
+               'glac_wide_runoff', 'glac_wide_snowline', 'glac_wide_ELA_annual']:
+        np.testing.assert_array_equal(getattr(mbmod_cache, vn), getattr(mbmod, vn))
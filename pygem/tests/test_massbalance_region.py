@@ -0,0 +1,50 @@
+from pygem.tests.test_massbalance import option_refreezing, SyntheticGlacierDirectory
+import pygem.pygem_input as pygem_prms
+import pygemfxns_massbalance as massbalance
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def synthetic_region(nglac=4, nyears=6, nbins=60, seed=1):
+    """Hypsometry, ice thickness, climate and model parameters of glaciers sharing the elevation bins"""
+    rng = np.random.default_rng(seed)
+    heights = np.arange(nbins) * 10 + 4005.
+    area = np.zeros((nglac, nbins))
+    icethickness = np.zeros((nglac, nbins))
+    for glac, (bin_low, bin_high) in enumerate([(5, 30), (20, 50), (0, 10), (40, 41)][:nglac]):
+        area[glac, bin_low:bin_high] = rng.uniform(0.01, 0.2, bin_high - bin_low)
+        icethickness[glac, bin_low:bin_high] = rng.uniform(10, 100, bin_high - bin_low)
+    # climate of each glacier
+    gdirs = [SyntheticGlacierDirectory(nyears, seed=seed + glac, elev=4300.) for glac in range(nglac)]
+    climate = {vn: np.array([gdir.historical_climate[vn] for gdir in gdirs])
+               for vn in ['temp', 'tempstd', 'prec', 'elev', 'lr']}
+    main_glac_rgi = pd.DataFrame({'RGIId': ['RGI60-15.{:05d}'.format(x) for x in range(nglac)], 'TermType': 0})
+    main_glac_rgi['Zmed'] = [heights[area[glac] > 0].mean() for glac in range(nglac)]
+    main_glac_rgi['Zmean'] = main_glac_rgi['Zmed']
+    modelparameters = np.array([[-0.0065, -0.0065, kp, 0.0001, 0.0041, 0.0041 / 0.7, 1., tbias]
+                                for kp, tbias in [(1, 0), (1.5, 2), (2, -1), (0.8, 6)][:nglac]])
+    return main_glac_rgi, area, icethickness, heights, climate, gdirs[0].dates_table, modelparameters
+
+
+@pytest.mark.parametrize('hyps_data', ['OGGM', 'Huss'])
+@pytest.mark.parametrize('option_ablation, option_ablation_dailytemp', [(1, 'random'), (2, 'random'), (2, 'expected')])
+def test_region_matches_single(option_refreezing, hyps_data, option_ablation, option_ablation_dailytemp, monkeypatch):
+    # every glacier of the region is the same as runmassbalance with constant area (with the same daily temperatures)
+    monkeypatch.setattr(pygem_prms, 'hyps_data', hyps_data)
+    monkeypatch.setattr(pygem_prms, 'option_ablation', option_ablation)
+    monkeypatch.setattr(pygem_prms, 'option_ablation_dailytemp', option_ablation_dailytemp)
+    main_glac_rgi, area, icethickness, heights, climate, dates_table, modelparameters = synthetic_region()
+    output_region = massbalance.runmassbalance_region(
+            modelparameters, main_glac_rgi, area, icethickness, heights, climate['temp'], climate['tempstd'],
+            climate['prec'], climate['elev'], climate['lr'], climate['lr'], dates_table)
+    # indices of the same variables in the output of runmassbalance
+    output_idx = [0, 1, 2, 3, 4, 5, 7, 8, 13, 14, 17, 18]
+    for glac in range(area.shape[0]):
+        output = massbalance.runmassbalance(
+                modelparameters[glac], main_glac_rgi.loc[glac], area[glac], icethickness[glac], area[glac] / 0.1,
+                heights, climate['temp'][glac], climate['tempstd'][glac], climate['prec'][glac],
+                climate['elev'][glac], climate['lr'][glac], climate['lr'][glac], dates_table, option_areaconstant=1,
+                option_compactbins=False)
+        for x_region, idx in zip(output_region, output_idx):
+            np.testing.assert_allclose(x_region[glac], output[idx], rtol=1e-10, atol=1e-14)
@@ -0,0 +1,36 @@
+from pygem.utils._massredistribution import huss_thickness_change_norm, huss_volumechange_curve
+import numpy as np
+
+
+def test_huss_thickness_change_norm():
+    elevrange_norm = np.linspace(0, 1, 11)
+    for glacier_area_total in [1, 10, 100]:
+        icethicknesschange_norm = huss_thickness_change_norm(elevrange_norm, glacier_area_total)
+        assert icethicknesschange_norm.min() >= 0 and icethicknesschange_norm.max() <= 1
+        # largest thickness change at the terminus
+        assert icethicknesschange_norm[-1] == icethicknesschange_norm.max()
+
+
+def test_huss_volumechange_curve():
+    glacier_area = np.array([2e5, 3e5, 4e5, 3e5, 1e5, 0, 0])
+    heights = np.array([3000, 2900, 2800, 2700, 2600, 2500, 2400.])
+    bin_volumechange = huss_volumechange_curve(glacier_area, heights, -1e6)
+    np.testing.assert_allclose(bin_volumechange.sum(), -1e6)
+    assert (bin_volumechange[glacier_area == 0] == 0).all()
+    # thinning increases towards the terminus
+    icethickness_change = bin_volumechange[:5] / glacier_area[:5]
+    assert (np.diff(icethickness_change) <= 0).all()
+
+
+def test_huss_volumechange_curve_ensemble():
+    rng = np.random.default_rng(0)
+    glacier_area = rng.uniform(1e4, 5e6, (4, 20))
+    glacier_area[1, 15:] = 0
+    glacier_area[2, :3] = 0
+    heights = np.linspace(4000, 3000, 20) + rng.normal(0, 20, (4, 20))
+    glacier_volumechange = np.array([-1e6, 2e5, -3e7, 0])
+    bin_volumechange = huss_volumechange_curve(glacier_area, heights, glacier_volumechange)
+    # each member is the same as on its own
+    for n in range(4):
+        np.testing.assert_array_equal(bin_volumechange[n], 
+                                      huss_volumechange_curve(glacier_area[n], heights[n], glacier_volumechange[n]))
@@ -0,0 +1,21 @@
+from pygem.utils._melt import melt_energy_daily, melt_energy_expected, tempstd_noise_table
+import numpy as np
+
+
+def test_melt_energy_expected():
+    bin_temp = np.array([-10, -3, -0.5, 0, 0.5, 3, 10])
+    tempstd = 2.5
+    # expected melt converges to the mean of many random months
+    noise = np.random.default_rng(0).standard_normal(200000)
+    melt_random = np.maximum(bin_temp[:,np.newaxis] + tempstd * noise, 0).mean(1) * 30
+    np.testing.assert_allclose(melt_energy_expected(bin_temp, tempstd, 30), melt_random, rtol=0.02, atol=0.05)
+    # no daily variability is the same as monthly temperature above zero
+    np.testing.assert_array_equal(melt_energy_expected(bin_temp, 0, 30), np.maximum(bin_temp, 0) * 30)
+
+
+def test_melt_energy_daily_reproducible():
+    bin_temp = np.linspace(-5, 5, 11)
+    noise = tempstd_noise_table(24, seed=1)
+    melt = melt_energy_daily(bin_temp, 2, 30, noise[3])
+    np.testing.assert_array_equal(melt, melt_energy_daily(bin_temp, 2, 30, tempstd_noise_table(24, seed=1)[3]))
+    np.testing.assert_allclose(melt, np.maximum(bin_temp[:,np.newaxis] + 2 * noise[3,:30], 0).sum(1))
@@ -0,0 +1,46 @@
+from pygem.utils._merge import merge_files, merge_files_parallel
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def output_ds(glac):
+    """Output dataset of glaciers (glac is a glacier number or an array of them)"""
+    glac = np.atleast_1d(glac)
+    ds = xr.Dataset({'RGIId': (('glac',), np.array(['RGI60-15.{:05d}'.format(x) for x in glac])),
+                     'Area': (('glac',), glac * 1.5),
+                     'glac_temp_monthly': (('glac', 'time'), 250 + np.add.outer(glac, np.linspace(0, 50, 24))),
+                     'glac_runoff_monthly': (('glac', 'time'), np.add.outer(glac, np.zeros(24)) * np.arange(24.)),
+                     'glac_area_annual': (('glac', 'year_plus1'), np.add.outer(glac, np.zeros(3)))},
+                    coords={'glac': glac, 'time': pd.date_range('2000-01-01', periods=24, freq='MS'),
+                            'year_plus1': [2000, 2001, 2002]})
+    ds['glac_runoff_monthly'].attrs = {'units': 'm3'}
+    return ds
+
+
+def batch_ds(glac):
+    ds = output_ds(glac)
+    ds['glacier_table'] = (('glac', 'glac_attrs'), np.column_stack((glac, glac * 2.)))
+    ds['glac_attrs'] = (('glac_attrs',), np.array(['glacno', 'Area']))
+    return ds
+
+
+def test_merge_files(tmp_path):
+    batches = [np.arange(0, 3), np.arange(3, 4), np.arange(4, 9)]
+    fns = []
+    for nbatch, glac in enumerate(batches):
+        fns.append(str(tmp_path / 'R15_batch{}.nc'.format(nbatch)))
+        batch_ds(glac + 10).to_netcdf(fns[-1], encoding={'glac_runoff_monthly': {'_FillValue': False}})
+    merged_fn = str(tmp_path / 'R15.nc')
+    assert merge_files(fns, merged_fn) == [3, 1, 5]
+    ds_concat = xr.concat([xr.open_dataset(x) for x in fns], dim='glac')
+    ds_concat['glac'] = np.arange(9)
+    with xr.open_dataset(merged_fn) as ds:
+        xr.testing.assert_identical(ds, ds_concat)
+        assert ds['glac_runoff_monthly'].encoding['zlib']
+
+    # several merges in parallel, glac values of the files kept
+    merge_files_parallel([(fns[:2], merged_fn), (fns[1:], str(tmp_path / 'R15b.nc'))], n_workers=2,
+                         renumber=False)
+    with xr.open_dataset(str(tmp_path / 'R15b.nc')) as ds:
+        assert list(ds.glac.values) == list(range(13, 19))
@@ -0,0 +1,84 @@
+from pygem.utils._output_container import GlacierContainer, consolidate_containers, container_index
+from pygem.utils._encoding import output_encoding, packing
+from pygem.tests.test_merge import output_ds
+import netCDF4
+import numpy as np
+import pytest
+import xarray as xr
+
+
+def test_glacier_container(tmp_path):
+    fn = str(tmp_path / 'container.nc')
+    synced = []
+    with GlacierContainer(fn, flush_every=2) as container:
+        assert [container.append(output_ds(x), callback=lambda row, checksum: synced.append(row))
+                for x in range(3)] == [0, 1, 2]
+        # callbacks of the glaciers that were synced
+        assert synced == [0, 1]
+    assert synced == [0, 1, 2]
+    # appended to the existing file
+    with GlacierContainer(fn) as container:
+        assert container.append(output_ds(7)) == 3
+    assert container_index(fn) == {'RGI60-15.00000': 0, 'RGI60-15.00001': 1, 'RGI60-15.00002': 2,
+                                   'RGI60-15.00007': 3}
+    ds_merged = xr.concat([output_ds(x) for x in [0, 1, 2, 7]], 'glac')
+    with xr.open_dataset(fn) as ds:
+        xr.testing.assert_allclose(ds.drop_vars('RGIId'), ds_merged.drop_vars('RGIId'))
+        assert list(ds['RGIId'].values) == list(ds_merged['RGIId'].values)
+        assert ds['glac_runoff_monthly'].attrs['units'] == 'm3'
+
+
+def test_glacier_container_encoding(tmp_path):
+    fn = str(tmp_path / 'container.nc')
+    ds_glac = output_ds(3)
+    ds_glac['glac_runoff_monthly'][0, 5] = np.nan
+    encoding = output_encoding(ds_glac, profile='int16', chunks={'glac': 50, 'time': 12},
+                               pack_ranges={'glac_runoff_monthly': (0, 100)})
+    with GlacierContainer(fn) as container:
+        container.append(ds_glac, encoding=encoding)
+        # values outside the pack range are not written
+        with pytest.raises(ValueError):
+            container.append(output_ds(5))
+        assert container.append(output_ds(4)) == 1
+    with xr.open_dataset(fn) as ds:
+        assert list(ds['glac'].values) == [3, 4]
+        assert ds['glac_runoff_monthly'].encoding['dtype'] == 'int16'
+        assert ds['glac_runoff_monthly'].encoding['chunksizes'] == (8, 12)
+        assert ds['glac_area_annual'].encoding['dtype'] == 'float32'
+        precision = packing(0, 100)[2]
+        np.testing.assert_allclose(ds['glac_runoff_monthly'].values[:1], ds_glac['glac_runoff_monthly'].values,
+                                   atol=precision)
+        assert np.isnan(ds['glac_runoff_monthly'].values[0, 5])
+
+
+def test_consolidate_containers(tmp_path):
+    fns = [str(tmp_path / 'container-1-2.nc'), str(tmp_path / 'container-1-3.nc')]
+    with GlacierContainer(fns[0]) as container:
+        for x in [0, 1, 2, 1]:
+            container.append(output_ds(x))
+    # glacier 3 was not completely written (no glac value)
+    with netCDF4.Dataset(fns[0], 'a') as nc:
+        nc['RGIId'][4] = 'RGI60-15.00003'
+        nc['Area'][4] = 4.5
+    # glacier 2 was run again by the resumed run
+    ds_glac = output_ds(2)
+    ds_glac['Area'][:] = 10.
+    with GlacierContainer(fns[1]) as container:
+        container.append(ds_glac)
+        container.append(output_ds(5))
+    assert container_index(fns[0]) == {'RGI60-15.00000': 0, 'RGI60-15.00001': 3, 'RGI60-15.00002': 2}
+
+    merged_fn = str(tmp_path / 'R15.nc')
+    rows = consolidate_containers(fns, merged_fn, renumber=False)
+    assert [list(x) for x in rows] == [[0, 3], [0, 1]]
+    with xr.open_dataset(merged_fn) as ds:
+        assert list(ds['RGIId'].values) == ['RGI60-15.00000', 'RGI60-15.00001', 'RGI60-15.00002', 'RGI60-15.00005']
+        assert list(ds['glac'].values) == [0, 1, 2, 5]
+        np.testing.assert_allclose(ds['Area'].values, [0, 1.5, 10, 7.5])
+        xr.testing.assert_allclose(ds['glac_runoff_monthly'].isel(glac=3), output_ds(5)['glac_runoff_monthly'][0])
+
+    # glaciers of a selection (e.g., a region)
+    consolidate_containers(fns, merged_fn, select=lambda x: x != 'RGI60-15.00001')
+    with xr.open_dataset(merged_fn) as ds:
+        assert list(ds['RGIId'].values) == ['RGI60-15.00000', 'RGI60-15.00002', 'RGI60-15.00005']
+        assert list(ds['glac'].values) == [0, 1, 2]
@@ -0,0 +1,35 @@
+from pygem.utils._refreeze import refreeze_hh2015
+from benchmark_refreezing import (refreeze_hh2015_loop, rf_layers, rf_dz, rf_dsc, rf_meltcrit, pp, Lh_rf,
+                                  density_water, rf_layers_dens, rf_layers_ch, rf_layers_k)
+import numpy as np
+
+
+def test_refreeze_hh2015_matches_bin_loop():
+    # run two years of random monthly forcing through the batched and per-bin refreezing
+    rng = np.random.default_rng(0)
+    nbins = 60
+    glac_idx = np.arange(5, 55)
+    glac_mask = np.zeros(nbins, dtype=bool)
+    glac_mask[glac_idx] = True
+    surfacetype = rng.integers(1, 5, nbins)
+
+    states = [[np.zeros((rf_layers,nbins)), np.zeros((rf_layers,nbins)), np.zeros(nbins)] for i in range(2)]
+    for step in range(24):
+        bin_temp = rng.normal(-2, 6, nbins)
+        bin_melt = np.where(rng.random(nbins) < 0.5, 0, rng.random(nbins) * 0.3)
+        bin_meltsnow = bin_melt * rng.random(nbins)
+        bin_prec = np.where(rng.random(nbins) < 0.5, 0, rng.random(nbins) * 0.1)
+        bin_snowpack = np.where(rng.random(nbins) < 0.2, 0, rng.random(nbins) * 2)
+        rf_dt = 3600 * 24 * 30 / rf_dsc
+
+        te_rf, tl_rf, rf_cold = states[0]
+        refr_loop = refreeze_hh2015_loop(te_rf, tl_rf, rf_cold, glac_idx, bin_temp, bin_melt, bin_meltsnow,
+                                         bin_prec, bin_snowpack, surfacetype, rf_dt)
+        te_rf, tl_rf, rf_cold = states[1]
+        refr = refreeze_hh2015(te_rf, tl_rf, rf_cold, glac_mask, bin_temp, bin_melt, bin_meltsnow, bin_prec,
+                               bin_snowpack, surfacetype, rf_dt, rf_layers_dens, rf_layers_ch, rf_layers_k, rf_dz,
+                               rf_dsc, rf_meltcrit, pp, Lh_rf, density_water)
+
+        np.testing.assert_array_equal(refr, refr_loop)
+        for state, state_loop in zip(states[1], states[0]):
+            np.testing.assert_array_equal(state, state_loop)
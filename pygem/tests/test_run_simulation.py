@@ -0,0 +1,46 @@
+import pygem.pygem_input as pygem_prms
+import pandas as pd
+import pytest
+import sys
+import run_simulation
+
+
+@pytest.fixture
+def run_calls(tmp_path, monkeypatch):
+    """main and the glacier data of run_simulation replaced by functions that record their calls"""
+    monkeypatch.setattr(sys, 'argv', ['run_simulation.py'])
+    monkeypatch.setattr(pygem_prms, 'output_sim_fp', str(tmp_path) + '/')
+    calls = {'main': [], 'load': []}
+
+    def load_glacier_data(glac_no):
+        calls['load'].append(list(glac_no))
+        return pd.DataFrame({'rgino_str': glac_no, 'Area': 1.})
+
+    def main(list_packed_vars):
+        count, glac_no, gcm_name, rcp_scenario = list_packed_vars
+        main_glac_rgi = run_simulation.cached(('glacier_data', tuple(glac_no)), load_glacier_data, glac_no)
+        calls['main'].append((count, list(glac_no), gcm_name, rcp_scenario, main_glac_rgi.to_dict()))
+        # the model run does not change the cached data
+        main_glac_rgi['Area'] = 0.
+        for glacier in glac_no:
+            run_simulation._manifest[0].record_start(glacier, run_simulation._manifest[1])
+            run_simulation._manifest[0].record_success(glacier, run_simulation._manifest[1], [])
+
+    monkeypatch.setattr(run_simulation, 'main', main)
+    return calls
+
+
+def test_main_gcms_matches_run_glaciers(run_calls):
+    # persistent worker runs the same glaciers, gcms and rcps as a run for each gcm, loading the glacier data once
+    glac_no = ['15.00001', '15.00002']
+    gcm_rcp_list = [('CCSM4', 'rcp26'), ('MPI-ESM-LR', 'rcp26'), ('CCSM4', 'rcp85')]
+    for gcm_name, rcp_scenario in gcm_rcp_list:
+        run_simulation.run_glaciers([0, glac_no, gcm_name, rcp_scenario])
+    calls_gcm = dict(run_calls)
+    assert run_calls['load'] == [glac_no] * 3
+    run_calls['main'], run_calls['load'] = [], []
+    # glaciers done in the manifest of the previous runs are run again (not resumed)
+    run_simulation.main_gcms([0, glac_no, gcm_rcp_list])
+    assert run_calls['main'] == calls_gcm['main']
+    assert run_calls['load'] == [glac_no]
+    assert run_simulation._worker_cache is None
@@ -0,0 +1,30 @@
+from pygem.utils._scheduler import glacier_costs, schedule_batches, utilisation
+import numpy as np
+
+
+def test_schedule_batches():
+    rng = np.random.default_rng(0)
+    glac_no = ['15.{:05d}'.format(x) for x in range(200)]
+    area = rng.lognormal(0, 2, 200)
+    costs = glacier_costs(area, nbins=np.sqrt(area) * 50)
+    batches = schedule_batches(glac_no, costs, n_workers=8)
+    # every glacier once, largest first
+    assert sorted(sum(batches, [])) == glac_no
+    costs_dict = dict(zip(glac_no, costs))
+    costs_ordered = [costs_dict[x] for x in sum(batches, [])]
+    assert np.all(np.diff(costs_ordered) <= 0)
+    # batches get smaller towards the end
+    batch_costs = [sum(costs_dict[x] for x in batch) for batch in batches]
+    assert batch_costs[-1] < batch_costs[0]
+    assert max(batch_costs[1:]) <= costs.sum() / 16 + costs.max()
+    # large glaciers are batches of their own
+    costs[:3] = costs.sum()
+    assert [len(x) for x in schedule_batches(glac_no, costs, n_workers=8)[:3]] == [1, 1, 1]
+    assert max(len(x) for x in schedule_batches(glac_no, costs, n_workers=8, max_batch=3)) == 3
+
+
+def test_utilisation():
+    records = [(1, 0, 4), (1, 4, 10), (2, 0, 5)]
+    stats = utilisation(records, 0, 10)
+    assert stats[1] == (2, 10, 1)
+    assert stats[2] == (1, 5, 0.5)
@@ -0,0 +1,23 @@
+from pygem.utils._shared_arrays import attach_shared_arrays, create_shared_arrays, release_shared_arrays
+import numpy as np
+import pytest
+
+
+def test_shared_arrays():
+    arrays = {'hyps': np.arange(12, dtype=float).reshape(3, 4), 'glac_idx': np.array([3, 1, 2])}
+    blocks, spec = create_shared_arrays(arrays)
+    try:
+        attached_blocks, views = attach_shared_arrays(spec)
+        for vn, array in arrays.items():
+            assert views[vn].dtype == array.dtype
+            np.testing.assert_array_equal(views[vn], array)
+        # views are read-only, rows selected from them are copies
+        with pytest.raises(ValueError):
+            views['hyps'][0, 0] = -1
+        rows = views['hyps'][[2, 0]]
+        rows[0, 0] = -1
+        assert views['hyps'][2, 0] == 8
+        del views, rows
+        release_shared_arrays(attached_blocks)
+    finally:
+        release_shared_arrays(blocks, unlink=True)
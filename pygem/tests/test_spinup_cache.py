@@ -0,0 +1,29 @@
+from pygem.utils._spinup_cache import spinup_cache_key, load_spinup_state, save_spinup_state
+import numpy as np
+import os
+
+
+def test_spinup_cache_key():
+    modelprms = {'kp': 1.5, 'tbias': -0.3, 'ddfsnow': 0.0041}
+    settings = {'option_refreezing': 'Woodward', 'constantarea_years': 5}
+    inputs = [np.arange(24.), np.ones(10)]
+    key = spinup_cache_key('RGI60-15.03733', modelprms, settings, inputs)
+    assert key.startswith('RGI60-15.03733_')
+    assert key == spinup_cache_key('RGI60-15.03733', dict(reversed(list(modelprms.items()))), settings, inputs)
+    assert key != spinup_cache_key('RGI60-15.03733', dict(modelprms, tbias=-0.2), settings, inputs)
+    assert key != spinup_cache_key('RGI60-15.03733', modelprms, dict(settings, constantarea_years=4), inputs)
+    assert key != spinup_cache_key('RGI60-15.03733', modelprms, settings, [np.arange(24.), np.ones(11)])
+
+
+def test_spinup_cache_eviction(tmp_path):
+    cache_fp = str(tmp_path)
+    state = {'thick': np.zeros(1000)}
+    save_spinup_state(cache_fp, 'a', state, 1e6)
+    save_spinup_state(cache_fp, 'b', state, 1e6)
+    os.utime(os.path.join(cache_fp, 'b.pkl'), (0, 0))
+    np.testing.assert_array_equal(load_spinup_state(cache_fp, 'a')['thick'], state['thick'])
+    assert load_spinup_state(cache_fp, 'c') is None
+    # least recently used state is removed once the cache is too large
+    size = os.path.getsize(os.path.join(cache_fp, 'a.pkl'))
+    save_spinup_state(cache_fp, 'c', state, 2.5 * size)
+    assert sorted(os.listdir(cache_fp)) == ['a.pkl', 'c.pkl']
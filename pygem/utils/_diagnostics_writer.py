@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming output of the yearly glacier diagnostics and geometry
+"""
+import netCDF4
+import numpy as np
+
+
+class NetCDFDiagnosticsWriter():
+    """Write the yearly diagnostics and the section and width of each flowline to a netCDF file as they are computed
+
+    The file has the same layout as the run_path of run_until_and_store: the diagnostics are variables of the root
+    group and the geometry of each flowline is in a group (fl_0, fl_1, ...), so it can be read with
+    xr.open_dataset(path) and xr.open_dataset(path, group='fl_0'). Years that are not written are NaN.
+    """
+    def __init__(self, path, store_geometry=True, complevel=5):
+        """
+        Parameters
+        ----------
+        path : str
+            filename of the netCDF file (overwritten)
+        store_geometry : bool
+            write the section and width of each flowline (otherwise only the diagnostics)
+        complevel : int
+            zlib compression level of the geometry
+        """
+        self.path = path
+        self.store_geometry = store_geometry
+        self.complevel = complevel
+        self.nc = None
+
+
+    def start(self, diag_ds, yearly_time, nx):
+        """
+        Create the file with the coordinates and attributes of the diagnostics
+
+        Parameters
+        ----------
+        diag_ds : xarray.Dataset
+            diagnostics of the run (coordinates, variables and attributes; the values are written later)
+        yearly_time : np.array
+            time of the geometry [yr]
+        nx : list
+            number of grid points of each flowline
+        """
+        self.nc = netCDF4.Dataset(self.path, 'w')
+        self.nc.setncatts({k: v for k, v in diag_ds.attrs.items() if v is not None})
+        self.nc.createDimension('time', diag_ds.sizes['time'])
+        for vn in diag_ds.coords:
+            var = self.nc.createVariable(vn, diag_ds[vn].dtype, ('time',))
+            var[:] = diag_ds[vn].values
+            var.setncatts(diag_ds[vn].attrs)
+        for vn in diag_ds.data_vars:
+            var = self.nc.createVariable(vn, 'f8', ('time',), fill_value=np.nan)
+            var.setncatts(diag_ds[vn].attrs)
+
+        if self.store_geometry:
+            for fl_id, fl_nx in enumerate(nx):
+                grp = self.nc.createGroup('fl_{}'.format(fl_id))
+                grp.createDimension('time', len(yearly_time))
+                grp.createDimension('x', fl_nx)
+                for vn in ['time', 'year']:
+                    var = grp.createVariable(vn, 'f8', ('time',))
+                    var[:] = yearly_time
+                grp['time'].description = 'Floating hydrological year'
+                for vn in ['ts_section', 'ts_width_m']:
+                    grp.createVariable(vn, 'f8', ('time', 'x'), fill_value=np.nan, zlib=True,
+                                       complevel=self.complevel, chunksizes=(1, fl_nx))
+
+
+    def write_diag(self, idx, values):
+        """
+        Write the diagnostics of one or several (same values) time steps
+
+        Parameters
+        ----------
+        idx : int or slice
+            time index
+        values : dict
+            value of each diagnostic variable {name: value}
+        """
+        for vn, value in values.items():
+            self.nc[vn][idx] = value
+
+
+    def write_geometry(self, idx, sections, widths):
+        """
+        Write the geometry of one or several (same geometry) years
+
+        Parameters
+        ----------
+        idx : int or slice
+            time index of the geometry
+        sections, widths : list of np.array
+            section [m2] and width [m] of each flowline
+        """
+        if not self.store_geometry:
+            return
+        for fl_id, (section, width) in enumerate(zip(sections, widths)):
+            grp = self.nc['fl_{}'.format(fl_id)]
+            nt = len(range(*idx.indices(len(grp.dimensions['time'])))) if isinstance(idx, slice) else None
+            if nt is not None:
+                section = np.broadcast_to(section, (nt, len(section)))
+                width = np.broadcast_to(width, (nt, len(width)))
+            grp['ts_section'][idx] = section
+            grp['ts_width_m'][idx] = width
+
+
+    def close(self):
+        """Close the file"""
+        if self.nc is not None:
+            self.nc.close()
+            self.nc = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Encoding (data type, packing, chunking and compression) of the output datasets written to netCDF
+"""
+import numpy as np
+
+
+# Encoding profiles of the time series variables (float variables with a time, year or year_plus1 dimension):
+#  'lossless' : float64, zlib with the shuffle filter (values are unchanged)
+#  'float32'  : float32, zlib with shuffle (relative precision of about 6e-8)
+#  'int16'    : variables with a range in pack_ranges are packed in int16 (absolute precision of half the
+#               scale_factor, see packing); the other variables are float32
+encoding_profiles = ['lossless', 'float32', 'int16']
+# Dimensions of the time series variables
+time_dims = ['time', 'year', 'year_plus1']
+
+
+def packing(vmin, vmax, dtype='int16'):
+    """
+    Scale factor and offset to pack values in a range as integers
+
+    The smallest integer is not used by the values, so it can be the fill value of missing values (NaN).
+
+    Parameters
+    ----------
+    vmin, vmax : float
+        range of the values
+    dtype : str
+        integer data type
+
+    Returns
+    -------
+    scale_factor, add_offset : float
+        values = packed values * scale_factor + add_offset
+    precision : float
+        maximum absolute error of the values in the range
+    """
+    info = np.iinfo(dtype)
+    scale_factor = (vmax - vmin) / (int(info.max) - int(info.min) - 1)
+    add_offset = vmin - (int(info.min) + 1) * scale_factor
+    return scale_factor, add_offset, scale_factor / 2
+
+
+def pack_range(scale_factor, add_offset, dtype='int16'):
+    """
+    Range of the values that can be packed with a scale factor and offset (inverse of packing)
+
+    Returns
+    -------
+    vmin, vmax : float
+        range of the values
+    """
+    info = np.iinfo(dtype)
+    return (int(info.min) + 1) * scale_factor + add_offset, int(info.max) * scale_factor + add_offset
+
+
+def check_pack_range(vn, values, vmin, vmax, tolerance=0):
+    """
+    Raise a ValueError if values of a packed variable are outside its range (NaN are the fill value)
+
+    Parameters
+    ----------
+    vn : str
+        variable name
+    values : np.ndarray
+        values of the variable
+    vmin, vmax : float
+        range of the values (see packing)
+    tolerance : float
+        values up to the tolerance outside the range are accepted
+    """
+    values = np.asarray(values, dtype=float)
+    if np.any((values < vmin - tolerance) | (values > vmax + tolerance)):
+        raise ValueError('Values of {} ({} to {}) are outside its pack range ({}, {})'.format(
+                vn, np.nanmin(values), np.nanmax(values), vmin, vmax))
+
+
+def output_encoding(ds, profile='lossless', complevel=4, chunks=None, pack_ranges=None, exclude=['RGIId']):
+    """
+    Encoding of the variables of a dataset for xarray.Dataset.to_netcdf
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        dataset to export
+    profile : str
+        encoding profile of the time series variables (see encoding_profiles)
+    complevel : int
+        zlib compression level
+    chunks : dict
+        chunk size of each dimension (e.g., {'glac': 50, 'time': 120}), limited to the size of the dimension; the
+        dimensions that are not listed are not split. None uses the default chunks of the netCDF library
+    pack_ranges : dict
+        range (min, max) of the values of the variables packed in int16 by the 'int16' profile; values of the dataset
+        outside the range raise a ValueError
+    exclude : list
+        variables without encoding (e.g., strings)
+
+    Returns
+    -------
+    encoding : dict
+        encoding of each variable
+    """
+    if profile not in encoding_profiles:
+        raise ValueError('Encoding profile {} not in {}'.format(profile, encoding_profiles))
+    if pack_ranges is None:
+        pack_ranges = {}
+    encoding = {}
+    for vn in ds.variables:
+        if vn in exclude:
+            continue
+        dims = ds[vn].dims
+        # no fill value (with _FillValue False, recent versions of xarray and netCDF4 write a fill value of 0)
+        encoding[vn] = {'_FillValue': None, 'zlib': True, 'complevel': complevel, 'shuffle': True}
+        if chunks is not None and len(dims) > 0:
+            encoding[vn]['chunksizes'] = tuple([min(chunks.get(x, ds.sizes[x]), ds.sizes[x]) for x in dims])
+        if (vn in ds.coords or ds[vn].dtype.kind != 'f' or not any([x in time_dims for x in dims]) or
+            profile == 'lossless'):
+            continue
+        if profile == 'int16' and vn in pack_ranges:
+            check_pack_range(vn, ds[vn].values, *pack_ranges[vn])
+            scale_factor, add_offset, precision = packing(*pack_ranges[vn])
+            encoding[vn].update({'dtype': 'int16', 'scale_factor': scale_factor, 'add_offset': add_offset,
+                                 '_FillValue': np.iinfo('int16').min})
+        else:
+            encoding[vn]['dtype'] = 'float32'
+    return encoding
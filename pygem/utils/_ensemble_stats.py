@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of the ensemble simulations (parameter sets) of a glacier
+"""
+import numpy as np
+
+
+# Statistics that can be computed, in the order of the output columns, and their percentile
+stats_percentiles = {'mean': None, 'std': None, '2.5%': 2.5, '25%': 25, 'median': 50, '75%': 75, '97.5%': 97.5}
+
+
+class EnsembleStats():
+    """Mean, standard deviation and percentiles of each time step over the simulations, updated one at a time"""
+    def __init__(self, nt, stats_cns=['mean', 'std'], sketch_size=64, seed=0, exact=False, nsims=None):
+        """
+        Parameters
+        ----------
+        nt : int
+            number of time steps
+        stats_cns : list
+            statistics to compute (see stats_percentiles)
+        sketch_size : int
+            number of values of each time step kept in a level of the quantile sketch (only used for percentiles)
+        seed : int
+            seed of the random choice of the values that are moved up a level (so the results are reproducible)
+        exact : bool
+            keep the values of all simulations and compute the percentiles exactly
+        nsims : int
+            number of simulations, to allocate the values at once if exact (otherwise they are appended)
+        """
+        self.nt = nt
+        self.stats_cns = [x for x in stats_percentiles if x in stats_cns]
+        self.sketch_size = sketch_size
+        self.count = 0
+        self.mean = np.zeros(nt)
+        self.m2 = np.zeros(nt)
+        self.has_nan = np.zeros(nt, dtype=bool)
+        # sketch levels (nt, number of values), the values of level i have a weight of 2**i
+        self.levels = []
+        self.rng = np.random.default_rng(seed)
+        self.use_sketch = any([stats_percentiles[x] is not None for x in self.stats_cns])
+        self.exact = exact
+        if exact:
+            self.data = np.zeros((nt, 0 if nsims is None else nsims))
+
+
+    def update(self, values):
+        """
+        Add the output of one or several simulations
+
+        Parameters
+        ----------
+        values : np.array
+            values of each time step (nt,) or (nt, number of simulations)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        n = values.shape[1]
+        if n == 0:
+            return
+        if self.exact:
+            if self.data.shape[1] < self.count + n:
+                self.data = np.concatenate((self.data, np.zeros((self.nt, self.count + n - self.data.shape[1]))),
+                                           axis=1)
+            self.data[:, self.count:self.count + n] = values
+            self.count += n
+            return
+        # Welford (Chan et al. for several simulations at once)
+        mean_b = values.mean(axis=1)
+        m2_b = ((values - mean_b[:, np.newaxis])**2).sum(axis=1)
+        self._merge_moments(n, mean_b, m2_b)
+        self.has_nan |= np.isnan(values).any(axis=1)
+        if self.use_sketch:
+            self._add_level(0, values)
+
+
+    def merge(self, other):
+        """
+        Add the statistics of other simulations (e.g., computed by another process)
+
+        Parameters
+        ----------
+        other : EnsembleStats
+            statistics of the same time steps and exact option
+        """
+        if other.count == 0:
+            return
+        if self.exact:
+            self.update(other.data[:, :other.count])
+            return
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.has_nan |= other.has_nan
+        if self.use_sketch:
+            for level, values in enumerate(other.levels):
+                self._add_level(level, values)
+
+
+    def _merge_moments(self, n_b, mean_b, m2_b):
+        """Combine the count, mean and sum of squared differences with those of other simulations"""
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / n
+        self.m2 = self.m2 + m2_b + delta**2 * n_a * n_b / n
+        self.count = n
+
+
+    def _add_level(self, level, values):
+        """Add values to a level of the sketch and compact the levels that are full"""
+        while len(self.levels) <= level:
+            self.levels.append(np.zeros((self.nt, 0)))
+        self.levels[level] = np.concatenate((self.levels[level], values), axis=1)
+        while self.levels[level].shape[1] >= 2 * self.sketch_size:
+            # the last value is kept if the number of values is odd, so every value moved up stands for two
+            nkeep = self.levels[level].shape[1] % 2
+            compact = np.sort(self.levels[level][:, :self.levels[level].shape[1] - nkeep], axis=1)
+            self.levels[level] = self.levels[level][:, self.levels[level].shape[1] - nkeep:]
+            # the smaller or the larger value of each pair is moved up at random so the sketch is not biased
+            idx = np.arange(0, compact.shape[1], 2)[np.newaxis, :] + self.rng.integers(2, size=(self.nt, 1))
+            promoted = np.take_along_axis(compact, idx, axis=1)
+            if len(self.levels) <= level + 1:
+                self.levels.append(np.zeros((self.nt, 0)))
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted), axis=1)
+            level += 1
+
+
+    def percentile(self, q):
+        """
+        Percentile of each time step (linear interpolation like np.percentile)
+
+        Parameters
+        ----------
+        q : float
+            percentile [%]
+
+        Returns
+        -------
+        values : np.array
+            percentile of each time step (nt,)
+        """
+        if len(self.levels) == 1:
+            values = np.percentile(self.levels[0], q, axis=1)
+        else:
+            values = np.concatenate(self.levels, axis=1)
+            weights = np.concatenate([np.zeros(x.shape[1]) + 2**i for i, x in enumerate(self.levels)])
+            order = np.argsort(values, axis=1)
+            values = np.take_along_axis(values, order, axis=1)
+            weights = weights[order]
+            # position of each value between 0 (minimum) and 1 (maximum), as for values of the same weight
+            position = (np.cumsum(weights, axis=1) - weights / 2 - 0.5) / max(self.count - 1, 1)
+            idx = np.clip((position <= q / 100).sum(axis=1) - 1, 0, values.shape[1] - 2)
+            rows = np.arange(self.nt)
+            p0, p1 = position[rows, idx], position[rows, idx + 1]
+            frac = np.clip((q / 100 - p0) / np.where(p1 > p0, p1 - p0, 1), 0, 1)
+            values = values[rows, idx] + frac * (values[rows, idx + 1] - values[rows, idx])
+        values[self.has_nan] = np.nan
+        return values
+
+
+    def stats(self):
+        """
+        Statistics of each time step in the order of stats_cns (same as calc_stats_array)
+
+        Returns
+        -------
+        stats : np.array
+            statistics of each time step (nt, number of statistics)
+        """
+        stats = np.zeros((self.nt, len(self.stats_cns)))
+        if self.exact:
+            data = self.data[:, :self.count]
+            for ncol, stat_cn in enumerate(self.stats_cns):
+                if stat_cn == 'mean':
+                    stats[:, ncol] = data.mean(axis=1)
+                elif stat_cn == 'std':
+                    stats[:, ncol] = data.std(axis=1)
+                else:
+                    stats[:, ncol] = np.percentile(data, stats_percentiles[stat_cn], axis=1)
+            return stats
+        for ncol, stat_cn in enumerate(self.stats_cns):
+            if stat_cn == 'mean':
+                stats[:, ncol] = self.mean
+            elif stat_cn == 'std':
+                stats[:, ncol] = np.sqrt(self.m2 / self.count)
+            else:
+                stats[:, ncol] = self.percentile(stats_percentiles[stat_cn])
+        return stats
@@ -46,3 +46,71 @@ def annualweightedmean_array(var, dates_table):
               'Exiting the model run.\n')
         exit()
     return var_annual
+
+
+def downscale_climate(gcm_temp, gcm_prec, gcm_elev, gcm_lrgcm, gcm_lrglac, elev_ref, heights, tbias, kp, precgrad):
+    """
+    Downscale the gcm temperature and precipitation to the elevation bins.
+    
+    The arrays broadcast against each other with the time steps on the last axis (e.g., heights[:,np.newaxis]).
+    
+    Parameters
+    ----------
+    gcm_temp, gcm_prec : np.ndarray
+        gcm temperature [degC] and precipitation [m]
+    gcm_elev : float or np.ndarray
+        gcm elevation [masl]
+    gcm_lrgcm, gcm_lrglac : np.ndarray
+        lapse rates from the gcm to the reference elevation and over the glacier [K m-1]
+    elev_ref : float or np.ndarray
+        reference elevation of the downscaling (option_elev_ref_downscale) [masl]
+    heights : np.ndarray
+        elevation of the bins [masl]
+    tbias, kp, precgrad : float or np.ndarray
+        temperature bias, precipitation factor and precipitation gradient
+    Returns
+    -------
+    bin_temp : np.ndarray
+        temperature of the bins [degC]
+    bin_precsnow : np.ndarray
+        total (liquid and solid) precipitation of the bins [m]
+    """
+    # T_bin = T_gcm + lr_gcm * (z_ref - z_gcm) + lr_glac * (z_bin - z_ref) + tempchange
+    bin_temp = gcm_temp + gcm_lrgcm * (elev_ref - gcm_elev) + gcm_lrglac * (heights - elev_ref) + tbias
+    # P_bin = P_gcm * prec_factor * (1 + prec_grad * (z_bin - z_ref))
+    bin_precsnow = gcm_prec * kp * (1 + precgrad * (heights - elev_ref))
+    return bin_temp, bin_precsnow
+
+
+def partition_precsnow(bin_temp, bin_precsnow, tsnow_threshold):
+    """
+    Separate the total precipitation into liquid and solid precipitation (option_accumulation).
+    
+    Parameters
+    ----------
+    bin_temp, bin_precsnow : np.ndarray
+        temperature [degC] and total precipitation [m] of the bins (see downscale_climate)
+    tsnow_threshold : float or np.ndarray
+        temperature threshold of snow [degC]
+    Returns
+    -------
+    bin_prec : np.ndarray
+        liquid precipitation [m]
+    bin_acc : np.ndarray
+        solid precipitation (accumulation) [m w.e.]
+    """
+    if pygem_prms.option_accumulation == 1:
+        # if temperature above threshold, then rain; otherwise snow
+        bin_prec = np.where(bin_temp > tsnow_threshold, bin_precsnow, 0)
+        bin_acc = np.where(bin_temp <= tsnow_threshold, bin_precsnow, 0)
+    elif pygem_prms.option_accumulation == 2:
+        # if temperature between min/max, then mix of snow/rain using linear relationship between min/max
+        bin_prec = (1/2 + (bin_temp - tsnow_threshold) / 2) * bin_precsnow
+        bin_acc = bin_precsnow - bin_prec
+        # if temperature above maximum threshold, then all rain
+        bin_prec = np.where(bin_temp > tsnow_threshold + 1, bin_precsnow, bin_prec)
+        bin_acc = np.where(bin_temp > tsnow_threshold + 1, 0, bin_acc)
+        # if temperature below minimum threshold, then all snow
+        bin_acc = np.where(bin_temp <= tsnow_threshold - 1, bin_precsnow, bin_acc)
+        bin_prec = np.where(bin_temp <= tsnow_threshold - 1, 0, bin_prec)
+    return bin_prec, bin_acc
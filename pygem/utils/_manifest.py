@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Manifest of the completed and failed glaciers of a run, so an interrupted run can be resumed
+"""
+import contextlib
+import hashlib
+import os
+import sqlite3
+import time
+import traceback
+
+from pygem.utils._output_container import container_row_checksum
+
+
+def file_checksum(fn, blocksize=2**20):
+    """
+    SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    fn : str
+        filename
+    blocksize : int
+        number of bytes read at once
+
+    Returns
+    -------
+    checksum : str
+        hexadecimal checksum
+    """
+    checksum = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def batch_name(batch_number=None, glac_number_fn=None):
+    """
+    Name of the batch of glaciers of a run, so the runs of several batches (e.g., one per node) use their own manifest
+
+    Parameters
+    ----------
+    batch_number : int
+        batch number of the run
+    glac_number_fn : str
+        filename of the list of glacier numbers of the batch
+
+    Returns
+    -------
+    batch : str
+        'batch<batch_number>', the name of glac_number_fn without its extension, or None if the run is not a batch
+    """
+    if batch_number is not None:
+        return 'batch' + str(batch_number)
+    if glac_number_fn is not None:
+        return os.path.splitext(os.path.basename(glac_number_fn))[0]
+    return None
+
+
+def outputs_unchanged(outputs, checksums):
+    """
+    Check that the output files of a glacier exist and have the recorded checksums
+
+    Parameters
+    ----------
+    outputs : list
+        output files of the glacier
+    checksums : list
+        checksum of each file, or 'row <row> <checksum>' if the output is a row of a container
+
+    Returns
+    -------
+    unchanged : bool
+        True if all outputs are unchanged
+    """
+    for output, checksum in zip(outputs, checksums):
+        if not os.path.exists(output):
+            return False
+        if checksum.startswith('row '):
+            _, row, checksum = checksum.split(' ')
+            if container_row_checksum(output, int(row)) != checksum:
+                return False
+        elif file_checksum(output) != checksum:
+            return False
+    return len(outputs) == len(checksums)
+
+
+class RunManifest():
+    """Completed and failed glaciers of a run configuration, recorded in a SQLite file"""
+    def __init__(self, path, timeout=60):
+        """
+        Parameters
+        ----------
+        path : str
+            filename of the manifest (created if it does not exist)
+        timeout : float
+            time to wait for other processes that write to the manifest [s]
+        """
+        self.path = path
+        self.timeout = timeout
+        if os.path.dirname(path) != '' and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS glaciers (glacier TEXT, task TEXT, status TEXT, '
+                        'attempts INTEGER DEFAULT 0, outputs TEXT, checksums TEXT, traceback TEXT, '
+                        'time_start REAL, time_end REAL, busy REAL DEFAULT 0, PRIMARY KEY (glacier, task))')
+            con.execute('CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, time_start REAL, time_end REAL, '
+                        'n_workers INTEGER)')
+
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Connection that commits (or rolls back) and closes at the end of the block"""
+        con = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+
+    def reset(self):
+        """Remove all records (start the configuration from scratch)"""
+        with self._connect() as con:
+            con.execute('DELETE FROM glaciers')
+            con.execute('DELETE FROM runs')
+
+
+    def forget(self, glac_no, task=''):
+        """Remove the records of glaciers (e.g., to run them again), keeping the other glaciers and the runs"""
+        with self._connect() as con:
+            con.executemany('DELETE FROM glaciers WHERE glacier = ? AND task = ?', [(x, task) for x in glac_no])
+
+
+    def start_run(self, n_workers=1):
+        """
+        Record the start of a run
+
+        Returns
+        -------
+        run : int
+            id of the run (see end_run)
+        """
+        with self._connect() as con:
+            return con.execute('INSERT INTO runs (time_start, n_workers) VALUES (?, ?)',
+                               (time.time(), n_workers)).lastrowid
+
+
+    def end_run(self, run):
+        """Record the end of a run"""
+        with self._connect() as con:
+            con.execute('UPDATE runs SET time_end = ? WHERE run = ?', (time.time(), run))
+
+
+    def record_start(self, glacier, task=''):
+        """Record that a glacier is running"""
+        with self._connect() as con:
+            con.execute('INSERT OR IGNORE INTO glaciers (glacier, task) VALUES (?, ?)', (glacier, task))
+            con.execute("UPDATE glaciers SET status = 'running', time_start = ?, time_end = NULL "
+                        "WHERE glacier = ? AND task = ?", (time.time(), glacier, task))
+
+
+    def record_success(self, glacier, task='', outputs=[]):
+        """
+        Record that a glacier is done
+
+        Parameters
+        ----------
+        glacier : str
+            glacier number
+        task : str
+            task of the glacier (e.g., gcm and rcp scenario)
+        outputs : list
+            output files of the glacier, whose checksums are recorded
+        """
+        outputs = [x for x in outputs if x is not None]
+        self._record_done(glacier, task, outputs, [file_checksum(x) for x in outputs])
+
+
+    def record_success_row(self, glacier, task, path, row, checksum):
+        """
+        Record that a glacier is done, whose output is a row of a container (see GlacierContainer)
+
+        Parameters
+        ----------
+        glacier : str
+            glacier number
+        task : str
+            task of the glacier (e.g., gcm and rcp scenario)
+        path : str
+            filename of the container
+        row : int
+            row of the glacier in the container
+        checksum : str
+            checksum of the row (see row_checksum)
+        """
+        self._record_done(glacier, task, [path], ['row {} {}'.format(row, checksum)])
+
+
+    def _record_done(self, glacier, task, outputs, checksums):
+        """Record that a glacier is done with its output files and their checksums"""
+        time_end = time.time()
+        with self._connect() as con:
+            con.execute('INSERT OR IGNORE INTO glaciers (glacier, task, time_start) VALUES (?, ?, ?)',
+                        (glacier, task, time_end))
+            con.execute("UPDATE glaciers SET status = 'done', attempts = attempts + 1, outputs = ?, checksums = ?, "
+                        "traceback = NULL, time_end = ?, busy = busy + ? - time_start WHERE glacier = ? AND task = ?",
+                        ('\n'.join(outputs), '\n'.join(checksums), time_end, time_end, glacier, task))
+
+
+    def record_failure(self, glacier, task='', tb=None):
+        """
+        Record that a glacier failed
+
+        Parameters
+        ----------
+        glacier : str
+            glacier number
+        task : str
+            task of the glacier (e.g., gcm and rcp scenario)
+        tb : str
+            traceback of the error (default: the exception being handled)
+        """
+        if tb is None:
+            tb = traceback.format_exc()
+        time_end = time.time()
+        with self._connect() as con:
+            con.execute('INSERT OR IGNORE INTO glaciers (glacier, task, time_start) VALUES (?, ?, ?)',
+                        (glacier, task, time_end))
+            con.execute("UPDATE glaciers SET status = 'failed', attempts = attempts + 1, traceback = ?, time_end = ?, "
+                        "busy = busy + ? - COALESCE(time_start, ?) WHERE glacier = ? AND task = ?",
+                        (tb, time_end, time_end, time_end, glacier, task))
+
+
+    def status(self, glac_no, task=''):
+        """
+        Records of the glaciers
+
+        Returns
+        -------
+        records : dict
+            {glacier: (status, attempts, outputs, checksums, traceback, time_start)} of the glaciers that have a record
+        """
+        with self._connect() as con:
+            rows = con.execute('SELECT glacier, status, attempts, outputs, checksums, traceback, time_start '
+                               'FROM glaciers WHERE task = ?', (task,)).fetchall()
+        glac_no = set(glac_no)
+        return {x[0]: x[1:] for x in rows if x[0] in glac_no}
+
+
+    def failed(self, glac_no, task=''):
+        """
+        Glaciers that failed (and were not done since)
+
+        Returns
+        -------
+        glac_no_failed : list
+            glacier numbers, in the order of glac_no
+        """
+        records = self.status(glac_no, task)
+        return [x for x in glac_no if x in records and records[x][0] == 'failed']
+
+
+    def pending(self, glac_no, task='', max_attempts=2, verify=True):
+        """
+        Glaciers that still need to run
+
+        A glacier is pending if it is not done (or its output files changed since) and it did not fail max_attempts
+        times.
+
+        Parameters
+        ----------
+        glac_no : list
+            glacier numbers
+        task : str
+            task of the glaciers (e.g., gcm and rcp scenario)
+        max_attempts : int
+            number of times a glacier is run before it is given up
+        verify : bool
+            compare the checksums of the output files of the glaciers that are done
+
+        Returns
+        -------
+        glac_no_pending : list
+            glacier numbers, in the order of glac_no
+        """
+        records = self.status(glac_no, task)
+        glac_no_pending = []
+        for glacier in glac_no:
+            if glacier not in records:
+                glac_no_pending.append(glacier)
+                continue
+            status, attempts, outputs, checksums = records[glacier][:4]
+            if status == 'done':
+                if verify and outputs and not outputs_unchanged(outputs.split('\n'), checksums.split('\n')):
+                    glac_no_pending.append(glacier)
+            elif status != 'failed' or attempts < max_attempts:
+                glac_no_pending.append(glacier)
+        return glac_no_pending
+
+
+    def report(self):
+        """
+        Text summary of the glaciers and the throughput of all runs of the configuration
+
+        Returns
+        -------
+        report : str
+            number of glaciers done and failed, run time and glaciers per hour
+        """
+        with self._connect() as con:
+            counts = dict(con.execute('SELECT status, COUNT(*) FROM glaciers GROUP BY status').fetchall())
+            busy = con.execute('SELECT SUM(busy) FROM glaciers').fetchone()[0] or 0
+            runs = con.execute('SELECT time_start, time_end FROM runs').fetchall()
+            failures = con.execute("SELECT glacier, task, attempts FROM glaciers WHERE status = 'failed'").fetchall()
+        wall_time = sum([x[1] - x[0] for x in runs if x[1] is not None])
+        lines = ['Manifest {}: {} runs, {} glaciers done, {} failed, {} not finished'.format(
+                self.path, len(runs), counts.get('done', 0), counts.get('failed', 0), counts.get('running', 0))]
+        lines.append('  wall time {:.1f} s, busy time {:.1f} s, {:.1f} glaciers per hour'.format(
+                wall_time, busy, counts.get('done', 0) / max(wall_time, 1e-9) * 3600))
+        for glacier, task, attempts in failures:
+            lines.append('  failed: {} {} ({} attempts)'.format(glacier, task, attempts))
+        return '\n'.join(lines)
+
+
+def run_pending(run, glac_no, manifest, task='', max_attempts=2, verify=True, raise_errors=False, resume=True):
+    """
+    Run the glaciers that are pending in the manifest, recording the glacier that fails and continuing with the others
+
+    run records each glacier with record_start and record_success. If it raises an error, the glaciers it started and
+    left running are recorded as failed (all pending glaciers if none started, e.g., if the climate data could not be
+    loaded) and run is called again with the glaciers that are still pending.
+
+    Parameters
+    ----------
+    run : function
+        function that runs a list of glacier numbers
+    glac_no : list
+        glacier numbers
+    manifest : RunManifest
+        manifest of the run configuration
+    task : str
+        task of the glaciers (e.g., gcm and rcp scenario)
+    max_attempts : int
+        number of times a glacier is run before it is given up
+    verify : bool
+        compare the checksums of the output files of the glaciers that are done
+    raise_errors : bool
+        record the failure and raise the error instead of continuing (e.g., for debugging)
+    resume : bool
+        skip the glaciers that are done in the manifest; otherwise the records of the glaciers are removed and all
+        glaciers are run (the records of other glaciers are kept)
+
+    Returns
+    -------
+    glac_no_failed : list
+        glacier numbers that failed in this call
+    """
+    glac_no_failed = []
+    if not resume:
+        manifest.forget(glac_no, task)
+    glac_no_pending = manifest.pending(glac_no, task, max_attempts=max_attempts, verify=verify)
+    while len(glac_no_pending) > 0:
+        time_run = time.time()
+        try:
+            run(glac_no_pending)
+            break
+        except Exception:
+            tb = traceback.format_exc()
+            records = manifest.status(glac_no_pending, task)
+            glac_no_running = [x for x in glac_no_pending if x in records and records[x][0] == 'running' and
+                               records[x][5] is not None and records[x][5] >= time_run]
+            if len(glac_no_running) == 0:
+                glac_no_running = glac_no_pending
+            for glacier in glac_no_running:
+                manifest.record_failure(glacier, task, tb)
+            glac_no_failed.extend(glac_no_running)
+            if raise_errors:
+                raise
+        glac_no_pending = manifest.pending(glac_no, task, max_attempts=max_attempts, verify=False)
+    return glac_no_failed
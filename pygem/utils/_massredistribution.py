@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mass redistribution curves of Huss and Hock (2015)
+"""
+import numpy as np
+
+# factors [gamma, a, b, c] of the normalized ice thickness change curve for small, medium and large glaciers
+_huss_curve_factors = np.array([[2, -0.30, 0.60, 0.09],
+                                [4, -0.05, 0.19, 0.01],
+                                [6, -0.02, 0.12, 0]])
+
+def huss_thickness_change_norm(elevrange_norm, glacier_area_total):
+    """
+    Normalized ice thickness change of the Huss and Hock (2015) curves.
+
+    Parameters
+    ----------
+    elevrange_norm : np.ndarray
+        normalized elevation range (max elevation - bin elevation) / (max elevation - min elevation) [-]
+    glacier_area_total : float or np.ndarray
+        glacier area used to select the parameters of the curve, broadcast against elevrange_norm
+
+    Returns
+    -------
+    icethicknesschange_norm : np.ndarray
+        normalized ice thickness change limited to 0 - 1 [-]
+    """
+    # Select the factors for the normalized ice thickness change curve based on glacier area
+    size_class = (np.asarray(glacier_area_total) > 5).astype(int) + (np.asarray(glacier_area_total) > 20)
+    factors = _huss_curve_factors[size_class]
+    gamma, a, b, c = factors[...,0], factors[...,1], factors[...,2], factors[...,3]
+    icethicknesschange_norm = (elevrange_norm + a)**gamma + b*(elevrange_norm + a) + c
+    return np.minimum(np.maximum(icethicknesschange_norm, 0), 1)
+
+
+def huss_volumechange_curve(glacier_area, heights, glacier_volumechange):
+    """
+    Volume change of each elevation bin distributed over the glacier with the Huss and Hock (2015) curve.
+
+    The ice available in each bin is not considered, i.e., bins may lose more ice than they have (retreat). Several
+    glaciers (e.g., ensemble members) can be given as rows of 2D arrays.
+
+    Parameters
+    ----------
+    glacier_area : np.ndarray
+        glacier area [m2] of each elevation bin (zero where there is no glacier), (nbins) or (nglaciers, nbins)
+    heights : np.ndarray
+        surface elevation [m] of each elevation bin, same shape as glacier_area
+    glacier_volumechange : float or np.ndarray
+        glacier-wide volume change [m3 ice], scalar or (nglaciers)
+
+    Returns
+    -------
+    bin_volumechange : np.ndarray
+        volume change [m3 ice] of each elevation bin
+    """
+    glac_mask = glacier_area > 0
+    icethicknesschange_norm = np.zeros(glacier_area.shape)
+    if glacier_area.ndim == 1:
+        # Normalized elevation range [-]
+        heights_glac = heights[glac_mask]
+        elevrange_norm = (heights_glac.max() - heights_glac) / (heights_glac.max() - heights_glac.min())
+        icethicknesschange_norm[glac_mask] = huss_thickness_change_norm(elevrange_norm, glacier_area.sum())
+    else:
+        heights_max = np.where(glac_mask, heights, -np.inf).max(axis=1, keepdims=True)
+        heights_min = np.where(glac_mask, heights, np.inf).min(axis=1, keepdims=True)
+        elevrange_norm = ((heights_max - heights) / (heights_max - heights_min))[glac_mask]
+        glacier_area_total = np.broadcast_to(glacier_area.sum(axis=1, keepdims=True), glacier_area.shape)[glac_mask]
+        icethicknesschange_norm[glac_mask] = huss_thickness_change_norm(elevrange_norm, glacier_area_total)
+    # Huss' ice thickness scaling factor [m ice]
+    fs_huss = glacier_volumechange / (glacier_area * icethicknesschange_norm).sum(axis=-1)
+    return icethicknesschange_norm * np.expand_dims(fs_huss, -1) * glacier_area
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Energy available for melt with daily temperature variability (option_ablation 2)
+"""
+import numpy as np
+from scipy.special import ndtr
+
+
+def tempstd_noise_table(nmonths, seed=0):
+    """
+    Draw the standard normal daily temperature anomalies for every month once.
+
+    Parameters
+    ----------
+    nmonths : int
+        number of months of the model run
+    seed : int
+        seed of the random number generator, so every model with the same seed uses the same daily temperatures
+
+    Returns
+    -------
+    noise : np.ndarray
+        standard normal anomalies (nmonths, 31), of which the first daysinmonth are used each month
+    """
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((nmonths, 31))
+
+
+def melt_energy_daily(bin_temp, tempstd, daysinmonth, noise):
+    """
+    Energy available for melt [degC day] from the monthly temperature superimposed with daily temperatures.
+
+    Parameters
+    ----------
+    bin_temp : np.ndarray
+        monthly air temperature of each elevation bin [degC] (..., nbins)
+    tempstd : float
+        standard deviation of the daily temperature for the month [degC]
+    daysinmonth : int
+        number of days in the month
+    noise : np.ndarray
+        standard normal daily anomalies for the month (at least daysinmonth values)
+
+    Returns
+    -------
+    melt_energy_available : np.ndarray
+        sum of positive daily temperatures of each elevation bin [degC day]
+    """
+    bin_temp_daily = bin_temp[...,np.newaxis] + tempstd * noise[:daysinmonth]
+    bin_temp_daily[bin_temp_daily < 0] = 0
+    return bin_temp_daily.sum(axis=-1)
+
+
+def melt_energy_expected(bin_temp, tempstd, daysinmonth):
+    """
+    Expected energy available for melt [degC day] assuming normally distributed daily temperatures.
+
+    Uses the partial expectation of the normal distribution, i.e. the expected positive degree days
+        E[max(T,0)] = tempstd * pdf(T / tempstd) + T * cdf(T / tempstd)
+    for each day of the month. If there is no daily variability, this is the monthly temperature above zero.
+
+    Parameters
+    ----------
+    bin_temp : np.ndarray
+        monthly air temperature of each elevation bin [degC]
+    tempstd : float or np.ndarray
+        standard deviation of the daily temperature [degC], broadcast against bin_temp
+    daysinmonth : int or np.ndarray
+        number of days in the month, broadcast against bin_temp
+
+    Returns
+    -------
+    melt_energy_available : np.ndarray
+        expected sum of positive daily temperatures of each elevation bin [degC day]
+    """
+    tempstd = np.broadcast_to(tempstd, np.shape(bin_temp))
+    melt_energy_available = np.maximum(bin_temp, 0)
+    var_idx = tempstd > 0
+    z = bin_temp[var_idx] / tempstd[var_idx]
+    melt_energy_available[var_idx] = (tempstd[var_idx] * np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi) +
+                                      bin_temp[var_idx] * ndtr(z))
+    return melt_energy_available * daysinmonth
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Merge of the output files of glaciers (or batches of glaciers) along the glac dimension
+"""
+import multiprocessing
+
+import netCDF4
+import numpy as np
+
+
+def file_dims(fns, dim='glac'):
+    """
+    Size of a dimension in each file, checking that the other dimensions are the same in all files.
+
+    Parameters
+    ----------
+    fns : list
+        filenames
+    dim : str
+        dimension along which the files are merged
+
+    Returns
+    -------
+    sizes : list
+        size of the dimension in each file
+    """
+    sizes = []
+    other_dims = None
+    for fn in fns:
+        with netCDF4.Dataset(fn) as nc:
+            sizes.append(len(nc.dimensions[dim]))
+            fn_dims = {k: len(v) for k, v in nc.dimensions.items() if k != dim}
+        if other_dims is None:
+            other_dims = fn_dims
+        elif fn_dims != other_dims:
+            raise ValueError('Dimensions of {} differ from the first file: {} != {}'.format(fn, fn_dims, other_dims))
+    return sizes
+
+
+def merge_files(fns, merged_fn, dim='glac', renumber=True, complevel=4, chunks=None, rows=None):
+    """
+    Merge files along a dimension into a new compressed netCDF4 file.
+
+    Variables without the dimension (e.g., time) are copied from the first file. Values are copied as they are stored
+    (same dtype, fill value, scale factor and attributes), so packed variables must have the same scale factor and
+    offset in all files.
+
+    Parameters
+    ----------
+    fns : list
+        filenames, in the order of the merged file
+    merged_fn : str
+        filename of the merged file (overwritten)
+    dim : str
+        dimension along which the files are merged
+    renumber : bool
+        set the coordinate of the dimension to 0, 1, 2, ... (otherwise the values of the files)
+    complevel : int
+        zlib compression level of the numeric variables
+    chunks : dict
+        chunk size of each dimension (see output_encoding), None for the default chunks of the netCDF library
+    rows : list
+        increasing indices of the dimension copied from each file (None for all of them), e.g., to leave out rows
+        of output containers (see consolidate_containers)
+
+    Returns
+    -------
+    sizes : list
+        size of the dimension copied from each file
+    """
+    sizes = file_dims(fns, dim=dim)
+    if rows is None:
+        rows = [None] * len(fns)
+    sizes = [size if file_rows is None else len(file_rows) for size, file_rows in zip(sizes, rows)]
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    with netCDF4.Dataset(fns[0]) as src, netCDF4.Dataset(merged_fn, 'w') as nc:
+        src.set_auto_maskandscale(False)
+        nc.set_auto_maskandscale(False)
+        nc.setncatts(src.__dict__)
+        for dim_name, dimension in src.dimensions.items():
+            nc.createDimension(dim_name, int(starts[-1]) if dim_name == dim else len(dimension))
+        for vn, var in src.variables.items():
+            attrs = {k: v for k, v in var.__dict__.items() if k != '_FillValue'}
+            fill_value = var.__dict__.get('_FillValue', None)
+            chunksizes = None
+            if chunks is not None and len(var.dimensions) > 0:
+                chunksizes = [min(chunks.get(x, len(nc.dimensions[x])), len(nc.dimensions[x]))
+                              for x in var.dimensions]
+            if var.dtype == str:
+                nc_var = nc.createVariable(vn, str, var.dimensions)
+            else:
+                nc_var = nc.createVariable(vn, var.dtype, var.dimensions, zlib=True, complevel=complevel,
+                                           shuffle=True, fill_value=fill_value, chunksizes=chunksizes)
+            nc_var.setncatts(attrs)
+            if dim not in var.dimensions:
+                nc_var[:] = var[:]
+
+    with netCDF4.Dataset(merged_fn, 'a') as nc:
+        nc.set_auto_maskandscale(False)
+        for nfile, fn in enumerate(fns):
+            if sizes[nfile] == 0:
+                continue
+            file_rows = slice(None) if rows[nfile] is None else np.asarray(rows[nfile])
+            with netCDF4.Dataset(fn) as src:
+                src.set_auto_maskandscale(False)
+                for vn, var in src.variables.items():
+                    if dim not in var.dimensions:
+                        continue
+                    for attr in ['scale_factor', 'add_offset']:
+                        if var.__dict__.get(attr, None) != nc[vn].__dict__.get(attr, None):
+                            raise ValueError('{} of {} in {} differs from the first file'.format(attr, vn, fn))
+                    idx = tuple([slice(starts[nfile], starts[nfile + 1]) if x == dim else slice(None)
+                                 for x in var.dimensions])
+                    nc[vn][idx] = var[tuple([file_rows if x == dim else slice(None) for x in var.dimensions])]
+        if renumber and dim in nc.variables:
+            nc[dim][:] = np.arange(starts[-1]).astype(nc[dim].dtype)
+    return sizes
+
+
+def merge_files_parallel(tasks, n_workers=1, **kwargs):
+    """
+    Merge several sets of files (e.g., regions and rcp scenarios) at the same time.
+
+    Parameters
+    ----------
+    tasks : list
+        (filenames, merged filename) of each merge
+    n_workers : int
+        number of worker processes (the merges run one after the other if 1)
+    kwargs : dict
+        arguments of merge_files
+
+    Returns
+    -------
+    sizes : list
+        sizes returned by merge_files for each task
+    """
+    args = [(fns, merged_fn, kwargs.get('dim', 'glac'), kwargs.get('renumber', True), kwargs.get('complevel', 4),
+             kwargs.get('chunks', None)) for fns, merged_fn in tasks]
+    if n_workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(n_workers, len(tasks))) as p:
+            return p.starmap(merge_files, args)
+    return [merge_files(*x) for x in args]
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Output of many glaciers in one netCDF file
+"""
+import hashlib
+import os
+
+import netCDF4
+import numpy as np
+
+from pygem.utils._encoding import check_pack_range, pack_range
+from pygem.utils._merge import merge_files
+
+
+# Reference of the time coordinates written to the file (decoded by xarray)
+time_units = 'days since 1900-01-01 00:00:00'
+
+
+class GlacierContainer():
+    """Append the output datasets of single glaciers (as from create_xrdataset) to a netCDF file"""
+    def __init__(self, path, flush_every=50, complevel=4, chunk_glac=8):
+        """
+        Parameters
+        ----------
+        path : str
+            filename of the netCDF file (glaciers are appended if it exists)
+        flush_every : int
+            number of glaciers after which the file is synced to disk
+        complevel : int
+            zlib compression level of the variables
+        chunk_glac : int
+            number of glaciers in a chunk of the variables
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.complevel = complevel
+        self.chunk_glac = chunk_glac
+        if os.path.exists(path):
+            self.nc = netCDF4.Dataset(path, 'a')
+        else:
+            self.nc = None
+        self.nunsynced = 0
+        self.callbacks = []
+
+
+    def _create(self, ds, encoding=None):
+        """
+        Create the file with the dimensions, coordinates, variables and attributes of a glacier dataset
+
+        The data type, packing, fill value, compression and time chunks of the variables are those of the encoding
+        (see output_encoding) if given; the glac chunk size is always chunk_glac.
+        """
+        if encoding is None:
+            encoding = {}
+        self.nc = netCDF4.Dataset(self.path, 'w')
+        self.nc.setncatts({k: v for k, v in ds.attrs.items() if v is not None})
+        self.nc.createDimension('glac', None)
+        for dim in ds.dims:
+            if dim == 'glac':
+                continue
+            self.nc.createDimension(dim, ds.sizes[dim])
+            values = ds[dim].values
+            attrs = dict(ds[dim].attrs)
+            if values.dtype.kind == 'M':
+                values = (values - np.datetime64('1900-01-01')) / np.timedelta64(1, 'D')
+                attrs.update({'units': time_units, 'calendar': 'proleptic_gregorian'})
+            var = self.nc.createVariable(dim, values.dtype, (dim,))
+            var[:] = values
+            var.setncatts(attrs)
+        var = self.nc.createVariable('glac', 'i8', ('glac',))
+        var.setncatts(ds['glac'].attrs)
+        for vn in ds.data_vars:
+            dims = ds[vn].dims
+            if ds[vn].dtype.kind in ['U', 'S', 'O']:
+                var = self.nc.createVariable(vn, str, dims)
+            else:
+                vn_encoding = encoding.get(vn, {})
+                chunksizes = vn_encoding.get('chunksizes', [ds.sizes[x] for x in dims])
+                chunksizes = [self.chunk_glac if x == 'glac' else chunksizes[n] for n, x in enumerate(dims)]
+                var = self.nc.createVariable(vn, vn_encoding.get('dtype', ds[vn].dtype), dims, zlib=True,
+                                             complevel=vn_encoding.get('complevel', self.complevel),
+                                             shuffle=vn_encoding.get('shuffle', True), chunksizes=chunksizes,
+                                             fill_value=vn_encoding.get('_FillValue', False))
+                # packing attributes are set before any value is written, so the values are packed
+                var.setncatts({k: vn_encoding[k] for k in ['scale_factor', 'add_offset'] if k in vn_encoding})
+            var.setncatts({k: v for k, v in ds[vn].attrs.items() if k != '_FillValue'})
+
+
+    def append(self, ds, callback=None, encoding=None):
+        """
+        Append the output of a glacier
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            output of one glacier (glac dimension of size 1)
+        callback : function
+            function called with the row of the glacier and its checksum (see row_checksum) once the glacier is
+            written to disk (e.g., to record it as done)
+        encoding : dict
+            encoding of the variables (as for to_netcdf), used when the file is created
+
+        Returns
+        -------
+        row : int
+            row of the glacier in the file
+        """
+        if self.nc is None:
+            self._create(ds, encoding)
+        # values of packed variables must be in their range, checked before the row is written
+        for vn in ds.data_vars:
+            if 'scale_factor' in self.nc[vn].ncattrs():
+                scale_factor, add_offset = self.nc[vn].scale_factor, self.nc[vn].add_offset
+                check_pack_range(vn, ds[vn].values, *pack_range(scale_factor, add_offset, self.nc[vn].dtype),
+                                 tolerance=scale_factor / 4)
+        row = len(self.nc.dimensions['glac'])
+        for vn in ds.data_vars:
+            values = ds[vn].values
+            if values.dtype.kind in ['U', 'S', 'O']:
+                self.nc[vn][row] = str(values[0])
+            elif '_FillValue' in self.nc[vn].ncattrs():
+                # missing values of packed variables are written as the fill value
+                missing = np.isnan(values[0])
+                self.nc[vn][row] = np.ma.array(np.where(missing, 0, values[0]), mask=missing)
+            else:
+                self.nc[vn][row] = values[0]
+        # the glac coordinate is written last, so the glacier is only counted once all its variables are written
+        self.nc['glac'][row] = ds['glac'].values[0]
+        self.nunsynced += 1
+        if callback is not None:
+            self.callbacks.append((callback, row))
+        if self.nunsynced >= self.flush_every:
+            self.sync()
+        return row
+
+
+    def sync(self):
+        """Write the glaciers that were appended to disk and call their callbacks"""
+        if self.nc is not None:
+            self.nc.sync()
+        self.nunsynced = 0
+        callbacks, self.callbacks = self.callbacks, []
+        for callback, row in callbacks:
+            callback(row, row_checksum(self.nc, row))
+
+
+    def close(self):
+        """Sync and close the file"""
+        if self.nc is not None:
+            self.sync()
+            self.nc.close()
+            self.nc = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def row_checksum(nc, row):
+    """
+    SHA-256 checksum of the values of a glacier in a container
+
+    Parameters
+    ----------
+    nc : netCDF4.Dataset
+        open container
+    row : int
+        row of the glacier
+
+    Returns
+    -------
+    checksum : str
+        hexadecimal checksum of the values (and missing values) of all variables with the glac dimension
+    """
+    checksum = hashlib.sha256()
+    for vn in sorted(nc.variables):
+        if 'glac' not in nc[vn].dimensions:
+            continue
+        values = nc[vn][row]
+        checksum.update(vn.encode())
+        if isinstance(values, str):
+            checksum.update(values.encode())
+        else:
+            checksum.update(np.ma.filled(values, 0).tobytes())
+            checksum.update(np.ma.getmaskarray(values).tobytes())
+    return checksum.hexdigest()
+
+
+def container_row_checksum(path, row):
+    """
+    Checksum of a glacier in a container file (see row_checksum)
+
+    Returns
+    -------
+    checksum : str
+        hexadecimal checksum, None if the file does not have the row
+    """
+    with netCDF4.Dataset(path) as nc:
+        if row >= len(nc.dimensions['glac']):
+            return None
+        return row_checksum(nc, row)
+
+
+def container_index(path, vn='RGIId'):
+    """
+    Row of each glacier in a container file
+
+    Parameters
+    ----------
+    path : str
+        filename of the container
+    vn : str
+        variable that identifies the glaciers
+
+    Returns
+    -------
+    index : dict
+        {glacier: row}; if a glacier was appended more than once (e.g., a run that was resumed), its last row
+    """
+    with netCDF4.Dataset(path) as nc:
+        # rows of glaciers that were not completely written (e.g., the run was killed) have no glac value
+        rows = np.where(~np.ma.getmaskarray(nc['glac'][:]))[0]
+        values = nc[vn][:]
+    return {str(values[row]): int(row) for row in rows}
+
+
+def container_rows(fns, vn='RGIId', select=None):
+    """
+    Rows of the last complete copy of each glacier in containers
+
+    Parameters
+    ----------
+    fns : list
+        filenames of the containers, from the oldest to the newest (a glacier in several containers is taken from the
+        last one)
+    vn : str
+        variable that identifies the glaciers
+    select : function
+        function of the glacier (value of vn) that is True for the glaciers that are kept, None to keep all glaciers
+
+    Returns
+    -------
+    rows : list
+        increasing rows of the glaciers kept in each container
+    """
+    glacier_rows = {}
+    for nfile, fn in enumerate(fns):
+        for glacier, row in container_index(fn, vn=vn).items():
+            if select is None or select(glacier):
+                glacier_rows[glacier] = (nfile, row)
+    rows = [[] for fn in fns]
+    for nfile, row in glacier_rows.values():
+        rows[nfile].append(row)
+    return [np.array(sorted(x), dtype=int) for x in rows]
+
+
+def consolidate_containers(fns, merged_fn, vn='RGIId', select=None, **kwargs):
+    """
+    Merge containers into one file with only the last complete row of each glacier
+
+    Parameters
+    ----------
+    fns : list
+        filenames of the containers, from the oldest to the newest (see container_rows)
+    merged_fn : str
+        filename of the merged file (overwritten)
+    vn : str
+        variable that identifies the glaciers
+    select : function
+        function of the glacier (value of vn) that is True for the glaciers that are kept, None to keep all glaciers
+    kwargs : dict
+        arguments of merge_files (e.g., complevel and chunks)
+
+    Returns
+    -------
+    rows : list
+        rows of the glaciers merged from each container
+    """
+    rows = container_rows(fns, vn=vn, select=select)
+    merge_files(fns, merged_fn, rows=rows, **kwargs)
+    return rows
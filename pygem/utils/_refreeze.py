@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Refreezing functions operating on all elevation bins at once
+"""
+import numpy as np
+
+
+def refreeze_hh2015(te_rf, tl_rf, rf_cold, glac_mask, bin_temp, bin_melt, bin_meltlimit, bin_prec, bin_snowpack,
+                    surfacetype, rf_dt, rf_layers_dens, rf_layers_ch, rf_layers_k, rf_dz, rf_dsc, rf_meltcrit, pp,
+                    Lh_rf, density_water):
+    """
+    Heat conduction and cold reservoir refreezing (Huss and Hock, 2015) for every glacier bin of one time step.
+
+    Batched equivalent of looping through each elevation bin: bins without melt build up the cold reservoir by heat
+    conduction through the layers, while bins with melt tap into the cold reservoir. The sequential layer update of the
+    per-bin loop is kept, so results are identical bin for bin. The layer temperatures and cold reservoir are updated
+    in place.
+
+    Parameters
+    ----------
+    te_rf : np.ndarray
+        layer temperature of each elevation bin for present time step (rf_layers, ...)
+    tl_rf : np.ndarray
+        layer temperature of each elevation bin for previous time step (rf_layers, ...)
+    rf_cold : np.ndarray
+        cold reservoir or "potential" refreeze of each elevation bin [m w.e.]
+    glac_mask : np.ndarray
+        boolean array, True where there is glacier
+    bin_temp : np.ndarray
+        air temperature of each elevation bin [degC]
+    bin_melt : np.ndarray
+        total melt of each elevation bin [m w.e.]
+    bin_meltlimit : np.ndarray
+        melt available for refreezing of each elevation bin (snow melt or total melt) [m w.e.]
+    bin_prec : np.ndarray
+        liquid precipitation of each elevation bin [m w.e.]
+    bin_snowpack : np.ndarray
+        snowpack of each elevation bin [m w.e.]
+    surfacetype : np.ndarray
+        surface type of each elevation bin [0=off-glacier, 1=ice, 2=snow, 3=firn, 4=debris]
+    rf_dt : float
+        refreeze time step [s]
+    rf_layers_dens, rf_layers_ch, rf_layers_k : np.ndarray
+        density [kg m-3], volumetric heat capacity [J m-3 K-1] and thermal conductivity [W m-1 K-1] of each layer
+    rf_dz : float
+        layer thickness [m]
+    rf_dsc : int
+        number of time steps for numerical stability
+    rf_meltcrit : float
+        critical amount of melt [m w.e.] for initializing refreezing module
+    pp : float
+        additional refreeze water to account for water refreezing at bare-ice surface
+    Lh_rf : float
+        latent heat of fusion [J kg-1]
+    density_water : float
+        density of water [kg m-3]
+
+    Returns
+    -------
+    refr : np.ndarray
+        refreeze of each elevation bin [m w.e.]
+    """
+    rf_layers = te_rf.shape[0]
+    refr = np.zeros(bin_temp.shape)
+
+    # COMPUTE HEAT CONDUCTION - BUILD COLD RESERVOIR
+    # If no melt, then build up cold reservoir (compute heat conduction)
+    mask_hc = glac_mask & (bin_melt < rf_meltcrit)
+    if mask_hc.any():
+        te = te_rf[:,mask_hc]
+        tl = tl_rf[:,mask_hc]
+        temp = bin_temp[mask_hc]
+        # Loop through multiple iterations to converge on a solution
+        for h in np.arange(0, rf_dsc):
+            # Compute heat conduction in layers (loop through rows)
+            #  go from 1 to rf_layers-1 to avoid indexing errors with "j-1" and "j+1"
+            for j in np.arange(1, rf_layers-1):
+                # Assume temperature of first layer equals air temperature
+                tl[0] = temp
+                # Temperature for each layer
+                te[j] = (tl[j] + rf_dt * rf_layers_k[j] / rf_layers_ch[j] / rf_dz**2 * 0.5 *
+                         ((tl[j-1] - tl[j]) - (tl[j] - tl[j+1])))
+                # Update previous time step
+                tl[:] = te
+        te_rf[:,mask_hc] = te
+        tl_rf[:,mask_hc] = tl
+
+    # COMPUTE REFREEZING - TAP INTO "COLD RESERVOIR" or potential refreezing
+    mask_rf = glac_mask & ~(bin_melt < rf_meltcrit)
+    if mask_rf.any():
+        tl = tl_rf[:,mask_rf]
+        cold = rf_cold[mask_rf]
+        snowpack = bin_snowpack[mask_rf]
+        # Refreezing over firn surface uses all layers
+        firn = (surfacetype[mask_rf] == 2) | (surfacetype[mask_rf] == 3)
+        # Refreezing over ice surface: approximate number of layers of snow on top of ice
+        smax = np.round((snowpack / (rf_layers_dens[0] / 1000) + pp) / rf_dz, 0)
+        # if there is very little snow on the ground (SWE > 0.06 m for pp=0.3), then still set smax (layers) to 1
+        smax[(snowpack > 0) & (smax == 0)] = 1
+        # if no snow on the ground, then set to rf_cold to NoData value
+        cold[~firn & (smax == 0)] = 0
+        # if smax greater than the number of layers, set to max number of layers minus 1
+        smax[smax > rf_layers - 1] = rf_layers - 1
+        nlayers = np.where(firn, rf_layers - 1, smax).astype(int)
+
+        # Compute potential refreeze, "cold reservoir", from temperature in each layer
+        #  only calculate potential refreezing first time it starts melting each year
+        mask_cold = (cold == 0) & (tl.min(axis=0) < 0)
+        for j in np.arange(1, rf_layers):
+            mask_layer = mask_cold & (nlayers >= j)
+            # units: (degC) * (J K-1 m-3) * (m) * (kg J-1) * (m3 kg-1)
+            cold[mask_layer] -= tl[j,mask_layer] * rf_layers_ch[j] * rf_dz / Lh_rf / density_water
+
+        # Compute refreezing
+        #  if melt and liquid prec < potential refreeze, then refreeze all melt and liquid prec
+        #  otherwise, refreeze equals the potential refreeze
+        water = bin_meltlimit[mask_rf] + bin_prec[mask_rf]
+        refr[mask_rf] = np.where(water < cold, water, np.where(cold > 0, cold, 0))
+
+        # Track the remaining potential refreeze
+        cold -= water
+        # if potential refreeze consumed, set to 0 and set temperature to 0 (temperate firn)
+        consumed = cold < 0
+        cold[consumed] = 0
+        tl[:,consumed] = 0
+        rf_cold[mask_rf] = cold
+        tl_rf[:,mask_rf] = tl
+
+    return refr
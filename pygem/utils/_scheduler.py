@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dynamic scheduling of glaciers on a pool of worker processes
+"""
+import functools
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+
+def glacier_costs(area, nbins, overhead=10, area_weight=1):
+    """
+    Relative run time of each glacier.
+
+    The run time of a glacier is a fixed overhead (loading data, setting up the models) plus the work of each time
+    step, which scales with the number of elevation bins and, for the glacier dynamics, with the glacier area.
+
+    Parameters
+    ----------
+    area : np.ndarray
+        glacier area [km2]
+    nbins : np.ndarray
+        number of elevation bins (e.g., elevation range / bin size)
+    overhead : float
+        cost of a glacier without bins, in units of one elevation bin
+    area_weight : float
+        cost of one km2 of glacier, in units of one elevation bin
+
+    Returns
+    -------
+    costs : np.ndarray
+        relative cost of each glacier
+    """
+    area = np.nan_to_num(np.asarray(area, dtype=float))
+    nbins = np.nan_to_num(np.asarray(nbins, dtype=float))
+    return overhead + np.maximum(nbins, 0) + area_weight * np.maximum(area, 0)
+
+
+def schedule_batches(glac_no, costs, n_workers, batch_factor=2, max_batch=None):
+    """
+    Batches of glaciers, largest first, that get smaller towards the end of the run.
+
+    Each batch is filled until its cost reaches the cost that remains to be scheduled divided by
+    (batch_factor * n_workers), so the largest glaciers are batches of their own, small glaciers are grouped to limit
+    the overhead of each task, and the last batches are small enough to balance the workers at the end.
+
+    Parameters
+    ----------
+    glac_no : list
+        glacier numbers
+    costs : np.ndarray
+        relative cost of each glacier (see glacier_costs)
+    n_workers : int
+        number of worker processes
+    batch_factor : float
+        number of batches per worker that the remaining cost is split into (larger gives smaller batches)
+    max_batch : int
+        maximum number of glaciers in a batch (no limit if None)
+
+    Returns
+    -------
+    batches : list
+        list of lists of glacier numbers, in the order they should be run
+    """
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(-costs, kind='stable')
+    remaining = costs.sum()
+    batches = []
+    batch, batch_cost, target = [], 0, 0
+    for i in order:
+        if len(batch) == 0:
+            target = remaining / (batch_factor * max(n_workers, 1))
+        batch.append(glac_no[i])
+        batch_cost += costs[i]
+        if batch_cost >= target or len(batch) == max_batch:
+            batches.append(batch)
+            remaining -= batch_cost
+            batch, batch_cost = [], 0
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def timed_task(func, task):
+    """
+    Run a task and record which worker ran it and when.
+
+    Parameters
+    ----------
+    func : function
+        function run by the worker (must be picklable, i.e., defined at the top level of a module)
+    task : object
+        argument of func
+
+    Returns
+    -------
+    record : tuple
+        (process id, start time [s], end time [s])
+    """
+    time_start = time.time()
+    func(task)
+    return (os.getpid(), time_start, time.time())
+
+
+def run_scheduled(func, tasks, n_workers, initializer=None, initargs=()):
+    """
+    Run the tasks on a pool of workers, handing each free worker the next task in the list.
+
+    Parameters
+    ----------
+    func : function
+        function run for each task (must be picklable, i.e., defined at the top level of a module)
+    tasks : list
+        arguments of func, in the order they should be started
+    n_workers : int
+        number of worker processes
+    initializer : function
+        function run by each worker when it starts, with initargs as arguments (e.g., to attach shared arrays)
+    initargs : tuple
+        arguments of initializer
+
+    Returns
+    -------
+    records : list
+        (process id, start time, end time) of each task, in the order they finished
+    time_start, time_end : float
+        start and end time of the pool [s]
+    """
+    time_start = time.time()
+    with multiprocessing.Pool(n_workers, initializer=initializer, initargs=initargs) as p:
+        records = list(p.imap_unordered(functools.partial(timed_task, func), tasks, chunksize=1))
+    return records, time_start, time.time()
+
+
+def utilisation(records, time_start, time_end):
+    """
+    Share of the wall time each worker spent running tasks.
+
+    Parameters
+    ----------
+    records : list
+        (process id, start time, end time) of each task (see run_scheduled)
+    time_start, time_end : float
+        start and end time of the pool [s]
+
+    Returns
+    -------
+    stats : dict
+        {process id: (number of tasks, busy time [s], utilisation [-])}
+    """
+    wall_time = max(time_end - time_start, 1e-9)
+    stats = {}
+    for pid, start, end in records:
+        ntasks, busy, _ = stats.get(pid, (0, 0, 0))
+        stats[pid] = (ntasks + 1, busy + end - start, (busy + end - start) / wall_time)
+    return stats
+
+
+def utilisation_report(records, time_start, time_end, n_workers=None):
+    """
+    Text summary of the worker utilisation (see utilisation).
+
+    Parameters
+    ----------
+    records : list
+        (process id, start time, end time) of each task (see run_scheduled)
+    time_start, time_end : float
+        start and end time of the pool [s]
+    n_workers : int
+        number of worker processes, so workers without tasks count as idle in the mean (default: workers with tasks)
+
+    Returns
+    -------
+    report : str
+        one line per worker and the mean utilisation
+    """
+    stats = utilisation(records, time_start, time_end)
+    if n_workers is None:
+        n_workers = len(stats)
+    lines = ['Worker utilisation (wall time {:.1f} s):'.format(time_end - time_start)]
+    for count, pid in enumerate(sorted(stats)):
+        ntasks, busy, util = stats[pid]
+        lines.append('  worker {:3d} (pid {}): {:5d} tasks, busy {:10.1f} s, {:5.1f}%'.format(
+                count, pid, ntasks, busy, util * 100))
+    if n_workers > 0:
+        lines.append('  mean: {:5.1f}%'.format(sum([x[2] for x in stats.values()]) / n_workers * 100))
+    return '\n'.join(lines)
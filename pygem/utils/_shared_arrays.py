@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Arrays shared by the worker processes through shared memory
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def create_shared_arrays(arrays):
+    """
+    Copy arrays into new shared memory blocks.
+
+    Parameters
+    ----------
+    arrays : dict
+        arrays to share {name: np.ndarray}
+
+    Returns
+    -------
+    blocks : list
+        shared memory blocks, which must be released with release_shared_arrays(blocks, unlink=True)
+    spec : dict
+        name, shape and dtype of the block of each array {name: (block name, shape, dtype)}, which is small and can be
+        passed to the workers
+    """
+    blocks = []
+    spec = {}
+    try:
+        for vn, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            spec[vn] = (block.name, array.shape, array.dtype.str)
+    except:
+        release_shared_arrays(blocks, unlink=True)
+        raise
+    return blocks, spec
+
+
+def attach_shared_arrays(spec):
+    """
+    Read-only views of arrays in shared memory.
+
+    Workers started by the process that created the blocks share its resource tracker, so the blocks are only removed
+    by release_shared_arrays in that process (or when it exits).
+
+    Parameters
+    ----------
+    spec : dict
+        {name: (block name, shape, dtype)} from create_shared_arrays
+
+    Returns
+    -------
+    blocks : list
+        shared memory blocks, which must stay referenced while the views are used
+    views : dict
+        read-only arrays {name: np.ndarray}
+    """
+    blocks = []
+    views = {}
+    for vn, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        views[vn] = view
+    return blocks, views
+
+
+def release_shared_arrays(blocks, unlink=False):
+    """
+    Close shared memory blocks and optionally remove them (only by the process that created them).
+
+    Parameters
+    ----------
+    blocks : list
+        shared memory blocks
+    unlink : bool
+        remove the blocks from the system
+    """
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
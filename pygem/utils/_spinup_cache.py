@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of model states after the spin-up years
+"""
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+
+def spinup_cache_key(rgiid, modelprms, settings, inputs):
+    """
+    Key of a spin-up state.
+
+    Parameters
+    ----------
+    rgiid : str
+        RGIId of the glacier
+    modelprms : dict
+        model parameters (e.g., kp, tbias, ddfsnow, ddfice, tsnow_threshold, precgrad)
+    settings : dict
+        model settings that affect the spin-up {name: value}
+    inputs : list of np.ndarray
+        inputs of the spin-up, e.g., the climate of the spin-up years and the initial ice thickness
+
+    Returns
+    -------
+    key : str
+        RGIId followed by the hash of the parameters, settings and inputs (used as filename)
+    """
+    digest = hashlib.sha1()
+    for name in sorted(modelprms):
+        digest.update('{}={!r};'.format(name, float(modelprms[name])).encode())
+    for name in sorted(settings):
+        digest.update('{}={!r};'.format(name, settings[name]).encode())
+    for x in inputs:
+        x = np.ascontiguousarray(x, dtype=float)
+        digest.update(str(x.shape).encode())
+        digest.update(x.tobytes())
+    return '{}_{}'.format(rgiid, digest.hexdigest()[:20])
+
+
+def load_spinup_state(cache_fp, key):
+    """
+    Load a spin-up state from the cache.
+
+    Parameters
+    ----------
+    cache_fp : str
+        cache directory
+    key : str
+        key of the state (see spinup_cache_key)
+
+    Returns
+    -------
+    state : dict or None
+        cached state, None if the state is not cached or cannot be read
+    """
+    state_fn = os.path.join(cache_fp, key + '.pkl')
+    try:
+        with open(state_fn, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    # mark as recently used for the eviction
+    try:
+        os.utime(state_fn)
+    except OSError:
+        pass
+    return state
+
+
+def save_spinup_state(cache_fp, key, state, maxsize):
+    """
+    Save a spin-up state to the cache and remove the least recently used states if the cache is too large.
+
+    The state is written to a temporary file first, so parallel runs never read a partially written state.
+
+    Parameters
+    ----------
+    cache_fp : str
+        cache directory
+    key : str
+        key of the state (see spinup_cache_key)
+    state : dict
+        state to cache (must be picklable)
+    maxsize : float
+        maximum size of the cache [bytes]
+    """
+    os.makedirs(cache_fp, exist_ok=True)
+    state_fn = os.path.join(cache_fp, key + '.pkl')
+    state_fn_tmp = '{}.{}.tmp'.format(state_fn, os.getpid())
+    with open(state_fn_tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(state_fn_tmp, state_fn)
+    evict_spinup_cache(cache_fp, maxsize)
+
+
+def evict_spinup_cache(cache_fp, maxsize):
+    """
+    Remove the least recently used states until the cache is not larger than maxsize.
+
+    Parameters
+    ----------
+    cache_fp : str
+        cache directory
+    maxsize : float
+        maximum size of the cache [bytes]
+
+    Returns
+    -------
+    nremoved : int
+        number of states removed
+    """
+    states = []
+    for fn in os.listdir(cache_fp):
+        if fn.endswith('.pkl'):
+            try:
+                stat = os.stat(os.path.join(cache_fp, fn))
+            except OSError:
+                continue
+            states.append((stat.st_mtime, stat.st_size, fn))
+    cache_size = sum([x[1] for x in states])
+    nremoved = 0
+    for mtime, size, fn in sorted(states):
+        if cache_size <= maxsize:
+            break
+        try:
+            os.remove(os.path.join(cache_fp, fn))
+        except OSError:
+            continue
+        cache_size -= size
+        nremoved += 1
+    return nremoved
@@ -5,13 +5,17 @@ associated with each glacier for PyGEM.
 import numpy as np
 #import pandas as pd
 import pygem.pygem_input as pygem_prms
+from pygem.utils._funcs import downscale_climate, partition_precsnow
+from pygem.utils._melt import melt_energy_daily, melt_energy_expected, tempstd_noise_table
+from pygem.utils._refreeze import refreeze_hh2015
 
 #========= FUNCTIONS (alphabetical order) ===================================
 def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, icethickness_initial, width_initial, 
                    heights, glacier_gcm_temp, glacier_gcm_tempstd, glacier_gcm_prec, glacier_gcm_elev, 
                    glacier_gcm_lrgcm, glacier_gcm_lrglac, dates_table, option_areaconstant=0, 
                    constantarea_years=pygem_prms.constantarea_years, frontalablation_k=None,
-                   glacier_debrismf=None, debug=False, debug_refreeze=False, hindcast=0):
+                   glacier_debrismf=None, debug=False, debug_refreeze=False, hindcast=0,
+                   option_compactbins=pygem_prms.option_compactbins):
     """
     Runs the mass balance and mass redistribution allowing the glacier to evolve.
     Parameters
@@ -45,6 +49,9 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
         switch to keep glacier area constant or not (default 0 allows glacier area to change annually)
     debug : Boolean
         option to turn on print statements for development or debugging of code (default False)
+    option_compactbins : Boolean
+        switch to only model the bins of the glacier plus compactbins_margin bins for advance; the output is mapped 
+        back to all bins and is the same as modeling all bins
     Returns
     -------
     bin_temp : np.ndarray
@@ -101,6 +108,35 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
     """       
     if debug:
         print('\n\nDEBUGGING MASS BALANCE FUNCTION\n\n')
+    
+    # Compact bins: run the glacier's bins plus a margin for advance and map the output back to all bins
+    if option_compactbins and glacier_area_initial.max() > 0:
+        bin_window = compact_bin_window(glacier_area_initial, pygem_prms.compactbins_margin)
+        if bin_window.stop - bin_window.start < heights.shape[0]:
+            glacier_debrismf_window = None
+            if glacier_debrismf is not None:
+                glacier_debrismf_window = glacier_debrismf[bin_window]
+            output = runmassbalance(
+                    modelparameters, glacier_rgi_table, glacier_area_initial[bin_window], 
+                    icethickness_initial[bin_window], width_initial[bin_window], heights[bin_window], glacier_gcm_temp, 
+                    glacier_gcm_tempstd, glacier_gcm_prec, glacier_gcm_elev, glacier_gcm_lrgcm, glacier_gcm_lrglac, 
+                    dates_table, option_areaconstant=option_areaconstant, constantarea_years=constantarea_years, 
+                    frontalablation_k=frontalablation_k, glacier_debrismf=glacier_debrismf_window, debug=debug, 
+                    debug_refreeze=debug_refreeze, hindcast=hindcast, option_compactbins=False)
+            # Glacier advanced to the edge of the window, so it may have been limited by the margin
+            glac_bin_area_annual = output[9]
+            if ((bin_window.start > 0 and glac_bin_area_annual[0].max() > 0) or 
+                (bin_window.stop < heights.shape[0] and glac_bin_area_annual[-1].max() > 0)):
+                if debug:
+                    print('glacier reached the edge of the compact bins, rerunning with all bins')
+            else:
+                # Elevation bin variables are the first 13 outputs
+                output = ([expand_compact_bins(x, bin_window, heights.shape[0]) for x in output[:13]] + 
+                          list(output[13:]))
+                expand_compact_climate(output, bin_window, modelparameters, glacier_rgi_table, icethickness_initial, 
+                                       heights, glacier_gcm_temp, glacier_gcm_prec, glacier_gcm_elev, 
+                                       glacier_gcm_lrgcm, glacier_gcm_lrglac)
+                return tuple(output)
         
     # Select annual divisor and columns
     if pygem_prms.timestep == 'monthly':
@@ -146,6 +182,9 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
     glacier_area_t0 = glacier_area_initial.copy()
     icethickness_t0 = icethickness_initial.copy()
     width_t0 = width_initial.copy()
+    if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'random':
+        # daily temperature anomalies drawn once with their own random number generator (as PyGEMMassBalance)
+        tempstd_noise = tempstd_noise_table(nmonths, seed=pygem_prms.tempstd_seed)
     if pygem_prms.option_refreezing == 'HH2015':
         # Refreezing layers density, volumetric heat capacity, and thermal conductivity
         rf_dens_expb = (pygem_prms.rf_dens_bot / pygem_prms.rf_dens_top)**(1/(pygem_prms.rf_layers-1))
@@ -201,15 +240,16 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
             #  only compute mass balance while glacier exists
             if (pygem_prms.timestep == 'monthly') and (glac_idx_t0.shape[0] != 0):      
                 
-                # AIR TEMPERATURE: Downscale the gcm temperature [deg C] to each bin
+                # AIR TEMPERATURE AND PRECIPITATION: Downscale the gcm temperature [deg C] and precipitation (liquid
+                #  and solid) to each bin
+                bin_temp_year, bin_precsnow_year = downscale_climate(
+                        glacier_gcm_temp[12*year:12*(year+1)], glacier_gcm_prec[12*year:12*(year+1)], 
+                        glacier_gcm_elev, glacier_gcm_lrgcm[12*year:12*(year+1)], 
+                        glacier_gcm_lrglac[12*year:12*(year+1)], 
+                        glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale], heights[:,np.newaxis], 
+                        modelparameters[7], modelparameters[2], modelparameters[3])
                 if pygem_prms.option_temp2bins == 1:
-                    # Downscale using gcm and glacier lapse rates
-                    #  T_bin = T_gcm + lr_gcm * (z_ref - z_gcm) + lr_glac * (z_bin - z_ref) + tempchange
-                    bin_temp[:,12*year:12*(year+1)] = (glacier_gcm_temp[12*year:12*(year+1)] + 
-                         glacier_gcm_lrgcm[12*year:12*(year+1)] * 
-                         (glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale] - glacier_gcm_elev) + 
-                         glacier_gcm_lrglac[12*year:12*(year+1)] * (heights - 
-                         glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale])[:,np.newaxis] + modelparameters[7])
+                    bin_temp[:,12*year:12*(year+1)] = bin_temp_year
                 # Option to adjust air temperature based on changes in surface elevation
                 #  note: OGGM automatically updates the bin elevation, so this step is not needed
                 if pygem_prms.option_adjusttemp_surfelev == 1 and pygem_prms.hyps_data in ['Huss', 'Farinotti']:
@@ -218,13 +258,8 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
                                                        glacier_gcm_lrglac[12*year:12*(year+1)] * 
                                                        (icethickness_t0 - icethickness_initial)[:,np.newaxis])
                 
-                # PRECIPITATION/ACCUMULATION: Downscale the precipitation (liquid and solid) to each bin
                 if pygem_prms.option_prec2bins == 1:
-                    # Precipitation using precipitation factor and precipitation gradient
-                    #  P_bin = P_gcm * prec_factor * (1 + prec_grad * (z_bin - z_ref))
-                    bin_precsnow[:,12*year:12*(year+1)] = (glacier_gcm_prec[12*year:12*(year+1)] * 
-                            modelparameters[2] * (1 + modelparameters[3] * (heights - 
-                            glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale]))[:,np.newaxis])
+                    bin_precsnow[:,12*year:12*(year+1)] = bin_precsnow_year
                 # Option to adjust prec of uppermost 25% of glacier for wind erosion and reduced moisture content
                 if pygem_prms.option_preclimit == 1:
                     # If elevation range > 1000 m, apply corrections to uppermost 25% of glacier (Huss and Hock, 2015)
@@ -252,30 +287,14 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
                                 (bin_precsnow[glac_idx_upper25,month] != 0)], month] = (
                                                                 0.875 * bin_precsnow[glac_idx_t0,month].max())
                 # Separate total precipitation into liquid (bin_prec) and solid (bin_acc)
-                if pygem_prms.option_accumulation == 1:
-                    # if temperature above threshold, then rain
-                    bin_prec[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] > modelparameters[6]] = (
-                        bin_precsnow[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] > modelparameters[6]])
-                    # if temperature below threshold, then snow
-                    bin_acc[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] <= modelparameters[6]] = (
-                        bin_precsnow[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] <= modelparameters[6]])
-                elif pygem_prms.option_accumulation == 2:
-                    # If temperature between min/max, then mix of snow/rain using linear relationship between min/max
-                    bin_prec[:,12*year:12*(year+1)] = ((1/2 + (bin_temp[:,12*year:12*(year+1)] - 
-                            modelparameters[6]) / 2) * bin_precsnow[:,12*year:12*(year+1)])
-                    bin_acc[:,12*year:12*(year+1)] = (bin_precsnow[:,12*year:12*(year+1)] - 
-                           bin_prec[:,12*year:12*(year+1)])
-                    # If temperature above maximum threshold, then all rain
-                    bin_prec[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] > modelparameters[6] + 1] = (
-                            bin_precsnow[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] > 
-                                         modelparameters[6] + 1])
-                    bin_acc[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] > modelparameters[6] + 1] = 0
-                    # If temperature below minimum threshold, then all snow
-                    (bin_acc[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] <= modelparameters[6] - 1]
-                        )= (bin_precsnow[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] <= 
-                                         modelparameters[6] - 1])
-                    bin_prec[:,12*year:12*(year+1)][bin_temp[:,12*year:12*(year+1)] <= modelparameters[6] - 1] = 0
+                bin_prec[:,12*year:12*(year+1)], bin_acc[:,12*year:12*(year+1)] = partition_precsnow(
+                        bin_temp[:,12*year:12*(year+1)], bin_precsnow[:,12*year:12*(year+1)], modelparameters[6])
                 
+                # Expected energy available for melt of normally distributed daily temperatures [degC day] of the year
+                if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+                    melt_energy_year = melt_energy_expected(bin_temp[:,12*year:12*(year+1)], 
+                                                            glacier_gcm_tempstd[12*year:12*(year+1)], 
+                                                            dayspermonth[12*year:12*(year+1)])
                 
                 # ENTER MONTHLY LOOP (monthly loop required as )
                 for month in range(0,12):
@@ -292,18 +311,14 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
                         # option 1: energy based on monthly temperature
                         melt_energy_available = bin_temp[:,step]*dayspermonth[step]
                         melt_energy_available[melt_energy_available < 0] = 0
+                    elif pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+                        # option 2: expected energy of normally distributed daily temperatures
+                        melt_energy_available = melt_energy_year[:,month]
                     elif pygem_prms.option_ablation == 2:
-                        # option 2: monthly temperature superimposed with daily temperature variability 
-                        # daily temperature variation in each bin for the monthly timestep
-                        bin_tempstd_daily = np.repeat(
-                                np.random.normal(loc=0, scale=glacier_gcm_tempstd[step], size=dayspermonth[step])
-                                .reshape(1,dayspermonth[step]), nbins, axis=0)
-                        # daily temperature in each bin for the monthly timestep
-                        bin_temp_daily = bin_temp[:,step][:,np.newaxis] + bin_tempstd_daily
-                        # remove negative values
-                        bin_temp_daily[bin_temp_daily < 0] = 0
-                        # Energy available for melt [degC day] = sum of daily energy available
-                        melt_energy_available = bin_temp_daily.sum(axis=1)
+                        # option 2: monthly temperature superimposed with daily temperature variability
+                        #  daily temperatures are the same in each bin and drawn once per run (see tempstd_noise)
+                        melt_energy_available = melt_energy_daily(bin_temp[:,step], glacier_gcm_tempstd[step], 
+                                                                  dayspermonth[step], tempstd_noise[step])
                     # SNOW MELT [m w.e.]
                     bin_meltsnow[:,step] = surfacetype_ddf_dict[2] * melt_energy_available
                     # snow melt cannot exceed the snow depth
@@ -547,9 +562,11 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
                     # adjust using tolerance to avoid any rounding errors that would leave a little glacier volume left
                     glac_bin_melt[:,12*year:12*(year+1)] = (glac_bin_melt[:,12*year:12*(year+1)] * 
                                                             (1 + pygem_prms.tolerance - mb_dif / glac_wide_melt))
-                    glac_bin_massbalclim[:,12*year:12*(year+1)] = (
-                            bin_acc[:,12*year:12*(year+1)] + glac_bin_refreeze[:,12*year:12*(year+1)] - 
-                            glac_bin_melt[:,12*year:12*(year+1)])
+                    #  only the glacier bins, as off-glacier bins have no climatic mass balance
+                    glac_bin_massbalclim[glac_idx_t0,12*year:12*(year+1)] = (
+                            bin_acc[glac_idx_t0,12*year:12*(year+1)] + 
+                            glac_bin_refreeze[glac_idx_t0,12*year:12*(year+1)] - 
+                            glac_bin_melt[glac_idx_t0,12*year:12*(year+1)])
 
                     # Check annual climatic mass balance
                     mb_mwea = ((glacier_area_t0 * glac_bin_massbalclim[:,12*year:12*(year+1)].sum(1)).sum() / 
@@ -856,6 +873,385 @@ def runmassbalance(modelparameters, glacier_rgi_table, glacier_area_initial, ice
             offglac_wide_snowpack, offglac_wide_runoff)  
 
 
+def runmassbalance_region(modelparameters, main_glac_rgi, main_glac_area, main_glac_icethickness, heights, 
+                          gcm_temp, gcm_tempstd, gcm_prec, gcm_elev, gcm_lrgcm, gcm_lrglac, dates_table, 
+                          main_glac_debrismf=None):
+    """
+    Runs the climatic mass balance of all glaciers of a region at once with constant glacier area.
+    
+    Region-wide equivalent of runmassbalance with option_areaconstant=1: the hypsometry, ice thickness and climate 
+    of every glacier are stacked along a glacier axis, so accumulation, melt, refreezing and the climatic mass balance 
+    are computed for all glaciers and elevation bins of each time step together. The glaciers share the elevation bins 
+    of the hypsometry matrices. Frontal ablation and mass redistribution are not included, so marine-terminating 
+    glaciers and runs with a changing glacier area must use runmassbalance.
+    
+    Parameters
+    ----------
+    modelparameters : np.ndarray
+        Model parameters (lrgcm, lrglac, precfactor, precgrad, ddfsnow, ddfice, tempsnow, tempchange) shared by all 
+        glaciers (8,) or of each glacier (nglac, 8)
+    main_glac_rgi : pd.DataFrame
+        Table of the glaciers' RGI information
+    main_glac_area : np.ndarray
+        Glacier area [km2] of each glacier and elevation bin (nglac, nbins)
+    main_glac_icethickness : np.ndarray
+        Ice thickness [m] of each glacier and elevation bin (nglac, nbins)
+    heights : np.ndarray
+        height of elevation bins [masl]
+    gcm_temp, gcm_tempstd, gcm_prec, gcm_lrgcm, gcm_lrglac : np.ndarray
+        GCM temperature [degC], daily temperature standard deviation [degC], precipitation [m], lapse rate from the 
+        GCM to the glacier [K m-1] and lapse rate over the glacier [K m-1] of each glacier and time step (nglac, nmonths)
+    gcm_elev : np.ndarray
+        GCM elevation [masl] of each glacier
+    dates_table : pd.DataFrame
+        Table of dates, year, month, daysinmonth, wateryear, and season for each timestep
+    main_glac_debrismf : np.ndarray
+        Debris melt factor of each glacier and elevation bin (nglac, nbins), only used if include_debris
+    Returns
+    -------
+    bin_temp : np.ndarray
+        Temperature [degC] for each glacier, elevation bin and timestep
+    bin_prec : np.ndarray
+        Precipitation (only liquid) [m] for each glacier, elevation bin and timestep
+    bin_acc : np.ndarray
+        Accumulation (solid precipitation) [mwe] for each glacier, elevation bin and timestep
+    glac_bin_refreeze : np.ndarray
+        Refreeze [mwe] for each glacier, elevation bin and timestep
+    glac_bin_snowpack : np.ndarray
+        Snowpack [mwe] for each glacier, elevation bin and timestep
+    glac_bin_melt : np.ndarray
+        Melt [mwe] for each glacier, elevation bin and timestep
+    glac_bin_massbalclim : np.ndarray
+        Climatic mass balance [mwe] for each glacier, elevation bin and timestep
+    glac_bin_massbalclim_annual : np.ndarray
+        Climatic mass balance [mwe] for each glacier, elevation bin and year
+    glac_wide_massbaltotal : np.ndarray
+        Glacier-wide total mass balance [mwe] for each glacier and timestep
+    glac_wide_runoff : np.ndarray
+        Glacier-wide runoff [m3] for each glacier and timestep
+    glac_wide_area_annual : np.ndarray
+        Glacier-wide area [km2] for each glacier and year
+    glac_wide_volume_annual : np.ndarray
+        Glacier-wide volume [km3 ice] for each glacier and year
+    """
+    glacier_area = np.asarray(main_glac_area, dtype=float)
+    icethickness = np.asarray(main_glac_icethickness, dtype=float)
+    nglac, nbins = glacier_area.shape
+    nmonths = gcm_temp.shape[1]
+    nyears = int(dates_table.shape[0] / 12)
+    dayspermonth = dates_table['daysinmonth'].values
+    # Model parameters of each glacier as column vectors, so they broadcast against the elevation bins
+    modelparameters = np.broadcast_to(np.asarray(modelparameters, dtype=float), (nglac, 8))
+    kp, precgrad, ddfsnow, ddfice, tsnow_threshold, tbias = [modelparameters[:,[i]] for i in [2, 3, 4, 5, 6, 7]]
+    # Glaciers without ice are not modeled
+    glac_mask = (glacier_area > 0) & (icethickness.max(axis=1) > 0)[:,np.newaxis]
+    glac_mask_monthly = glac_mask[:,:,np.newaxis]
+    elev_ref = main_glac_rgi[pygem_prms.option_elev_ref_downscale].values.astype(float)[:,np.newaxis]
+    
+    # Surface type (0 = off-glacier, 1 = ice, 2 = snow, 3 = firn, 4 = debris)
+    if pygem_prms.option_surfacetype_initial == 1:
+        elev_surfacetype = main_glac_rgi['Zmed'].values[:,np.newaxis]
+    elif pygem_prms.option_surfacetype_initial == 2:
+        elev_surfacetype = main_glac_rgi['Zmean'].values[:,np.newaxis]
+    surfacetype = np.zeros((nglac, nbins))
+    surfacetype[(heights < elev_surfacetype) & glac_mask] = 1
+    surfacetype[(heights >= elev_surfacetype) & glac_mask] = 2
+    if pygem_prms.include_firn:
+        surfacetype[surfacetype == 2] = 3
+    # Degree-day factor of each surface type
+    surfacetype_ddf_dict = {0: ddfsnow, 1: ddfice, 2: ddfsnow}
+    if pygem_prms.include_firn:
+        if pygem_prms.option_ddf_firn == 0:
+            surfacetype_ddf_dict[3] = ddfsnow
+        elif pygem_prms.option_ddf_firn == 1:
+            surfacetype_ddf_dict[3] = np.mean([ddfsnow, ddfice], axis=0)
+    surfacetype_ddf = np.zeros((nglac, nbins))
+    for surfacetype_idx in surfacetype_ddf_dict:
+        surfacetype_ddf = np.where(surfacetype == surfacetype_idx, surfacetype_ddf_dict[surfacetype_idx], 
+                                   surfacetype_ddf)
+    if pygem_prms.include_debris and main_glac_debrismf is not None:
+        surfacetype_ddf = surfacetype_ddf * main_glac_debrismf
+    
+    # DOWNSCALE CLIMATE (all glaciers and time steps at once)
+    # Temperature [degC] and precipitation [m] with the glaciers on the first axis
+    bin_temp, bin_precsnow = downscale_climate(
+            gcm_temp[:,np.newaxis,:], gcm_prec[:,np.newaxis,:], gcm_elev[:,np.newaxis,np.newaxis], 
+            gcm_lrgcm[:,np.newaxis,:], gcm_lrglac[:,np.newaxis,:], elev_ref[:,:,np.newaxis], heights[:,np.newaxis], 
+            tbias[:,:,np.newaxis], kp[:,:,np.newaxis], precgrad[:,:,np.newaxis])
+    if pygem_prms.option_adjusttemp_surfelev == 1 and pygem_prms.hyps_data in ['Huss', 'Farinotti']:
+        # bins below the terminus use the ice thickness of the terminus as the initial thickness
+        terminus_idx = (icethickness > 0).argmax(axis=1)
+        icethickness_change = np.where(np.arange(nbins) < terminus_idx[:,np.newaxis], 
+                                       -icethickness[np.arange(nglac), terminus_idx][:,np.newaxis], 0)
+        bin_temp = bin_temp + gcm_lrglac[:,np.newaxis,:] * icethickness_change[:,:,np.newaxis]
+    # Option to adjust precipitation of the uppermost 25% of glaciers that span more than 1000 m
+    if pygem_prms.option_preclimit == 1:
+        heights_min = np.where(glac_mask, heights, np.inf).min(axis=1)[:,np.newaxis]
+        heights_max = np.where(glac_mask, heights, -np.inf).max(axis=1)[:,np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            upper25_mask = (glac_mask & (heights_max - heights_min > 1000) & 
+                            ((heights - heights_min) / (heights_max - heights_min) * 100 >= 75))
+        glac_idx_preclimit = np.where(upper25_mask.any(axis=1))[0]
+        heights_upper25 = np.where(upper25_mask, heights, np.nan)[glac_idx_preclimit]
+        glac_idx_75 = np.nanargmin(heights_upper25, axis=1)
+        height_75 = heights[glac_idx_75][:,np.newaxis]
+        precsnow_75 = bin_precsnow[glac_idx_preclimit, glac_idx_75, :]
+        precsnow_upper25 = (precsnow_75[:,np.newaxis,:] * 
+                            np.exp(-1*(heights - height_75) / 
+                                   (np.nanmax(heights_upper25, axis=1) - height_75[:,0])[:,np.newaxis])
+                            [:,:,np.newaxis])
+        upper25_mask_preclimit = upper25_mask[glac_idx_preclimit]
+        bin_precsnow[glac_idx_preclimit] = np.where(upper25_mask_preclimit[:,:,np.newaxis], precsnow_upper25, 
+                                                    bin_precsnow[glac_idx_preclimit])
+        # Limit the uppermost 25% to at least 87.5% of the maximum precipitation (first year as in runmassbalance)
+        precsnow_year0 = bin_precsnow[glac_idx_preclimit,:,0:12]
+        precsnow_limit = 0.875 * np.where(glac_mask[glac_idx_preclimit][:,:,np.newaxis], precsnow_year0, 
+                                          -np.inf).max(axis=1)[:,np.newaxis,:]
+        limit_mask = (upper25_mask_preclimit[:,:,np.newaxis] & (precsnow_year0 < precsnow_limit) & 
+                      (precsnow_year0 != 0))
+        bin_precsnow[glac_idx_preclimit,:,0:12] = np.where(limit_mask, precsnow_limit, precsnow_year0)
+    # Rain and snow partition [m w.e.] based on the snow temperature threshold
+    bin_prec, bin_acc = partition_precsnow(bin_temp, bin_precsnow, tsnow_threshold[:,:,np.newaxis])
+    # Downscaled climate is only used for glaciers with ice
+    bin_temp = np.where(glac_mask.any(axis=1)[:,np.newaxis,np.newaxis], bin_temp, 0)
+    bin_prec = np.where(glac_mask.any(axis=1)[:,np.newaxis,np.newaxis], bin_prec, 0)
+    bin_acc = np.where(glac_mask.any(axis=1)[:,np.newaxis,np.newaxis], bin_acc, 0)
+    
+    # Local variables
+    bin_snowpack = np.zeros((nglac, nbins, nmonths))
+    bin_meltsnow = np.zeros((nglac, nbins, nmonths))
+    bin_melt = np.zeros((nglac, nbins, nmonths))
+    bin_refreeze = np.zeros((nglac, nbins, nmonths))
+    snowpack_remaining = np.zeros((nglac, nbins))
+    refreeze_potential = np.zeros((nglac, nbins))
+    if pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'random':
+        tempstd_noise = tempstd_noise_table(nmonths, seed=pygem_prms.tempstd_seed)
+    elif pygem_prms.option_ablation == 2 and pygem_prms.option_ablation_dailytemp == 'expected':
+        # Expected energy available for melt [degC day] of all glaciers and time steps at once
+        melt_energy_expected_all = melt_energy_expected(bin_temp, gcm_tempstd[:,np.newaxis,:], dayspermonth)
+    if pygem_prms.option_refreezing == 'HH2015':
+        # Refreezing layers density, volumetric heat capacity, and thermal conductivity
+        rf_dens_expb = (pygem_prms.rf_dens_bot / pygem_prms.rf_dens_top)**(1/(pygem_prms.rf_layers-1))
+        rf_layers_dens = np.array([pygem_prms.rf_dens_top * rf_dens_expb**x for x in np.arange(0,pygem_prms.rf_layers)])
+        rf_layers_ch = (1 - rf_layers_dens/1000) * pygem_prms.ch_air + rf_layers_dens/1000 * pygem_prms.ch_ice
+        rf_layers_k = (1 - rf_layers_dens/1000) * pygem_prms.k_air + rf_layers_dens/1000 * pygem_prms.k_ice
+        te_rf = np.zeros((pygem_prms.rf_layers, nglac, nbins))
+        tl_rf = np.zeros((pygem_prms.rf_layers, nglac, nbins))
+        rf_cold = np.zeros((nglac, nbins))
+    
+    for step in range(nmonths):
+        # Snowpack [m w.e.] = snow remaining + new snow
+        bin_snowpack[:,:,step] = snowpack_remaining + bin_acc[:,:,step]
+        
+        # MELT [m w.e.]
+        if pygem_prms.option_ablation == 1:
+            # Energy available for melt [degC day]
+            melt_energy_available = bin_temp[:,:,step] * dayspermonth[step]
+            melt_energy_available[melt_energy_available < 0] = 0
+        elif pygem_prms.option_ablation == 2:
+            # Daily temperature variation of each glacier
+            if pygem_prms.option_ablation_dailytemp == 'expected':
+                melt_energy_available = melt_energy_expected_all[:,:,step]
+            else:
+                melt_energy_available = melt_energy_daily(bin_temp[:,:,step], gcm_tempstd[:,step,np.newaxis,np.newaxis],
+                                                          dayspermonth[step], tempstd_noise[step])
+        # Snow melt [m w.e.], which cannot exceed the snowpack
+        bin_meltsnow[:,:,step] = np.minimum(surfacetype_ddf_dict[2] * melt_energy_available, bin_snowpack[:,:,step])
+        # Energy remaining after snow melt [degC day]
+        melt_energy_available = melt_energy_available - bin_meltsnow[:,:,step] / surfacetype_ddf_dict[2]
+        melt_energy_available[abs(melt_energy_available) < pygem_prms.tolerance] = 0
+        # Glacier melt [m w.e.] based on remaining energy
+        bin_melt[:,:,step] = (np.where(glac_mask, surfacetype_ddf * melt_energy_available, 0) + 
+                              bin_meltsnow[:,:,step])
+        
+        # REFREEZING
+        if pygem_prms.option_refreezing == 'HH2015':
+            rf_dt = 3600 * 24 * dayspermonth[step] / pygem_prms.rf_dsc
+            if pygem_prms.option_rf_limit_meltsnow == 1:
+                bin_meltlimit = bin_meltsnow[:,:,step]
+            else:
+                bin_meltlimit = bin_melt[:,:,step]
+            bin_refreeze[:,:,step] = refreeze_hh2015(
+                    te_rf, tl_rf, rf_cold, glac_mask, bin_temp[:,:,step], bin_melt[:,:,step], bin_meltlimit, 
+                    bin_prec[:,:,step], bin_snowpack[:,:,step], surfacetype, rf_dt, rf_layers_dens, rf_layers_ch, 
+                    rf_layers_k, pygem_prms.rf_dz, pygem_prms.rf_dsc, pygem_prms.rf_meltcrit, pygem_prms.pp, 
+                    pygem_prms.Lh_rf, pygem_prms.density_water)
+        elif pygem_prms.option_refreezing == 'Woodward':
+            # Refreeze potential [m w.e.] is reset each year in the refreeze month
+            if dates_table.loc[step,'month'] == pygem_prms.rf_month:
+                year = int(step / 12)
+                bin_temp_annual = annualweightedmean_array(bin_temp[:,:,12*year:12*(year+1)].reshape(-1,12), 
+                                                           dates_table.iloc[12*year:12*(year+1),:])
+                bin_refreezepotential = (-0.69 * bin_temp_annual.reshape(nglac,nbins) + 0.0096) * 1/100
+                bin_refreezepotential[bin_refreezepotential < 0] = 0
+                reset_mask = bin_refreezepotential.max(axis=1) > 0
+                refreeze_potential[reset_mask] = bin_refreezepotential[reset_mask]
+            # Refreeze [m w.e.] limited by snow melt and rain, the snowpack and the refreeze potential
+            refreeze = np.minimum(np.minimum(bin_meltsnow[:,:,step] + bin_prec[:,:,step], bin_snowpack[:,:,step]),
+                                  refreeze_potential)
+            refreeze[abs(refreeze) < pygem_prms.tolerance] = 0
+            bin_refreeze[:,:,step] = refreeze
+            refreeze_potential = refreeze_potential - refreeze
+            refreeze_potential[abs(refreeze_potential) < pygem_prms.tolerance] = 0
+        
+        # Snowpack remaining [m w.e.]
+        snowpack_remaining = bin_snowpack[:,:,step] - bin_meltsnow[:,:,step]
+        snowpack_remaining[abs(snowpack_remaining) < pygem_prms.tolerance] = 0
+    
+    # Climatic mass balance [m w.e.] of the glacier bins
+    glac_bin_melt = np.where(glac_mask_monthly, bin_melt, 0)
+    glac_bin_refreeze = np.where(glac_mask_monthly, bin_refreeze, 0)
+    glac_bin_snowpack = np.where(glac_mask_monthly, bin_snowpack, 0)
+    glac_bin_massbalclim = np.where(glac_mask_monthly, bin_acc + glac_bin_refreeze - glac_bin_melt, 0)
+    
+    # Annual mass balance cannot exceed the glacier's mass, so reduce the melt of those years
+    glacier_area_total = glacier_area.sum(axis=1)
+    glacier_area_total[glacier_area_total == 0] = np.nan
+    with np.errstate(invalid='ignore'):
+        mb_max_loss = (-1 * (glacier_area * icethickness * pygem_prms.density_ice / pygem_prms.density_water)
+                       .sum(axis=1) / glacier_area_total)
+        glac_bin_massbalclim_annual = glac_bin_massbalclim.reshape(nglac, nbins, nyears, 12).sum(axis=3)
+        mb_mwea = ((glacier_area[:,np.newaxis,:] * np.ascontiguousarray(glac_bin_massbalclim_annual.transpose(0,2,1)))
+                   .sum(axis=2) / glacier_area_total[:,np.newaxis])
+        maxloss_mask = mb_mwea < mb_max_loss[:,np.newaxis]
+    if maxloss_mask.any():
+        glac_idx_maxloss, year_idx_maxloss = np.where(maxloss_mask)
+        for glac, year in zip(glac_idx_maxloss, year_idx_maxloss):
+            mb_dif = mb_max_loss[glac] - mb_mwea[glac,year]
+            glac_wide_melt = ((glac_bin_melt[glac,:,12*year:12*(year+1)] * glacier_area[glac,:,np.newaxis]).sum() / 
+                              glacier_area_total[glac])
+            glac_bin_melt[glac,:,12*year:12*(year+1)] = (glac_bin_melt[glac,:,12*year:12*(year+1)] * 
+                                                         (1 + pygem_prms.tolerance - mb_dif / glac_wide_melt))
+            glac_bin_massbalclim[glac,:,12*year:12*(year+1)] = np.where(
+                    glac_mask[glac,:,np.newaxis], 
+                    bin_acc[glac,:,12*year:12*(year+1)] + glac_bin_refreeze[glac,:,12*year:12*(year+1)] - 
+                    glac_bin_melt[glac,:,12*year:12*(year+1)], 0)
+        glac_bin_massbalclim_annual = glac_bin_massbalclim.reshape(nglac, nbins, nyears, 12).sum(axis=3)
+    
+    # Remove the spinup years of the variables that are being exported
+    colstart = pygem_prms.ref_spinupyears * 12
+    bin_temp = bin_temp[:,:,colstart:]
+    bin_prec = bin_prec[:,:,colstart:]
+    bin_acc = bin_acc[:,:,colstart:]
+    glac_bin_refreeze = glac_bin_refreeze[:,:,colstart:]
+    glac_bin_snowpack = glac_bin_snowpack[:,:,colstart:]
+    glac_bin_melt = glac_bin_melt[:,:,colstart:]
+    glac_bin_massbalclim = glac_bin_massbalclim[:,:,colstart:]
+    glac_bin_massbalclim_annual = glac_bin_massbalclim_annual[:,:,pygem_prms.ref_spinupyears:]
+    
+    # Glacier-wide output with constant area
+    glac_bin_area = np.repeat(np.where(glac_mask, glacier_area, 0)[:,:,np.newaxis], glac_bin_melt.shape[2], axis=2)
+    glac_wide_area = glac_bin_area.sum(axis=1)
+    glac_wide_prec = calc_glacwide_region(bin_prec, glac_bin_area, glac_wide_area)
+    glac_wide_acc = calc_glacwide_region(bin_acc, glac_bin_area, glac_wide_area)
+    glac_wide_refreeze = calc_glacwide_region(glac_bin_refreeze, glac_bin_area, glac_wide_area)
+    glac_wide_melt = calc_glacwide_region(glac_bin_melt, glac_bin_area, glac_wide_area)
+    glac_wide_massbaltotal = glac_wide_acc + glac_wide_refreeze - glac_wide_melt
+    glac_wide_runoff = calc_runoff(glac_wide_prec, glac_wide_melt, glac_wide_refreeze, glac_wide_area)
+    nyears_output = glac_bin_massbalclim_annual.shape[2]
+    glac_wide_area_annual = np.repeat(glac_wide_area[:,[0]], nyears_output + 1, axis=1)
+    glac_wide_volume_annual = np.repeat(
+            (glac_bin_area[:,:,0] * np.where(glac_mask, icethickness, 0) / 1000).sum(axis=1)[:,np.newaxis], 
+            nyears_output + 1, axis=1)
+    
+    return (bin_temp, bin_prec, bin_acc, glac_bin_refreeze, glac_bin_snowpack, glac_bin_melt, glac_bin_massbalclim, 
+            glac_bin_massbalclim_annual, glac_wide_massbaltotal, glac_wide_runoff, glac_wide_area_annual, 
+            glac_wide_volume_annual)
+
+
+def compact_bin_window(glacier_area, margin):
+    """
+    Window of elevation bins spanning the glacier plus a margin of bins on each side.
+    
+    Parameters
+    ----------
+    glacier_area : np.ndarray
+        Glacier area [km2] for each elevation bin
+    margin : int
+        number of bins added below and above the glacier to allow the glacier to advance
+    Returns
+    -------
+    bin_window : slice
+        slice of the elevation bins that are modeled
+    """
+    glac_idx = glacier_area.nonzero()[0]
+    return slice(max(glac_idx[0] - margin, 0), min(glac_idx[-1] + margin + 1, glacier_area.shape[0]))
+
+
+def expand_compact_bins(bin_var, bin_window, nbins):
+    """
+    Map a variable of the compact bins back to all elevation bins, with zeros outside of the window.
+    
+    Parameters
+    ----------
+    bin_var : np.ndarray
+        variable for each compact elevation bin (first axis) 
+    bin_window : slice
+        slice of the elevation bins that were modeled
+    nbins : int
+        number of elevation bins
+    Returns
+    -------
+    bin_var_all : np.ndarray
+        variable for each elevation bin
+    """
+    bin_var_all = np.zeros((nbins,) + bin_var.shape[1:], dtype=bin_var.dtype)
+    bin_var_all[bin_window] = bin_var
+    return bin_var_all
+
+
+def expand_compact_climate(output, bin_window, modelparameters, glacier_rgi_table, icethickness_initial, heights, 
+                           glacier_gcm_temp, glacier_gcm_prec, glacier_gcm_elev, glacier_gcm_lrgcm, 
+                           glacier_gcm_lrglac):
+    """
+    Fill the bins outside of the compact window of the expanded runmassbalance output as if all bins were modeled.
+    
+    The glacier never reaches these bins, so they only hold the downscaled temperature, precipitation and 
+    accumulation of the years in which the glacier exists and, with option_adjusttemp_surfelev, the initial ice 
+    thickness of the terminus below the glacier.
+    
+    Parameters
+    ----------
+    output : list
+        runmassbalance output with the elevation bin variables mapped back to all bins, updated in place
+    bin_window : slice
+        slice of the elevation bins that were modeled
+    modelparameters, glacier_rgi_table, icethickness_initial, heights, glacier_gcm_temp, glacier_gcm_prec, 
+    glacier_gcm_elev, glacier_gcm_lrgcm, glacier_gcm_lrglac :
+        runmassbalance input
+    """
+    if icethickness_initial.max() == 0:
+        return
+    bin_temp, bin_prec, bin_acc = output[0:3]
+    glac_bin_area_annual, glac_bin_icethickness_annual = output[9:11]
+    bin_outside = np.ones(heights.shape[0], dtype=bool)
+    bin_outside[bin_window] = False
+    # Bins below the terminus use the ice thickness of the terminus as the initial thickness
+    icethickness_change = np.zeros(heights.shape[0])
+    if pygem_prms.option_adjusttemp_surfelev == 1:
+        icethickness_terminus = icethickness_initial[icethickness_initial.nonzero()[0][0]]
+        if pygem_prms.ref_spinupyears == 0:
+            glac_bin_icethickness_annual[0:bin_window.start,0] = icethickness_terminus
+        icethickness_change[0:bin_window.start] = -1 * icethickness_terminus
+    # Climate is only downscaled in the years that the glacier exists
+    year_exists = (glac_bin_area_annual[:,:-1].max(axis=0) > 0) & (glac_bin_icethickness_annual[:,:-1].max(axis=0) > 0)
+    steps = np.where(year_exists.repeat(12))[0]
+    colstart = pygem_prms.ref_spinupyears * 12
+    elev_ref = glacier_rgi_table.loc[pygem_prms.option_elev_ref_downscale]
+    heights_outside = heights[bin_outside][:,np.newaxis]
+    # Temperature and precipitation (liquid and solid) as in runmassbalance
+    temp, precsnow = downscale_climate(
+            glacier_gcm_temp[colstart + steps], glacier_gcm_prec[colstart + steps], glacier_gcm_elev, 
+            glacier_gcm_lrgcm[colstart + steps], glacier_gcm_lrglac[colstart + steps], elev_ref, heights_outside, 
+            modelparameters[7], modelparameters[2], modelparameters[3])
+    if pygem_prms.option_adjusttemp_surfelev == 1 and pygem_prms.hyps_data in ['Huss', 'Farinotti']:
+        temp = temp + glacier_gcm_lrglac[colstart + steps] * icethickness_change[bin_outside][:,np.newaxis]
+    prec, acc = partition_precsnow(temp, precsnow, modelparameters[6])
+    bin_temp[np.ix_(bin_outside, steps)] = temp
+    bin_prec[np.ix_(bin_outside, steps)] = prec
+    bin_acc[np.ix_(bin_outside, steps)] = acc
+
+
 #%% ===================================================================================================================
 def annualweightedmean_array(var, dates_table):
     """
@@ -905,6 +1301,15 @@ def calc_glacwide(bin_var, area_bin, area_wide):
     return var_wide
 
 
+def calc_glacwide_region(bin_var, area_bin, area_wide):
+    """Calculate glacier wide sum of a variable for each glacier (glacier axis first, then elevation bins)"""
+    var_wide = np.zeros((bin_var.shape[0], bin_var.shape[2]))
+    var_wide_mkm2 = (bin_var * area_bin).sum(axis=1)
+    var_wide[var_wide_mkm2 > 0] = (var_wide_mkm2[var_wide_mkm2 > 0] / 
+                                   np.broadcast_to(area_wide, var_wide.shape)[var_wide_mkm2 > 0])
+    return var_wide
+
+
 def calc_runoff(prec_wide, melt_wide, refreeze_wide, area_wide):
     """
     Calculate runoff from precipitation, melt, and refreeze [units: m3]
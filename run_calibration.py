@@ -146,6 +146,111 @@ def mb_mwea_calc(modelparameters, glacier_rgi_table, glacier_area_initial, iceth
         return mb_mwea
 
 
+def mb_mwea_calc_region(modelparameters, main_glac_rgi, main_glac_area, main_glac_icethickness, elev_bins, gcm_temp, 
+                        gcm_tempstd, gcm_prec, gcm_elev, gcm_lrgcm, gcm_lrglac, dates_table, t1_idx, t2_idx, t1, t2,
+                        main_glac_debrismf=None, chunk_cells=pygem_prms.region_chunk_cells):
+    """
+    Run the mass balance of all glaciers at once with constant area and calculate their mass balance [mwea]
+    
+    The glaciers are run in chunks of at most chunk_cells glaciers x bins x months, and each chunk only models the 
+    elevation bins spanned by its glaciers, so the memory of the region-wide mass balance stays bounded.
+
+    Parameters
+    ----------
+    modelparameters : np.ndarray
+        model parameters shared by all glaciers (8,) or of each glacier (nglac, 8)
+    t1_idx, t2_idx, t1, t2 : np.ndarray
+        indices and dates of the mass balance observations of each glacier
+    chunk_cells : float
+        maximum number of glaciers x bins x months modeled at once
+
+    Returns
+    -------
+    mb_mwea : np.ndarray
+        mass balance [m w.e. a-1] of each glacier
+    """
+    main_glac_area = np.asarray(main_glac_area, dtype=float)
+    main_glac_icethickness = np.asarray(main_glac_icethickness, dtype=float)
+    nglac, nbins = main_glac_area.shape
+    modelparameters = np.broadcast_to(np.asarray(modelparameters, dtype=float), (nglac, 8))
+    nglac_chunk = max(int(chunk_cells / (nbins * gcm_temp.shape[1])), 1)
+    mb_mwea = np.zeros(nglac)
+    for glac_start in range(0, nglac, nglac_chunk):
+        glac_chunk = slice(glac_start, min(glac_start + nglac_chunk, nglac))
+        chunk_area = main_glac_area[glac_chunk].sum(axis=0)
+        if chunk_area.max() == 0:
+            continue
+        bin_window = massbalance.compact_bin_window(chunk_area, 0)
+        chunk_debrismf = None
+        if main_glac_debrismf is not None:
+            chunk_debrismf = np.asarray(main_glac_debrismf)[glac_chunk, bin_window]
+        (glac_bin_temp, glac_bin_prec, glac_bin_acc, glac_bin_refreeze, glac_bin_snowpack, glac_bin_melt,
+         glac_bin_massbalclim, glac_bin_massbalclim_annual, glac_wide_massbaltotal, glac_wide_runoff, 
+         glac_wide_area_annual, glac_wide_volume_annual) = (
+            massbalance.runmassbalance_region(
+                    modelparameters[glac_chunk], main_glac_rgi.iloc[glac_chunk], main_glac_area[glac_chunk, bin_window], 
+                    main_glac_icethickness[glac_chunk, bin_window], elev_bins[bin_window], gcm_temp[glac_chunk], 
+                    gcm_tempstd[glac_chunk], gcm_prec[glac_chunk], gcm_elev[glac_chunk], gcm_lrgcm[glac_chunk], 
+                    gcm_lrglac[glac_chunk], dates_table, main_glac_debrismf=chunk_debrismf))
+        # Mass change [km3 mwe] of each glacier and time step
+        glac_wide_area = glac_wide_area_annual[:,:-1].repeat(12, axis=1)
+        glac_wide_masschange = glac_wide_massbaltotal / 1000 * glac_wide_area
+        # Mean annual mass balance [mwea] over each glacier's observation period
+        for glac in np.where(glac_wide_area[:,0] > 0)[0]:
+            glac_region = glac_start + glac
+            mb_mwea[glac_region] = (glac_wide_masschange[glac,int(t1_idx[glac_region]):int(t2_idx[glac_region])+1]
+                                    .sum() / glac_wide_area[glac,0] * 1000 / (t2[glac_region] - t1[glac_region]))
+    return mb_mwea
+
+
+def bisect_region(mb_mwea_calc_glac, modelparameters, prm_idx, prm_bndlow, prm_bndhigh, glac_idx, mb_mwea, 
+                  observed_massbal, ddfsnow_iceratio):
+    """
+    Bisect one model parameter of the selected glaciers at once until their mass balance matches observations.
+
+    Parameters
+    ----------
+    mb_mwea_calc_glac : function
+        mass balance [mwea] of glaciers with their model parameters, mb_mwea_calc_glac(modelparameters, glac_idx)
+        (e.g., mb_mwea_calc_region of the selected glaciers)
+    modelparameters : np.ndarray
+        model parameters of each glacier (nglac, 8), updated in place
+    prm_idx : int
+        index of the model parameter (2: precipitation factor, 4: ddfsnow, 7: temperature bias)
+    prm_bndlow, prm_bndhigh : np.ndarray
+        lower and upper bounds of the parameter of each selected glacier
+    glac_idx : np.ndarray
+        indices of the glaciers to calibrate
+    mb_mwea : np.ndarray
+        modeled mass balance [mwea] of each glacier, updated in place
+    observed_massbal : np.ndarray
+        observed mass balance [mwea] of each glacier
+    ddfsnow_iceratio : float
+        ratio of ddfsnow to ddfice
+    """
+    prm_bndlow = np.array(prm_bndlow, dtype=float)
+    prm_bndhigh = np.array(prm_bndhigh, dtype=float)
+    bisect_mask = np.ones(glac_idx.shape[0], dtype=bool)
+    for nstep in range(pygem_prms.bisect_steps_region):
+        glac_idx_step = glac_idx[bisect_mask]
+        prm_mid = (prm_bndlow[bisect_mask] + prm_bndhigh[bisect_mask]) / 2
+        modelparameters[glac_idx_step, prm_idx] = prm_mid
+        modelparameters[glac_idx_step, 5] = modelparameters[glac_idx_step, 4] / ddfsnow_iceratio
+        mb_mwea[glac_idx_step] = mb_mwea_calc_glac(modelparameters[glac_idx_step], glac_idx_step)
+        # Mass balance increases with the precipitation factor and decreases with ddfsnow and tbias
+        mb_toohigh = mb_mwea[glac_idx_step] > observed_massbal[glac_idx_step]
+        if prm_idx == 2:
+            lower_prm = mb_toohigh
+        else:
+            lower_prm = ~mb_toohigh
+        prm_bndhigh[bisect_mask] = np.where(lower_prm, prm_mid, prm_bndhigh[bisect_mask])
+        prm_bndlow[bisect_mask] = np.where(lower_prm, prm_bndlow[bisect_mask], prm_mid)
+        bisect_mask[bisect_mask] = (abs(mb_mwea[glac_idx_step] - observed_massbal[glac_idx_step]) > 
+                                    pygem_prms.bisect_tol_region)
+        if not bisect_mask.any():
+            break
+
+
 def retrieve_priors(modelparameters, glacier_rgi_table, glacier_area_initial, icethickness_initial, width_initial, 
                     elev_bins, glacier_gcm_temp, glacier_gcm_tempstd, glacier_gcm_prec, glacier_gcm_elev, 
                     glacier_gcm_lrgcm, glacier_gcm_lrglac, dates_table, t1_idx, t2_idx, t1, t2, debug=False):
@@ -973,8 +1078,75 @@ def main(list_packed_vars):
         ddfsnow_iceratio = 0.5
 
         # ===== Begin processing =====
+        # Region-wide calibration of the land-terminating glaciers with ice, the others are calibrated one by one
+        glac_idx_single = np.arange(main_glac_rgi.shape[0])
+        if pygem_prms.option_calibration_region:
+            main_glac_area_region = main_glac_hyps.values.astype(float)
+            main_glac_icethickness_region = main_glac_icethickness.values.astype(float)
+            cal_idx_region = np.array([np.where(main_glac_rgi.loc[x, 'rgino_str'] == cal_data['glacno'])[0][0] 
+                                       for x in main_glac_rgi.index.values])
+            glacier_cal_data = cal_data.iloc[cal_idx_region,:]
+            t1_idx_region = glacier_cal_data['t1_idx'].values.astype(int)
+            t2_idx_region = glacier_cal_data['t2_idx'].values.astype(int)
+            # Mass balance is averaged over the observation period of each glacier as in mb_mwea_calc
+            t1_region = glacier_cal_data['t1'].values.astype(float)
+            t2_region = glacier_cal_data['t2'].values.astype(float)
+            observed_massbal_region = glacier_cal_data['mb_mwe'].values / (t2_region - t1_region)
+            glac_idx_region = np.where((main_glac_rgi['TermType'].values == 0) & 
+                                       (main_glac_icethickness_region.max(axis=1) > 0))[0]
+            glac_idx_single = np.setdiff1d(glac_idx_single, glac_idx_region)
+            
+            def mb_mwea_calc_glac(modelparameters, glac_idx):
+                """Mass balance [mwea] of the glaciers of the region with their model parameters"""
+                return mb_mwea_calc_region(
+                        modelparameters, main_glac_rgi.iloc[glac_idx], main_glac_area_region[glac_idx], 
+                        main_glac_icethickness_region[glac_idx], elev_bins, gcm_temp[glac_idx], 
+                        gcm_tempstd[glac_idx], gcm_prec[glac_idx], gcm_elev[glac_idx], gcm_lr[glac_idx], 
+                        gcm_lr[glac_idx], dates_table, t1_idx_region[glac_idx], t2_idx_region[glac_idx], 
+                        t1_region[glac_idx], t2_region[glac_idx])
+            
+            modelparameters_region = np.repeat(
+                    np.array([[pygem_prms.lrgcm, pygem_prms.lrglac, kp_init, pygem_prms.precgrad, ddfsnow_init, 
+                               ddfsnow_init / ddfsnow_iceratio, pygem_prms.tsnow_threshold, tbias_init]]), 
+                    main_glac_rgi.shape[0], axis=0)
+            mb_mwea_region = np.zeros(main_glac_rgi.shape[0])
+            # Round 1: optimize precipitation factor
+            bisect_region(mb_mwea_calc_glac, modelparameters_region, 2, np.full(glac_idx_region.shape[0], kp_bndlow), 
+                          np.full(glac_idx_region.shape[0], kp_bndhigh), glac_idx_region, mb_mwea_region, 
+                          observed_massbal_region, ddfsnow_iceratio)
+            # Round 2: optimize DDFsnow of the glaciers that do not match the observations yet
+            glac_idx_round = glac_idx_region[abs(mb_mwea_region[glac_idx_region] - 
+                                                 observed_massbal_region[glac_idx_region]) > 
+                                             pygem_prms.bisect_tol_region]
+            bisect_region(mb_mwea_calc_glac, modelparameters_region, 4, 
+                          np.full(glac_idx_round.shape[0], ddfsnow_bndlow), 
+                          np.full(glac_idx_round.shape[0], ddfsnow_bndhigh), glac_idx_round, mb_mwea_region, 
+                          observed_massbal_region, ddfsnow_iceratio)
+            # Round 3: optimize tempbias with the lower bound based on no positive temperatures at the lowest bin
+            glac_idx_round = glac_idx_region[abs(mb_mwea_region[glac_idx_region] - 
+                                                 observed_massbal_region[glac_idx_region]) > 
+                                             pygem_prms.bisect_tol_region]
+            lowest_bin = (main_glac_area_region[glac_idx_round] > 0).argmax(axis=1)
+            tbias_max_acc = -1 * (gcm_temp[glac_idx_round] + gcm_lr[glac_idx_round] * 
+                                  (elev_bins[lowest_bin] - gcm_elev[glac_idx_round])[:,np.newaxis]).max(axis=1)
+            bisect_region(mb_mwea_calc_glac, modelparameters_region, 7, tbias_max_acc, 
+                          np.full(glac_idx_round.shape[0], tbias_bndhigh), glac_idx_round, mb_mwea_region, 
+                          observed_massbal_region, ddfsnow_iceratio)
+            
+            # EXPORT TO NETCDF
+            netcdf_output_fp = (pygem_prms.output_fp_cal)
+            if not os.path.exists(netcdf_output_fp):
+                os.makedirs(netcdf_output_fp)
+            for glac in glac_idx_region:
+                glacier_str = '{0:0.5f}'.format(main_glac_rgi.loc[main_glac_rgi.index.values[glac],'RGIId_float'])
+                if debug:
+                    print(count, glacier_str, 'mb_mwea:', np.round(mb_mwea_region[glac],2), 
+                          'obs_mwea:', np.round(observed_massbal_region[glac],2))
+                write_netcdf_modelparams(netcdf_output_fp + glacier_str + '.nc', modelparameters_region[glac], 
+                                         mb_mwea_region[glac], observed_massbal_region[glac])
+        
         # loop through each glacier selected
-        for glac in range(main_glac_rgi.shape[0]):
+        for glac in glac_idx_single:
 
             if debug:
                 print(count, main_glac_rgi.loc[main_glac_rgi.index.values[glac],'RGIId_float'])
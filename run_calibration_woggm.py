@@ -12,6 +12,7 @@ import collections
 import inspect
 import multiprocessing
 import os
+import sys
 import time
 # External libraries
 import pandas as pd
@@ -28,12 +29,14 @@ import xarray as xr
 import class_climate
 #import class_mbdata
 import pygem.pygem_input as pygem_prms
-from pygem.massbalance import PyGEMMassBalance
+from pygem.massbalance import PyGEMMassBalance, PyGEMMassBalanceBatch
 #from pygem.glacierdynamics import MassRedistributionCurveModel
 from pygem.oggm_compat import single_flowline_glacier_directory, single_flowline_glacier_directory_with_calving
 import pygemfxns_gcmbiasadj as gcmbiasadj
 import pygemfxns_modelsetup as modelsetup
 import spc_split_glaciers as split_glaciers
+import pygem.utils._manifest as run_manifest
+import pygem.utils._scheduler as scheduler
 
 from oggm import cfg
 from oggm import graphics
@@ -65,6 +68,16 @@ def getparser():
         option to keep glaciers ordered or to grab every n value for the batch
         (the latter helps make sure run times on each core are similar as it removes any timing differences caused by
          regional variations)
+    option_scheduler : int
+        option to hand batches of glaciers, largest first, to the cores as they become free (1) or to split the
+        glaciers into one list per core (0, default)
+    resume : int
+        option to skip the glaciers that are done in the manifest of the calibration and batch and retry the ones
+        that failed (1), or to run all glaciers again (0)
+    reset_manifest : int
+        option to remove all records of the manifest of the calibration and batch before the run (1) or not (0)
+    max_attempts : int
+        number of times a glacier that fails is run (in this run and the resumed runs) before it is given up
     progress_bar : int
         Switch for turning the progress bar on or off (default = 0 (off))
     debug : int
@@ -86,6 +99,14 @@ def getparser():
                         help='Filename containing list of rgi_glac_number, helpful for running batches on spc')
     parser.add_argument('-option_ordered', action='store', type=int, default=1,
                         help='switch to keep lists ordered or not')
+    parser.add_argument('-option_scheduler', action='store', type=int, default=0,
+                        help='switch to schedule glaciers largest first on free cores (1) or use fixed lists (0)')
+    parser.add_argument('-resume', action='store', type=int, default=0,
+                        help='switch to skip the glaciers that are done in the manifest (1) or run all glaciers (0)')
+    parser.add_argument('-reset_manifest', action='store', type=int, default=0,
+                        help='switch to remove all records of the manifest before the run (1) or not (0)')
+    parser.add_argument('-max_attempts', action='store', type=int, default=2,
+                        help='number of times a glacier that fails is run before it is given up')
     parser.add_argument('-progress_bar', action='store', type=int, default=0,
                         help='Boolean for the progress bar to turn it on or off (default 0 is off)')
     parser.add_argument('-debug', action='store', type=int, default=0,
@@ -141,6 +162,42 @@ def mb_mwea_calc(gdir, modelprms, glacier_rgi_table, fls=None, t1=None, t2=None,
         return mb_mwea
     
     
+def mb_mwea_calc_batch(gdir, modelprms, glacier_rgi_table, fls=None, return_tbias_mustmelt=False):
+    """
+    Run the mass balance for many parameter sets at once and calculate the mass balance [mwea] of each set
+
+    Parameters
+    ----------
+    modelprms : dict
+        model parameters, where each parameter is a float or an array with one value per parameter set
+
+    Returns
+    -------
+    mb_mwea : np.array
+        mass balance [m w.e. a-1] of each parameter set
+    """
+    # RUN MASS BALANCE MODEL
+    mbmod = PyGEMMassBalanceBatch(gdir, modelprms, glacier_rgi_table, fls=fls)
+    years = np.arange(0, int(gdir.dates_table.shape[0]/12))
+    for year in years:
+        mbmod.get_annual_mb(fls[0].surface_h, year=year)
+
+    # Option for must melt condition
+    if return_tbias_mustmelt:
+        # Number of years and bins with negative climatic mass balance
+        nbinyears_negmbclim = (mbmod.glac_bin_massbalclim_annual < 0).sum(axis=(1,2))
+        return nbinyears_negmbclim
+    # Otherwise return specific mass balance
+    else:
+        # Specific mass balance [mwea]
+        t1_idx = gdir.mbdata['t1_idx']
+        t2_idx = gdir.mbdata['t2_idx']
+        nyears = gdir.mbdata['nyears']
+        mb_mwea = (mbmod.glac_wide_massbaltotal[:,t1_idx:t2_idx+1].sum(1) / mbmod.glac_wide_area_annual[:,0] /
+                   nyears)
+        return mb_mwea
+
+
 def retrieve_tbias_bnds(gdir, modelprms, glacier_rgi_table, fls=None, debug=False):
     """
     Calculate parameters for prior distributions for the MCMC analysis
@@ -216,6 +273,48 @@ def retrieve_tbias_bnds(gdir, modelprms, glacier_rgi_table, fls=None, debug=Fals
 
     
 #%%
+def manifest_fn(batch=None):
+    """
+    Filename of the manifest of the completed and failed glaciers of the calibration and batch (see batch_name)
+    """
+    manifest_fn = ('manifest_calibration_' + str(pygem_prms.option_calibration) + '_' + str(pygem_prms.ref_startyear) +
+                   '_' + str(pygem_prms.ref_endyear))
+    if batch is not None:
+        manifest_fn += '_' + batch
+    return pygem_prms.output_sim_fp + manifest_fn + '.sqlite'
+
+
+# Manifest of the calibration and task (reference climate) of the glaciers that main runs, set by run_glaciers
+_manifest = None
+
+
+def run_glaciers(list_packed_vars):
+    """
+    Calibration of the glaciers of a batch that are pending in the manifest of the calibration
+
+    main records each glacier in the manifest when it starts and when its model parameters are exported. If a glacier
+    fails, its traceback is recorded and the other glaciers of the batch continue; failed glaciers are run again up to
+    max_attempts.
+
+    Parameters
+    ----------
+    list_packed_vars : list
+        count, glacier numbers and gcm_name
+    """
+    global _manifest
+    count, glac_no, gcm_name = list_packed_vars
+    parser = getparser()
+    args = parser.parse_args()
+    batch = run_manifest.batch_name(glac_number_fn=args.rgi_glac_number_fn)
+    _manifest = (run_manifest.RunManifest(manifest_fn(batch)), gcm_name)
+    try:
+        run_manifest.run_pending(lambda glac_no_pending: main([count, glac_no_pending, gcm_name]), glac_no,
+                                 _manifest[0], gcm_name, max_attempts=args.max_attempts,
+                                 raise_errors=(args.debug == 1), resume=(args.resume == 1))
+    finally:
+        _manifest = None
+
+
 def main(list_packed_vars):
     """
     Model simulation
@@ -277,6 +376,9 @@ def main(list_packed_vars):
         # Select subsets of data
         glacier_rgi_table = main_glac_rgi.loc[main_glac_rgi.index.values[glac], :]
         glacier_str = '{0:0.5f}'.format(glacier_rgi_table['RGIId_float'])
+        output_fns = []
+        if _manifest is not None:
+            _manifest[0].record_start(glacier_str, _manifest[1])
 
         # ===== Load glacier data: area (km2), ice thickness (m), width (km) =====
         if glacier_rgi_table['TermType'] == 1:
@@ -931,6 +1033,7 @@ def main(list_packed_vars):
                     modelprms_dict = {pygem_prms.option_calibration: modelprms}
                 with open(modelprms_fullfn, 'wb') as f:
                     pickle.dump(modelprms_dict, f)
+                output_fns.append(modelprms_fullfn)
                     
                     
             #%% ===== MODIFIED HUSS AND HOCK (2015) CALIBRATION =====
@@ -1161,6 +1264,7 @@ def main(list_packed_vars):
                     modelprms_dict = {pygem_prms.option_calibration: modelprms}
                 with open(modelprms_fullfn, 'wb') as f:
                     pickle.dump(modelprms_dict, f)
+                output_fns.append(modelprms_fullfn)
                     
                     
             #%% ===== EMULATOR TO SETUP MCMC ANALYSIS =====
@@ -1273,18 +1377,22 @@ def main(list_packed_vars):
                 if debug:    
                     print('ddfsnow random:', ddfsnow_random.mean(), ddfsnow_random.std(),'\n')
                 
-                # Run through random values
-                for nsim in range(pygem_prms.emulator_sims):
-                    modelprms['tbias'] = tbias_random[nsim]
-                    modelprms['kp'] = kp_random[nsim]
-                    modelprms['ddfsnow'] = ddfsnow_random[nsim]
-                    modelprms['ddfice'] = modelprms['ddfsnow'] / pygem_prms.ddfsnow_iceratio
-                    mb_mwea = mb_mwea_calc(gdir, modelprms, glacier_rgi_table, fls=fls)
-                    output_single = np.array([modelprms['tbias'], modelprms['kp'], modelprms['ddfsnow'], mb_mwea])
-                    output_all = np.vstack((output_all, output_single))
-                    if debug and nsim%500 == 0:
-                        print(nsim, 'tbias:', np.round(modelprms['tbias'],2), 'kp:', np.round(modelprms['kp'],2),
-                              'ddfsnow:', np.round(modelprms['ddfsnow'],4), 'mb_mwea:', np.round(mb_mwea,3))
+                # Run through random values in batches of parameter sets
+                for nsim in range(0, pygem_prms.emulator_sims, pygem_prms.emulator_batchsize):
+                    nsim_batch = np.arange(nsim, min(nsim + pygem_prms.emulator_batchsize, pygem_prms.emulator_sims))
+                    modelprms_batch = modelprms.copy()
+                    modelprms_batch['tbias'] = tbias_random[nsim_batch]
+                    modelprms_batch['kp'] = kp_random[nsim_batch]
+                    modelprms_batch['ddfsnow'] = ddfsnow_random[nsim_batch]
+                    modelprms_batch['ddfice'] = modelprms_batch['ddfsnow'] / pygem_prms.ddfsnow_iceratio
+                    mb_mwea = mb_mwea_calc_batch(gdir, modelprms_batch, glacier_rgi_table, fls=fls)
+                    output_batch = np.column_stack((modelprms_batch['tbias'], modelprms_batch['kp'],
+                                                    modelprms_batch['ddfsnow'], mb_mwea))
+                    output_all = np.vstack((output_all, output_batch))
+                    if debug:
+                        print(nsim, 'tbias:', np.round(modelprms_batch['tbias'][0],2),
+                              'kp:', np.round(modelprms_batch['kp'][0],2),
+                              'ddfsnow:', np.round(modelprms_batch['ddfsnow'][0],4), 'mb_mwea:', np.round(mb_mwea[0],3))
                 
                 # ----- EXPORT RESULTS -----
                 output_df = pd.DataFrame(output_all, columns=['tbias', 'kp', 'ddfsnow', 'mb_mwea'])
@@ -1293,6 +1401,11 @@ def main(list_packed_vars):
                     os.makedirs(output_fp)
                 output_fn = glacier_str + '-' + str(pygem_prms.emulator_sims) + '_emulator_sims.csv'
                 output_df.to_csv(output_fp + output_fn, index=False)
+                output_fns.append(output_fp + output_fn)
+
+        # Record the glacier and the checksum of its output in the manifest
+        if _manifest is not None:
+            _manifest[0].record_success(glacier_str, _manifest[1], output_fns)
 
 
     # Global variables for Spyder development
@@ -1334,12 +1447,27 @@ if __name__ == '__main__':
         num_cores = 1
 
     # Glacier number lists to pass for parallel processing
-    glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
+    if args.option_parallels != 0 and args.option_scheduler == 1:
+        # largest glaciers first (cost from area and number of elevation bins) in batches that get smaller
+        main_glac_rgi_schedule = modelsetup.selectglaciersrgitable(glac_no=glac_no)
+        glac_costs = scheduler.glacier_costs(
+                main_glac_rgi_schedule['Area'].values,
+                (main_glac_rgi_schedule['Zmax'] - main_glac_rgi_schedule['Zmin']).values / pygem_prms.binsize + 1)
+        glac_no_lsts = scheduler.schedule_batches(list(main_glac_rgi_schedule['rgino_str'].values), glac_costs, 
+                                                  num_cores)
+    else:
+        glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
 
     # Read GCM names from argument parser
     gcm_name = args.ref_gcm_name
     print('Processing:', gcm_name)
     
+    # Manifest of the completed and failed glaciers of the calibration
+    manifest = run_manifest.RunManifest(manifest_fn(run_manifest.batch_name(glac_number_fn=args.rgi_glac_number_fn)))
+    if args.reset_manifest == 1:
+        manifest.reset()
+    manifest_run = manifest.start_run(n_workers=num_cores)
+
     # Pack variables for multiprocessing
     list_packed_vars = []
     for count, glac_no_lst in enumerate(glac_no_lsts):
@@ -1348,18 +1476,30 @@ if __name__ == '__main__':
     # Parallel processing
     if args.option_parallels != 0:
         print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-        with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-            p.map(main,list_packed_vars)
+        if args.option_scheduler == 1:
+            records, time_pool_start, time_pool_end = scheduler.run_scheduled(run_glaciers, list_packed_vars,
+                                                                              num_cores)
+            print(scheduler.utilisation_report(records, time_pool_start, time_pool_end, n_workers=num_cores))
+        else:
+            with multiprocessing.Pool(args.num_simultaneous_processes) as p:
+                p.map(run_glaciers,list_packed_vars)
     # If not in parallel, then only should be one loop
     else:
         # Loop through the chunks and export bias adjustments
         for n in range(len(list_packed_vars)):
-            main(list_packed_vars[n])
+            run_glaciers(list_packed_vars[n])
 
+    manifest.end_run(manifest_run)
+    print(manifest.report())
 
 
     print('Total processing time:', time.time()-time_start, 's')
 
+    # Glaciers that failed make the run fail, so the job is not reported as successful
+    glac_no_failed = manifest.failed(glac_no, gcm_name)
+    if len(glac_no_failed) > 0:
+        sys.exit(str(len(glac_no_failed)) + ' glaciers failed (see ' + manifest.path + ')')
+
 
 #%% ===== PLOTTING AND PROCESSING FOR MODEL DEVELOPMENT =====
     # Place local variables in variable explorer
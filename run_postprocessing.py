@@ -14,6 +14,7 @@ import pygem.pygem_input as pygem_prms
 import pygemfxns_modelsetup as modelsetup
 import pygemfxns_gcmbiasadj as gcmbiasadj
 import run_simulation as simulation
+from pygem.utils._merge import merge_files_parallel
 
 
 #%run run_postprocessing.py -gcm_name='ERA-Interim' -merge_batches=1
@@ -34,6 +35,8 @@ def getparser():
         representative concentration pathway (ex. 'rcp26')
     merge_batches (optional) : int
         switch to run merge_batches fxn (1 merge, 0 ignore)
+    num_simultaneous_processes (optional) : int
+        number of regions and rcp scenarios merged at the same time by merge_batches
     debug : int
         Switch for turning debug printing on or off (default = 0 (off))
         
@@ -57,6 +60,8 @@ def getparser():
                         help='Switch to delete batch files or not (1-delete)')
     parser.add_argument('-merge_batches', action='store', type=int, default=0,
                         help='Switch to merge batches or not (1-merge)')
+    parser.add_argument('-num_simultaneous_processes', action='store', type=int, default=1,
+                        help='number of regions and rcp scenarios merged at the same time')
     parser.add_argument('-extract_subset', action='store', type=int, default=0,
                         help='Switch to extract a subset of variables or not (1-yes)')
     parser.add_argument('-unzip_files', action='store', type=int, default=0,
@@ -260,8 +265,13 @@ if option_multimodel == 1:
                     #%%
 
 def merge_batches(gcm_name, output_sim_fp=pygem_prms.output_sim_fp, rcp=None,
-                  option_remove_merged_files=0, option_remove_batch_files=0, debug=False):   
-    """ MERGE BATCHES """
+                  option_remove_merged_files=0, option_remove_batch_files=0, num_simultaneous_processes=1,
+                  debug=False):   
+    """ MERGE BATCHES 
+    
+    The batches of each region and rcp scenario are merged into one internally compressed file in spc_merged (see
+    merge_files), which is zipped to spc_zipped.
+    """
     
 #for gcm_name in ['CCSM4', 'GFDL-CM3', 'GFDL-ESM2M', 'GISS-E2-R', 'IPSL-CM5A-LR', 'MIROC5', 'MRI-CGCM3', 'NorESM1-M']:
 #    debug=True
@@ -306,17 +316,9 @@ def merge_batches(gcm_name, output_sim_fp=pygem_prms.output_sim_fp, rcp=None,
         print('Regions:', regions, 
               '\nRCPs:', rcps)
     
-    # Encoding
-    # Add variables to empty dataset and merge together
-    encoding = {}
-    noencoding_vn = ['stats', 'glac_attrs']
-    if pygem_prms.output_package == 2:
-        for vn in pygem_prms.output_variables_package2:
-            # Encoding (specify _FillValue, offsets, etc.)
-            if vn not in noencoding_vn:
-                encoding[vn] = {'_FillValue': False}
-    
-    
+    # Batches of each region and rcp scenario, merged at the same time
+    merge_tasks = []
+    batch_lists = []
     for reg in regions:
         
         check_str = 'R' + str(reg) + '_' + gcm_name
@@ -330,51 +332,41 @@ def merge_batches(gcm_name, output_sim_fp=pygem_prms.output_sim_fp, rcp=None,
                 print('Region(s)', reg, 'RCP', rcp, ':', 'check_str:', check_str)
             
             output_list = []
-            merged_list = []
             
             for i in os.listdir(netcdf_fp):
                 if i.startswith(check_str) and splitter in i:
                     output_list.append([int(i.split(splitter)[1].split('.')[0]), i])
             output_list = sorted(output_list)
             output_list = [i[1] for i in output_list]
-            
-            # Open datasets and combine
-            count_ds = 0
-            for i in output_list:
-                if debug:
-                    print(i)
-                count_ds += 1
-                ds = xr.open_dataset(netcdf_fp + i)
-                # Merge datasets of stats into one output
-                if count_ds == 1:
-                    ds_all = ds
-                else:
-                    ds_all = xr.concat([ds_all, ds], dim='glac')
-            ds_all.glac.values = np.arange(0,len(ds_all.glac.values))
-            ds_all_fn = i.split(splitter)[0] + '.nc'
-            # Export to netcdf
-            ds_all.to_netcdf(merged_fp + ds_all_fn, encoding=encoding)
-            
-            print('Merged ', gcm_name, rcp, 'Region(s)', reg)
-            
-            merged_list.append(merged_fp + ds_all_fn)
+            if len(output_list) == 0:
+                continue
             
             if debug:
-                print(merged_list)
+                print(output_list)
             
-            # Zip file to reduce file size
-            with zipfile.ZipFile(zipped_fp + ds_all_fn + '.zip', mode='w', compression=zipfile.ZIP_DEFLATED) as myzip:
-                myzip.write(merged_fp + ds_all_fn, arcname=ds_all_fn)
-                
-            # Remove unzipped files
-            if option_remove_merged_files == 1:
-                for i in merged_list:
-                    os.remove(i)
+            ds_all_fn = output_list[-1].split(splitter)[0] + '.nc'
+            merge_tasks.append(([netcdf_fp + i for i in output_list], merged_fp + ds_all_fn))
+            batch_lists.append(output_list)
+    
+    merge_files_parallel(merge_tasks, n_workers=num_simultaneous_processes, complevel=pygem_prms.output_complevel,
+                         chunks=pygem_prms.output_chunks)
+    
+    for (batch_fns, ds_all_fn), output_list in zip(merge_tasks, batch_lists):
+        print('Merged ', gcm_name, ds_all_fn)
+        
+        # Zip file to reduce file size
+        with zipfile.ZipFile(zipped_fp + os.path.basename(ds_all_fn) + '.zip', mode='w',
+                             compression=zipfile.ZIP_DEFLATED) as myzip:
+            myzip.write(ds_all_fn, arcname=os.path.basename(ds_all_fn))
             
-            if option_remove_batch_files == 1:
-                # Remove batch files
-                for i in output_list:
-                    os.remove(netcdf_fp + i)
+        # Remove unzipped files
+        if option_remove_merged_files == 1:
+            os.remove(ds_all_fn)
+            
+        if option_remove_batch_files == 1:
+            # Remove batch files
+            for i in output_list:
+                os.remove(netcdf_fp + i)
   
 
 #def extract_subset(gcm_name, netcdf_fp=pygem_prms.output_sim_fp):
@@ -894,7 +886,8 @@ if __name__ == '__main__':
     if args.merge_batches == 1:
         merge_batches(args.gcm_name, output_sim_fp=args.output_sim_fp, rcp=args.rcp,
                       option_remove_merged_files=args.option_remove_merged_files,
-                      option_remove_batch_files=args.option_remove_batch_files)
+                      option_remove_batch_files=args.option_remove_batch_files,
+                      num_simultaneous_processes=args.num_simultaneous_processes, debug=debug)
         
     if args.extract_subset == 1:
         extract_subset(args.gcm_name, rcp_scenario=args.rcp, region_no=args.region, netcdf_fp=args.output_sim_fp,
@@ -9,10 +9,13 @@
 # Built-in libraries
 import argparse
 import collections
+import copy
+import functools
 import inspect
 import multiprocessing
 import os
 import resource
+import sys
 import time
 # External libraries
 import pandas as pd
@@ -27,6 +30,12 @@ import pygemfxns_gcmbiasadj as gcmbiasadj
 import pygemfxns_massbalance as massbalance
 import pygemfxns_modelsetup as modelsetup
 import spc_split_glaciers as split_glaciers
+from pygem.utils._ensemble_stats import EnsembleStats
+from pygem.utils._encoding import output_encoding
+import pygem.utils._manifest as run_manifest
+from pygem.utils._output_container import GlacierContainer
+import pygem.utils._scheduler as scheduler
+import pygem.utils._shared_arrays as shared_arrays
 
 
 #%% FUNCTIONS
@@ -54,6 +63,24 @@ def getparser():
         option to keep glaciers ordered or to grab every n value for the batch
         (the latter helps make sure run times on each core are similar as it removes any timing differences caused by
          regional variations)
+    option_scheduler : int
+        option to hand batches of glaciers, largest first, to the cores as they become free (1) or to split the
+        glaciers into one list per core (0, default)
+    rcp_list (optional) : list
+        rcp scenarios to run each gcm of gcm_list_fn for (default: the rcp of gcm_list_fn or rcp)
+    option_persistent_workers : int
+        option to run all gcms and rcps on one pool of workers, which load the glacier data and the reference climate
+        of their glaciers once (1), or to start a new pool for each gcm (0, default)
+    option_shared_memory : int
+        option to load the glacier data and reference climate of all glaciers once in the parent process and share
+        them with the workers through shared memory (1), or to load them in each worker (0)
+    resume : int
+        option to skip the glaciers that are done in the manifest of the run configuration and batch and retry the ones
+        that failed (1), or to run all glaciers again (0)
+    reset_manifest : int
+        option to remove all records of the manifest of the run configuration and batch before the run (1) or not (0)
+    max_attempts : int
+        number of times a glacier that fails is run (in this run and the resumed runs) before it is given up
     debug (optional) : int
         Switch for turning debug printing on or off (default = 0 (off))
     debug_spc (optional) : int
@@ -81,6 +108,20 @@ def getparser():
                         help='Batch number used to differentiate output on supercomputer')
     parser.add_argument('-option_ordered', action='store', type=int, default=1,
                         help='switch to keep lists ordered or not')
+    parser.add_argument('-option_scheduler', action='store', type=int, default=0,
+                        help='switch to schedule glaciers largest first on free cores (1) or use fixed lists (0)')
+    parser.add_argument('-rcp_list', action='store', type=str, nargs='+', default=None,
+                        help='rcp scenarios to run each gcm for (ex. rcp26 rcp45)')
+    parser.add_argument('-option_persistent_workers', action='store', type=int, default=0,
+                        help='switch to run all gcms and rcps on one pool of workers (1) or a pool per gcm (0)')
+    parser.add_argument('-option_shared_memory', action='store', type=int, default=0,
+                        help='switch to share the glacier data and reference climate with the workers (1) or not (0)')
+    parser.add_argument('-resume', action='store', type=int, default=0,
+                        help='switch to skip the glaciers that are done in the manifest (1) or run all glaciers (0)')
+    parser.add_argument('-reset_manifest', action='store', type=int, default=0,
+                        help='switch to remove all records of the manifest before the run (1) or not (0)')
+    parser.add_argument('-max_attempts', action='store', type=int, default=2,
+                        help='number of times a glacier that fails is run before it is given up')
     parser.add_argument('-debug', action='store', type=int, default=0,
                         help='Boolean for debugging to turn it on or off (default 0 is off')
     parser.add_argument('-debug_spc', action='store', type=int, default=0,
@@ -121,14 +162,33 @@ def calc_stats_array(data, stats_cns=pygem_prms.sim_stat_cns):
     return stats
 
 
-def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms.gcm_wateryear):
+def ensemble_stats(nt, sim_iters):
     """
-    Create empty xarray dataset that will be used to record simulation runs.
+    Statistics of a variable over the simulations of a glacier, updated as each simulation finishes
+
+    Parameters
+    ----------
+    nt : int
+        number of time steps
+    sim_iters : int
+        number of simulations
+
+    Returns
+    -------
+    stats : EnsembleStats
+        streaming mean, std and percentiles, or the output of all simulations if option_exact_stats
+    """
+    return EnsembleStats(nt, stats_cns=pygem_prms.sim_stat_cns, sketch_size=pygem_prms.sim_stat_sketch_size,
+                         exact=pygem_prms.option_exact_stats, nsims=sim_iters)
+
+
+def create_xrdataset_template(dates_table, option_wateryear=pygem_prms.gcm_wateryear):
+    """
+    Create the empty xarray dataset of one glacier (glacier index 0, no RGI values) with the variables, coordinates
+    and attributes that depend on the run configuration only.
 
     Parameters
     ----------
-    main_glac_rgi : pandas dataframe
-        dataframe containing relevant rgi glacier information
     dates_table : pandas dataframe
         table of the dates, months, days in month, etc.
 
@@ -142,7 +202,7 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
     if pygem_prms.output_package == 2:
         # Create empty datasets for each variable and merge them
         # Coordinate values
-        glac_values = np.array([glacier_rgi_table.name])
+        glac_values = np.array([0])
         annual_columns = np.unique(dates_table['wateryear'].values)[0:int(dates_table.shape[0]/12)]
         time_values = dates_table.loc[pygem_prms.gcm_spinupyears*12:dates_table.shape[0]+1,'date'].tolist()
         year_values = annual_columns[pygem_prms.gcm_spinupyears:annual_columns.shape[0]]
@@ -453,7 +513,6 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
             
         # Add variables to empty dataset and merge together
         count_vn = 0
-        encoding = {}
         for vn in output_coords_dict.keys():
             count_vn += 1
             empty_holder = np.zeros([len(output_coords_dict[vn][i]) for i in list(output_coords_dict[vn].keys())])
@@ -464,20 +523,59 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
                 output_ds_all = output_ds
             else:
                 output_ds_all = xr.merge((output_ds_all, output_ds))
-        noencoding_vn = ['RGIId']
         # Add attributes
         for vn in output_ds_all.variables:
             try:
                 output_ds_all[vn].attrs = output_attrs_dict[vn]
             except:
                 pass
-            # Encoding (specify _FillValue, offsets, etc.)
-            
-            if vn not in noencoding_vn:
-                encoding[vn] = {'_FillValue': False,
-                                'zlib':True,
-                                'complevel':9
-                                }
+        # Encoding (data type, packing, chunks and compression; see output_encoding)
+        encoding = output_encoding(output_ds_all, profile=pygem_prms.output_encoding_profile,
+                                   complevel=pygem_prms.output_complevel, chunks=pygem_prms.output_chunks,
+                                   pack_ranges=pygem_prms.output_pack_ranges, exclude=['RGIId'])
+        
+        output_ds.attrs = {'source': 'PyGEMv0.1.0',
+                           'institution': 'University of Alaska Fairbanks, Fairbanks, AK',
+                           'history': 'Created by David Rounce (drounce@alaska.edu) on ' + pygem_prms.model_run_date,
+                           'references': 'doi:10.3389/feart.2019.00331 and doi:10.1017/jog.2019.91' }
+        
+    return output_ds_all, encoding
+
+
+# Empty output dataset and encoding of each dates table and year type (see create_xrdataset)
+_xrdataset_templates = {}
+
+
+def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms.gcm_wateryear):
+    """
+    Create empty xarray dataset that will be used to record simulation runs.
+
+    The variables, coordinates and attributes are the same for every glacier of a run configuration, so the dataset is
+    created once (see create_xrdataset_template) and copied for each glacier.
+
+    Parameters
+    ----------
+    main_glac_rgi : pandas dataframe
+        dataframe containing relevant rgi glacier information
+    dates_table : pandas dataframe
+        table of the dates, months, days in month, etc.
+
+    Returns
+    -------
+    output_ds_all : xarray Dataset
+        empty xarray dataset that contains variables and attributes to be filled in by simulation runs
+    encoding : dictionary
+        encoding used with exporting xarray dataset to netcdf
+    """
+    if pygem_prms.output_package == 2:
+        template_key = (option_wateryear, pygem_prms.gcm_spinupyears, dates_table.shape[0],
+                        str(dates_table['date'].values[0]), str(dates_table['date'].values[-1]))
+        if template_key not in _xrdataset_templates:
+            _xrdataset_templates[template_key] = create_xrdataset_template(dates_table, option_wateryear)
+        output_ds_template, encoding = _xrdataset_templates[template_key]
+        output_ds_all = output_ds_template.copy(deep=True).assign_coords(
+                glac=output_ds_template['glac'].copy(data=np.array([glacier_rgi_table.name])))
+        encoding = copy.deepcopy(encoding)
         output_ds_all['RGIId'].values = np.array(['RGI60-' + str(int(glacier_rgi_table.loc['O1Region'])).zfill(2) + 
                                          '.' + str(int(glacier_rgi_table.loc['glacno'])).zfill(5)])
         output_ds_all['CenLon'].values = np.array([glacier_rgi_table.CenLon])
@@ -485,12 +583,7 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
         output_ds_all['O1Region'].values = np.array([glacier_rgi_table.O1Region])
         output_ds_all['O2Region'].values = np.array([glacier_rgi_table.O2Region])
         output_ds_all['Area'].values = np.array([glacier_rgi_table.Area])
-        
-        output_ds.attrs = {'source': 'PyGEMv0.1.0',
-                           'institution': 'University of Alaska Fairbanks, Fairbanks, AK',
-                           'history': 'Created by David Rounce (drounce@alaska.edu) on ' + pygem_prms.model_run_date,
-                           'references': 'doi:10.3389/feart.2019.00331 and doi:10.1017/jog.2019.91' }
-        
+
     return output_ds_all, encoding
 
 
@@ -608,6 +701,312 @@ def convert_glacwide_results(elev_bins, glac_bin_temp, glac_bin_prec, glac_bin_a
             glac_wide_area_annual, glac_wide_volume_annual, glac_wide_ELA_annual)
 
 
+# Glacier data and reference climate loaded by a worker for its glaciers {key: data}, None if not caching
+_worker_cache = None
+
+
+def cached(key, fxn, *args, **kwargs):
+    """
+    Result of fxn(*args, **kwargs), loaded once while the worker runs the gcms of a batch (see main_gcms)
+
+    Parameters
+    ----------
+    key : tuple
+        key of the data, including everything that it depends on (e.g., the glacier numbers and dates)
+    fxn : function
+        function that loads the data
+
+    Returns
+    -------
+    data : object
+        copy of the data, so the cached data is not modified by the model run
+    """
+    if _worker_cache is None:
+        return fxn(*args, **kwargs)
+    if key not in _worker_cache:
+        _worker_cache[key] = fxn(*args, **kwargs)
+    return copy.deepcopy(_worker_cache[key])
+
+
+def load_glacier_data(glac_no):
+    """
+    RGI table, hypsometry, ice thickness, width and debris factors of the glaciers
+
+    Parameters
+    ----------
+    glac_no : list
+        glacier numbers (e.g., ['15.03733'])
+
+    Returns
+    -------
+    main_glac_rgi, main_glac_hyps, main_glac_icethickness, main_glac_width, main_glac_debrisfactor : pd.DataFrame
+        glacier data (hypsometry [km2], thickness [m] and width [km] for each elevation bin)
+    """
+    main_glac_rgi = modelsetup.selectglaciersrgitable(glac_no=glac_no)
+    # Glacier hypsometry [km**2], total area
+    main_glac_hyps = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.hyps_filepath, pygem_prms.hyps_filedict,
+                                                 pygem_prms.hyps_colsdrop)
+    # Ice thickness [m], average
+    main_glac_icethickness = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.thickness_filepath,
+                                                         pygem_prms.thickness_filedict, pygem_prms.thickness_colsdrop)
+    main_glac_icethickness[main_glac_icethickness < 0] = 0
+    main_glac_hyps[main_glac_icethickness == 0] = 0
+    # Width [km], average
+    main_glac_width = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.width_filepath, pygem_prms.width_filedict,
+                                                  pygem_prms.width_colsdrop)
+    # Volume [km**3] and mean elevation [m a.s.l.]
+    main_glac_rgi['Volume'], main_glac_rgi['Zmean'] = modelsetup.hypsometrystats(main_glac_hyps, main_glac_icethickness)
+    # Sub-debris melt enhancement factors
+    if pygem_prms.include_debris:
+        assert 0==1, 'Need to set up debris factors'
+        main_glac_debrisfactor = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.debris_fp, 
+                                                             pygem_prms.debris_filedict, pygem_prms.debris_colsdrop)
+    else:
+        main_glac_debrisfactor = np.zeros(main_glac_hyps.shape) + 1
+    main_glac_debrisfactor[main_glac_hyps == 0] = 0
+    return main_glac_rgi, main_glac_hyps, main_glac_icethickness, main_glac_width, main_glac_debrisfactor
+
+
+def ref_dates_table():
+    """
+    Dates of the reference climate used for the bias adjustments, limited to the years of the simulation
+
+    Returns
+    -------
+    dates_table_ref : pd.DataFrame
+        dates of the reference climate
+    ref_startyear, ref_endyear : int
+        first and last year of the reference climate
+    """
+    # Adjust reference dates in event that reference is longer than GCM data
+    if pygem_prms.startyear >= pygem_prms.gcm_startyear:
+        ref_startyear = pygem_prms.startyear
+    else:
+        ref_startyear = pygem_prms.gcm_startyear
+    if pygem_prms.endyear <= pygem_prms.gcm_endyear:
+        ref_endyear = pygem_prms.endyear
+    else:
+        ref_endyear = pygem_prms.gcm_endyear
+    dates_table_ref = modelsetup.datesmodelrun(startyear=ref_startyear, endyear=ref_endyear,
+                                               spinupyears=pygem_prms.ref_spinupyears,
+                                               option_wateryear=pygem_prms.ref_wateryear)
+    return dates_table_ref, ref_startyear, ref_endyear
+
+
+def ref_climate_vns(gcm_list):
+    """
+    Reference climate variables used by the simulations of the gcms (bias adjustments, lapse rates, temperature std)
+    """
+    ref_vns = []
+    if any([x not in ['ERA5', 'ERA-Interim', 'COAWST'] for x in gcm_list]):
+        if pygem_prms.option_synthetic_sim == 0:
+            ref_vns.append('lr')
+            if pygem_prms.option_ablation == 2 and pygem_prms.ref_gcm_name in ['ERA5']:
+                ref_vns.append('tempstd')
+        if pygem_prms.option_bias_adjustment != 0:
+            ref_vns.extend(['temp', 'prec', 'elev'])
+    return ref_vns
+
+
+def share_region_data(glac_no, gcm_list):
+    """
+    Load the glacier data and reference climate of all glaciers once and copy the arrays into shared memory
+
+    Parameters
+    ----------
+    glac_no : list
+        glacier numbers of the run
+    gcm_list : list
+        gcm names of the run (to select the reference climate variables that are needed)
+
+    Returns
+    -------
+    blocks : list
+        shared memory blocks, which must be released by the parent process at the end of the run
+    initargs : tuple
+        arguments of init_shared_worker (array specifications, RGI table, column names and reference dates)
+    """
+    (main_glac_rgi, main_glac_hyps, main_glac_icethickness, main_glac_width, main_glac_debrisfactor) = (
+            load_glacier_data(glac_no))
+    arrays = {'hyps': main_glac_hyps.values, 'icethickness': main_glac_icethickness.values,
+              'width': main_glac_width.values, 'debrisfactor': np.asarray(main_glac_debrisfactor, dtype=float)}
+    ref_dates = None
+    ref_vns = ref_climate_vns(gcm_list)
+    if len(ref_vns) > 0:
+        ref_gcm = class_climate.GCM(name=pygem_prms.ref_gcm_name)
+        dates_table_ref, ref_startyear, ref_endyear = ref_dates_table()
+        for vn in ref_vns:
+            if vn == 'elev':
+                arrays['ref_elev'] = ref_gcm.importGCMfxnearestneighbor_xarray(ref_gcm.elev_fn, ref_gcm.elev_vn,
+                                                                               main_glac_rgi)
+            else:
+                arrays['ref_' + vn], ref_dates = ref_gcm.importGCMvarnearestneighbor_xarray(
+                        getattr(ref_gcm, vn + '_fn'), getattr(ref_gcm, vn + '_vn'), main_glac_rgi, dates_table_ref)
+    blocks, spec = shared_arrays.create_shared_arrays(arrays)
+    return blocks, (spec, main_glac_rgi, list(main_glac_hyps.columns), ref_dates)
+
+
+# Glacier data and reference climate of all glaciers shared by the parent process, None if not shared
+_shared = None
+
+
+def init_shared_worker(spec, main_glac_rgi, hyps_columns, ref_dates):
+    """
+    Attach the worker to the arrays shared by the parent process (see share_region_data)
+    """
+    global _shared
+    blocks, arrays = shared_arrays.attach_shared_arrays(spec)
+    _shared = {'blocks': blocks, 'arrays': arrays, 'rgi': main_glac_rgi, 'hyps_columns': hyps_columns,
+               'ref_dates': ref_dates, 'rows': dict(zip(main_glac_rgi['rgino_str'], range(main_glac_rgi.shape[0])))}
+
+
+def shared_glacier_data(glac_no):
+    """
+    Glacier data of the glaciers from the shared arrays (same as load_glacier_data)
+
+    Only the rows of the glaciers are copied from the shared arrays, in the order of the RGI table.
+    """
+    rows = np.sort([_shared['rows'][x] for x in glac_no if x in _shared['rows']])
+    main_glac_rgi = _shared['rgi'].iloc[rows].reset_index(drop=True)
+    main_glac_rgi.index.name = pygem_prms.indexname
+    glac_tables = []
+    for vn in ['hyps', 'icethickness', 'width']:
+        glac_table = pd.DataFrame(_shared['arrays'][vn][rows], columns=_shared['hyps_columns'])
+        glac_table.index.name = pygem_prms.indexname
+        glac_tables.append(glac_table)
+    main_glac_debrisfactor = _shared['arrays']['debrisfactor'][rows]
+    return (main_glac_rgi, *glac_tables, main_glac_debrisfactor)
+
+
+def ref_climate(vn, ref_gcm, ref_key, main_glac_rgi, dates_table_ref):
+    """
+    Reference climate of the glaciers from the shared arrays, the worker cache or the climate files
+
+    Parameters
+    ----------
+    vn : str
+        variable name ('temp', 'prec', 'elev', 'lr' or 'tempstd')
+    ref_gcm : class_climate.GCM
+        reference climate data
+    ref_key : tuple
+        key of the reference climate of the glaciers in the worker cache
+    main_glac_rgi : pd.DataFrame
+        RGI table of the glaciers
+    dates_table_ref : pd.DataFrame
+        dates of the reference climate
+
+    Returns
+    -------
+    data : np.array
+        data of each glacier, and the dates for time series (all but 'elev')
+    """
+    if _shared is not None and 'ref_' + vn in _shared['arrays']:
+        rows = [_shared['rows'][x] for x in main_glac_rgi['rgino_str'].values]
+        if vn == 'elev':
+            return _shared['arrays']['ref_' + vn][rows]
+        return _shared['arrays']['ref_' + vn][rows], _shared['ref_dates']
+    if vn == 'elev':
+        return cached(ref_key + (vn,), ref_gcm.importGCMfxnearestneighbor_xarray, ref_gcm.elev_fn, ref_gcm.elev_vn,
+                      main_glac_rgi)
+    return cached(ref_key + (vn,), ref_gcm.importGCMvarnearestneighbor_xarray, getattr(ref_gcm, vn + '_fn'),
+                  getattr(ref_gcm, vn + '_vn'), main_glac_rgi, dates_table_ref)
+
+
+def manifest_fn(batch=None):
+    """
+    Filename of the manifest of the completed and failed glaciers of the run configuration and batch (see batch_name)
+    """
+    if pygem_prms.option_calibration == 'MCMC':
+        sim_iters = pygem_prms.sim_iters
+    else:
+        sim_iters = 1
+    manifest_fn = ('manifest_' + str(pygem_prms.option_calibration) + '_ba' + str(pygem_prms.option_bias_adjustment) +
+                   '_' + str(sim_iters) + 'sets_' + str(pygem_prms.gcm_startyear) + '_' + str(pygem_prms.gcm_endyear))
+    if pygem_prms.option_synthetic_sim == 1:
+        manifest_fn += '_T' + str(pygem_prms.synthetic_temp_adjust) + '_P' + str(pygem_prms.synthetic_prec_factor)
+    if batch is not None:
+        manifest_fn += '_' + batch
+    return pygem_prms.output_sim_fp + manifest_fn + '.sqlite'
+
+
+# Manifest of the run configuration and task (gcm and rcp scenario) of the glaciers that main runs, set by run_glaciers
+_manifest = None
+
+
+# Output containers of this worker {filename: GlacierContainer} (see option_output_container), closed by run_glaciers
+_output_containers = {}
+
+
+def output_container(fn):
+    """
+    Output container of this worker, opened (or created) the first time it is used
+    """
+    if fn not in _output_containers:
+        _output_containers[fn] = GlacierContainer(fn, flush_every=pygem_prms.output_container_flush)
+    return _output_containers[fn]
+
+
+def run_glaciers(list_packed_vars):
+    """
+    Model simulations of the glaciers of a batch that are pending in the manifest of the run configuration
+
+    main records each glacier in the manifest when it starts and when its output is exported. If a glacier fails, its
+    traceback is recorded and the other glaciers of the batch continue; failed glaciers are run again up to
+    max_attempts.
+
+    Parameters
+    ----------
+    list_packed_vars : list
+        count, glacier numbers, gcm_name and rcp scenario
+    """
+    global _manifest
+    count, glac_no, gcm_name, rcp_scenario = list_packed_vars
+    parser = getparser()
+    args = parser.parse_args()
+    task = gcm_name if rcp_scenario is None else gcm_name + '_' + rcp_scenario
+    batch = run_manifest.batch_name(args.batch_number, args.rgi_glac_number_fn)
+    _manifest = (run_manifest.RunManifest(manifest_fn(batch)), task)
+
+    def run(glac_no_pending):
+        # glaciers appended to the output containers are written (and recorded) before any failure is recorded
+        try:
+            main([count, glac_no_pending, gcm_name, rcp_scenario])
+        finally:
+            for container in _output_containers.values():
+                container.sync()
+
+    try:
+        run_manifest.run_pending(run, glac_no, _manifest[0], task, max_attempts=args.max_attempts,
+                                 raise_errors=(args.debug == 1), resume=(args.resume == 1))
+    finally:
+        for container in _output_containers.values():
+            container.close()
+        _output_containers.clear()
+        _manifest = None
+
+
+def main_gcms(list_packed_vars):
+    """
+    Model simulations of a batch of glaciers for several gcms and rcp scenarios
+
+    The worker loads the glacier data and the reference climate of the glaciers once and keeps them while it runs
+    the gcms and rcp scenarios, instead of loading them again for every gcm.
+
+    Parameters
+    ----------
+    list_packed_vars : list
+        count, glacier numbers and list of (gcm_name, rcp_scenario)
+    """
+    global _worker_cache
+    count, glac_no, gcm_rcp_list = list_packed_vars
+    _worker_cache = {}
+    try:
+        for gcm_name, rcp_scenario in gcm_rcp_list:
+            run_glaciers([count, glac_no, gcm_name, rcp_scenario])
+    finally:
+        _worker_cache = None
+
+
 def main(list_packed_vars):
     """
     Model simulation
@@ -615,7 +1014,8 @@ def main(list_packed_vars):
     Parameters
     ----------
     list_packed_vars : list
-        list of packed variables that enable the use of parallels
+        list of packed variables that enable the use of parallels (count, glacier numbers, gcm_name and optionally
+        the rcp scenario)
 
     Returns
     -------
@@ -629,7 +1029,9 @@ def main(list_packed_vars):
     parser = getparser()
     args = parser.parse_args()
 
-    if (gcm_name != pygem_prms.ref_gcm_name) and (args.rcp is None):
+    if len(list_packed_vars) > 3 and list_packed_vars[3] is not None:
+        rcp_scenario = list_packed_vars[3]
+    elif (gcm_name != pygem_prms.ref_gcm_name) and (args.rcp is None):
         rcp_scenario = os.path.basename(args.gcm_list_fn).split('_')[1]
     elif args.rcp is not None:
         rcp_scenario = args.rcp
@@ -644,29 +1046,13 @@ def main(list_packed_vars):
         debug_spc = False
 
     # ===== LOAD GLACIER DATA =====
-    main_glac_rgi = modelsetup.selectglaciersrgitable(glac_no=glac_no)
-    # Glacier hypsometry [km**2], total area
-    main_glac_hyps = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.hyps_filepath, pygem_prms.hyps_filedict,
-                                                 pygem_prms.hyps_colsdrop)
-    # Ice thickness [m], average
-    main_glac_icethickness = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.thickness_filepath,
-                                                         pygem_prms.thickness_filedict, pygem_prms.thickness_colsdrop)
-    main_glac_icethickness[main_glac_icethickness < 0] = 0
-    main_glac_hyps[main_glac_icethickness == 0] = 0
-    # Width [km], average
-    main_glac_width = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.width_filepath, pygem_prms.width_filedict,
-                                                  pygem_prms.width_colsdrop)
-    elev_bins = main_glac_hyps.columns.values.astype(int)
-    # Volume [km**3] and mean elevation [m a.s.l.]
-    main_glac_rgi['Volume'], main_glac_rgi['Zmean'] = modelsetup.hypsometrystats(main_glac_hyps, main_glac_icethickness)
-    # Sub-debris melt enhancement factors
-    if pygem_prms.include_debris:
-        assert 0==1, 'Need to set up debris factors'
-        main_glac_debrisfactor = modelsetup.import_Husstable(main_glac_rgi, pygem_prms.debris_fp, 
-                                                             pygem_prms.debris_filedict, pygem_prms.debris_colsdrop)
+    if _shared is not None:
+        (main_glac_rgi, main_glac_hyps, main_glac_icethickness, main_glac_width, main_glac_debrisfactor) = (
+                shared_glacier_data(glac_no))
     else:
-        main_glac_debrisfactor = np.zeros(main_glac_hyps.shape) + 1
-    main_glac_debrisfactor[main_glac_hyps == 0] = 0
+        (main_glac_rgi, main_glac_hyps, main_glac_icethickness, main_glac_width, main_glac_debrisfactor) = (
+                cached(('glacier_data', tuple(glac_no)), load_glacier_data, glac_no))
+    elev_bins = main_glac_hyps.columns.values.astype(int)
 
     # Select dates including future projections
     dates_table = modelsetup.datesmodelrun(startyear=pygem_prms.gcm_startyear, endyear=pygem_prms.gcm_endyear,
@@ -709,18 +1095,10 @@ def main(list_packed_vars):
         gcm = class_climate.GCM(name=gcm_name, rcp_scenario=rcp_scenario)
         # Reference GCM
         ref_gcm = class_climate.GCM(name=pygem_prms.ref_gcm_name)
-        # Adjust reference dates in event that reference is longer than GCM data
-        if pygem_prms.startyear >= pygem_prms.gcm_startyear:
-            ref_startyear = pygem_prms.startyear
-        else:
-            ref_startyear = pygem_prms.gcm_startyear
-        if pygem_prms.endyear <= pygem_prms.gcm_endyear:
-            ref_endyear = pygem_prms.endyear
-        else:
-            ref_endyear = pygem_prms.gcm_endyear
-        dates_table_ref = modelsetup.datesmodelrun(startyear=ref_startyear, endyear=ref_endyear,
-                                                   spinupyears=pygem_prms.ref_spinupyears,
-                                                   option_wateryear=pygem_prms.ref_wateryear)
+        # Reference dates
+        dates_table_ref, ref_startyear, ref_endyear = ref_dates_table()
+        # key of the reference climate of these glaciers, which is the same for all gcms
+        ref_key = (pygem_prms.ref_gcm_name, tuple(glac_no), ref_startyear, ref_endyear)
 
     # ===== Regular Climate Data (not synthetic simulation) =====
     if pygem_prms.option_synthetic_sim == 0:
@@ -734,8 +1112,7 @@ def main(list_packed_vars):
                                                                             main_glac_rgi, dates_table)
         elif pygem_prms.option_ablation == 2 and pygem_prms.ref_gcm_name in ['ERA5']:
             # Compute temp std based on reference climate data
-            ref_tempstd, ref_dates = ref_gcm.importGCMvarnearestneighbor_xarray(ref_gcm.tempstd_fn, ref_gcm.tempstd_vn,
-                                                                                main_glac_rgi, dates_table_ref)
+            ref_tempstd, ref_dates = ref_climate('tempstd', ref_gcm, ref_key, main_glac_rgi, dates_table_ref)
             # Monthly average from reference climate data
             gcm_tempstd = gcmbiasadj.monthly_avg_array_rolled(ref_tempstd, dates_table_ref, dates_table)
         else:
@@ -751,8 +1128,7 @@ def main(list_packed_vars):
             gcm_lr, gcm_dates = gcm.importGCMvarnearestneighbor_xarray(gcm.lr_fn, gcm.lr_vn, main_glac_rgi, dates_table)
         else:
             # Compute lapse rates based on reference climate data
-            ref_lr, ref_dates = ref_gcm.importGCMvarnearestneighbor_xarray(ref_gcm.lr_fn, ref_gcm.lr_vn, main_glac_rgi,
-                                                                           dates_table_ref)
+            ref_lr, ref_dates = ref_climate('lr', ref_gcm, ref_key, main_glac_rgi, dates_table_ref)
             # Monthly average from reference climate data
             gcm_lr = gcmbiasadj.monthly_avg_array_rolled(ref_lr, dates_table_ref, dates_table)
 
@@ -809,11 +1185,9 @@ def main(list_packed_vars):
     # Bias correct based on reference climate data
     else:
         # Air temperature [degC], Precipitation [m], Elevation [masl], Lapse rate [K m-1]
-        ref_temp, ref_dates = ref_gcm.importGCMvarnearestneighbor_xarray(ref_gcm.temp_fn, ref_gcm.temp_vn,
-                                                                         main_glac_rgi, dates_table_ref)
-        ref_prec, ref_dates = ref_gcm.importGCMvarnearestneighbor_xarray(ref_gcm.prec_fn, ref_gcm.prec_vn,
-                                                                         main_glac_rgi, dates_table_ref)
-        ref_elev = ref_gcm.importGCMfxnearestneighbor_xarray(ref_gcm.elev_fn, ref_gcm.elev_vn, main_glac_rgi)
+        ref_temp, ref_dates = ref_climate('temp', ref_gcm, ref_key, main_glac_rgi, dates_table_ref)
+        ref_prec, ref_dates = ref_climate('prec', ref_gcm, ref_key, main_glac_rgi, dates_table_ref)
+        ref_elev = ref_climate('elev', ref_gcm, ref_key, main_glac_rgi, dates_table_ref)
 
         # OPTION 1: Adjust temp using Huss and Hock (2015), prec similar but addresses for variance and outliers
         if pygem_prms.option_bias_adjustment == 1:
@@ -872,6 +1246,10 @@ def main(list_packed_vars):
         width_initial = main_glac_width.iloc[glac,:].values.astype(float)
         
         glacier_str = '{0:0.5f}'.format(glacier_rgi_table['RGIId_float'])
+        output_fns = []
+        glacier_recorded = False
+        if _manifest is not None:
+            _manifest[0].record_start(glacier_str, _manifest[1])
 
         if debug_spc:
             debug_rgiid_fn = glacier_str + '_' + gcm_name + '_' + rcp_scenario + '.csv'
@@ -882,23 +1260,23 @@ def main(list_packed_vars):
         year_values = annual_columns[pygem_prms.gcm_spinupyears:annual_columns.shape[0]]
         year_plus1_values = np.concatenate((annual_columns[pygem_prms.gcm_spinupyears:annual_columns.shape[0]],
                                             np.array([annual_columns[annual_columns.shape[0]-1]+1])))
-        output_temp_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_prec_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_acc_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_refreeze_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_melt_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_frontalablation_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_massbaltotal_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_runoff_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_snowline_glac_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_area_glac_annual = np.zeros((year_plus1_values.shape[0], sim_iters))
-        output_volume_glac_annual = np.zeros((year_plus1_values.shape[0], sim_iters))
-        output_ELA_glac_annual = np.zeros((year_values.shape[0], sim_iters))
-        output_offglac_prec_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_offglac_refreeze_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_offglac_melt_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_offglac_snowpack_monthly = np.zeros((dates_table.shape[0], sim_iters))
-        output_offglac_runoff_monthly = np.zeros((dates_table.shape[0], sim_iters))
+        output_temp_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_prec_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_acc_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_refreeze_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_melt_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_frontalablation_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_massbaltotal_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_runoff_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_snowline_glac_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_area_glac_annual = ensemble_stats(year_plus1_values.shape[0], sim_iters)
+        output_volume_glac_annual = ensemble_stats(year_plus1_values.shape[0], sim_iters)
+        output_ELA_glac_annual = ensemble_stats(year_values.shape[0], sim_iters)
+        output_offglac_prec_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_offglac_refreeze_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_offglac_melt_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_offglac_snowpack_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
+        output_offglac_runoff_monthly = ensemble_stats(dates_table.shape[0], sim_iters)
 
 
         if icethickness_initial.max() > 0:
@@ -1022,23 +1400,23 @@ def main(list_packed_vars):
                         print('  mb_model [mwea]:', mb_mwea.round(3))
 
                     # Record output to xarray dataset
-                    output_temp_glac_monthly[:, n_iter] = glac_wide_temp
-                    output_prec_glac_monthly[:, n_iter] = glac_wide_prec
-                    output_acc_glac_monthly[:, n_iter] = glac_wide_acc
-                    output_refreeze_glac_monthly[:, n_iter] = glac_wide_refreeze
-                    output_melt_glac_monthly[:, n_iter] = glac_wide_melt
-                    output_frontalablation_glac_monthly[:, n_iter] = glac_wide_frontalablation
-                    output_massbaltotal_glac_monthly[:, n_iter] = glac_wide_massbaltotal
-                    output_runoff_glac_monthly[:, n_iter] = glac_wide_runoff
-                    output_snowline_glac_monthly[:, n_iter] = glac_wide_snowline
-                    output_area_glac_annual[:, n_iter] = glac_wide_area_annual
-                    output_volume_glac_annual[:, n_iter] = glac_wide_volume_annual
-                    output_ELA_glac_annual[:, n_iter] = glac_wide_ELA_annual
-                    output_offglac_prec_monthly[:, n_iter] = offglac_wide_prec
-                    output_offglac_refreeze_monthly[:, n_iter] = offglac_wide_refreeze
-                    output_offglac_melt_monthly[:, n_iter] = offglac_wide_melt
-                    output_offglac_snowpack_monthly[:, n_iter] = offglac_wide_snowpack
-                    output_offglac_runoff_monthly[:, n_iter] = offglac_wide_runoff
+                    output_temp_glac_monthly.update(glac_wide_temp)
+                    output_prec_glac_monthly.update(glac_wide_prec)
+                    output_acc_glac_monthly.update(glac_wide_acc)
+                    output_refreeze_glac_monthly.update(glac_wide_refreeze)
+                    output_melt_glac_monthly.update(glac_wide_melt)
+                    output_frontalablation_glac_monthly.update(glac_wide_frontalablation)
+                    output_massbaltotal_glac_monthly.update(glac_wide_massbaltotal)
+                    output_runoff_glac_monthly.update(glac_wide_runoff)
+                    output_snowline_glac_monthly.update(glac_wide_snowline)
+                    output_area_glac_annual.update(glac_wide_area_annual)
+                    output_volume_glac_annual.update(glac_wide_volume_annual)
+                    output_ELA_glac_annual.update(glac_wide_ELA_annual)
+                    output_offglac_prec_monthly.update(offglac_wide_prec)
+                    output_offglac_refreeze_monthly.update(offglac_wide_refreeze)
+                    output_offglac_melt_monthly.update(offglac_wide_melt)
+                    output_offglac_snowpack_monthly.update(offglac_wide_snowpack)
+                    output_offglac_runoff_monthly.update(offglac_wide_runoff)
 
                 if debug:
                     print('  years:', glac_wide_volume_annual.shape[0]-1)
@@ -1054,23 +1432,23 @@ def main(list_packed_vars):
             output_ds_all_stats, encoding = create_xrdataset(glacier_rgi_table, dates_table)
             
             # Output statistics
-            output_temp_glac_monthly_stats = calc_stats_array(output_temp_glac_monthly)
-            output_prec_glac_monthly_stats = calc_stats_array(output_prec_glac_monthly)
-            output_acc_glac_monthly_stats = calc_stats_array(output_acc_glac_monthly)
-            output_refreeze_glac_monthly_stats = calc_stats_array(output_refreeze_glac_monthly)
-            output_melt_glac_monthly_stats = calc_stats_array(output_melt_glac_monthly)
-            output_frontalablation_glac_monthly_stats = calc_stats_array(output_frontalablation_glac_monthly)
-            output_massbaltotal_glac_monthly_stats = calc_stats_array(output_massbaltotal_glac_monthly)
-            output_runoff_glac_monthly_stats = calc_stats_array(output_runoff_glac_monthly)
-            output_snowline_glac_monthly_stats = calc_stats_array(output_snowline_glac_monthly)
-            output_area_glac_annual_stats = calc_stats_array(output_area_glac_annual)
-            output_volume_glac_annual_stats = calc_stats_array(output_volume_glac_annual)
-            output_ELA_glac_annual_stats = calc_stats_array(output_ELA_glac_annual)
-            output_offglac_prec_monthly_stats = calc_stats_array(output_offglac_prec_monthly)
-            output_offglac_melt_monthly_stats = calc_stats_array(output_offglac_melt_monthly)
-            output_offglac_refreeze_monthly_stats = calc_stats_array(output_offglac_refreeze_monthly)
-            output_offglac_snowpack_monthly_stats = calc_stats_array(output_offglac_snowpack_monthly)
-            output_offglac_runoff_monthly_stats = calc_stats_array(output_offglac_runoff_monthly)
+            output_temp_glac_monthly_stats = output_temp_glac_monthly.stats()
+            output_prec_glac_monthly_stats = output_prec_glac_monthly.stats()
+            output_acc_glac_monthly_stats = output_acc_glac_monthly.stats()
+            output_refreeze_glac_monthly_stats = output_refreeze_glac_monthly.stats()
+            output_melt_glac_monthly_stats = output_melt_glac_monthly.stats()
+            output_frontalablation_glac_monthly_stats = output_frontalablation_glac_monthly.stats()
+            output_massbaltotal_glac_monthly_stats = output_massbaltotal_glac_monthly.stats()
+            output_runoff_glac_monthly_stats = output_runoff_glac_monthly.stats()
+            output_snowline_glac_monthly_stats = output_snowline_glac_monthly.stats()
+            output_area_glac_annual_stats = output_area_glac_annual.stats()
+            output_volume_glac_annual_stats = output_volume_glac_annual.stats()
+            output_ELA_glac_annual_stats = output_ELA_glac_annual.stats()
+            output_offglac_prec_monthly_stats = output_offglac_prec_monthly.stats()
+            output_offglac_melt_monthly_stats = output_offglac_melt_monthly.stats()
+            output_offglac_refreeze_monthly_stats = output_offglac_refreeze_monthly.stats()
+            output_offglac_snowpack_monthly_stats = output_offglac_snowpack_monthly.stats()
+            output_offglac_runoff_monthly_stats = output_offglac_runoff_monthly.stats()
             
             # Output Mean
             output_ds_all_stats['glac_temp_monthly'].values[0,:] = output_temp_glac_monthly_stats[:,0]
@@ -1138,7 +1516,21 @@ def main(list_packed_vars):
                     netcdf_fn = (netcdf_fn.split('--')[0] + '_T' + str(pygem_prms.synthetic_temp_adjust) + '_P' +
                                  str(pygem_prms.synthetic_prec_factor) + '--' + netcdf_fn.split('--')[1])
                 # Export netcdf
-                output_ds_all_stats.to_netcdf(output_sim_fp + netcdf_fn, encoding=encoding)
+                if pygem_prms.option_output_container:
+                    # append to the container of this worker, gcm and rcp; the glacier is recorded in the manifest
+                    #  once the container is synced to disk
+                    container_fn = netcdf_fn.replace(glacier_str, 'container-{}-{}'.format(os.getppid(), os.getpid()),
+                                                     1)
+                    glacier_record = None
+                    if _manifest is not None:
+                        glacier_record = functools.partial(_manifest[0].record_success_row, glacier_str, _manifest[1],
+                                                           output_sim_fp + container_fn)
+                    output_container(output_sim_fp + container_fn).append(output_ds_all_stats, callback=glacier_record,
+                                                                     encoding=encoding)
+                    glacier_recorded = True
+                else:
+                    output_ds_all_stats.to_netcdf(output_sim_fp + netcdf_fn, encoding=encoding)
+                    output_fns.append(output_sim_fp + netcdf_fn)
 
             # Close datasets
             output_ds_all_stats.close()
@@ -1147,6 +1539,10 @@ def main(list_packed_vars):
         if debug_spc:
             os.remove(debug_fp + debug_rgiid_fn)
 
+        # Record the glacier and the checksum of its output in the manifest
+        if _manifest is not None and not glacier_recorded:
+            _manifest[0].record_success(glacier_str, _manifest[1], output_fns)
+
     # Global variables for Spyder development
     if args.option_parallels == 0:
         global main_vars
@@ -1187,7 +1583,16 @@ if __name__ == '__main__':
         num_cores = 1
 
     # Glacier number lists to pass for parallel processing
-    glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
+    if args.option_parallels != 0 and args.option_scheduler == 1:
+        # largest glaciers first (cost from area and number of elevation bins) in batches that get smaller
+        main_glac_rgi_schedule = modelsetup.selectglaciersrgitable(glac_no=glac_no)
+        glac_costs = scheduler.glacier_costs(
+                main_glac_rgi_schedule['Area'].values,
+                (main_glac_rgi_schedule['Zmax'] - main_glac_rgi_schedule['Zmin']).values / pygem_prms.binsize + 1)
+        glac_no_lsts = scheduler.schedule_batches(list(main_glac_rgi_schedule['rgino_str'].values), glac_costs, 
+                                                  num_cores)
+    else:
+        glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
 
     # Read GCM names from argument parser
     gcm_name = args.gcm_list_fn
@@ -1203,30 +1608,83 @@ if __name__ == '__main__':
             rcp_scenario = os.path.basename(args.gcm_list_fn).split('_')[1]
             print('Found %d gcms to process'%(len(gcm_list)))
 
+    # GCMs and RCP scenarios
+    if args.rcp_list is not None:
+        rcp_list = args.rcp_list
+    else:
+        rcp_list = [rcp_scenario]
+    gcm_rcp_list = [(gcm_name, rcp_scenario) for rcp_scenario in rcp_list for gcm_name in gcm_list]
+    tasks = [x[0] if x[1] is None else x[0] + '_' + x[1] for x in gcm_rcp_list]
+
+    # Manifest of the completed and failed glaciers of the run configuration
+    manifest = run_manifest.RunManifest(manifest_fn(run_manifest.batch_name(args.batch_number,
+                                                                             args.rgi_glac_number_fn)))
+    if args.reset_manifest == 1:
+        manifest.reset()
+    manifest_run = manifest.start_run(n_workers=num_cores)
+
+    # Shared memory: glacier data and reference climate loaded once and shared with the workers
+    shared_blocks, pool_kwargs = [], {}
+    if args.option_parallels != 0 and args.option_shared_memory == 1:
+        shared_blocks, initargs = share_region_data(glac_no, gcm_list)
+        pool_kwargs = {'initializer': init_shared_worker, 'initargs': initargs}
+        print('Sharing', sum([x.size for x in shared_blocks]) / 1e6, 'MB of glacier and reference climate data')
+
+    # Persistent workers: each batch of glaciers runs all GCMs and RCPs on the same worker
+    if args.option_parallels != 0 and args.option_persistent_workers == 1:
+        print('Processing', len(gcm_rcp_list), 'GCMs/RCPs in parallel with ' + str(num_cores) + ' cores...')
+        list_packed_vars = []
+        for count, glac_no_lst in enumerate(glac_no_lsts):
+            list_packed_vars.append([count, glac_no_lst, gcm_rcp_list])
+        if args.option_scheduler == 1:
+            records, time_pool_start, time_pool_end = scheduler.run_scheduled(main_gcms, list_packed_vars, num_cores,
+                                                                              **pool_kwargs)
+            print(scheduler.utilisation_report(records, time_pool_start, time_pool_end, n_workers=num_cores))
+        else:
+            with multiprocessing.Pool(args.num_simultaneous_processes, **pool_kwargs) as p:
+                p.map(main_gcms, list_packed_vars)
+        gcm_rcp_list = []
+
     # Loop through all GCMs
-    for gcm_name in gcm_list:
-        if args.rcp is None:
+    for gcm_name, rcp_scenario in gcm_rcp_list:
+        if rcp_scenario is None:
             print('Processing:', gcm_name)
         else:
             print('Processing:', gcm_name, rcp_scenario)
         # Pack variables for multiprocessing
         list_packed_vars = []
         for count, glac_no_lst in enumerate(glac_no_lsts):
-            list_packed_vars.append([count, glac_no_lst, gcm_name])
+            list_packed_vars.append([count, glac_no_lst, gcm_name, rcp_scenario])
 
         # Parallel processing
         if args.option_parallels != 0:
             print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-            with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-                p.map(main,list_packed_vars)
+            if args.option_scheduler == 1:
+                records, time_pool_start, time_pool_end = scheduler.run_scheduled(run_glaciers, list_packed_vars,
+                                                                                  num_cores, **pool_kwargs)
+                print(scheduler.utilisation_report(records, time_pool_start, time_pool_end, n_workers=num_cores))
+            else:
+                with multiprocessing.Pool(args.num_simultaneous_processes, **pool_kwargs) as p:
+                    p.map(run_glaciers,list_packed_vars)
         # If not in parallel, then only should be one loop
         else:
             # Loop through the chunks and export bias adjustments
             for n in range(len(list_packed_vars)):
-                main(list_packed_vars[n])
+                run_glaciers(list_packed_vars[n])
+
+    # Remove the shared memory blocks
+    shared_arrays.release_shared_arrays(shared_blocks, unlink=True)
+
+    manifest.end_run(manifest_run)
+    print(manifest.report())
 
     print('Total processing time:', time.time()-time_start, 's')
 
+    # Glaciers that failed make the run fail, so the job is not reported as successful
+    glac_no_failed = [x for task in tasks for x in manifest.failed(glac_no, task)]
+    if len(glac_no_failed) > 0:
+        sys.exit(str(len(glac_no_failed)) + ' glaciers failed (see ' + manifest.path + ')')
+
 #    print('memory:', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 10**6, 'GB')
 
 #%% ===== PLOTTING AND PROCESSING FOR MODEL DEVELOPMENT =====
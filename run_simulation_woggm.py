@@ -9,6 +9,7 @@
 # Built-in libraries
 import argparse
 import collections
+import copy
 import inspect
 import multiprocessing
 import os
@@ -23,14 +24,17 @@ import xarray as xr
 import class_climate
 #import class_mbdata
 import pygem.pygem_input as pygem_prms
-from pygem.massbalance import PyGEMMassBalance
-from pygem.glacierdynamics import MassRedistributionCurveModel
+from pygem.massbalance import PyGEMMassBalance, PyGEMMassBalanceBatch
+from pygem.glacierdynamics import MassRedistributionCurveModel, MassRedistributionCurveModelEnsemble
 from pygem.oggm_compat import single_flowline_glacier_directory
 from pygem.oggm_compat import single_flowline_glacier_directory_with_calving
 from pygem.shop import debris
+from pygem.utils._spinup_cache import spinup_cache_key, load_spinup_state, save_spinup_state
+from pygem.utils._encoding import output_encoding
 import pygemfxns_gcmbiasadj as gcmbiasadj
 import pygemfxns_modelsetup as modelsetup
 import spc_split_glaciers as split_glaciers
+import pygem.utils._scheduler as scheduler
 
 from oggm import cfg
 from oggm import graphics
@@ -74,6 +78,9 @@ def getparser():
         option to keep glaciers ordered or to grab every n value for the batch
         (the latter helps make sure run times on each core are similar as it removes any timing differences caused by
          regional variations)
+    option_scheduler : int
+        option to hand batches of glaciers, largest first, to the cores as they become free (1) or to split the
+        glaciers into one list per core (0, default)
     debug (optional) : int
         Switch for turning debug printing on or off (default = 0 (off))
     debug_spc (optional) : int
@@ -101,6 +108,8 @@ def getparser():
                         help='Batch number used to differentiate output on supercomputer')
     parser.add_argument('-option_ordered', action='store', type=int, default=1,
                         help='switch to keep lists ordered or not')
+    parser.add_argument('-option_scheduler', action='store', type=int, default=0,
+                        help='switch to schedule glaciers largest first on free cores (1) or use fixed lists (0)')
     parser.add_argument('-debug', action='store', type=int, default=0,
                         help='Boolean for debugging to turn it on or off (default 0 is off')
     parser.add_argument('-debug_spc', action='store', type=int, default=0,
@@ -141,14 +150,13 @@ def calc_stats_array(data, stats_cns=pygem_prms.sim_stat_cns):
     return stats
 
 
-def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms.gcm_wateryear):
+def create_xrdataset_template(dates_table, option_wateryear=pygem_prms.gcm_wateryear):
     """
-    Create empty xarray dataset that will be used to record simulation runs.
+    Create the empty xarray dataset of one glacier (glacier index 0, no RGI values) with the variables, coordinates
+    and attributes that depend on the run configuration only.
 
     Parameters
     ----------
-    main_glac_rgi : pandas dataframe
-        dataframe containing relevant rgi glacier information
     dates_table : pandas dataframe
         table of the dates, months, days in month, etc.
 
@@ -163,7 +171,7 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
         
         # Create empty datasets for each variable and merge them
         # Coordinate values
-        glac_values = np.array([glacier_rgi_table.name])
+        glac_values = np.array([0])
 
         # Time attributes and values
         if option_wateryear == 'hydro':
@@ -480,7 +488,6 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
            
         # Add variables to empty dataset and merge together
         count_vn = 0
-        encoding = {}
         for vn in output_coords_dict.keys():
             count_vn += 1
             empty_holder = np.zeros([len(output_coords_dict[vn][i]) for i in list(output_coords_dict[vn].keys())])
@@ -491,20 +498,59 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
                 output_ds_all = output_ds
             else:
                 output_ds_all = xr.merge((output_ds_all, output_ds))
-        noencoding_vn = ['RGIId']
         # Add attributes
         for vn in output_ds_all.variables:
             try:
                 output_ds_all[vn].attrs = output_attrs_dict[vn]
             except:
                 pass
-            # Encoding (specify _FillValue, offsets, etc.)
-           
-            if vn not in noencoding_vn:
-                encoding[vn] = {'_FillValue': False,
-                                'zlib':True,
-                                'complevel':9
-                                }
+        # Encoding (data type, packing, chunks and compression; see output_encoding)
+        encoding = output_encoding(output_ds_all, profile=pygem_prms.output_encoding_profile,
+                                   complevel=pygem_prms.output_complevel, chunks=pygem_prms.output_chunks,
+                                   pack_ranges=pygem_prms.output_pack_ranges, exclude=['RGIId'])
+       
+        output_ds.attrs = {'source': 'PyGEMv0.1.0',
+                           'institution': 'University of Alaska Fairbanks, Fairbanks, AK',
+                           'history': 'Created by David Rounce (drounce@alaska.edu) on ' + pygem_prms.model_run_date,
+                           'references': 'doi:10.3389/feart.2019.00331 and doi:10.1017/jog.2019.91'}
+       
+    return output_ds_all, encoding
+
+
+# Empty output dataset and encoding of each dates table and year type (see create_xrdataset)
+_xrdataset_templates = {}
+
+
+def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms.gcm_wateryear):
+    """
+    Create empty xarray dataset that will be used to record simulation runs.
+
+    The variables, coordinates and attributes are the same for every glacier of a run configuration, so the dataset is
+    created once (see create_xrdataset_template) and copied for each glacier.
+
+    Parameters
+    ----------
+    main_glac_rgi : pandas dataframe
+        dataframe containing relevant rgi glacier information
+    dates_table : pandas dataframe
+        table of the dates, months, days in month, etc.
+
+    Returns
+    -------
+    output_ds_all : xarray Dataset
+        empty xarray dataset that contains variables and attributes to be filled in by simulation runs
+    encoding : dictionary
+        encoding used with exporting xarray dataset to netcdf
+    """
+    if pygem_prms.output_package == 2:
+        template_key = (option_wateryear, pygem_prms.gcm_spinupyears, dates_table.shape[0],
+                        str(dates_table['date'].values[0]), str(dates_table['date'].values[-1]))
+        if template_key not in _xrdataset_templates:
+            _xrdataset_templates[template_key] = create_xrdataset_template(dates_table, option_wateryear)
+        output_ds_template, encoding = _xrdataset_templates[template_key]
+        output_ds_all = output_ds_template.copy(deep=True).assign_coords(
+                glac=output_ds_template['glac'].copy(data=np.array([glacier_rgi_table.name])))
+        encoding = copy.deepcopy(encoding)
         output_ds_all['RGIId'].values = np.array(['RGI60-' + str(int(glacier_rgi_table.loc['O1Region'])).zfill(2) + 
                                          '.' + str(int(glacier_rgi_table.loc['glacno'])).zfill(5)])
         output_ds_all['CenLon'].values = np.array([glacier_rgi_table.CenLon])
@@ -512,15 +558,123 @@ def create_xrdataset(glacier_rgi_table, dates_table, option_wateryear=pygem_prms
         output_ds_all['O1Region'].values = np.array([glacier_rgi_table.O1Region])
         output_ds_all['O2Region'].values = np.array([glacier_rgi_table.O2Region])
         output_ds_all['Area'].values = np.array([glacier_rgi_table.Area * 1e6])
-       
-        output_ds.attrs = {'source': 'PyGEMv0.1.0',
-                           'institution': 'University of Alaska Fairbanks, Fairbanks, AK',
-                           'history': 'Created by David Rounce (drounce@alaska.edu) on ' + pygem_prms.model_run_date,
-                           'references': 'doi:10.3389/feart.2019.00331 and doi:10.1017/jog.2019.91'}
-       
+
     return output_ds_all, encoding
 
 
+def run_until_and_store_spinupcache(ev_model, gdir, modelprms, nyears):
+    """
+    Run the model and return the diagnostics, starting from the cached state after the spin-up years if available.
+
+    The spin-up years are max(gcm_spinupyears, constantarea_years). The state after these years depends on the
+    glacier, the model parameters, the model settings (spinup_cache_settings), the climate of the spin-up years and the
+    initial flowlines, so all of these are part of the cache key. The diagnostics of the spin-up years are cached with
+    the state, so the returned diagnostics cover all years as if the model was run from the start.
+
+    Parameters
+    ----------
+    ev_model : MassRedistributionCurveModel
+        glacier dynamics model at year 0
+    gdir : oggm.GlacierDirectory
+        glacier directory with the historical climate
+    modelprms : dict
+        model parameters
+    nyears : int
+        number of years to run
+
+    Returns
+    -------
+    diag : xarray.Dataset
+        model diagnostics (see MassRedistributionCurveModel.run_until_and_store)
+    """
+    spinupyears = max(pygem_prms.gcm_spinupyears, pygem_prms.constantarea_years)
+    if spinupyears == 0 or spinupyears >= nyears:
+        _, diag = ev_model.run_until_and_store(nyears, store_geometry=False)
+        return diag
+
+    settings = {vn: getattr(pygem_prms, vn, None) for vn in pygem_prms.spinup_cache_settings}
+    inputs = [np.atleast_1d(gdir.historical_climate[vn])[:12*spinupyears] 
+              for vn in ['elev', 'temp', 'tempstd', 'prec', 'lr']]
+    for fl in ev_model.fls:
+        inputs.extend([fl.bed_h, fl.widths_m, fl.thick, getattr(fl, 'debris_ed', np.ones(fl.nx))])
+    key = spinup_cache_key(gdir.rgi_id, modelprms, settings, inputs)
+
+    state = load_spinup_state(pygem_prms.spinup_cache_fp, key)
+    if state is None:
+        _, diag_spinup = ev_model.run_until_and_store(spinupyears, store_geometry=False)
+        state = ev_model.get_state(spinupyears)
+        state['diag'] = diag_spinup
+        save_spinup_state(pygem_prms.spinup_cache_fp, key, state, pygem_prms.spinup_cache_maxsize)
+    else:
+        diag_spinup = state['diag']
+    # run_until_and_store does not advance the model time, so the state also sets the start of the remaining years
+    ev_model.set_state(state)
+
+    _, diag = ev_model.run_until_and_store(nyears, store_geometry=False)
+    return append_diag(diag_spinup, diag)
+
+
+def append_diag(diag_prev, diag):
+    """
+    Append the diagnostics of a run that continued from the end of a previous run.
+
+    Parameters
+    ----------
+    diag_prev : xarray.Dataset
+        model diagnostics of the previous run
+    diag : xarray.Dataset
+        model diagnostics of the continued run, starting with the last time of the previous run
+
+    Returns
+    -------
+    diag : xarray.Dataset
+        model diagnostics of both runs
+    """
+    return xr.concat([diag_prev.isel(time=slice(0,-1)), diag], dim='time', data_vars='minimal', 
+                     combine_attrs='override')
+
+
+def sim_output_fn(glacier_str, gcm_name, sim_iters, rcp_scenario=None, endyear=pygem_prms.gcm_endyear):
+    """
+    Subdirectory and filename of the simulation output of a glacier.
+
+    Parameters
+    ----------
+    glacier_str : str
+        glacier number (e.g., '15.03733')
+    gcm_name : str
+        name of the climate dataset
+    sim_iters : int
+        number of simulations (parameter sets)
+    rcp_scenario : str
+        emission scenario (not used for reanalysis datasets)
+    endyear : int
+        last year of the simulation
+
+    Returns
+    -------
+    output_subdir : str
+        subdirectory of the output, e.g., gcm_name + '/' + rcp_scenario + '/'
+    netcdf_fn : str
+        netcdf filename
+    """
+    if gcm_name in ['ERA-Interim', 'ERA5', 'COAWST']:
+        output_subdir = gcm_name + '/'
+        netcdf_fn = (glacier_str + '_' + gcm_name + '_' + str(pygem_prms.option_calibration) + '_ba' +
+                      str(pygem_prms.option_bias_adjustment) + '_' +  str(sim_iters) + 'sets' + '_' +
+                      str(pygem_prms.gcm_startyear) + '_' + str(endyear) + '.nc')
+    else:
+        output_subdir = gcm_name + '/' + rcp_scenario + '/'
+        netcdf_fn = (glacier_str + '_' + gcm_name + '_' + rcp_scenario + '_' +
+                      str(pygem_prms.option_calibration) + '_ba' + str(pygem_prms.option_bias_adjustment) + 
+                      '_' + str(sim_iters) + 'sets' + '_' + str(pygem_prms.gcm_startyear) + '_' + 
+                      str(endyear) + '.nc')
+    if pygem_prms.option_synthetic_sim==1:
+        netcdf_fn = (netcdf_fn.split('--')[0] + '_T' + str(pygem_prms.synthetic_temp_adjust) + '_P' +
+                      str(pygem_prms.synthetic_prec_factor) + '--' + netcdf_fn.split('--')[1])
+    return output_subdir, netcdf_fn
+
+
 def main(list_packed_vars):
     """
     Model simulation
@@ -539,12 +693,13 @@ def main(list_packed_vars):
     gcm_name = list_packed_vars[2]
     parser = getparser()
     args = parser.parse_args()
+    rcp_scenario = None
     if (gcm_name != pygem_prms.ref_gcm_name) and (args.rcp is None):
         rcp_scenario = os.path.basename(args.gcm_list_fn).split('_')[1]
     elif args.rcp is not None:
         rcp_scenario = args.rcp
     if debug:
-        if 'rcp_scenario' in locals():
+        if rcp_scenario is not None:
             print(rcp_scenario)
     if args.debug_spc == 1:
         debug_spc = True
@@ -740,6 +895,17 @@ def main(list_packed_vars):
                                   'ddfice': [pygem_prms.ddfice],
                                   'tsnow_threshold': [pygem_prms.tsnow_threshold],
                                   'precgrad': [pygem_prms.precgrad]}
+
+            # Saved simulations that are continued from sim_extend_endyear to gcm_endyear
+            if pygem_prms.option_sim_extend:
+                assert pygem_prms.option_dynamics == 'MassRedistributionCurves', (
+                        'Error: only MassRedistributionCurves simulations can be continued')
+                sim_subdir, sim_fn_prev = sim_output_fn(glacier_str, gcm_name, sim_iters, rcp_scenario=rcp_scenario,
+                                                        endyear=pygem_prms.sim_extend_endyear)
+                with open(pygem_prms.sim_state_fp + sim_subdir + sim_fn_prev.replace('.nc', '.pkl'), 'rb') as f:
+                    sim_states_prev = pickle.load(f)
+                nyears_prev = pygem_prms.sim_extend_endyear - pygem_prms.gcm_startyear + 1
+            sim_states = []
             
             # Time attributes and values
             if pygem_prms.gcm_wateryear == 'hydro':
@@ -767,6 +933,14 @@ def main(list_packed_vars):
             output_offglac_melt_monthly = np.zeros((dates_table.shape[0], sim_iters))
             output_offglac_snowpack_monthly = np.zeros((dates_table.shape[0], sim_iters))
             output_offglac_runoff_monthly = np.zeros((dates_table.shape[0], sim_iters))
+
+            # Ensemble of the parameter sets advanced together after their inversions
+            dynamics_ensemble = (pygem_prms.option_dynamics_ensemble and 
+                                 pygem_prms.option_dynamics == 'MassRedistributionCurves' and 
+                                 not pygem_prms.option_sim_extend and not pygem_prms.option_sim_savestate and
+                                 not pygem_prms.option_spinup_cache and pygem_prms.hindcast == 0 and
+                                 glacier_rgi_table['TermType'] != 1)
+            modelprms_ens, nfls_ens = [], []
            
             # Loop through model parameters
             for n_iter in range(sim_iters):
@@ -776,6 +950,9 @@ def main(list_packed_vars):
                               'ddfice': modelprms_all['ddfice'][n_iter],
                               'tsnow_threshold': modelprms_all['tsnow_threshold'][n_iter],
                               'precgrad': modelprms_all['precgrad'][n_iter]}
+                # continued simulations use the parameters of the saved simulation (MCMC sets are drawn randomly)
+                if pygem_prms.option_sim_extend:
+                    modelprms = sim_states_prev[n_iter]['modelprms']
 
                 if debug:
                     print(glacier_str + '  kp: ' + str(np.round(modelprms['kp'],2)) +
@@ -816,42 +993,51 @@ def main(list_packed_vars):
 #                                             debug=pygem_prms.debug_mb,
 #                                             debug_refreeze=pygem_prms.debug_refreeze,
 #                                             fls=fls_inv, option_areaconstant=True)
-                print('apply inversion_filter on mass balance with debris to avoid negative flux')
-                if pygem_prms.include_debris:
-                    inversion_filter = True
+                if pygem_prms.option_sim_extend:
+                    # initial flowlines of the saved simulation (no inversion for the extended period)
+                    nfls = copy.deepcopy(sim_states_prev[n_iter]['fls'])
                 else:
-                    inversion_filter = False
+                    print('apply inversion_filter on mass balance with debris to avoid negative flux')
+                    if pygem_prms.include_debris:
+                        inversion_filter = True
+                    else:
+                        inversion_filter = False
 #                inversion_filter = False
-                mbmod_inv = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table,
-                                              hindcast=pygem_prms.hindcast,
-                                              debug=pygem_prms.debug_mb,
-                                              debug_refreeze=pygem_prms.debug_refreeze,
-                                              fls=fls, option_areaconstant=True,
-                                              inversion_filter=inversion_filter)
-                h, w = gdir.get_inversion_flowline_hw()
+                    mbmod_inv = PyGEMMassBalance(gdir, modelprms, glacier_rgi_table,
+                                                  hindcast=pygem_prms.hindcast,
+                                                  debug=pygem_prms.debug_mb,
+                                                  debug_refreeze=pygem_prms.debug_refreeze,
+                                                  fls=fls, option_areaconstant=True,
+                                                  inversion_filter=inversion_filter)
+                    h, w = gdir.get_inversion_flowline_hw()
                 
-                if debug:
-                    mb_t0 = (mbmod_inv.get_annual_mb(h, year=0, fl_id=0, fls=fls) * cfg.SEC_IN_YEAR * 
-                             pygem_prms.density_ice / pygem_prms.density_water) 
-                    plt.plot(mb_t0, h, '.')
-                    plt.ylabel('Elevation')
-                    plt.xlabel('Mass balance (mwea)')
-                    plt.show()
+                    if debug:
+                        mb_t0 = (mbmod_inv.get_annual_mb(h, year=0, fl_id=0, fls=fls) * cfg.SEC_IN_YEAR * 
+                                 pygem_prms.density_ice / pygem_prms.density_water) 
+                        plt.plot(mb_t0, h, '.')
+                        plt.ylabel('Elevation')
+                        plt.xlabel('Mass balance (mwea)')
+                        plt.show()
                     
                
-                # Arbitrariliy shift the MB profile up (or down) until mass balance is zero (equilibrium for inversion)
-                climate.apparent_mb_from_any_mb(gdir, mb_model=mbmod_inv, mb_years=np.arange(nyears))
+                    # Arbitrariliy shift the MB profile up (or down) until mass balance is zero (equilibrium for inversion)
+                    climate.apparent_mb_from_any_mb(gdir, mb_model=mbmod_inv, mb_years=np.arange(nyears))
                
-                print('setting glacier dynamic model parameters here')
-                fs = 0                      # keep this set at 0
-                glen_a_multiplier = 1       # calibrate this based on ice thickness data or the consensus estimates
+                    print('setting glacier dynamic model parameters here')
+                    fs = 0                      # keep this set at 0
+                    glen_a_multiplier = 1       # calibrate this based on ice thickness data or the consensus estimates
                
-                tasks.prepare_for_inversion(gdir)
-                tasks.mass_conservation_inversion(gdir, glen_a=cfg.PARAMS['glen_a']*glen_a_multiplier, fs=fs)
+                    tasks.prepare_for_inversion(gdir)
+                    tasks.mass_conservation_inversion(gdir, glen_a=cfg.PARAMS['glen_a']*glen_a_multiplier, fs=fs)
 #                tasks.filter_inversion_output(gdir)
-                tasks.init_present_time_glacier(gdir) # adds bins below
-                debris.debris_binned(gdir, fl_str='model_flowlines')  # add debris enhancement factors to flowlines
-                nfls = gdir.read_pickle('model_flowlines')
+                    tasks.init_present_time_glacier(gdir) # adds bins below
+                    debris.debris_binned(gdir, fl_str='model_flowlines')  # add debris enhancement factors to flowlines
+                    nfls = gdir.read_pickle('model_flowlines')
+
+                if dynamics_ensemble:
+                    modelprms_ens.append(modelprms)
+                    nfls_ens.append(nfls)
+                    continue
                 
                 #%%
                 # ------ MODEL WITH EVOLVING AREA ------
@@ -860,7 +1046,7 @@ def main(list_packed_vars):
                                           hindcast=pygem_prms.hindcast,
                                           debug=pygem_prms.debug_mb,
                                           debug_refreeze=pygem_prms.debug_refreeze,
-                                          fls=nfls, option_areaconstant=True)
+                                          fls=nfls, option_areaconstant=False)
                
                 # Glacier dynamics model
                 if pygem_prms.option_dynamics == 'OGGM':
@@ -879,12 +1065,31 @@ def main(list_packed_vars):
                 elif pygem_prms.option_dynamics == 'MassRedistributionCurves':
                     print('MASS REDISTRIBUTION CURVES!')
                     ev_model = MassRedistributionCurveModel(nfls, mb_model=mbmod, y0=0)
+                    # constant-area years were already computed by the mass balance model of the inversion
+                    if pygem_prms.option_reuse_inversion_mb and not pygem_prms.option_sim_extend:
+                        mbmod.reuse_years(mbmod_inv, max(ev_model.spinupyears, ev_model.constantarea_years), 
+                                          fls=ev_model.fls)
                    
                     if debug:
                         print('New glacier vol', ev_model.volume_m3)
                         graphics.plot_modeloutput_section(ev_model)
                        
-                    _, diag = ev_model.run_until_and_store(nyears)
+                    if pygem_prms.option_sim_extend:
+                        sim_state_prev = sim_states_prev[n_iter]['state']
+                        assert sim_state_prev['year'] == nyears_prev, 'Error: saved state is not from the end year'
+                        ev_model.set_state(sim_state_prev)
+                        _, diag = ev_model.run_until_and_store(nyears, store_geometry=False)
+                        diag = append_diag(sim_state_prev['diag'], diag)
+                    elif pygem_prms.option_spinup_cache:
+                        diag = run_until_and_store_spinupcache(ev_model, gdir, modelprms, nyears)
+                    else:
+                        _, diag = ev_model.run_until_and_store(nyears, store_geometry=False)
+
+                    # final state before the mass conservation, which is applied again to all years when continued
+                    if pygem_prms.option_sim_savestate:
+                        sim_state = ev_model.get_state(nyears)
+                        sim_state['diag'] = diag
+                        sim_states.append({'modelprms': modelprms, 'fls': nfls, 'state': sim_state})
                     
                 if debug:
                     graphics.plot_modeloutput_section(ev_model)
@@ -936,6 +1141,44 @@ def main(list_packed_vars):
                 output_offglac_snowpack_monthly[:, n_iter] = mbmod.offglac_wide_snowpack
                 output_offglac_runoff_monthly[:, n_iter] = mbmod.offglac_wide_runoff
                   
+            # ------ ENSEMBLE WITH EVOLVING AREA ------
+            if dynamics_ensemble:
+                print('MASS REDISTRIBUTION CURVES ENSEMBLE!')
+                modelprms_ens = {vn: np.array([x[vn] for x in modelprms_ens]) for vn in modelprms_ens[0]}
+                mbmod = PyGEMMassBalanceBatch(gdir, modelprms_ens, glacier_rgi_table, fls=nfls_ens)
+                ev_model = MassRedistributionCurveModelEnsemble(nfls_ens, mb_model=mbmod, y0=0)
+                _, diag = ev_model.run_until_and_store(nyears, store_geometry=False)
+
+                # Ensure mass is conserved for each parameter set (see above)
+                area_initial = mbmod.glac_wide_area_annual[:,0]
+                mb_mwea_diag = ((diag.volume_m3.values[:,-1] - diag.volume_m3.values[:,0]) 
+                                / area_initial / nyears * pygem_prms.density_ice / pygem_prms.density_water)
+                mb_mwea_mbmod = mbmod.glac_wide_massbaltotal.sum(1) / area_initial / nyears
+                set_idx = np.where(np.abs(mb_mwea_diag - mb_mwea_mbmod) > 1e-6)[0]
+                if len(set_idx) > 0:
+                    mbmod.ensure_mass_conservation(diag, set_idx=set_idx)
+
+                # RECORD PARAMETERS TO DATASET
+                output_glac_temp_monthly[:] = mbmod.glac_wide_temp.T
+                output_glac_prec_monthly[:] = mbmod.glac_wide_prec.T
+                output_glac_acc_monthly[:] = mbmod.glac_wide_acc.T
+                output_glac_refreeze_monthly[:] = mbmod.glac_wide_refreeze.T
+                output_glac_melt_monthly[:] = mbmod.glac_wide_melt.T
+                output_glac_massbaltotal_monthly[:] = mbmod.glac_wide_massbaltotal.T
+                output_glac_runoff_monthly[:] = mbmod.glac_wide_runoff.T
+                output_glac_frontalablation_monthly[:] = mbmod.glac_wide_frontalablation.T
+                output_glac_snowline_monthly[:] = mbmod.glac_wide_snowline.T
+                output_glac_area_annual[:] = diag.area_m2.values.T
+                output_glac_volume_annual[:] = diag.volume_m3.values.T
+                output_glac_volume_change_ignored_annual[:-1] = mbmod.glac_wide_volume_change_ignored_annual.T
+                output_glac_ELA_annual[:] = mbmod.glac_wide_ELA_annual.T
+                output_offglac_prec_monthly[:] = mbmod.offglac_wide_prec.T
+                output_offglac_refreeze_monthly[:] = mbmod.offglac_wide_refreeze.T
+                output_offglac_melt_monthly[:] = mbmod.offglac_wide_melt.T
+                output_offglac_snowpack_monthly[:] = mbmod.offglac_wide_snowpack.T
+                output_offglac_runoff_monthly[:] = mbmod.offglac_wide_runoff.T
+                print('mass loss [Gt]:', mbmod.glac_wide_massbaltotal.sum(1).mean() / 1e9)
+
 
                 #%% ===== Adding functionality for calving =====
 #                water_level = None
@@ -1157,30 +1400,32 @@ def main(list_packed_vars):
             
 
             # Export statistics to netcdf
+            sim_subdir, netcdf_fn = sim_output_fn(glacier_str, gcm_name, sim_iters, rcp_scenario=rcp_scenario)
             if pygem_prms.output_package == 2:
-                output_sim_fp = pygem_prms.output_sim_fp + gcm_name + '/'
-                if gcm_name not in ['ERA-Interim', 'ERA5', 'COAWST']:
-                    output_sim_fp += rcp_scenario + '/'
+                output_sim_fp = pygem_prms.output_sim_fp + sim_subdir
                 # Create filepath if it does not exist
                 if os.path.exists(output_sim_fp) == False:
                     os.makedirs(output_sim_fp)
-                # Netcdf filename
-                if gcm_name in ['ERA-Interim', 'ERA5', 'COAWST']:
-                    # Filename
-                    netcdf_fn = (glacier_str + '_' + gcm_name + '_' + str(pygem_prms.option_calibration) + '_ba' +
-                                  str(pygem_prms.option_bias_adjustment) + '_' +  str(sim_iters) + 'sets' + '_' +
-                                  str(pygem_prms.gcm_startyear) + '_' + str(pygem_prms.gcm_endyear) + '.nc')
-                else:
-                    netcdf_fn = (glacier_str + '_' + gcm_name + '_' + rcp_scenario + '_' +
-                                  str(pygem_prms.option_calibration) + '_ba' + str(pygem_prms.option_bias_adjustment) + 
-                                  '_' + str(sim_iters) + 'sets' + '_' + str(pygem_prms.gcm_startyear) + '_' + 
-                                  str(pygem_prms.gcm_endyear) + '.nc')
-                if pygem_prms.option_synthetic_sim==1:
-                    netcdf_fn = (netcdf_fn.split('--')[0] + '_T' + str(pygem_prms.synthetic_temp_adjust) + '_P' +
-                                  str(pygem_prms.synthetic_prec_factor) + '--' + netcdf_fn.split('--')[1])
+                # Continued simulations: keep the existing output and append the new years
+                if pygem_prms.option_sim_extend:
+                    with xr.open_dataset(output_sim_fp + sim_fn_prev) as ds_prev:
+                        for vn in output_ds_all_stats.data_vars:
+                            if 'time' in output_ds_all_stats[vn].dims:
+                                output_ds_all_stats[vn].values[:,:12*nyears_prev] = ds_prev[vn].values
+                            elif 'year' in output_ds_all_stats[vn].dims:
+                                # last year of the existing output is the end of period (or not computed)
+                                output_ds_all_stats[vn].values[:,:nyears_prev] = ds_prev[vn].values[:,:-1]
                 # Export netcdf
                 output_ds_all_stats.to_netcdf(output_sim_fp + netcdf_fn, encoding=encoding)
 
+            # Export final states to continue the simulations
+            if pygem_prms.option_sim_savestate and len(sim_states) > 0:
+                sim_state_fp = pygem_prms.sim_state_fp + sim_subdir
+                if os.path.exists(sim_state_fp) == False:
+                    os.makedirs(sim_state_fp)
+                with open(sim_state_fp + netcdf_fn.replace('.nc', '.pkl'), 'wb') as f:
+                    pickle.dump(sim_states, f)
+
             # Close datasets
             output_ds_all_stats.close()
 
@@ -1224,7 +1469,16 @@ if __name__ == '__main__':
         num_cores = 1
 
     # Glacier number lists to pass for parallel processing
-    glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
+    if args.option_parallels != 0 and args.option_scheduler == 1:
+        # largest glaciers first (cost from area and number of elevation bins) in batches that get smaller
+        main_glac_rgi_schedule = modelsetup.selectglaciersrgitable(glac_no=glac_no)
+        glac_costs = scheduler.glacier_costs(
+                main_glac_rgi_schedule['Area'].values,
+                (main_glac_rgi_schedule['Zmax'] - main_glac_rgi_schedule['Zmin']).values / pygem_prms.binsize + 1)
+        glac_no_lsts = scheduler.schedule_batches(list(main_glac_rgi_schedule['rgino_str'].values), glac_costs, 
+                                                  num_cores)
+    else:
+        glac_no_lsts = split_glaciers.split_list(glac_no, n=num_cores, option_ordered=args.option_ordered)
 
     # Read GCM names from argument parser
     gcm_name = args.gcm_list_fn
@@ -1254,8 +1508,12 @@ if __name__ == '__main__':
         # Parallel processing
         if args.option_parallels != 0:
             print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-            with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-                p.map(main,list_packed_vars)
+            if args.option_scheduler == 1:
+                records, time_pool_start, time_pool_end = scheduler.run_scheduled(main, list_packed_vars, num_cores)
+                print(scheduler.utilisation_report(records, time_pool_start, time_pool_end, n_workers=num_cores))
+            else:
+                with multiprocessing.Pool(args.num_simultaneous_processes) as p:
+                    p.map(main,list_packed_vars)
         # If not in parallel, then only should be one loop
         else:
             # Loop through the chunks and export bias adjustments